@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
@@ -8,6 +8,9 @@ from flask_limiter.errors import RateLimitExceeded
 from models import db
 from config import get_config, validate_config
 from services.zalo_message_processor import zalo_processor
+from services.database_pools import get_pool_stats
+from services.warehouse_database_service import warehouse_service
+from utils.metrics import metrics
 
 # Khởi tạo app
 app = Flask(__name__)
@@ -111,6 +114,28 @@ def zalo_processor_stop():
             'error': str(e)
         }, 500
 
+# API endpoint thống kê connection pool (easychat, warehouse)
+@app.route('/api/db-pools/stats', methods=['GET'])
+def db_pools_stats():
+    """Lấy thống kê connection pool: số connection đang dùng, số thread chờ, thời gian chờ"""
+    try:
+        return {
+            'success': True,
+            'data': get_pool_stats()
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }, 500
+
+# Metrics của processor/warehouse theo text format của Prometheus (scrape định kỳ, không tính rate limit)
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def prometheus_metrics():
+    """Export counter/gauge/histogram: thời gian từng stage, queue lag, batch size, token LLM, lỗi parse, DB retry"""
+    return Response(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Error handler cho JWT
 @jwt.invalid_token_loader
 def invalid_token_callback(error_string):
@@ -266,6 +291,13 @@ if __name__ == '__main__':
         else:
             print("⏸️  Zalo Message Processor schedule is disabled (ZALO_MESSAGE_PROCESSOR_SCHEDULE=0)")
             print("   Use /api/zalo-test/schedule/start to start manually")
+        
+        # Kiểm tra cột tùy chọn của schema warehouse 1 lần (lỗi thì kiểm tra lại ở request đầu tiên)
+        try:
+            warehouse_service.probe_schema()
+            print("✅ Warehouse schema probed")
+        except Exception as e:
+            print(f"⚠️  Warehouse schema probe failed, will retry on first request: {e}")
     
     try:
         app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark tìm kiếm apartments: FULLTEXT ngram trên search_text (search_apartments hiện tại)
+so với 5 điều kiện LIKE '%q%' qua 3 bảng JOIN (cách cũ).
+
+Chạy trên warehouse DB cấu hình trong .env (nên trỏ tới MySQL local đã restore dump và đã chạy
+migrations/apartments_search_text_fulltext.sql + reindex). Mỗi từ khóa chạy --repeat lần mỗi mode,
+báo cáo p50/p95/max (ms) gồm cả COUNT; kết quả lưu JSON để so sánh giữa các commit.
+
+Từ khóa: file text mỗi dòng 1 từ khóa, không có thì lấy mẫu từ DB (mã căn, tên dự án, loại căn, từ trong ghi chú).
+
+Ví dụ:
+    python benchmark_apartment_search.py
+    python benchmark_apartment_search.py --queries data/search_queries.txt --repeat 20
+    python benchmark_apartment_search.py --modes fulltext --sample 50
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_replay_pipeline import DEFAULT_RESULTS_DIR, git_commit, percentile
+
+MODES = ['fulltext', 'like']
+
+# Query cũ (trước FULLTEXT) để so sánh
+LEGACY_CONDITION = """
+WHERE (
+    a.unit_code LIKE :search_query OR
+    pg.name LIKE :search_query OR
+    ut.name LIKE :search_query OR
+    a.unit_axis LIKE :search_query OR
+    a.notes LIKE :search_query
+)
+"""
+LEGACY_FROM = """
+FROM apartments a
+LEFT JOIN property_groups pg ON a.property_group = pg.id
+LEFT JOIN types_unit ut ON a.unit_type = ut.id
+"""
+
+
+def sample_queries(size, seed=42):
+    """Lấy mẫu từ khóa từ dữ liệu thật: mã căn (đủ và 1 phần), tên dự án, loại căn, từ trong ghi chú"""
+    from sqlalchemy import text
+    from services.database_pools import warehouse_pool
+    connection = warehouse_pool.connect()
+    try:
+        unit_codes = [r[0] for r in connection.execute(text(
+            "SELECT unit_code FROM apartments WHERE unit_code IS NOT NULL ORDER BY id DESC LIMIT 500"))]
+        group_names = [r[0] for r in connection.execute(text(
+            "SELECT name FROM property_groups WHERE name IS NOT NULL"))]
+        unit_types = [r[0] for r in connection.execute(text(
+            "SELECT name FROM types_unit WHERE name IS NOT NULL"))]
+        notes = [r[0] for r in connection.execute(text(
+            "SELECT notes FROM apartments WHERE notes IS NOT NULL ORDER BY id DESC LIMIT 500"))]
+    finally:
+        connection.close()
+
+    rng = random.Random(seed)
+    candidates = []
+    candidates += unit_codes
+    candidates += [code[-4:] for code in unit_codes if len(code) > 4]
+    candidates += group_names + unit_types
+    candidates += [word for note in notes for word in note.split() if len(word) >= 3]
+    candidates = list(dict.fromkeys(c.strip() for c in candidates if c and c.strip()))
+    rng.shuffle(candidates)
+    return candidates[:size]
+
+
+def run_legacy(connection, search_query, limit):
+    from sqlalchemy import text
+    params = {'search_query': f"%{search_query}%", 'limit': limit, 'offset': 0}
+    connection.execute(text(f"SELECT COUNT(*) {LEGACY_FROM} {LEGACY_CONDITION}"), params).fetchone()
+    return len(connection.execute(text(
+        f"SELECT a.id {LEGACY_FROM} {LEGACY_CONDITION} ORDER BY a.id DESC LIMIT :limit OFFSET :offset"), params).fetchall())
+
+
+def run_benchmark(args):
+    from services.database_pools import warehouse_pool
+    from services.warehouse_database_service import warehouse_service
+
+    if args.queries:
+        with open(args.queries, encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(args.sample)
+    if not queries:
+        raise SystemExit('❌ No search queries')
+
+    # Đo cả COUNT ở mỗi lần tìm, không dùng cache
+    warehouse_service.apartment_count_cache.ttl = 0
+
+    timings = {mode: [] for mode in args.modes}
+    hits = {mode: 0 for mode in args.modes}
+    for query in queries:
+        for mode in args.modes:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                if mode == 'fulltext':
+                    result = warehouse_service.search_apartments(query, limit=args.limit)
+                    if not result['success']:
+                        raise SystemExit(f"❌ search_apartments failed: {result.get('error')}")
+                    found = len(result['data'])
+                else:
+                    connection = warehouse_pool.connect()
+                    try:
+                        found = run_legacy(connection, query, args.limit)
+                    finally:
+                        connection.close()
+                timings[mode].append((time.perf_counter() - started) * 1000)
+            hits[mode] += 1 if found else 0
+
+    stages = {}
+    for mode, values in timings.items():
+        values.sort()
+        stages[mode] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p95_ms': round(percentile(values, 95), 3),
+            'max_ms': round(values[-1], 3) if values else 0.0,
+            'queries_with_results': hits[mode]
+        }
+    return {
+        'git_commit': git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'queries': len(queries),
+        'settings': {'repeat': args.repeat, 'limit': args.limit, 'modes': args.modes,
+                     'queries_file': args.queries, 'sample': args.sample},
+        'modes': stages
+    }
+
+
+def print_report(result):
+    print(f"\n📊 Apartment search, {result['queries']} queries x {result['settings']['repeat']} @ {result['git_commit']}")
+    print(f"\n  {'mode':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'with results':>13}")
+    for mode, stats in result['modes'].items():
+        print(f"  {mode:<10} {stats['count']:>6} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+              f"{stats['max_ms']:>9.3f} {stats['queries_with_results']:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tìm kiếm apartments (FULLTEXT vs LIKE)')
+    parser.add_argument('--queries', help='File từ khóa (mỗi dòng 1 từ khóa)')
+    parser.add_argument('--sample', type=int, default=30, help='Số từ khóa lấy mẫu từ DB khi không có --queries')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--output', help='File JSON kết quả (mặc định benchmark_results/search_<commit>_<time>.json)')
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_report(result)
+
+    output = args.output
+    if not output:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR,
+                              f"search_{result['git_commit'] or 'nogit'}_{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
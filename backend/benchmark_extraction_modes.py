@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+So sánh bóc tách hybrid (regex local + LLM schema rút gọn) với LLM-only trên dữ liệu đã gán nhãn:
+độ chính xác từng trường, token prompt/output, thời gian mỗi batch.
+
+Dữ liệu: file JSONL, mỗi dòng {"content": "...", "expected": {"price": ..., "num_bedrooms": ..., ...}}
+(mặc định data/field_extraction_labels.jsonl). Chỉ so sánh các trường có trong expected.
+
+Ví dụ:
+    python benchmark_extraction_modes.py --local-only
+    python benchmark_extraction_modes.py --batch-size 10
+    python benchmark_extraction_modes.py --modes hybrid --input-price 0.15 --output-price 0.75
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.deterministic_extractor import LOCAL_FIELDS, extract_structured_fields
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'field_extraction_labels.jsonl')
+
+
+def load_samples(path):
+    """Đọc các mẫu đã gán nhãn"""
+    samples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                samples.append((item.get('content') or '', item.get('expected') or {}))
+    return samples
+
+
+def values_match(expected, actual):
+    """So sánh giá trị trường (số so theo giá trị, bỏ qua khác biệt int/float và chuỗi số)"""
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if isinstance(expected, (int, float)) and not isinstance(expected, bool):
+        try:
+            return abs(float(actual) - float(expected)) < 1e-6
+        except (TypeError, ValueError):
+            return False
+    return str(actual).strip().upper() == str(expected).strip().upper()
+
+
+class FieldScore:
+    """Đếm số lần đúng/sai theo từng trường"""
+
+    def __init__(self):
+        self.correct = {}
+        self.total = {}
+
+    def add(self, expected, actual):
+        for field, value in expected.items():
+            self.total[field] = self.total.get(field, 0) + 1
+            if values_match(value, (actual or {}).get(field)):
+                self.correct[field] = self.correct.get(field, 0) + 1
+
+    def accuracy(self, field=None):
+        if field:
+            return self.correct.get(field, 0) / self.total[field] if self.total.get(field) else 0.0
+        total = sum(self.total.values())
+        return sum(self.correct.values()) / total if total else 0.0
+
+    def print_table(self, title):
+        print(f"\n{title}: {self.accuracy():.1%} ({sum(self.correct.values())}/{sum(self.total.values())})")
+        for field in sorted(self.total):
+            print(f"  {field:<22} {self.correct.get(field, 0):>3}/{self.total[field]:<3} {self.accuracy(field):.1%}")
+
+
+def run_local_only(samples):
+    """Chỉ chạy extractor local (không gọi Groq): độ chính xác các trường LOCAL_FIELDS + thời gian"""
+    score = FieldScore()
+    ambiguous_count = 0
+    started = time.perf_counter()
+    for content, expected in samples:
+        fields, ambiguous = extract_structured_fields(content)
+        if any(field in LOCAL_FIELDS for field in ambiguous):
+            ambiguous_count += 1
+            continue
+        score.add({k: v for k, v in expected.items() if k in fields}, fields)
+    elapsed = time.perf_counter() - started
+    score.print_table("🧮 Local extractor")
+    print(f"  Ambiguous (gửi schema đầy đủ): {ambiguous_count}/{len(samples)}")
+    print(f"  Thời gian: {elapsed * 1e6 / max(len(samples), 1):.1f} µs/tin nhắn")
+
+
+def run_mode(processor, samples, mode, batch_size):
+    """
+    Bóc tách toàn bộ samples bằng 1 chế độ (không dùng extraction cache, không ghi DB)
+
+    Returns:
+        Dict {'score', 'prompt_tokens', 'completion_tokens', 'latency', 'requests', 'failed'}
+    """
+    stats = {'score': FieldScore(), 'prompt_tokens': 0, 'completion_tokens': 0, 'latency': 0.0,
+             'requests': 0, 'failed': 0}
+    messages = [{'id': i + 1, 'content': content, 'sender_name': None, 'received_at': None}
+                for i, (content, _) in enumerate(samples)]
+
+    local_fields = {}
+    full_ids = set(m['id'] for m in messages)
+    if mode == 'hybrid':
+        processor.extraction_mode = 'hybrid'
+        local_fields, full_messages = processor._extract_local_fields(messages)
+        full_ids = set(m['id'] for m in full_messages)
+
+    groups = [([m for m in messages if m['id'] in local_fields], local_fields),
+              ([m for m in messages if m['id'] in full_ids], None)]
+    apartments = {}
+    for group, group_local_fields in groups:
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            prompt = processor.build_extraction_prompt(
+                processor.create_batch_prompt(batch), LOCAL_FIELDS if group_local_fields is not None else None
+            )
+            started = time.perf_counter()
+            result = processor.complete_extraction(prompt, processor.batch_sizer.output_tokens_for(len(batch)))
+            stats['latency'] += time.perf_counter() - started
+            stats['requests'] += 1
+            if not result or not result['content']:
+                stats['failed'] += len(batch)
+                continue
+            usage = result.get('usage') or {}
+            stats['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            stats['completion_tokens'] += usage.get('completion_tokens') or 0
+            parsed = processor.parse_groq_batch_response(result['content'])
+            if group_local_fields is not None:
+                parsed = processor._apply_local_fields(parsed, group_local_fields)
+            for apartment in parsed:
+                try:
+                    apartments.setdefault(int(apartment.get('message_id')), apartment)
+                except (TypeError, ValueError):
+                    continue
+
+    for message, (_, expected) in zip(messages, samples):
+        stats['score'].add(expected, apartments.get(message['id']))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bóc tách hybrid vs LLM-only')
+    parser.add_argument('--data', default=DEFAULT_DATA, help='File JSONL đã gán nhãn')
+    parser.add_argument('--local-only', action='store_true', help='Chỉ đánh giá extractor local (không gọi Groq)')
+    parser.add_argument('--modes', default='llm,hybrid', help='Các chế độ cần chạy, cách nhau bằng dấu phẩy')
+    parser.add_argument('--batch-size', type=int, default=10, help='Số tin nhắn mỗi request')
+    parser.add_argument('--input-price', type=float, default=0.0, help='USD / 1M token input (để ước tính chi phí)')
+    parser.add_argument('--output-price', type=float, default=0.0, help='USD / 1M token output')
+    args = parser.parse_args()
+
+    samples = load_samples(args.data)
+    print(f"📄 {len(samples)} mẫu từ {args.data}")
+    run_local_only(samples)
+    if args.local_only:
+        return
+
+    from services.zalo_message_processor import zalo_processor
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        print(f"\n🤖 Đang chạy chế độ {mode}...")
+        results[mode] = run_mode(zalo_processor, samples, mode, max(1, args.batch_size))
+        results[mode]['score'].print_table(f"📊 {mode}")
+
+    print(f"\n{'mode':<8} {'accuracy':>9} {'requests':>9} {'prompt':>9} {'output':>9} {'latency':>9} {'cost $':>9}")
+    for mode, stats in results.items():
+        cost = (stats['prompt_tokens'] * args.input_price + stats['completion_tokens'] * args.output_price) / 1e6
+        print(f"{mode:<8} {stats['score'].accuracy():>9.1%} {stats['requests']:>9} {stats['prompt_tokens']:>9} "
+              f"{stats['completion_tokens']:>9} {stats['latency']:>8.1f}s {cost:>9.4f}")
+        if stats['failed']:
+            print(f"  ⚠️ {stats['failed']} tin nhắn không có kết quả")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Replay benchmark cho pipeline bóc tách tin nhắn (process_messages_batch / process_messages_pipeline).
+
+Phát lại một corpus tin nhắn đã ghi lại qua toàn bộ pipeline với response LLM đã ghi lại (hoặc giả lập),
+không gọi Groq. Báo cáo messages/sec, p50/p95 từng stage (fetch, prompt_build, llm, parse, validate, insert,
+back_link, ack), số DB round-trip mỗi tin nhắn và bộ nhớ cao nhất; kết quả lưu JSON để so sánh giữa các commit.
+
+Corpus: file JSONL, mỗi dòng {"id", "content", "sender_name", "received_at", "apartments": [...]}
+(mặc định data/replay_corpus.jsonl). "apartments" là kết quả bóc tách đã ghi lại, không có thì LLM giả lập
+trả về các trường bóc tách được bằng regex.
+
+Backend:
+- memory (mặc định): work queue, warehouse insert và back-link chạy trong bộ nhớ (mỗi lần gọi tính 1 round-trip),
+  extraction cache và near-duplicate index tắt
+- mysql: dùng DB cấu hình trong .env (nên trỏ tới MySQL local đã restore dump), đếm round-trip thật qua SQLAlchemy
+
+Ví dụ:
+    python benchmark_replay_pipeline.py
+    python benchmark_replay_pipeline.py --mode pipeline --concurrency 4 --llm-latency 0.8 --repeat 20
+    python benchmark_replay_pipeline.py --compare benchmark_results/replay_abc1234_20260101-120000.json
+    python benchmark_replay_pipeline.py --export-corpus 500 --output data/my_corpus.jsonl
+    python benchmark_replay_pipeline.py --backend mysql --reset-state
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import functools
+import threading
+import subprocess
+import tracemalloc
+from collections import defaultdict, deque
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BASE_DIR, 'data', 'replay_corpus.jsonl')
+DEFAULT_RESULTS_DIR = os.path.join(BASE_DIR, 'benchmark_results')
+
+STAGES = ['fetch', 'prompt_build', 'llm', 'parse', 'validate', 'insert', 'back_link', 'ack']
+
+
+def percentile(values, pct):
+    """Percentile theo nearest-rank (values đã sort)"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class StageTimer:
+    """
+    Đo thời gian từng stage bằng cách bọc hàm. Thời gian của stage lồng bên trong (ví dụ validate trong insert)
+    được trừ khỏi stage bên ngoài để các stage không tính trùng.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault('stack', [])
+            stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                with self._lock:
+                    self.samples[stage].append(elapsed - children)
+        return timed
+
+    def summary(self):
+        result = {}
+        for stage in STAGES + sorted(set(self.samples) - set(STAGES)):
+            values = sorted(self.samples.get(stage, []))
+            result[stage] = {
+                'count': len(values),
+                'total_ms': round(sum(values) * 1000, 3),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3) if values else 0.0
+            }
+        return result
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.count += n
+
+    def listen(self, engine):
+        """Đếm mọi câu SQL gửi tới MySQL qua engine"""
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', lambda *args, **kwargs: self.add())
+
+
+class ReplayWorkQueue:
+    """Work queue trong bộ nhớ: claim theo thứ tự id, ghi lại trạng thái cuối của từng message"""
+
+    def __init__(self, messages, round_trips):
+        self.owner = 'replay'
+        self.lease_seconds = 300
+        self.pending = deque(messages)
+        self.states = {}
+        self.round_trips = round_trips
+        self._lock = threading.Lock()
+
+    def claim(self, limit=20, message_ids=None):
+        with self._lock:
+            self.round_trips.add()
+            claimed = []
+            while self.pending and len(claimed) < limit:
+                message = dict(self.pending.popleft())
+                message['attempt_count'] = message.get('attempt_count', 0) + 1
+                self.states[message['id']] = 'LEASED'
+                claimed.append(message)
+            return claimed
+
+    def _set_state(self, message_ids, state):
+        with self._lock:
+            self.round_trips.add()
+            for message_id in message_ids:
+                self.states[message_id] = state
+            return len(message_ids)
+
+    def complete(self, message_ids):
+        return self._set_state(message_ids, 'DONE') if message_ids else 0
+
+    def fail(self, message_ids, error):
+        return self._set_state(message_ids, 'FAILED') if message_ids else 0
+
+    def skip(self, scores):
+        return self._set_state(list(scores), 'SKIPPED') if scores else 0
+
+    def extend_lease(self, messages):
+        with self._lock:
+            self.round_trips.add()
+            return {m['id'] for m in messages if self.states.get(m['id']) == 'LEASED'}
+
+    def get_stats(self):
+        counts = defaultdict(int)
+        for state in self.states.values():
+            counts[state] += 1
+        return {'owner': self.owner, 'states': dict(counts)}
+
+
+class ReplayStore:
+    """Warehouse insert + back-link warehouse_ids trong bộ nhớ (chạy validate_apartment_item như bản thật)"""
+
+    def __init__(self, round_trips):
+        self.round_trips = round_trips
+        self.apartments = {}
+        self.warehouse_ids_by_hash = defaultdict(list)
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def bulk_insert_apartments(self, apartments, validated=False, source_message_ids=None):
+        from services import warehouse_database_service
+        cleaned = apartments if validated else [warehouse_database_service.validate_apartment_item(a) for a in apartments]
+        with self._lock:
+            self.round_trips.add()
+            apartment_ids = list(range(self._next_id, self._next_id + len(cleaned)))
+            self._next_id += len(cleaned)
+            self.apartments.update(zip(apartment_ids, cleaned))
+        return {'success': True, 'inserted_count': len(cleaned), 'merged_count': 0, 'apartment_ids': apartment_ids}
+
+    def update_warehouse_ids_by_content_hash(self, warehouse_ids_by_hash):
+        with self._lock:
+            self.round_trips.add(2)  # SELECT ... FOR UPDATE + UPDATE ... CASE
+            for content_hash, ids in warehouse_ids_by_hash.items():
+                current = self.warehouse_ids_by_hash[content_hash]
+                current.extend(i for i in ids if i not in current)
+        return {'success': True, 'updated_hashes': list(warehouse_ids_by_hash), 'missing_hashes': [],
+                'updated_rows': len(warehouse_ids_by_hash), 'error': None}
+
+
+def load_corpus(path, repeat=1):
+    """Đọc corpus, nhân bản `repeat` lần với id mới (nội dung giữ nguyên)"""
+    base = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                base.append(json.loads(line))
+    max_id = max((int(item['id']) for item in base), default=0)
+    corpus = []
+    for round_index in range(max(1, repeat)):
+        for item in base:
+            message = dict(item)
+            message['id'] = int(item['id']) + round_index * max_id
+            message.setdefault('content_hash', hashlib.sha1((item.get('content') or '').encode('utf-8')).hexdigest())
+            corpus.append(message)
+    return corpus
+
+
+def synthesize_apartment(message):
+    """Kết quả giả lập cho tin nhắn không có apartments đã ghi lại: các trường bóc tách được bằng regex"""
+    from utils.deterministic_extractor import extract_structured_fields
+    fields, _ = extract_structured_fields(message.get('content'))
+    listing_type = 'CAN_CHO_THUE' if fields.get('price_rent') else 'CAN_BAN' if fields.get('price') else 'KHAC'
+    return dict(fields, property_group=None, unit_code=None, listing_type=listing_type)
+
+
+def make_responder(corpus):
+    """Responder cho StubProvider: trả apartments đã ghi lại của các message có trong prompt"""
+    import re
+    recorded = {m['id']: m.get('apartments') for m in corpus}
+    messages_by_id = {m['id']: m for m in corpus}
+
+    def responder(model, chat_messages):
+        prompt = chat_messages[-1]['content']
+        apartments = []
+        for message_id in (int(x) for x in re.findall(r'\(ID: (\d+)\)', prompt)):
+            items = recorded.get(message_id)
+            if items is None:
+                items = [synthesize_apartment(messages_by_id.get(message_id, {}))]
+            apartments.extend(dict(item, message_id=message_id) for item in items)
+        return json.dumps(apartments, ensure_ascii=False)
+    return responder
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def max_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả KB, macOS trả bytes
+        return round(rss / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+    except Exception:
+        return None
+
+
+def instrument(processor, timer):
+    """Bọc các hàm tương ứng từng stage của pipeline"""
+    from services import warehouse_database_service
+
+    processor.work_queue.claim = timer.wrap('fetch', processor.work_queue.claim)
+    processor.build_extraction_prompt = timer.wrap('prompt_build', processor.build_extraction_prompt)
+    processor.complete_extraction = timer.wrap('llm', processor.complete_extraction)
+    processor.parse_groq_batch_response = timer.wrap('parse', processor.parse_groq_batch_response)
+    service = processor.warehouse_service
+    service.build_apartment_record = timer.wrap('validate', service.build_apartment_record)
+    warehouse_database_service.validate_apartment_item = timer.wrap(
+        'validate', warehouse_database_service.validate_apartment_item)
+    service.bulk_insert_apartments = timer.wrap('insert', service.bulk_insert_apartments)
+    processor.update_messages_warehouse_ids = timer.wrap('back_link', processor.update_messages_warehouse_ids)
+    processor.work_queue.complete = timer.wrap('ack', processor.work_queue.complete)
+    processor.work_queue.fail = timer.wrap('ack', processor.work_queue.fail)
+
+
+def setup_memory_backend(processor, corpus, round_trips, property_tree):
+    queue = ReplayWorkQueue(corpus, round_trips)
+    store = ReplayStore(round_trips)
+    processor.work_queue = queue
+    processor.update_warehouse_ids_by_content_hash = store.update_warehouse_ids_by_content_hash
+    processor.extraction_cache.enabled = False
+    processor.near_duplicate_index.enabled = False
+    service = processor.warehouse_service
+    service.bulk_insert_apartments = store.bulk_insert_apartments
+    service.get_property_tree_for_prompt = lambda root_id=1: property_tree
+    service.get_property_group_names = lambda: []
+    return queue, store
+
+
+def setup_mysql_backend(processor, corpus, round_trips, reset_state, allow_remote):
+    from sqlalchemy import text
+    from services.database_pools import chat_pool, warehouse_pool
+    from services.message_work_queue import _id_params
+
+    round_trips.listen(chat_pool.engine)
+    round_trips.listen(warehouse_pool.engine)
+    if not reset_state:
+        return
+    host = os.getenv('DB_CHAT_HOST', '')
+    if host not in ('localhost', '127.0.0.1', '::1') and not allow_remote:
+        raise SystemExit(f"❌ --reset-state chỉ chạy với MySQL local (DB_CHAT_HOST={host}), thêm --allow-remote nếu chắc chắn")
+    placeholders, params = _id_params([m['id'] for m in corpus])
+    connection = chat_pool.connect()
+    try:
+        result = connection.execute(text(f"""
+            UPDATE zalo_received_messages
+            SET processing_state = 'PENDING', warehouse_ids = NULL, attempt_count = 0,
+                next_attempt_at = NULL, lease_owner = NULL, lease_expires_at = NULL, last_error = NULL
+            WHERE id IN ({placeholders})
+        """), params)
+        connection.commit()
+        print(f"🔄 Reset {result.rowcount} message(s) về PENDING")
+    finally:
+        connection.close()
+
+
+def run_benchmark(args):
+    corpus = load_corpus(args.corpus, args.repeat)
+    os.environ.setdefault('GROQ_API_KEY', 'replay')
+
+    from services.zalo_message_processor import zalo_processor as processor
+
+    round_trips = RoundTripCounter()
+    queue = store = None
+    if args.backend == 'memory':
+        queue, store = setup_memory_backend(processor, corpus, round_trips, args.property_tree)
+    else:
+        setup_mysql_backend(processor, corpus, round_trips, args.reset_state, args.allow_remote)
+
+    if not args.live_llm:
+        gateway = processor.llm_gateway
+        gateway.default_provider = 'stub'
+        stub = gateway.providers['stub']
+        stub.responder = make_responder(corpus)
+        stub.latency = args.llm_latency
+    processor.stream_completions = not args.no_stream
+    processor.prefilter_enabled = not args.no_prefilter
+
+    timer = StageTimer()
+    instrument(processor, timer)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    processed = errors = 0
+    if args.mode == 'pipeline':
+        processed, errors, _ = processor.process_messages_pipeline(
+            batch_size=args.batch_size, concurrency=args.concurrency, queue_depth=args.queue_depth)
+    else:
+        while True:
+            batch_processed, batch_errors = processor.process_messages_batch(limit=args.batch_size)
+            processed += batch_processed
+            errors += batch_errors
+            if queue is not None and not queue.pending:
+                break
+            if queue is None and batch_processed == 0 and batch_errors == 0:
+                break
+    wall_seconds = time.perf_counter() - started
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    message_count = len(corpus)
+    llm_stats = processor.llm_gateway.get_stats()['models']
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'corpus': os.path.relpath(args.corpus, BASE_DIR),
+        'messages': message_count,
+        'settings': {
+            'backend': args.backend, 'mode': args.mode, 'batch_size': args.batch_size,
+            'concurrency': args.concurrency, 'llm_latency': args.llm_latency, 'live_llm': args.live_llm,
+            'stream': processor.stream_completions, 'prefilter': processor.prefilter_enabled,
+            'extraction_mode': processor.extraction_mode
+        },
+        'wall_seconds': round(wall_seconds, 3),
+        'messages_per_second': round(message_count / wall_seconds, 2) if wall_seconds else None,
+        'processed': processed,
+        'errors': errors,
+        'queue_states': queue.get_stats()['states'] if queue else None,
+        'apartments_inserted': len(store.apartments) if store else None,
+        'llm_requests': sum(stats.get('requests', 0) for stats in llm_stats.values()),
+        'stages': timer.summary(),
+        'db_round_trips': round_trips.count,
+        'db_round_trips_per_message': round(round_trips.count / message_count, 3) if message_count else None,
+        'memory': {'python_peak_mb': round(python_peak / 1024 / 1024, 2), 'max_rss_mb': max_rss_mb()}
+    }
+
+
+def print_report(result):
+    print(f"\n📊 Replay {result['messages']} messages ({result['settings']['backend']}, {result['settings']['mode']}) "
+          f"@ {result['git_commit']}")
+    print(f"  Throughput: {result['messages_per_second']} msg/s ({result['wall_seconds']}s), "
+          f"processed: {result['processed']}, errors: {result['errors']}, LLM requests: {result['llm_requests']}")
+    print(f"  DB round-trips: {result['db_round_trips']} ({result['db_round_trips_per_message']}/message)")
+    print(f"  Memory: python peak {result['memory']['python_peak_mb']} MB, max RSS {result['memory']['max_rss_mb']} MB")
+    print(f"\n  {'stage':<14} {'count':>6} {'total ms':>10} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for stage, stats in result['stages'].items():
+        print(f"  {stage:<14} {stats['count']:>6} {stats['total_ms']:>10.2f} {stats['p50_ms']:>9.3f} "
+              f"{stats['p95_ms']:>9.3f} {stats['max_ms']:>9.3f}")
+
+
+def compare(result, baseline_path):
+    """In chênh lệch so với kết quả cũ (dương = tăng)"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def delta(old, new):
+        if not old:
+            return 'n/a'
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\n🔍 So với {baseline_path} (@ {baseline.get('git_commit')}):")
+    for key in ('messages_per_second', 'db_round_trips_per_message'):
+        print(f"  {key:<28} {baseline.get(key)!s:>10} -> {result.get(key)!s:>10}  {delta(baseline.get(key), result.get(key))}")
+    print(f"  {'memory.python_peak_mb':<28} {baseline['memory']['python_peak_mb']!s:>10} -> "
+          f"{result['memory']['python_peak_mb']!s:>10}  "
+          f"{delta(baseline['memory']['python_peak_mb'], result['memory']['python_peak_mb'])}")
+    for stage, stats in result['stages'].items():
+        old = baseline.get('stages', {}).get(stage, {}).get('p95_ms')
+        print(f"  {stage + '.p95_ms':<28} {old!s:>10} -> {stats['p95_ms']!s:>10}  {delta(old, stats['p95_ms'])}")
+
+
+def export_corpus(limit, output):
+    """Xuất tin nhắn gần nhất + kết quả bóc tách đã cache (zalo_extraction_cache) ra JSONL"""
+    os.environ.setdefault('GROQ_API_KEY', 'replay')
+    from sqlalchemy import text
+    from services.database_pools import chat_pool
+
+    connection = chat_pool.connect()
+    try:
+        rows = connection.execute(text("""
+            SELECT m.id, m.content, m.sender_name, m.received_at, m.content_hash,
+                   (SELECT c.apartments FROM zalo_extraction_cache c
+                    WHERE c.content_hash = m.content_hash ORDER BY c.last_hit_at DESC LIMIT 1) AS apartments
+            FROM zalo_received_messages m
+            WHERE m.content_hash IS NOT NULL
+            ORDER BY m.id DESC
+            LIMIT :limit
+        """), {'limit': limit}).fetchall()
+    finally:
+        connection.close()
+
+    with open(output, 'w', encoding='utf-8') as f:
+        for row in reversed(rows):
+            item = dict(row._mapping)
+            item['received_at'] = item['received_at'].isoformat() if item['received_at'] else None
+            apartments = item.pop('apartments')
+            if apartments is not None:
+                item['apartments'] = json.loads(apartments) if isinstance(apartments, str) else apartments
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    print(f"✅ Đã xuất {len(rows)} tin nhắn ra {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay benchmark cho pipeline bóc tách tin nhắn')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='File JSONL corpus tin nhắn')
+    parser.add_argument('--repeat', type=int, default=1, help='Nhân bản corpus N lần')
+    parser.add_argument('--backend', choices=['memory', 'mysql'], default='memory')
+    parser.add_argument('--mode', choices=['batch', 'pipeline'], default='batch',
+                        help='batch = process_messages_batch, pipeline = process_messages_pipeline')
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--queue-depth', type=int, default=8)
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Độ trễ giả lập mỗi request LLM (giây)')
+    parser.add_argument('--live-llm', action='store_true', help='Gọi LLM thật thay vì response đã ghi lại')
+    parser.add_argument('--no-stream', action='store_true', help='Tắt streaming response')
+    parser.add_argument('--no-prefilter', action='store_true', help='Tắt prefilter tin rao')
+    parser.add_argument('--property-tree', default='<thong-tin-du-an></thong-tin-du-an>',
+                        help='Property tree dùng cho prompt ở backend memory')
+    parser.add_argument('--reset-state', action='store_true', help='(mysql) Đưa các message trong corpus về PENDING')
+    parser.add_argument('--allow-remote', action='store_true', help='(mysql) Cho phép --reset-state trên DB không phải local')
+    parser.add_argument('--output', help='File JSON kết quả (mặc định benchmark_results/replay_<commit>_<time>.json)')
+    parser.add_argument('--compare', help='File JSON kết quả cũ để so sánh')
+    parser.add_argument('--export-corpus', type=int, metavar='N', help='Xuất N tin nhắn gần nhất từ DB ra --output')
+    args = parser.parse_args()
+
+    if args.export_corpus:
+        export_corpus(args.export_corpus, args.output or 'replay_corpus.jsonl')
+        return
+
+    result = run_benchmark(args)
+    print_report(result)
+
+    output = args.output
+    if not output:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR,
+                              f"replay_{result['git_commit'] or 'nogit'}_{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Saved to {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Đánh giá prefilter tin rao (utils/listing_prefilter.py) trên dữ liệu đã gán nhãn bằng tay.
+
+Dữ liệu: file JSONL, mỗi dòng {"content": "...", "is_listing": true/false}
+(mặc định data/listing_prefilter_labels.jsonl)
+
+Ví dụ:
+    python evaluate_listing_prefilter.py --threshold 0.35
+    python evaluate_listing_prefilter.py --sweep
+    python evaluate_listing_prefilter.py --fit
+    python evaluate_listing_prefilter.py --export-from-db 500 --output to_label.jsonl
+"""
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.listing_prefilter import ListingPrefilter
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'listing_prefilter_labels.jsonl')
+
+
+def load_samples(path):
+    """Đọc các mẫu đã gán nhãn (bỏ qua dòng chưa có is_listing)"""
+    samples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if item.get('is_listing') is None:
+                continue
+            samples.append((item.get('content') or '', bool(item['is_listing'])))
+    return samples
+
+
+def load_project_names():
+    """Tên dự án từ warehouse database (bỏ qua nếu không kết nối được)"""
+    try:
+        from services.warehouse_database_service import warehouse_service
+        return warehouse_service.get_property_group_names()
+    except Exception as e:
+        print(f"⚠️ Không lấy được tên dự án từ warehouse: {e}")
+        return []
+
+
+def export_from_db(limit, output):
+    """Xuất tin nhắn gần nhất ra JSONL (is_listing = null) để gán nhãn bằng tay"""
+    from sqlalchemy import text
+    from services.database_pools import chat_pool
+
+    connection = chat_pool.connect()
+    try:
+        rows = connection.execute(text("""
+            SELECT id, content FROM zalo_received_messages
+            WHERE content_hash IS NOT NULL
+            ORDER BY id DESC
+            LIMIT :limit
+        """), {'limit': limit}).fetchall()
+    finally:
+        connection.close()
+
+    with open(output, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps({'id': row._mapping['id'], 'content': row._mapping['content'], 'is_listing': None},
+                               ensure_ascii=False) + '\n')
+    print(f"✅ Đã xuất {len(rows)} tin nhắn ra {output}")
+
+
+def print_report(report):
+    print(f"threshold={report['threshold']:.2f}  precision={report['precision']:.3f}  recall={report['recall']:.3f}  "
+          f"f1={report['f1']:.3f}  skipped={report['skipped_ratio']:.1%}  "
+          f"(tp={report['tp']} fp={report['fp']} tn={report['tn']} fn={report['fn']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Đánh giá prefilter tin rao căn hộ')
+    parser.add_argument('--data', default=DEFAULT_DATA, help='File JSONL đã gán nhãn')
+    parser.add_argument('--threshold', type=float, default=float(os.getenv('ZALO_PREFILTER_THRESHOLD', '0.35')),
+                        help='Ngưỡng score (default: ZALO_PREFILTER_THRESHOLD)')
+    parser.add_argument('--sweep', action='store_true', help='Đánh giá nhiều ngưỡng 0.05 - 0.95')
+    parser.add_argument('--fit', action='store_true', help='Học lại trọng số trên dữ liệu và in ra')
+    parser.add_argument('--no-projects', action='store_true', help='Không lấy tên dự án từ warehouse database')
+    parser.add_argument('--export-from-db', type=int, metavar='N', help='Xuất N tin nhắn gần nhất để gán nhãn')
+    parser.add_argument('--output', default='listing_prefilter_unlabelled.jsonl', help='File xuất cho --export-from-db')
+    args = parser.parse_args()
+
+    if args.export_from_db:
+        export_from_db(args.export_from_db, args.output)
+        return
+
+    samples = load_samples(args.data)
+    positives = sum(1 for _, label in samples if label)
+    print(f"📋 {len(samples)} mẫu ({positives} tin rao, {len(samples) - positives} không phải tin rao)")
+
+    prefilter = ListingPrefilter(project_names=[] if args.no_projects else load_project_names(),
+                                 threshold=args.threshold)
+
+    if args.fit:
+        weights = prefilter.fit(samples)
+        print("🧮 Trọng số sau khi học:")
+        print(json.dumps(weights, indent=2))
+
+    if args.sweep:
+        for step in range(1, 20):
+            print_report(prefilter.evaluate(samples, threshold=step * 0.05))
+    else:
+        print_report(prefilter.evaluate(samples))
+        for content, label in samples:
+            predicted, score = prefilter.is_listing(content)
+            if predicted != label:
+                print(f"  {'FN' if label else 'FP'} score={score:.3f}  {content[:80]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+-- Migration: correlation_key để batch insert trả về đúng ID của từng dòng
+-- Database: warehouse
+--
+-- bulk_insert_apartments trước đây suy ID = lastrowid .. lastrowid + rowcount - 1. Với
+-- innodb_autoinc_lock_mode=2 (mặc định từ MySQL 8) và nhiều worker insert đồng thời, ID của 1 câu
+-- INSERT nhiều dòng không chắc liên tiếp nên tin nhắn có thể bị gắn nhầm căn.
+-- Mỗi dòng giờ mang correlation_key = '<batch token uuid hex>:<index trong batch>' do client sinh,
+-- ID được đọc lại bằng SELECT ... WHERE correlation_key LIKE '<token>:%' (range scan trên unique key).
+-- Dòng cũ để NULL (UNIQUE cho phép nhiều NULL). Deploy code mới SAU khi chạy migration này.
+
+ALTER TABLE `apartments`
+  ADD COLUMN `correlation_key` varchar(48) DEFAULT NULL COMMENT 'Khóa do client sinh khi batch insert để đọc lại ID từng dòng',
+  ADD UNIQUE KEY `uq_apartments_correlation_key` (`correlation_key`);
+
+-- Kiểm tra:
+-- SELECT id, correlation_key FROM apartments WHERE correlation_key IS NOT NULL ORDER BY id DESC LIMIT 20;
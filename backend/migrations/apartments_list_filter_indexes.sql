@@ -0,0 +1,27 @@
+-- Migration: Cột generated + index cho filter danh sách apartments (/api/warehouse/apartments/list)
+-- Database: warehouse (MySQL 8.0+)
+--
+-- Query dùng: filter property_group / unit_type / listing_type / price / effective_area,
+-- ORDER BY id DESC và keyset pagination (id < :cursor_id). InnoDB thêm id vào cuối mọi secondary
+-- index nên các index bắt đầu bằng cột filter dạng "=" vẫn đọc được theo thứ tự id.
+
+-- ---------------------------------------------------------------------------
+-- Bước 1: Diện tích chuẩn hóa (ưu tiên diện tích thông thủy, không có thì tim tường)
+-- (thay cho điều kiện area_net >= x OR area_gross >= x không dùng được index)
+-- ---------------------------------------------------------------------------
+ALTER TABLE `apartments`
+  ADD COLUMN `effective_area` float GENERATED ALWAYS AS (COALESCE(`area_net`, `area_gross`)) STORED
+    COMMENT 'Diện tích dùng để filter: area_net, không có thì area_gross';
+
+-- ---------------------------------------------------------------------------
+-- Bước 2: Index composite cho các filter hay dùng
+-- ---------------------------------------------------------------------------
+ALTER TABLE `apartments`
+  ADD KEY `idx_apartments_group_listing_price` (`property_group`, `listing_type`, `price`),
+  ADD KEY `idx_apartments_listing_price` (`listing_type`, `price`),
+  ADD KEY `idx_apartments_unit_type` (`unit_type`),
+  ADD KEY `idx_apartments_effective_area` (`effective_area`);
+
+-- Kiểm tra sau migration:
+-- EXPLAIN SELECT id FROM apartments WHERE property_group IN (12, 13) AND listing_type = 'CAN_BAN' AND price <= 5 ORDER BY id DESC LIMIT 21;
+-- EXPLAIN SELECT id FROM apartments WHERE effective_area BETWEEN 60 AND 80 ORDER BY id DESC LIMIT 21;
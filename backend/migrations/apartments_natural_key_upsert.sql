@@ -0,0 +1,40 @@
+-- Migration: Gộp tin rao cùng 1 căn theo khóa tự nhiên + bảng liên kết nguồn tin
+-- Database: warehouse (MySQL 8.0.19+: upsert dùng row alias INSERT ... AS new ON DUPLICATE KEY UPDATE)
+--
+-- natural_key = property_group | loại tin (sale/rent) | mã căn chuẩn hóa, hoặc trục + tầng
+-- (xem utils/apartment_natural_key.py). Căn không đủ thông tin để nhận diện có natural_key NULL
+-- và vẫn được insert dòng mới như trước (UNIQUE cho phép nhiều NULL).
+-- Dòng cũ giữ natural_key NULL; tắt upsert bằng WAREHOUSE_APARTMENT_UPSERT=0 nếu chưa chạy migration.
+
+ALTER TABLE `apartments`
+  ADD COLUMN `natural_key` varchar(191) DEFAULT NULL COMMENT 'Khóa tự nhiên để gộp các tin rao cùng 1 căn',
+  ADD COLUMN `source_count` int NOT NULL DEFAULT 1 COMMENT 'Số lần căn được rao (số tin đã gộp vào dòng này)',
+  ADD COLUMN `last_seen_at` datetime DEFAULT NULL COMMENT 'Lần gần nhất căn xuất hiện trong tin rao',
+  ADD UNIQUE KEY `uq_apartments_natural_key` (`natural_key`);
+
+-- Nguồn của mỗi căn: tin nhắn Zalo (easychat.zalo_received_messages.id, khác database nên không có FK)
+-- và số điện thoại người rao. message_id = 0 / phone_number = '' khi không có (để UNIQUE hoạt động).
+CREATE TABLE IF NOT EXISTS `apartment_sources` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `apartment_id` int NOT NULL,
+  `message_id` int NOT NULL DEFAULT 0 COMMENT 'zalo_received_messages.id (0 = insert qua API)',
+  `phone_number` varchar(32) NOT NULL DEFAULT '' COMMENT 'Số điện thoại đã chuẩn hóa (chỉ chữ số)',
+  `seen_count` int NOT NULL DEFAULT 1,
+  `first_seen_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `last_seen_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_apartment_source` (`apartment_id`, `message_id`, `phone_number`),
+  KEY `idx_apartment_sources_message` (`message_id`),
+  KEY `idx_apartment_sources_phone` (`phone_number`),
+  CONSTRAINT `apartment_sources_ibfk_1` FOREIGN KEY (`apartment_id`) REFERENCES `apartments` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+COMMENT='Tin nhắn nguồn và số điện thoại của từng căn (nhiều môi giới rao cùng 1 căn)';
+
+-- Nguồn của các dòng hiện có: số điện thoại đang lưu trên apartments
+INSERT IGNORE INTO `apartment_sources` (`apartment_id`, `phone_number`, `first_seen_at`, `last_seen_at`)
+SELECT `id`, `phone_number`, COALESCE(`created_at`, NOW()), COALESCE(`created_at`, NOW())
+FROM `apartments`
+WHERE `phone_number` IS NOT NULL AND `phone_number` <> '';
+
+-- Kiểm tra:
+-- SELECT natural_key, source_count, last_seen_at FROM apartments WHERE natural_key IS NOT NULL ORDER BY source_count DESC LIMIT 20;
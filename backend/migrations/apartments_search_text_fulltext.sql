@@ -0,0 +1,27 @@
+-- Migration: Index tìm kiếm không dấu cho apartments (/api/warehouse/apartments/search)
+-- Database: warehouse (MySQL 5.7.6+ vì dùng ngram full-text parser)
+--
+-- search_text = mã căn (dạng tách và viết liền), trục, tên dự án/phân khu/tòa (kèm nhóm cha), loại căn, ghi chú,
+-- đã bỏ dấu và viết thường (xem utils/apartment_search_text.py). Được ghi khi insert/gộp căn;
+-- xóa căn thì InnoDB tự cập nhật FULLTEXT index.
+-- ngram parser (ngram_token_size mặc định = 2) cho phép tìm chuỗi con của mã căn: '1205' khớp 'a11205'.
+-- Thay cho 5 điều kiện LIKE '%q%' qua 3 bảng JOIN (full scan ở mỗi lần tìm và ở COUNT).
+
+-- ---------------------------------------------------------------------------
+-- Bước 1: Cột search_text + FULLTEXT index
+-- ---------------------------------------------------------------------------
+ALTER TABLE `apartments`
+  ADD COLUMN `search_text` text COMMENT 'Chuỗi tìm kiếm đã bỏ dấu (mã căn, trục, dự án, loại căn, ghi chú)';
+
+ALTER TABLE `apartments`
+  ADD FULLTEXT KEY `ft_apartments_search_text` (`search_text`) WITH PARSER ngram;
+
+-- ---------------------------------------------------------------------------
+-- Bước 2: Điền search_text cho các căn hiện có (bỏ dấu bằng Python, không làm được bằng SQL)
+-- ---------------------------------------------------------------------------
+-- curl -X POST http://localhost:5000/warehouse/api/warehouse/apartments/search/reindex
+-- hoặc: python -c "from services.warehouse_database_service import warehouse_service; print(warehouse_service.rebuild_search_text())"
+
+-- Kiểm tra:
+-- SELECT id, search_text FROM apartments ORDER BY id DESC LIMIT 10;
+-- EXPLAIN SELECT id FROM apartments a WHERE MATCH(a.search_text) AGAINST('+vinhomes +a11205' IN BOOLEAN MODE);
@@ -0,0 +1,19 @@
+-- Migration: Cache kết quả bóc tách LLM theo content_hash
+-- Database: easychat
+--
+-- fingerprint = SHA1(model + prompt template + property tree đang dùng trong prompt)
+-- Khi đổi prompt/model/property tree thì fingerprint đổi nên entry cũ tự động không còn được dùng,
+-- có thể xóa bằng POST /api/zalo-test/extraction-cache/purge
+
+CREATE TABLE IF NOT EXISTS `zalo_extraction_cache` (
+  `content_hash` char(40) NOT NULL COMMENT 'SHA1(content) giống zalo_received_messages.content_hash',
+  `fingerprint` char(40) NOT NULL COMMENT 'SHA1 của model + prompt template + property tree',
+  `model` varchar(100) NOT NULL,
+  `apartments` json NOT NULL COMMENT 'Mảng apartment đã parse (không gồm message_id), [] nếu tin không có căn hộ',
+  `hit_count` int NOT NULL DEFAULT 0,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `last_hit_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`content_hash`, `fingerprint`),
+  KEY `idx_fingerprint` (`fingerprint`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+COMMENT='Kết quả bóc tách Groq theo content_hash + fingerprint prompt/model';
@@ -0,0 +1,32 @@
+-- Migration: Index tin nhắn gần trùng (MinHash/LSH) cho zalo_received_messages
+-- Database: easychat
+-- Chạy SAU zalo_received_messages_processing_lease.sql.
+--
+-- minhash_signature: chữ ký MinHash 128 x uint32 (little-endian) của nội dung đã chuẩn hóa (bỏ dấu, emoji, dấu câu)
+-- near_dup_of: id message đại diện của cluster (NULL = message là đại diện hoặc chưa được index)
+-- zalo_message_lsh_buckets: 16 band key mỗi message, 2 message chung 1 band key là ứng viên gần trùng
+
+-- ---------------------------------------------------------------------------
+-- Bước 1: Cột chữ ký và cluster
+-- ---------------------------------------------------------------------------
+ALTER TABLE `zalo_received_messages`
+  ADD COLUMN `minhash_signature` varbinary(512) DEFAULT NULL COMMENT 'Chữ ký MinHash của nội dung đã chuẩn hóa',
+  ADD COLUMN `near_dup_of` int DEFAULT NULL COMMENT 'ID message đại diện của cluster gần trùng',
+  ADD KEY `idx_near_dup_of` (`near_dup_of`);
+
+-- ---------------------------------------------------------------------------
+-- Bước 2: Bucket LSH
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS `zalo_message_lsh_buckets` (
+  `band_key` char(16) NOT NULL COMMENT 'Hash của 1 band trong chữ ký MinHash',
+  `message_id` int NOT NULL,
+  PRIMARY KEY (`band_key`, `message_id`),
+  KEY `idx_message_id` (`message_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+COMMENT='Bucket LSH để tìm tin nhắn gần trùng';
+
+-- Index các message cũ (tùy chọn, chạy nhiều lần tới khi hết):
+--   python services/zalo_message_processor.py --mode backfill-near-dup --limit 1000
+--
+-- Kiểm tra sau migration:
+-- SELECT near_dup_of, COUNT(*) FROM zalo_received_messages WHERE near_dup_of IS NOT NULL GROUP BY near_dup_of ORDER BY 2 DESC LIMIT 20;
@@ -0,0 +1,31 @@
+-- Migration: Index cho keyset pagination + filter warehouse_ids của zalo_received_messages
+-- Database: easychat (MySQL 8.0.17+ vì dùng multi-valued index)
+-- Chạy SAU content_hash_unique_and_extra_senders.sql: nhờ uq_content_hash mỗi content_hash chỉ còn
+-- đúng 1 bản ghi (bản ghi canonical), nên query không cần GROUP BY content_hash nữa.
+
+-- ---------------------------------------------------------------------------
+-- Bước 1: Cột generated đánh dấu message đã có warehouse_ids
+-- (thay cho điều kiện JSON_LENGTH(warehouse_ids) > 0 không dùng được index)
+-- ---------------------------------------------------------------------------
+ALTER TABLE `zalo_received_messages`
+  ADD COLUMN `has_warehouse_ids` tinyint GENERATED ALWAYS AS (
+    IF(`warehouse_ids` IS NOT NULL AND JSON_LENGTH(`warehouse_ids`) > 0, 1, 0)
+  ) STORED COMMENT '1 nếu warehouse_ids có ít nhất 1 phần tử';
+
+-- ---------------------------------------------------------------------------
+-- Bước 2: Index composite cho keyset pagination theo (received_at, id)
+-- ---------------------------------------------------------------------------
+ALTER TABLE `zalo_received_messages`
+  ADD KEY `idx_has_warehouse_ids_received` (`has_warehouse_ids`, `received_at`, `id`),
+  ADD KEY `idx_received_at_id` (`received_at`, `id`);
+
+-- ---------------------------------------------------------------------------
+-- Bước 3: Multi-valued index cho filter theo 1 warehouse_id cụ thể
+-- Query dùng: :warehouse_id MEMBER OF (warehouse_ids)
+-- ---------------------------------------------------------------------------
+ALTER TABLE `zalo_received_messages`
+  ADD KEY `idx_warehouse_ids_mv` ((CAST(`warehouse_ids` AS UNSIGNED ARRAY)));
+
+-- Kiểm tra sau migration:
+-- EXPLAIN SELECT id FROM zalo_received_messages WHERE has_warehouse_ids = 0 AND content_hash IS NOT NULL ORDER BY received_at DESC, id DESC LIMIT 20;
+-- EXPLAIN SELECT id FROM zalo_received_messages WHERE 123 MEMBER OF (warehouse_ids) ORDER BY received_at DESC, id DESC LIMIT 20;
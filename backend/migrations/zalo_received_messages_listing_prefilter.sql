@@ -0,0 +1,14 @@
+-- Migration: Bỏ qua tin nhắn không phải tin rao (prefilter) trước khi gửi Groq
+-- Database: easychat
+-- Chạy SAU zalo_received_messages_processing_lease.sql.
+--
+-- processing_state thêm SKIPPED: prefilter chấm điểm thấp hơn ngưỡng, không gửi Groq.
+-- Có thể đưa lại về PENDING bằng POST /api/zalo-test/work-queue/requeue {"state": "SKIPPED"}
+-- listing_score: điểm prefilter (0-1) lúc bị bỏ qua, dùng để chỉnh ngưỡng
+
+ALTER TABLE `zalo_received_messages`
+  MODIFY COLUMN `processing_state` enum('PENDING','LEASED','DONE','FAILED','DEAD','SKIPPED') NOT NULL DEFAULT 'PENDING' COMMENT 'Trạng thái xử lý bóc tách',
+  ADD COLUMN `listing_score` decimal(5,4) DEFAULT NULL COMMENT 'Điểm prefilter tin rao (0-1)';
+
+-- Kiểm tra sau migration:
+-- SELECT ROUND(listing_score, 1) AS score, COUNT(*) FROM zalo_received_messages WHERE processing_state = 'SKIPPED' GROUP BY 1;
@@ -0,0 +1,38 @@
+-- Migration: Trạng thái xử lý (work queue có lease) cho zalo_received_messages
+-- Database: easychat
+-- Chạy SAU zalo_received_messages_keyset_indexes.sql (dùng cột has_warehouse_ids).
+--
+-- processing_state:
+--   PENDING - chờ xử lý
+--   LEASED  - đang được 1 worker xử lý (lease_owner, hết hạn lúc lease_expires_at)
+--   DONE    - đã xử lý xong
+--   FAILED  - lỗi, sẽ retry sau next_attempt_at (backoff)
+--   DEAD    - lỗi quá số lần cho phép, không retry tự động nữa
+
+-- ---------------------------------------------------------------------------
+-- Bước 1: Thêm các cột trạng thái xử lý
+-- ---------------------------------------------------------------------------
+ALTER TABLE `zalo_received_messages`
+  ADD COLUMN `processing_state` enum('PENDING','LEASED','DONE','FAILED','DEAD') NOT NULL DEFAULT 'PENDING' COMMENT 'Trạng thái xử lý bóc tách',
+  ADD COLUMN `lease_owner` varchar(128) DEFAULT NULL COMMENT 'Worker đang giữ lease (host:pid:uuid)',
+  ADD COLUMN `lease_expires_at` datetime DEFAULT NULL COMMENT 'Lease hết hạn thì worker khác được nhận lại',
+  ADD COLUMN `attempt_count` int NOT NULL DEFAULT 0 COMMENT 'Số lần đã nhận xử lý',
+  ADD COLUMN `last_error` text COMMENT 'Lỗi của lần xử lý gần nhất',
+  ADD COLUMN `next_attempt_at` datetime DEFAULT NULL COMMENT 'Thời điểm được retry (FAILED)';
+
+-- ---------------------------------------------------------------------------
+-- Bước 2: Index cho claim (SELECT ... FOR UPDATE SKIP LOCKED) và thu hồi lease hết hạn
+-- ---------------------------------------------------------------------------
+ALTER TABLE `zalo_received_messages`
+  ADD KEY `idx_processing_claim` (`processing_state`, `next_attempt_at`, `id`),
+  ADD KEY `idx_processing_lease` (`processing_state`, `lease_expires_at`);
+
+-- ---------------------------------------------------------------------------
+-- Bước 3: Các message đã có warehouse_ids coi như đã xử lý xong
+-- ---------------------------------------------------------------------------
+UPDATE `zalo_received_messages`
+SET `processing_state` = 'DONE'
+WHERE `has_warehouse_ids` = 1;
+
+-- Kiểm tra sau migration:
+-- SELECT processing_state, COUNT(*) FROM zalo_received_messages GROUP BY processing_state;
@@ -5,9 +5,10 @@ Warehouse API Routes - Insert multiple apartment items
 from flask import Blueprint, request, jsonify
 import logging
 import pymysql
-import os
-from typing import List, Dict, Any
-from services.warehouse_database_service import warehouse_service
+from typing import List, Dict, Any, Optional
+from services.database_pools import warehouse_pool
+from services.warehouse_database_service import warehouse_service, validate_apartment_item
+from utils.keyset_pagination import decode_cursor
 
 logger = logging.getLogger(__name__)
 
@@ -15,132 +16,14 @@ logger = logging.getLogger(__name__)
 warehouse_bp = Blueprint('warehouse', __name__)
 
 def get_warehouse_connection():
-    """Tạo kết nối database warehouse"""
+    """Mượn kết nối (pymysql) database warehouse từ pool chung, close() để trả lại pool"""
     try:
-        connection = pymysql.connect(
-            host=os.getenv('DB_WAREHOUSE_HOST', '103.6.234.59'),
-            port=int(os.getenv('DB_WAREHOUSE_PORT', '6033')),
-            user=os.getenv('DB_WAREHOUSE_USER', 'root'),
-            password=os.getenv('DB_WAREHOUSE_PASSWORD', ''),
-            database=os.getenv('DB_WAREHOUSE_NAME', 'warehouse'),
-            charset='utf8mb4',
-            autocommit=False
-        )
+        connection = warehouse_pool.raw_connection()
         return connection
     except Exception as e:
         logger.error(f"Error connecting to warehouse database: {e}")
         return None
 
-def validate_apartment_item(item: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Validate và clean apartment item data
-    Thiếu trường để NULL, thừa trường bỏ qua
-    """
-    # Danh sách các trường hợp lệ trong bảng apartments (khớp với DB schema)
-    valid_fields = {
-        'property_group': 'int',
-        'unit_type': 'int',
-        'unit_code': 'str',
-        'unit_axis': 'str',
-        'unit_floor_number': 'str',       # char(255) trong DB
-        'area_land': 'float',
-        'area_construction': 'float',
-        'area_net': 'float',
-        'area_gross': 'float',
-        'num_bedrooms': 'int',
-        'num_bathrooms': 'int',
-        'type_view': 'int',               # int FK to types_view trong DB
-        'direction_door': 'str',
-        'direction_balcony': 'str',
-        'price': 'float',
-        'price_early': 'float',
-        'price_schedule': 'float',
-        'price_loan': 'float',
-        'price_rent': 'float',
-        'notes': 'str',
-        'status': 'str',
-        'data_status': 'str',
-        'unit_allocation': 'str',
-        'listing_type': 'str',
-        'phone_number': 'str',
-        'furnished_status': 'str',
-        'floor_level_category': 'str',
-        'move_in_ready': 'bool',
-        'includes_transfer_fees': 'bool',
-    }
-    
-    cleaned_item = {}
-    
-    for field, field_type in valid_fields.items():
-        if field in item:
-            value = item[field]
-            
-            # Convert và validate theo type
-            if value is None or value == '' or value == 'null':
-                cleaned_item[field] = None
-            elif field_type == 'int':
-                try:
-                    cleaned_item[field] = int(float(str(value).replace('m2', '').replace('tỷ', '').replace('triệu', '').strip()))
-                except (ValueError, TypeError):
-                    cleaned_item[field] = None
-            elif field_type == 'float':
-                try:
-                    cleaned_item[field] = float(str(value).replace('m2', '').replace('tỷ', '').replace('triệu', '').strip())
-                except (ValueError, TypeError):
-                    cleaned_item[field] = None
-            elif field_type == 'bool':
-                if isinstance(value, bool):
-                    cleaned_item[field] = int(value)
-                elif isinstance(value, int):
-                    cleaned_item[field] = 1 if value else 0
-                else:
-                    cleaned_item[field] = None
-            elif field_type == 'str':
-                cleaned_item[field] = str(value) if value else None
-            else:
-                cleaned_item[field] = value
-        else:
-            # Thiếu trường thì để NULL
-            cleaned_item[field] = None
-    
-    # Validate enum values
-    if cleaned_item.get('direction_door') not in ['D', 'T', 'N', 'B', 'DB', 'DN', 'TB', 'TN', None]:
-        cleaned_item['direction_door'] = None
-    
-    if cleaned_item.get('direction_balcony') not in ['D', 'T', 'N', 'B', 'DB', 'DN', 'TB', 'TN', None]:
-        cleaned_item['direction_balcony'] = None
-    
-    if cleaned_item.get('status') not in ['CHUA_BAN', 'DA_LOCK', 'DA_COC', 'DA_BAN', None]:
-        cleaned_item['status'] = None
-    
-    if cleaned_item.get('data_status') not in ['REVIEWING', 'PENDING', 'APPROVED', None]:
-        cleaned_item['data_status'] = 'PENDING'  # Default value
-    
-    # unit_allocation là SET type, validate từng giá trị
-    valid_allocations = {'QUY_DOC_QUYEN', 'QUY_AN', 'QUY_CHEO', 'QUY_THUONG'}
-    if cleaned_item.get('unit_allocation'):
-        parts = [p.strip() for p in cleaned_item['unit_allocation'].split(',')]
-        valid_parts = [p for p in parts if p in valid_allocations]
-        cleaned_item['unit_allocation'] = ','.join(valid_parts) if valid_parts else 'QUY_CHEO'
-
-    # Validate listing_type enum values
-    if cleaned_item.get('listing_type') not in ['CAN_THUE', 'CAN_CHO_THUE', 'CAN_BAN', 'CAN_MUA', 'KHAC', None]:
-        cleaned_item['listing_type'] = None
-
-    # Validate furnished_status enum
-    if cleaned_item.get('furnished_status') not in ['FULL', 'PARTIAL', 'UNFURNISHED', None]:
-        cleaned_item['furnished_status'] = None
-
-    # Validate floor_level_category enum
-    if cleaned_item.get('floor_level_category') not in ['LOW', 'MEDIUM', 'HIGH', None]:
-        cleaned_item['floor_level_category'] = None
-
-    # data_status là NOT NULL, default PENDING
-    if not cleaned_item.get('data_status'):
-        cleaned_item['data_status'] = 'PENDING'
-
-    return cleaned_item
-
 @warehouse_bp.route('/api/warehouse/apartments/batch-insert', methods=['POST'])
 def batch_insert_apartments():
     """
@@ -186,69 +69,27 @@ def batch_insert_apartments():
                     'error': f'Error validating apartment {i+1}: {str(e)}'
                 }), 400
         
-        # Insert vào database
-        connection = get_warehouse_connection()
-        if not connection:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to connect to warehouse database'
-            }), 500
+        # Insert vào database (1 câu INSERT nhiều dòng, 1 transaction)
+        result = warehouse_service.bulk_insert_apartments(cleaned_apartments, validated=True)
         
-        try:
-            cursor = connection.cursor()
-            
-            # Prepare INSERT statement
-            insert_sql = """
-            INSERT INTO apartments (
-                property_group, unit_type, unit_code, unit_axis, unit_floor_number,
-                area_land, area_construction, area_net, area_gross,
-                num_bedrooms, num_bathrooms, type_view,
-                direction_door, direction_balcony,
-                price, price_early, price_schedule, price_loan, price_rent,
-                notes, status, data_status, unit_allocation, listing_type, phone_number,
-                furnished_status, floor_level_category, move_in_ready, includes_transfer_fees
-            ) VALUES (
-                %(property_group)s, %(unit_type)s, %(unit_code)s, %(unit_axis)s, %(unit_floor_number)s,
-                %(area_land)s, %(area_construction)s, %(area_net)s, %(area_gross)s,
-                %(num_bedrooms)s, %(num_bathrooms)s, %(type_view)s,
-                %(direction_door)s, %(direction_balcony)s,
-                %(price)s, %(price_early)s, %(price_schedule)s, %(price_loan)s, %(price_rent)s,
-                %(notes)s, %(status)s, %(data_status)s, %(unit_allocation)s, %(listing_type)s, %(phone_number)s,
-                %(furnished_status)s, %(floor_level_category)s, %(move_in_ready)s, %(includes_transfer_fees)s
-            )
-            """
-            
-            # Execute batch insert using executemany
-            cursor.executemany(insert_sql, cleaned_apartments)
-            connection.commit()
-
-            inserted_count = cursor.rowcount
-            # lastrowid trả về ID của record đầu tiên, các record sau có ID liên tiếp
-            first_id = cursor.lastrowid
-            apartment_ids = list(range(first_id, first_id + inserted_count)) if first_id else []
-            logger.info(f"Batch insert completed: {inserted_count} inserted, IDs: {apartment_ids}")
-
-            return jsonify({
-                'success': True,
-                'data': {
-                    'total_items': len(apartments),
-                    'inserted_count': inserted_count,
-                    'apartment_ids': apartment_ids
-                },
-                'message': f'Successfully inserted {inserted_count}/{len(apartments)} apartments'
-            })
-            
-        except Exception as e:
-            connection.rollback()
-            logger.error(f"Database error during batch insert: {e}")
+        if not result['success']:
             return jsonify({
                 'success': False,
-                'error': f'Database error: {str(e)}'
+                'error': result['error']
             }), 500
-            
-        finally:
-            cursor.close()
-            connection.close()
+        
+        inserted_count = result['inserted_count']
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'total_items': len(apartments),
+                'inserted_count': inserted_count,
+                'merged_count': result.get('merged_count', 0),
+                'apartment_ids': result['apartment_ids']
+            },
+            'message': f'Successfully inserted {inserted_count}/{len(apartments)} apartments'
+        })
         
     except Exception as e:
         logger.error(f"Error in batch_insert_apartments: {str(e)}")
@@ -308,6 +149,7 @@ def get_apartments_list():
     - price_to: Filter giá đến (optional)
     - area_from: Filter diện tích từ (optional)
     - area_to: Filter diện tích đến (optional)
+    - cursor: next_cursor của trang trước (optional, keyset pagination, ưu tiên hơn offset)
     """
     try:
         # Lấy query parameters
@@ -322,6 +164,7 @@ def get_apartments_list():
         price_to = request.args.get('price_to', type=float)
         area_from = request.args.get('area_from', type=float)
         area_to = request.args.get('area_to', type=float)
+        cursor = request.args.get('cursor', None, type=str) or None
         
         # Validate parameters
         if limit <= 0 or limit > 1000:
@@ -342,7 +185,16 @@ def get_apartments_list():
                 'error': 'listing_type must be one of: CAN_THUE, CAN_CHO_THUE, CAN_BAN, CAN_MUA, KHAC'
             }), 400
         
-        logger.info(f"Getting apartments list: limit={limit}, offset={offset}, property_group_id={property_group_id}, property_group_slug={property_group_slug}, unit_type_id={unit_type_id}, unit_type_slug={unit_type_slug}, listing_type={listing_type}, price_from={price_from}, price_to={price_to}, area_from={area_from}, area_to={area_to}")
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid cursor'
+                }), 400
+        
+        logger.info(f"Getting apartments list: limit={limit}, offset={offset}, property_group_id={property_group_id}, property_group_slug={property_group_slug}, unit_type_id={unit_type_id}, unit_type_slug={unit_type_slug}, listing_type={listing_type}, price_from={price_from}, price_to={price_to}, area_from={area_from}, area_to={area_to}, cursor={cursor}")
 
         # Gọi service method
         result = warehouse_service.get_apartments_list(
@@ -356,7 +208,8 @@ def get_apartments_list():
             price_from=price_from,
             price_to=price_to,
             area_from=area_from,
-            area_to=area_to
+            area_to=area_to,
+            cursor=cursor
         )
         
         if result['success']:
@@ -486,9 +339,9 @@ def delete_apartment(apartment_id):
 @warehouse_bp.route('/api/warehouse/apartments/search', methods=['GET'])
 def search_apartments():
     """
-    Tìm kiếm apartments với các điều kiện
+    Tìm kiếm apartments với các điều kiện (không phân biệt dấu, xếp theo độ liên quan)
     Query parameters:
-    - q: Từ khóa tìm kiếm (unit_code, property_group_name, unit_type_name)
+    - q: Từ khóa tìm kiếm (unit_code, unit_axis, property_group_name, unit_type_name, notes)
     - limit: Số lượng records tối đa (default: 50)
     - offset: Vị trí bắt đầu (default: 0)
     """
@@ -538,60 +391,45 @@ def search_apartments():
             'error': str(e)
         }), 500
 
-@warehouse_bp.route('/api/warehouse/unit-types', methods=['GET'])
-def get_unit_types():
+@warehouse_bp.route('/api/warehouse/apartments/search/reindex', methods=['POST'])
+def reindex_apartments_search():
     """
-    Lấy danh sách unit types
+    Tính lại search_text (index tìm kiếm) cho toàn bộ apartments
+    Dùng sau migration apartments_search_text_fulltext.sql hoặc sau khi đổi tên dự án/loại căn
+    Body (optional): {"batch_size": 500}
     """
     try:
-        connection = get_warehouse_connection()
-        if not connection:
+        data = request.get_json(silent=True) or {}
+        batch_size = data.get('batch_size', 500)
+        
+        if not isinstance(batch_size, int) or batch_size <= 0 or batch_size > 5000:
             return jsonify({
                 'success': False,
-                'error': 'Database connection failed'
-            }), 500
-
-        try:
-            cursor = connection.cursor(pymysql.cursors.DictCursor)
-
-            # Check if slug column exists
-            cursor.execute("SHOW COLUMNS FROM types_unit LIKE 'slug'")
-            has_slug = cursor.fetchone() is not None
-
-            if has_slug:
-                query = """
-                    SELECT id, name, slug
-                    FROM types_unit
-                    ORDER BY name
-                """
-            else:
-                query = """
-                    SELECT id, name
-                    FROM types_unit
-                    ORDER BY name
-                """
-
-            cursor.execute(query)
-            unit_types = cursor.fetchall()
-            cursor.close()
-
-            result = []
-            for unit_type in unit_types:
-                result.append({
-                    'id': unit_type['id'],
-                    'name': unit_type['name'],
-                    'slug': unit_type.get('slug') if has_slug else None
-                })
-
-            return jsonify({
-                'success': True,
-                'data': result,
-                'count': len(result)
-            })
-
-        finally:
-            connection.close()
+                'error': 'batch_size must be between 1 and 5000'
+            }), 400
+        
+        result = warehouse_service.rebuild_search_text(batch_size=batch_size)
+        
+        if result['success']:
+            return jsonify(result)
+        else:
+            return jsonify(result), 500
+            
+    except Exception as e:
+        logger.error(f"Error in reindex_apartments_search: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
+@warehouse_bp.route('/api/warehouse/unit-types', methods=['GET'])
+def get_unit_types():
+    """
+    Lấy danh sách unit types
+    Response được cache (WAREHOUSE_REFERENCE_CACHE_TTL) kèm ETag, hỗ trợ If-None-Match
+    """
+    try:
+        return warehouse_service.reference_cache.respond('unit-types', 'all', _load_unit_types)
     except Exception as e:
         logger.error(f"Error in get_unit_types: {str(e)}")
         return jsonify({
@@ -599,6 +437,56 @@ def get_unit_types():
             'error': str(e)
         }), 500
 
+def _load_unit_types() -> Dict[str, Any]:
+    # Cột slug được kiểm tra 1 lần lúc khởi động (warehouse_service.probe_schema)
+    has_slug = warehouse_service.has_schema_feature('types_unit_slug')
+    
+    connection = get_warehouse_connection()
+    if not connection:
+        raise RuntimeError('Database connection failed')
+    try:
+        cursor = connection.cursor(pymysql.cursors.DictCursor)
+        cursor.execute(f"""
+            SELECT id, name{', slug' if has_slug else ''}
+            FROM types_unit
+            ORDER BY name
+        """)
+        unit_types = cursor.fetchall()
+        cursor.close()
+    finally:
+        connection.close()
+    
+    result = []
+    for unit_type in unit_types:
+        result.append({
+            'id': unit_type['id'],
+            'name': unit_type['name'],
+            'slug': unit_type.get('slug') if has_slug else None
+        })
+    
+    return {
+        'success': True,
+        'data': result,
+        'count': len(result)
+    }
+
+PROPERTY_GROUP_COLUMNS = """
+    pg.id, pg.name, pg.description, pg.thumbnail, pg.slug,
+    pg.parent_id, pg.group_type, tg.name as group_type_name
+"""
+
+def _property_group_dict(group: Dict) -> Dict[str, Any]:
+    return {
+        'id': group['id'],
+        'name': group['name'],
+        'description': group['description'],
+        'thumbnail': group['thumbnail'],
+        'slug': group.get('slug'),
+        'parent_id': group['parent_id'],
+        'group_type': group['group_type'],
+        'group_type_name': group['group_type_name']
+    }
+
 @warehouse_bp.route('/api/warehouse/property-groups', methods=['GET'])
 def get_property_groups():
     """
@@ -606,169 +494,16 @@ def get_property_groups():
     Query parameters:
     - parent_id: ID của parent group (optional, None để lấy root groups)
     - slug: Slug của property group để lấy children (optional)
+    Response được cache theo (parent_id, slug) kèm ETag, hỗ trợ If-None-Match
     """
     try:
         # Lấy query parameters
         parent_id = request.args.get('parent_id', type=int)
         slug = request.args.get('slug', type=str)
         
-        connection = get_warehouse_connection()
-        if not connection:
-            return jsonify({
-                'success': False,
-                'error': 'Database connection failed'
-            }), 500
-        
-        try:
-            cursor = connection.cursor(pymysql.cursors.DictCursor)
-            
-            # Query property groups với join types_group để lấy type name
-            if slug:
-                # Lấy property group theo slug
-                query = """
-                    SELECT pg.id, pg.name, pg.description, pg.thumbnail, pg.slug,
-                           pg.parent_id, pg.group_type, tg.name as group_type_name
-                    FROM property_groups pg
-                    LEFT JOIN types_group tg ON pg.group_type = tg.id
-                    WHERE pg.slug = %s
-                    ORDER BY pg.name
-                    LIMIT 1
-                """
-                cursor.execute(query, (slug,))
-                current_group = cursor.fetchone()
-
-                if current_group:
-                    # Lấy children của property group này
-                    query = """
-                        SELECT pg.id, pg.name, pg.description, pg.thumbnail, pg.slug,
-                               pg.parent_id, pg.group_type, tg.name as group_type_name
-                        FROM property_groups pg
-                        LEFT JOIN types_group tg ON pg.group_type = tg.id
-                        WHERE pg.parent_id = %s
-                        ORDER BY pg.name
-                    """
-                    cursor.execute(query, (current_group['id'],))
-                    children = cursor.fetchall()
-
-                    # Lấy tất cả các cấp cha (parents hierarchy)
-                    parents = []
-                    current_parent_id = current_group['parent_id']
-                    while current_parent_id is not None:
-                        query = """
-                            SELECT pg.id, pg.name, pg.description, pg.thumbnail, pg.slug,
-                                   pg.parent_id, pg.group_type, tg.name as group_type_name
-                            FROM property_groups pg
-                            LEFT JOIN types_group tg ON pg.group_type = tg.id
-                            WHERE pg.id = %s
-                        """
-                        cursor.execute(query, (current_parent_id,))
-                        parent = cursor.fetchone()
-                        if parent:
-                            parents.insert(0, {  # Insert at beginning to maintain order from root to current
-                                'id': parent['id'],
-                                'name': parent['name'],
-                                'description': parent['description'],
-                                'thumbnail': parent['thumbnail'],
-                                'slug': parent.get('slug'),
-                                'parent_id': parent['parent_id'],
-                                'group_type': parent['group_type'],
-                                'group_type_name': parent['group_type_name']
-                            })
-                            current_parent_id = parent['parent_id']
-                        else:
-                            break
-
-                    cursor.close()
-
-                    # Convert current group to dict
-                    current_result = {
-                        'id': current_group['id'],
-                        'name': current_group['name'],
-                        'description': current_group['description'],
-                        'thumbnail': current_group['thumbnail'],
-                        'slug': current_group.get('slug'),
-                        'parent_id': current_group['parent_id'],
-                        'group_type': current_group['group_type'],
-                        'group_type_name': current_group['group_type_name']
-                    }
-
-                    # Convert children to list of dicts
-                    children_result = []
-                    for child in children:
-                        children_result.append({
-                            'id': child['id'],
-                            'name': child['name'],
-                            'description': child['description'],
-                            'thumbnail': child['thumbnail'],
-                            'slug': child.get('slug'),
-                            'parent_id': child['parent_id'],
-                            'group_type': child['group_type'],
-                            'group_type_name': child['group_type_name']
-                        })
-
-                    return jsonify({
-                        'success': True,
-                        'current': current_result,
-                        'parents': parents,
-                        'data': children_result,
-                        'count': len(children_result)
-                    })
-                else:
-                    # Slug not found
-                    cursor.close()
-                    return jsonify({
-                        'success': True,
-                        'current': None,
-                        'parents': [],
-                        'data': [],
-                        'count': 0
-                    })
-            elif parent_id is None:
-                query = """
-                    SELECT pg.id, pg.name, pg.description, pg.thumbnail, pg.slug,
-                           pg.parent_id, pg.group_type, tg.name as group_type_name
-                    FROM property_groups pg 
-                    LEFT JOIN types_group tg ON pg.group_type = tg.id 
-                    WHERE pg.parent_id IS NULL
-                    ORDER BY pg.name
-                """
-                cursor.execute(query)
-            else:
-                query = """
-                    SELECT pg.id, pg.name, pg.description, pg.thumbnail, pg.slug,
-                           pg.parent_id, pg.group_type, tg.name as group_type_name
-                    FROM property_groups pg 
-                    LEFT JOIN types_group tg ON pg.group_type = tg.id 
-                    WHERE pg.parent_id = %s
-                    ORDER BY pg.name
-                """
-                cursor.execute(query, (parent_id,))
-            
-            groups = cursor.fetchall()
-            cursor.close()
-            
-            # Convert to list of dicts
-            result = []
-            for group in groups:
-                result.append({
-                    'id': group['id'],
-                    'name': group['name'],
-                    'description': group['description'],
-                    'thumbnail': group['thumbnail'],
-                    'slug': group.get('slug'),
-                    'parent_id': group['parent_id'],
-                    'group_type': group['group_type'],
-                    'group_type_name': group['group_type_name']
-                })
-            
-            return jsonify({
-                'success': True,
-                'data': result,
-                'count': len(result)
-            })
-            
-        finally:
-            connection.close()
+        return warehouse_service.reference_cache.respond(
+            'property-groups', (parent_id, slug), lambda: _load_property_groups(parent_id, slug)
+        )
             
     except Exception as e:
         logger.error(f"Error in get_property_groups: {str(e)}")
@@ -776,3 +511,108 @@ def get_property_groups():
             'success': False,
             'error': str(e)
         }), 500
+
+def _load_property_groups(parent_id: Optional[int], slug: Optional[str]) -> Dict[str, Any]:
+    connection = get_warehouse_connection()
+    if not connection:
+        raise RuntimeError('Database connection failed')
+    
+    try:
+        cursor = connection.cursor(pymysql.cursors.DictCursor)
+        
+        # Query property groups với join types_group để lấy type name
+        if slug:
+            # Lấy property group theo slug
+            cursor.execute(f"""
+                SELECT {PROPERTY_GROUP_COLUMNS}
+                FROM property_groups pg
+                LEFT JOIN types_group tg ON pg.group_type = tg.id
+                WHERE pg.slug = %s
+                ORDER BY pg.name
+                LIMIT 1
+            """, (slug,))
+            current_group = cursor.fetchone()
+            
+            if not current_group:
+                # Slug not found
+                cursor.close()
+                return {
+                    'success': True,
+                    'current': None,
+                    'parents': [],
+                    'data': [],
+                    'count': 0
+                }
+            
+            # Lấy children của property group này
+            cursor.execute(f"""
+                SELECT {PROPERTY_GROUP_COLUMNS}
+                FROM property_groups pg
+                LEFT JOIN types_group tg ON pg.group_type = tg.id
+                WHERE pg.parent_id = %s
+                ORDER BY pg.name
+            """, (current_group['id'],))
+            children = cursor.fetchall()
+            
+            # Lấy tất cả các cấp cha bằng 1 recursive CTE, thứ tự từ root xuống cha trực tiếp
+            # (depth giới hạn để không lặp vô hạn nếu parent_id bị vòng)
+            parents = []
+            if current_group['parent_id'] is not None:
+                cursor.execute(f"""
+                    WITH RECURSIVE ancestors AS (
+                        SELECT id, parent_id, 1 AS depth
+                        FROM property_groups
+                        WHERE id = %s
+                        UNION ALL
+                        SELECT pg.id, pg.parent_id, a.depth + 1
+                        FROM property_groups pg
+                        INNER JOIN ancestors a ON pg.id = a.parent_id
+                        WHERE a.depth < 100
+                    )
+                    SELECT {PROPERTY_GROUP_COLUMNS}
+                    FROM ancestors a
+                    INNER JOIN property_groups pg ON pg.id = a.id
+                    LEFT JOIN types_group tg ON pg.group_type = tg.id
+                    ORDER BY a.depth DESC
+                """, (current_group['parent_id'],))
+                parents = [_property_group_dict(parent) for parent in cursor.fetchall()]
+            
+            cursor.close()
+            
+            children_result = [_property_group_dict(child) for child in children]
+            return {
+                'success': True,
+                'current': _property_group_dict(current_group),
+                'parents': parents,
+                'data': children_result,
+                'count': len(children_result)
+            }
+        elif parent_id is None:
+            cursor.execute(f"""
+                SELECT {PROPERTY_GROUP_COLUMNS}
+                FROM property_groups pg 
+                LEFT JOIN types_group tg ON pg.group_type = tg.id 
+                WHERE pg.parent_id IS NULL
+                ORDER BY pg.name
+            """)
+        else:
+            cursor.execute(f"""
+                SELECT {PROPERTY_GROUP_COLUMNS}
+                FROM property_groups pg 
+                LEFT JOIN types_group tg ON pg.group_type = tg.id 
+                WHERE pg.parent_id = %s
+                ORDER BY pg.name
+            """, (parent_id,))
+        
+        groups = cursor.fetchall()
+        cursor.close()
+        
+        result = [_property_group_dict(group) for group in groups]
+        return {
+            'success': True,
+            'data': result,
+            'count': len(result)
+        }
+        
+    finally:
+        connection.close()
@@ -8,7 +8,6 @@ import os
 from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime
 import logging
-import json
 from models import db, ZaloConfig, ZaloSession, ZaloMessage
 from services.zalo_bot_manager import zalo_bot_manager
 
@@ -139,6 +138,21 @@ def get_bot_status(config_id):
             'message': f'Lỗi: {str(e)}'
         }), 500
 
+@zalo_bot_bp.route('/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    """API thống kê ghi tin nhắn nhận được vào DB: hàng đợi, journal trên đĩa, lỗi ghi"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': zalo_bot_manager.get_ingest_stats()
+        })
+    except Exception as e:
+        logger.error(f"Lỗi lấy ingest stats: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi: {str(e)}'
+        }), 500
+
 @zalo_bot_bp.route('/messages/<int:config_id>', methods=['GET'])
 def get_bot_messages(config_id):
     """API lấy tin nhắn gần đây cho config_id cụ thể"""
@@ -294,27 +308,14 @@ def send_message(config_id):
             # Lưu tin nhắn đã gửi vào database
             try:
                 with current_app.app_context():
-                    config_info = zalo_bot_manager.get_config_by_id(config_id)
-                    if not config_info:
+                    # Session của config lấy từ cache của bot manager (chỉ query khi chưa có)
+                    session_id = zalo_bot_manager.get_session_id(config_id)
+                    if not session_id:
                         logger.error(f"Config {config_id}: Không tìm thấy config")
                     else:
-                        db_session = ZaloSession.query.filter_by(imei=config_info['imei']).first()
-                        
-                        if not db_session:
-                            # Tạo session mới nếu không có
-                            db_session = ZaloSession(
-                                imei=config_info['imei'],
-                                cookies=json.dumps(config_info['cookies']),
-                                created_at=datetime.now(),
-                                is_active=True
-                            )
-                            db.session.add(db_session)
-                            db.session.commit()
-                            db.session.refresh(db_session)
-                        
                         # Lưu tin nhắn đã gửi
                         sent_msg = ZaloMessage(
-                            session_id=db_session.id,
+                            session_id=session_id,
                             recipient_id=recipient_id,
                             recipient_name=f"User_{recipient_id}",
                             content=content,
@@ -331,7 +332,7 @@ def send_message(config_id):
                         if config_id in zalo_bot_manager.stats:
                             zalo_bot_manager.stats[config_id]['messages_sent'] += 1
                         
-                        logger.info(f"Config {config_id}: Đã lưu tin nhắn đã gửi vào database (session_id: {db_session.id})")
+                        logger.info(f"Config {config_id}: Đã lưu tin nhắn đã gửi vào database (session_id: {session_id})")
                         
             except Exception as e:
                 logger.error(f"Config {config_id}: Lỗi lưu tin nhắn đã gửi: {e}")
@@ -441,25 +442,12 @@ def send_bulk_messages(config_id):
                 # Lưu tin nhắn đã gửi vào database
                 try:
                     with current_app.app_context():
-                        config_info = zalo_bot_manager.get_config_by_id(config_id)
-                        if config_info:
-                            db_session = ZaloSession.query.filter_by(imei=config_info['imei']).first()
-                            
-                            if not db_session:
-                                # Tạo session mới nếu không có
-                                db_session = ZaloSession(
-                                    imei=config_info['imei'],
-                                    cookies=json.dumps(config_info['cookies']),
-                                    created_at=datetime.now(),
-                                    is_active=True
-                                )
-                                db.session.add(db_session)
-                                db.session.commit()
-                                db.session.refresh(db_session)
-                            
+                        # Session của config lấy từ cache của bot manager (chỉ query khi chưa có)
+                        session_id = zalo_bot_manager.get_session_id(config_id)
+                        if session_id:
                             # Lưu tin nhắn đã gửi
                             sent_msg = ZaloMessage(
-                                session_id=db_session.id,
+                                session_id=session_id,
                                 recipient_id=recipient_id,
                                 recipient_name=f"User_{recipient_id}",
                                 content=content,
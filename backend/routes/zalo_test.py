@@ -4,6 +4,7 @@ Zalo Message Processor Test API Routes
 
 from flask import Blueprint, request, jsonify
 from services.zalo_message_processor import zalo_processor
+from utils.keyset_pagination import decode_cursor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -102,6 +103,7 @@ def get_messages():
         offset = request.args.get('offset', 0, type=int)
         warehouse_id = request.args.get('warehouse_id', 'NULL', type=str)
         sort = request.args.get('sort', 'newest', type=str)
+        cursor = request.args.get('cursor', None, type=str) or None
         
         # Validate sort parameter
         if sort not in ('newest', 'oldest'):
@@ -131,9 +133,19 @@ def get_messages():
                 'error': 'offset must be >= 0'
             }), 400
         
-        result = zalo_processor.get_unprocessed_messages(limit=limit, offset=offset, warehouse_id=warehouse_id, sort=sort)
+        # Validate cursor (keyset pagination, ưu tiên hơn offset)
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid cursor'
+                }), 400
         
-        # result is now a dict with 'messages' and 'total'
+        result = zalo_processor.get_unprocessed_messages(limit=limit, offset=offset, warehouse_id=warehouse_id, sort=sort, cursor=cursor)
+        
+        # result is now a dict with 'messages', 'total' and 'next_cursor'
         messages = result.get('messages', [])
         total_count = result.get('total', 0)
         
@@ -144,6 +156,8 @@ def get_messages():
             'total': total_count,
             'limit': limit,
             'offset': offset,
+            'cursor': cursor,
+            'next_cursor': result.get('next_cursor'),
             'warehouse_id_filter': warehouse_id,
             'sort': sort
         })
@@ -193,7 +207,8 @@ def get_property_tree():
             'success': True,
             'data': {
                 'root_id': root_id,
-                'property_tree': property_tree
+                'property_tree': property_tree,
+                'version': zalo_processor.warehouse_service.get_property_tree_version(root_id)
             }
         })
         
@@ -204,6 +219,150 @@ def get_property_tree():
             'error': str(e)
         }), 500
 
+@zalo_test_bp.route('/property-tree/refresh', methods=['POST'])
+def refresh_property_tree():
+    """
+    Load lại property tree cache từ database (sau khi thay đổi property_groups / types_unit)
+    Body (optional): {"root_id": 1, "all": false} - all=true để xóa cache của mọi root
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        root_id = data.get('root_id', 1)
+        
+        if not isinstance(root_id, int) or root_id <= 0:
+            return jsonify({
+                'success': False,
+                'error': 'root_id must be a positive integer'
+            }), 400
+        
+        if data.get('all'):
+            zalo_processor.warehouse_service.invalidate_property_tree_cache()
+        
+        cache_info = zalo_processor.warehouse_service.refresh_property_tree(root_id)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'root_id': root_id,
+                'cache': cache_info
+            },
+            'message': 'Property tree cache refreshed'
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in refresh_property_tree: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@zalo_test_bp.route('/work-queue/stats', methods=['GET'])
+def get_work_queue_stats():
+    """Thống kê work queue: số message theo processing_state (PENDING, LEASED, DONE, FAILED, DEAD)"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': zalo_processor.work_queue.get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error in get_work_queue_stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@zalo_test_bp.route('/work-queue/requeue', methods=['POST'])
+def requeue_dead_messages():
+    """
+    Đưa các message DEAD (hoặc SKIPPED bởi prefilter) về PENDING để xử lý lại
+    Body (optional): {"message_ids": [1, 2, 3], "state": "DEAD"} - bỏ trống message_ids để requeue toàn bộ
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        message_ids = data.get('message_ids')
+        state = data.get('state', 'DEAD')
+        
+        if state not in ('DEAD', 'SKIPPED'):
+            return jsonify({
+                'success': False,
+                'error': 'state must be DEAD or SKIPPED'
+            }), 400
+        
+        if message_ids is not None and (not isinstance(message_ids, list) or
+                                        not all(isinstance(mid, int) and mid > 0 for mid in message_ids)):
+            return jsonify({
+                'success': False,
+                'error': 'message_ids must be an array of positive integers'
+            }), 400
+        
+        requeued = zalo_processor.work_queue.requeue(message_ids, state=state)
+        
+        return jsonify({
+            'success': True,
+            'data': {'requeued': requeued},
+            'message': f'Requeued {requeued} message(s)'
+        })
+    except Exception as e:
+        logger.error(f"Error in requeue_dead_messages: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@zalo_test_bp.route('/extraction-cache/stats', methods=['GET'])
+def get_extraction_cache_stats():
+    """Thống kê extraction cache: hit rate và số entry của fingerprint (prompt + model + property tree) hiện tại"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': zalo_processor.extraction_cache.get_stats(zalo_processor.get_extraction_fingerprint())
+        })
+    except Exception as e:
+        logger.error(f"Error in get_extraction_cache_stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@zalo_test_bp.route('/extraction-cache/purge', methods=['POST'])
+def purge_extraction_cache():
+    """
+    Xóa extraction cache
+    Body (optional): {"all": true} - xóa toàn bộ, mặc định chỉ xóa entry của prompt/model/property tree cũ
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        fingerprint = None if data.get('all') else zalo_processor.get_extraction_fingerprint()
+
+        purged = zalo_processor.extraction_cache.purge_stale(fingerprint)
+
+        return jsonify({
+            'success': True,
+            'data': {'purged': purged},
+            'message': f'Purged {purged} extraction cache entries'
+        })
+    except Exception as e:
+        logger.error(f"Error in purge_extraction_cache: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@zalo_test_bp.route('/llm-gateway/stats', methods=['GET'])
+def get_llm_gateway_stats():
+    """Thống kê LLM gateway theo model: request, lỗi, 429, failover, hedge, ngân sách rpm/tpm hiện tại"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': zalo_processor.llm_gateway.get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error in get_llm_gateway_stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @zalo_test_bp.route('/batch-process', methods=['POST'])
 def batch_process_messages():
     """Xử lý batch tin nhắn"""
@@ -0,0 +1,183 @@
+"""
+Database Pools
+Quản lý connection pool dùng chung cho database easychat (chat) và warehouse
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from utils.metrics import metrics
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+logger = logging.getLogger(__name__)
+
+
+def _pool_setting(prefix: str, name: str, default: str) -> str:
+    """Đọc cấu hình pool: ưu tiên {prefix}_{name}, sau đó DB_{name}, cuối cùng default"""
+    return os.getenv(f'{prefix}_{name}', os.getenv(f'DB_{name}', default))
+
+
+class DatabasePool:
+    """
+    Connection pool (SQLAlchemy QueuePool, driver pymysql) cho một database.
+
+    - connect(): SQLAlchemy Connection, dùng với text()
+    - raw_connection(): DBAPI (pymysql) connection, close() trả connection về pool
+    - get_stats(): số connection đang dùng, số thread đang chờ, thời gian chờ
+    """
+
+    def __init__(self, name: str, env_prefix: str, host: str, port: str, user: str, password: str, database: str):
+        self.name = name
+        self.pool_size = int(_pool_setting(env_prefix, 'POOL_SIZE', '5'))
+        self.max_overflow = int(_pool_setting(env_prefix, 'POOL_MAX_OVERFLOW', '10'))
+        self.pool_timeout = int(_pool_setting(env_prefix, 'POOL_TIMEOUT', '10'))
+        self.pool_recycle = int(_pool_setting(env_prefix, 'POOL_RECYCLE', '1800'))
+        self.connect_timeout = int(_pool_setting(env_prefix, 'CONNECT_TIMEOUT', '10'))
+        self.query_timeout = int(_pool_setting(env_prefix, 'QUERY_TIMEOUT', '30'))
+
+        url = URL.create(
+            'mysql+pymysql',
+            username=user,
+            password=password,
+            host=host,
+            port=int(port),
+            database=database,
+            query={'charset': 'utf8mb4'}
+        )
+
+        self.engine = create_engine(
+            url,
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_recycle=self.pool_recycle,
+            pool_pre_ping=True,
+            connect_args={
+                'connect_timeout': self.connect_timeout,
+                # Timeout socket cho từng query (đọc/ghi)
+                'read_timeout': self.query_timeout,
+                'write_timeout': self.query_timeout,
+                # Giới hạn thời gian chạy SELECT phía MySQL (ms)
+                'init_command': f'SET SESSION max_execution_time={self.query_timeout * 1000}'
+            }
+        )
+
+        # Thống kê checkout
+        self._lock = threading.Lock()
+        self._waiters = 0
+        self._checkouts = 0
+        self._checkout_errors = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+        logger.info(f"DatabasePool '{name}' initialized (size: {self.pool_size}, overflow: {self.max_overflow}, "
+                    f"recycle: {self.pool_recycle}s, query timeout: {self.query_timeout}s)")
+
+    def _checkout(self, factory: Callable):
+        with self._lock:
+            self._waiters += 1
+        start = time.perf_counter()
+        try:
+            connection = factory()
+        except Exception:
+            with self._lock:
+                self._checkout_errors += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._waiters -= 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+        with self._lock:
+            self._checkouts += 1
+        return connection
+
+    def connect(self):
+        """Mượn một SQLAlchemy Connection từ pool (close() để trả lại)"""
+        return self._checkout(self.engine.connect)
+
+    def raw_connection(self):
+        """Mượn một DBAPI (pymysql) connection từ pool (close() để trả lại)"""
+        return self._checkout(self.engine.raw_connection)
+
+    def get_stats(self) -> Dict:
+        """Thống kê pool"""
+        pool = self.engine.pool
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'name': self.name,
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'waiters': self._waiters,
+                'checkouts': checkouts,
+                'checkout_errors': self._checkout_errors,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 2),
+                'wait_time_avg_ms': round(self._wait_time_total * 1000 / checkouts, 2) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 2)
+            }
+
+    def dispose(self):
+        """Đóng toàn bộ connection trong pool"""
+        self.engine.dispose()
+
+
+# Pool cho database easychat (zalo_received_messages, ...)
+chat_pool = DatabasePool(
+    name='easychat',
+    env_prefix='DB_CHAT',
+    host=os.getenv('DB_CHAT_HOST', '103.6.234.59'),
+    port=os.getenv('DB_CHAT_PORT', '6033'),
+    user=os.getenv('DB_CHAT_USER', 'easychat'),
+    password=os.getenv('DB_CHAT_PASSWORD', ''),
+    database=os.getenv('DB_NAME', 'easychat')
+)
+
+# Pool cho database warehouse (apartments, property_groups, ...)
+warehouse_pool = DatabasePool(
+    name='warehouse',
+    env_prefix='DB_WAREHOUSE',
+    host=os.getenv('DB_WAREHOUSE_HOST', '103.6.234.59'),
+    port=os.getenv('DB_WAREHOUSE_PORT', '6033'),
+    user=os.getenv('DB_WAREHOUSE_USER', 'root'),
+    password=os.getenv('DB_WAREHOUSE_PASSWORD', ''),
+    database=os.getenv('DB_WAREHOUSE_NAME', 'warehouse')
+)
+
+
+def get_pool_stats() -> Dict:
+    """Thống kê của tất cả pools"""
+    return {
+        'easychat': chat_pool.get_stats(),
+        'warehouse': warehouse_pool.get_stats()
+    }
+
+
+POOL_CONNECTIONS = metrics.gauge('zalo_db_pool_connections', 'Connections per pool by state (checked_out, checked_in, overflow, waiters)')
+POOL_CHECKOUTS = metrics.gauge('zalo_db_pool_checkouts', 'Connection checkouts per pool since start')
+POOL_CHECKOUT_ERRORS = metrics.gauge('zalo_db_pool_checkout_errors', 'Failed connection checkouts per pool since start')
+POOL_WAIT_SECONDS = metrics.gauge('zalo_db_pool_wait_seconds', 'Total time spent waiting for a pooled connection')
+
+
+def _collect_pool_metrics():
+    """Cập nhật gauge của connection pool ngay trước khi export metrics"""
+    for name, stats in get_pool_stats().items():
+        for state in ('checked_out', 'checked_in', 'overflow', 'waiters'):
+            POOL_CONNECTIONS.set(stats[state], pool=name, state=state)
+        POOL_CHECKOUTS.set(stats['checkouts'], pool=name)
+        POOL_CHECKOUT_ERRORS.set(stats['checkout_errors'], pool=name)
+        POOL_WAIT_SECONDS.set(stats['wait_time_total_ms'] / 1000, pool=name)
+
+
+metrics.register_collector(_collect_pool_metrics)
@@ -0,0 +1,196 @@
+"""
+Extraction Cache
+Cache bền vững (bảng zalo_extraction_cache) cho kết quả bóc tách LLM theo content_hash
+và fingerprint của prompt + model, để không gọi Groq lại cho nội dung đã bóc tách
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import text
+from .database_pools import chat_pool
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+logger = logging.getLogger(__name__)
+
+
+def compute_fingerprint(model: str, prompt_template: str) -> str:
+    """
+    Fingerprint của cấu hình bóc tách: đổi model, prompt hay property tree thì fingerprint đổi
+
+    Args:
+        model: Tên model LLM
+        prompt_template: Prompt đầy đủ với placeholder thay cho nội dung tin nhắn
+
+    Returns:
+        str: SHA1 hex
+    """
+    return hashlib.sha1(f"{model}\n{prompt_template}".encode('utf-8')).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache kết quả bóc tách theo (content_hash, fingerprint)
+
+    - get_many(): lấy kết quả cho nhiều content_hash bằng 1 query
+    - put_many(): lưu kết quả của 1 batch bằng 1 câu INSERT ... ON DUPLICATE KEY UPDATE
+    - purge_stale(): xóa các entry không thuộc fingerprint hiện tại
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('ZALO_EXTRACTION_CACHE', '1') == '1'
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        logger.info(f"ExtractionCache initialized (enabled: {self.enabled})")
+
+    def get_many(self, content_hashes: List[str], fingerprint: str) -> Dict[str, List[Dict]]:
+        """
+        Lấy kết quả đã cache
+
+        Args:
+            content_hashes: List content_hash cần tra
+            fingerprint: Fingerprint hiện tại
+
+        Returns:
+            Dict {content_hash: [apartment, ...]} cho các hash có trong cache
+        """
+        content_hashes = list(dict.fromkeys(h for h in content_hashes if h))
+        if not self.enabled or not content_hashes:
+            return {}
+
+        connection = None
+        try:
+            connection = chat_pool.connect()
+            placeholders = ','.join([f':h_{i}' for i in range(len(content_hashes))])
+            params = {f'h_{i}': h for i, h in enumerate(content_hashes)}
+            params['fingerprint'] = fingerprint
+            rows = connection.execute(text(f"""
+                SELECT content_hash, apartments
+                FROM zalo_extraction_cache
+                WHERE fingerprint = :fingerprint AND content_hash IN ({placeholders})
+            """), params).fetchall()
+
+            cached = {}
+            for row in rows:
+                apartments = row._mapping['apartments']
+                if isinstance(apartments, str):
+                    apartments = json.loads(apartments)
+                cached[row._mapping['content_hash']] = apartments if isinstance(apartments, list) else []
+
+            if cached:
+                hit_placeholders = ','.join([f':hit_{i}' for i in range(len(cached))])
+                hit_params = {f'hit_{i}': h for i, h in enumerate(cached)}
+                hit_params['fingerprint'] = fingerprint
+                connection.execute(text(f"""
+                    UPDATE zalo_extraction_cache
+                    SET hit_count = hit_count + 1, last_hit_at = NOW()
+                    WHERE fingerprint = :fingerprint AND content_hash IN ({hit_placeholders})
+                """), hit_params)
+                connection.commit()
+
+            with self._lock:
+                self.hits += len(cached)
+                self.misses += len(content_hashes) - len(cached)
+            return cached
+        except Exception as e:
+            logger.error(f"❌ Error reading extraction cache: {e}")
+            with self._lock:
+                self.misses += len(content_hashes)
+            return {}
+        finally:
+            if connection:
+                connection.close()
+
+    def put_many(self, entries: Dict[str, List[Dict]], fingerprint: str, model: str) -> int:
+        """
+        Lưu kết quả bóc tách
+
+        Args:
+            entries: Dict {content_hash: [apartment, ...]} (apartment không chứa message_id)
+            fingerprint: Fingerprint hiện tại
+            model: Tên model
+
+        Returns:
+            int: Số entry đã ghi
+        """
+        entries = {h: apartments for h, apartments in entries.items() if h}
+        if not self.enabled or not entries:
+            return 0
+
+        connection = None
+        try:
+            connection = chat_pool.connect()
+            values = []
+            params = {'fingerprint': fingerprint, 'model': model}
+            for i, (content_hash, apartments) in enumerate(entries.items()):
+                values.append(f"(:h_{i}, :fingerprint, :model, CAST(:a_{i} AS JSON))")
+                params[f'h_{i}'] = content_hash
+                params[f'a_{i}'] = json.dumps(apartments, ensure_ascii=False)
+            connection.execute(text(f"""
+                INSERT INTO zalo_extraction_cache (content_hash, fingerprint, model, apartments)
+                VALUES {', '.join(values)} AS new
+                ON DUPLICATE KEY UPDATE apartments = new.apartments, created_at = NOW()
+            """), params)
+            connection.commit()
+            with self._lock:
+                self.writes += len(entries)
+            return len(entries)
+        except Exception as e:
+            logger.error(f"❌ Error writing extraction cache: {e}")
+            return 0
+        finally:
+            if connection:
+                connection.close()
+
+    def purge_stale(self, fingerprint: Optional[str] = None) -> int:
+        """Xóa entry không thuộc fingerprint hiện tại (fingerprint=None để xóa toàn bộ)"""
+        connection = chat_pool.connect()
+        try:
+            if fingerprint:
+                result = connection.execute(text("DELETE FROM zalo_extraction_cache WHERE fingerprint <> :fingerprint"),
+                                            {'fingerprint': fingerprint})
+            else:
+                result = connection.execute(text("DELETE FROM zalo_extraction_cache"))
+            connection.commit()
+            logger.info(f"🧹 Purged {result.rowcount} extraction cache entries")
+            return result.rowcount
+        finally:
+            connection.close()
+
+    def get_stats(self, fingerprint: Optional[str] = None) -> Dict:
+        """Hit rate trong process và số entry của fingerprint hiện tại"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+        if fingerprint:
+            connection = chat_pool.connect()
+            try:
+                row = connection.execute(text("""
+                    SELECT COUNT(*) AS entries, COALESCE(SUM(hit_count), 0) AS total_hits
+                    FROM zalo_extraction_cache
+                    WHERE fingerprint = :fingerprint
+                """), {'fingerprint': fingerprint}).fetchone()
+                stats['fingerprint'] = fingerprint
+                stats['entries'] = row._mapping['entries']
+                stats['total_hits'] = int(row._mapping['total_hits'])
+            finally:
+                connection.close()
+        return stats
+
+
+# Global instance
+extraction_cache = ExtractionCache()
@@ -0,0 +1,358 @@
+"""
+Message Ingest Writer
+Ghi tin nhắn nhận từ Zalo bot vào database ở thread riêng: listener websocket chỉ đưa tin vào hàng đợi
+rồi quay lại nhận tin tiếp, writer gom nhiều tin vào 1 transaction.
+Khi hàng đợi đầy hoặc database lỗi, tin được ghi ra journal trên đĩa và ghi lại vào DB sau.
+Tin lỗi dữ liệu (DataError, IntegrityError...) được tách ra file dead-letter để không chặn các tin khác.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import exc as sa_exc
+from utils.metrics import metrics, span
+
+logger = logging.getLogger(__name__)
+
+INGEST_MESSAGES = metrics.counter('zalo_ingest_messages_total',
+                                  'Received messages by ingest outcome (queued, written, spilled, replayed, dead_letter, failed)')
+INGEST_QUEUE_DEPTH = metrics.gauge('zalo_ingest_queue_depth', 'Messages waiting in the in-memory ingest queue')
+INGEST_JOURNAL_RECORDS = metrics.gauge('zalo_ingest_journal_records', 'Messages waiting in the on-disk ingest journal')
+INGEST_BATCH_SIZE = metrics.histogram('zalo_ingest_batch_size', 'Messages per ingest transaction',
+                                      buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+# Lỗi kết nối/DB không sẵn sàng: cả batch vào journal và thử lại sau, các lỗi khác coi là lỗi dữ liệu của record
+OUTAGE_ERRORS = (sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.DisconnectionError, sa_exc.TimeoutError,
+                 ConnectionError, TimeoutError)
+
+
+def is_outage_error(error: Exception) -> bool:
+    """Lỗi do DB/kết nối (thử lại sau sẽ được), không phải do dữ liệu của record"""
+    return isinstance(error, OUTAGE_ERRORS) or getattr(error, 'connection_invalidated', False)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class MessageIngestWriter:
+    """
+    Hàng đợi ghi DB có giới hạn + 1 thread writer.
+
+    - submit(): không block listener; hàng đợi đầy thì ghi thẳng ra journal (không mất tin)
+    - Writer flush khi đủ batch_size tin hoặc sau max_wait_ms kể từ tin đầu tiên của batch
+    - handler(records) lỗi kết nối (DB down) thì cả batch vào journal, các batch sau ghi thẳng ra journal
+      cho tới lần thử lại kế tiếp (retry_seconds); DB ổn lại thì journal được ghi lại theo từng batch
+    - Lỗi khác (dữ liệu) thì batch được ghi lại từng record, record vẫn lỗi được ghi ra file dead-letter
+      (kèm lỗi) để 1 tin hỏng không kéo cả hàng đợi vào journal
+    - Record trong journal là JSON (datetime thành chuỗi ISO), handler phải chấp nhận cả 2 dạng
+    """
+
+    def __init__(self, handler: Callable[[List[Dict]], Any], max_pending: int = 5000, batch_size: int = 100,
+                 max_wait_ms: int = 200, journal_path: Optional[str] = None, retry_seconds: float = 5.0,
+                 name: str = 'ingest-writer', dead_letter_path: Optional[str] = None):
+        """
+        Args:
+            handler: Hàm ghi 1 batch record vào DB trong 1 transaction (raise nếu lỗi)
+            max_pending: Số record tối đa trong hàng đợi bộ nhớ
+            batch_size: Số record tối đa mỗi transaction
+            max_wait_ms: Thời gian chờ tối đa kể từ record đầu tiên của batch
+            journal_path: File JSON lines chứa record chưa ghi được (None = không spill, record bị bỏ)
+            retry_seconds: Thời gian chờ trước khi thử ghi DB lại sau lỗi
+            name: Tên dùng cho thread và log
+            dead_letter_path: File JSON lines chứa record lỗi dữ liệu (None = <journal>.dead.jsonl cạnh journal)
+        """
+        self.handler = handler
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.journal_path = journal_path
+        if dead_letter_path is None and journal_path:
+            dead_letter_path = os.path.splitext(journal_path)[0] + '.dead.jsonl'
+        self.dead_letter_path = dead_letter_path
+        self.retry_seconds = retry_seconds
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._journal_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._atexit_registered = False
+        self._journal_records = 0
+        self._retry_at = 0.0
+
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'batches': 0,
+            'spilled': 0,
+            'spilled_queue_full': 0,
+            'replayed': 0,
+            'dead_lettered': 0,
+            'write_errors': 0,
+            'last_error': None,
+            'last_write_at': None
+        }
+        self._recover_journal()
+
+    def start(self):
+        """Khởi động thread writer (gọi nhiều lần cũng không sao)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+            logger.info(f"🚀 {self.name} started (batch size: {self.batch_size}, max wait: {int(self.max_wait * 1000)}ms, "
+                        f"journal: {self.journal_path})")
+
+    def stop(self, timeout: float = 10.0):
+        """Dừng writer: ghi nốt hàng đợi, phần không kịp ghi được đưa vào journal"""
+        with self._lock:
+            if not self._thread:
+                return
+            self._stop_event.set()
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        leftover = self._drain(self._queue.qsize())
+        if leftover:
+            self._spill(leftover)
+        logger.info(f"🛑 {self.name} stopped")
+
+    def submit(self, record: Dict) -> bool:
+        """
+        Đưa record vào hàng đợi, tự khởi động writer nếu chưa chạy
+
+        Returns:
+            True nếu vào hàng đợi, False nếu hàng đợi đầy và record được ghi ra journal
+        """
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+            self.stats['queued'] += 1
+            INGEST_MESSAGES.inc(outcome='queued')
+            INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+            return True
+        except queue.Full:
+            self.stats['spilled_queue_full'] += 1
+            logger.warning(f"⚠️ {self.name} queue full, spilling message to journal")
+            self._spill([record])
+            return False
+
+    def _drain(self, limit: int) -> List[Dict]:
+        records = []
+        while len(records) < limit:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                self._replay_journal()
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+
+            if time.monotonic() < self._retry_at:
+                # DB vừa lỗi: ghi thẳng ra journal, không chờ timeout kết nối cho từng batch
+                self._spill(batch)
+            elif self._write(batch, 'written'):
+                self._replay_journal()
+
+    def _write(self, records: List[Dict], outcome: str) -> bool:
+        """
+        Ghi 1 batch bằng handler.
+        Lỗi kết nối thì đưa batch vào journal và hoãn lần ghi kế tiếp; lỗi dữ liệu thì ghi lại từng record
+
+        Returns:
+            False nếu DB không sẵn sàng (phần chưa ghi đã vào journal), True nếu mọi record đã ghi hoặc vào dead-letter
+        """
+        try:
+            with span('ingest_write'):
+                self.handler(records)
+        except Exception as e:
+            self.stats['write_errors'] += 1
+            self.stats['last_error'] = str(e)
+            if is_outage_error(e):
+                self._defer(records, outcome, e)
+                return False
+            logger.warning(f"⚠️ {self.name} failed to write {len(records)} message(s), retrying one by one: {e}")
+            return self._write_one_by_one(records, outcome)
+        self._record_written(len(records), outcome)
+        return True
+
+    def _write_one_by_one(self, records: List[Dict], outcome: str) -> bool:
+        """Ghi lại từng record của batch lỗi; record lỗi dữ liệu vào dead-letter, lỗi kết nối thì phần còn lại vào journal"""
+        for index, record in enumerate(records):
+            try:
+                with span('ingest_write'):
+                    self.handler([record])
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                if is_outage_error(e):
+                    self._defer(records[index:], outcome, e)
+                    return False
+                self._dead_letter(record, e)
+                continue
+            self._record_written(1, outcome)
+        return True
+
+    def _defer(self, records: List[Dict], outcome: str, error: Exception):
+        """DB không sẵn sàng: đưa record vào journal và hoãn lần ghi kế tiếp retry_seconds"""
+        self._retry_at = time.monotonic() + self.retry_seconds
+        logger.error(f"❌ {self.name} failed to write {len(records)} message(s), retry in {self.retry_seconds}s: {error}")
+        self._spill(records, new=outcome != 'replayed')
+
+    def _record_written(self, count: int, outcome: str):
+        self.stats['batches'] += 1
+        self.stats[outcome] += count
+        self.stats['last_write_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        INGEST_BATCH_SIZE.observe(count)
+        INGEST_MESSAGES.inc(count, outcome=outcome)
+
+    def _dead_letter(self, record: Dict, error: Exception):
+        """Ghi record lỗi dữ liệu (kèm lỗi) ra file dead-letter, không ghi lại tự động"""
+        self.stats['dead_lettered'] += 1
+        INGEST_MESSAGES.inc(outcome='dead_letter')
+        logger.error(f"❌ {self.name} dead-lettered message {str(record)[:200]}: {error}")
+        if not self.dead_letter_path:
+            return
+        entry = {'record': record, 'error': f"{type(error).__name__}: {error}",
+                 'failed_at': datetime.now().isoformat(timespec='seconds')}
+        try:
+            with self._journal_lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+                with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=_json_default) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"❌ {self.name} could not write dead-letter file {self.dead_letter_path}: {e}")
+
+    def _spill(self, records: List[Dict], new: bool = True):
+        """Ghi thêm record vào cuối journal (new=False: record lấy ra từ journal, không tính là spill mới)"""
+        if not records:
+            return
+        if not self.journal_path:
+            INGEST_MESSAGES.inc(len(records), outcome='failed')
+            logger.error(f"❌ {self.name} has no journal, dropped {len(records)} message(s)")
+            return
+        try:
+            with self._journal_lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False, default=_json_default) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_records += len(records)
+                INGEST_JOURNAL_RECORDS.set(self._journal_records)
+            if new:
+                self.stats['spilled'] += len(records)
+                INGEST_MESSAGES.inc(len(records), outcome='spilled')
+        except OSError as e:
+            INGEST_MESSAGES.inc(len(records), outcome='failed')
+            logger.error(f"❌ {self.name} could not write journal {self.journal_path}, dropped {len(records)} message(s): {e}")
+
+    def _read_journal(self, path: str) -> List[Dict]:
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Dòng cuối bị cắt dở khi process chết giữa lúc ghi
+                    logger.warning(f"⚠️ {self.name} skipped corrupt journal line: {line[:100]}")
+        return records
+
+    def _recover_journal(self):
+        """Đếm record còn trong journal; file .replay còn sót (process chết khi đang replay) được gộp lại"""
+        if not self.journal_path:
+            return
+        replay_path = self.journal_path + '.replay'
+        try:
+            if os.path.exists(replay_path):
+                records = self._read_journal(replay_path)
+                os.remove(replay_path)
+                self._spill(records, new=False)
+            elif os.path.exists(self.journal_path):
+                self._journal_records = len(self._read_journal(self.journal_path))
+            INGEST_JOURNAL_RECORDS.set(self._journal_records)
+            if self._journal_records:
+                logger.warning(f"⚠️ {self.name} found {self._journal_records} message(s) in journal, will replay")
+        except OSError as e:
+            logger.error(f"❌ {self.name} could not read journal {self.journal_path}: {e}")
+
+    def _replay_journal(self):
+        """Ghi lại journal vào DB theo từng batch; lỗi giữa chừng thì phần còn lại quay về journal"""
+        if not self._journal_records or time.monotonic() < self._retry_at:
+            return
+        replay_path = self.journal_path + '.replay'
+        try:
+            with self._journal_lock:
+                if not os.path.exists(self.journal_path):
+                    self._journal_records = 0
+                    return
+                os.replace(self.journal_path, replay_path)
+                self._journal_records = 0
+                INGEST_JOURNAL_RECORDS.set(0)
+            records = self._read_journal(replay_path)
+        except OSError as e:
+            logger.error(f"❌ {self.name} could not open journal for replay: {e}")
+            self._retry_at = time.monotonic() + self.retry_seconds
+            return
+
+        logger.info(f"🔁 {self.name} replaying {len(records)} journaled message(s)")
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            if not self._write(batch, 'replayed'):
+                # _write đã đưa batch lỗi vào journal, các batch sau cũng quay lại journal
+                self._spill(records[start + self.batch_size:], new=False)
+                break
+        else:
+            logger.info(f"✅ {self.name} replayed {len(records)} journaled message(s)")
+        os.remove(replay_path)
+
+    def get_stats(self) -> Dict:
+        """Thống kê writer (số tin đã ghi, đang chờ, trong journal, lỗi)"""
+        return dict(
+            self.stats,
+            running=bool(self._thread and self._thread.is_alive()),
+            pending=self._queue.qsize(),
+            journal_records=self._journal_records,
+            journal_path=self.journal_path,
+            dead_letter_path=self.dead_letter_path,
+            batch_size=self.batch_size,
+            max_wait_ms=int(self.max_wait * 1000)
+        )
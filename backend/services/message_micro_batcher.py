@@ -0,0 +1,150 @@
+"""
+Message Micro Batcher
+Gom message id mới nhận vào batch nhỏ và flush khi đủ N message hoặc sau T mili giây
+(tùy điều kiện nào đến trước) để bóc tách gần như realtime mà vẫn giữ hiệu quả của batch
+"""
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class MessageMicroBatcher:
+    """
+    Micro-batcher in-process.
+
+    - submit(): không block, trả về False nếu hàng đợi đầy (message vẫn PENDING trong DB,
+      scheduler/work queue sẽ xử lý sau)
+    - Thread collector gom item và flush khi đủ max_batch_size hoặc quá max_wait_ms kể từ item đầu tiên
+    - Flush chạy trong worker pool (tối đa max_concurrent_flushes batch cùng lúc) để collector không bị chặn
+      bởi request Groq; khi tất cả worker bận thì collector chờ, hàng đợi đầy dần và submit() trả về False
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Any], max_batch_size: int = 20, max_wait_ms: int = 2000,
+                 max_pending: int = 1000, max_concurrent_flushes: int = 2, name: str = 'micro-batcher'):
+        """
+        Args:
+            handler: Hàm nhận list item của 1 batch
+            max_batch_size: Số item tối đa mỗi batch (N)
+            max_wait_ms: Thời gian chờ tối đa kể từ item đầu tiên của batch (T)
+            max_pending: Số item tối đa đang chờ trong hàng đợi
+            max_concurrent_flushes: Số batch được xử lý song song
+            name: Tên dùng cho thread và log
+        """
+        self.handler = handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self.max_concurrent_flushes = max(1, max_concurrent_flushes)
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._flush_slots = threading.BoundedSemaphore(self.max_concurrent_flushes)
+        self._executor = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'submitted': 0,
+            'dropped': 0,
+            'batches': 0,
+            'flushed_items': 0,
+            'flush_errors': 0,
+            'flush_by_size': 0,
+            'flush_by_time': 0,
+            'last_flush_at': None
+        }
+
+    def start(self):
+        """Khởi động thread collector (gọi nhiều lần cũng không sao)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_flushes, thread_name_prefix=f'{self.name}-flush')
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            logger.info(f"🚀 {self.name} started (batch size: {self.max_batch_size}, max wait: {int(self.max_wait * 1000)}ms)")
+
+    def stop(self, timeout: float = 10.0):
+        """Dừng collector, flush nốt các item còn trong hàng đợi"""
+        with self._lock:
+            if not self._thread:
+                return
+            self._stop_event.set()
+            self._thread.join(timeout=timeout)
+            self._executor.shutdown(wait=True)
+            self._thread = None
+            self._executor = None
+            logger.info(f"🛑 {self.name} stopped")
+
+    def submit(self, item: Any) -> bool:
+        """Đưa item vào hàng đợi, tự khởi động collector nếu chưa chạy"""
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait(item)
+            self.stats['submitted'] += 1
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            logger.warning(f"⚠️ {self.name} queue full, item {item} left for scheduled processing")
+            return False
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            # Chờ item đầu tiên của batch
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.stats['flush_by_size' if len(batch) >= self.max_batch_size else 'flush_by_time'] += 1
+
+            # Chờ slot trống để giới hạn số batch xử lý song song (backpressure)
+            self._flush_slots.acquire()
+            try:
+                future = self._executor.submit(self._flush, batch)
+            except RuntimeError:
+                self._flush_slots.release()
+                self._flush(batch)
+                continue
+            future.add_done_callback(lambda _: self._flush_slots.release())
+
+    def _flush(self, batch: List[Any]):
+        try:
+            logger.info(f"📤 {self.name} flushing {len(batch)} item(s)")
+            self.handler(batch)
+        except Exception as e:
+            self.stats['flush_errors'] += 1
+            logger.error(f"❌ {self.name} flush failed: {e}")
+        finally:
+            self.stats['batches'] += 1
+            self.stats['flushed_items'] += len(batch)
+            self.stats['last_flush_at'] = time.time()
+
+    def get_stats(self) -> Dict:
+        """Thống kê micro-batcher"""
+        return dict(
+            self.stats,
+            running=bool(self._thread and self._thread.is_alive()),
+            pending=self._queue.qsize(),
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=int(self.max_wait * 1000)
+        )
@@ -0,0 +1,87 @@
+"""
+Message Repository
+Đọc zalo_received_messages theo nhiều id bằng 1 query IN (thay cho mỗi id 1 connection + 1 query)
+"""
+
+import os
+import logging
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import text
+from utils.identity_map import IdentityMap
+from .database_pools import chat_pool
+from .message_work_queue import MESSAGE_COLUMNS, _id_params
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+logger = logging.getLogger(__name__)
+
+# Số id tối đa trong 1 mệnh đề IN
+MESSAGE_FETCH_CHUNK_SIZE = 500
+
+
+class MessageRepository:
+    """
+    Truy vấn message theo lô, mượn 1 connection từ pool cho mỗi lần gọi
+
+    - get_messages_by_ids(): toàn bộ cột MESSAGE_COLUMNS cho nhiều message
+    - get_content_hashes(): chỉ content_hash (dùng khi cập nhật warehouse_ids)
+    - identity_map(): cache trong phạm vi 1 batch để không load lại message đã có
+    """
+
+    def _fetch_by_ids(self, columns: str, message_ids: List[int]) -> Dict[int, Dict]:
+        ids = list(dict.fromkeys(int(i) for i in message_ids if i is not None))
+        if not ids:
+            return {}
+        connection = chat_pool.connect()
+        try:
+            messages = {}
+            for start in range(0, len(ids), MESSAGE_FETCH_CHUNK_SIZE):
+                placeholders, params = _id_params(ids[start:start + MESSAGE_FETCH_CHUNK_SIZE])
+                result = connection.execute(text(f"""
+                    SELECT {columns}
+                    FROM zalo_received_messages
+                    WHERE id IN ({placeholders})
+                """), params)
+                for row in result:
+                    message = dict(row._mapping)
+                    messages[message['id']] = message
+            return messages
+        finally:
+            connection.close()
+
+    def get_messages_by_ids(self, message_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Lấy nhiều message bằng 1 query IN (chia chunk nếu quá MESSAGE_FETCH_CHUNK_SIZE id)
+
+        Args:
+            message_ids: List ID message (id trùng được bỏ qua)
+
+        Returns:
+            Dict {message_id: message dict}, id không tồn tại không có trong kết quả ({} nếu lỗi DB)
+        """
+        try:
+            messages = self._fetch_by_ids(MESSAGE_COLUMNS, message_ids)
+            logger.info(f"📥 Loaded {len(messages)}/{len(set(message_ids))} message(s) in one query")
+            return messages
+        except Exception as e:
+            logger.error(f"❌ Error fetching messages {list(message_ids)[:20]}: {e}")
+            return {}
+
+    def get_content_hashes(self, message_ids: List[int]) -> Dict[int, Optional[str]]:
+        """Lấy content_hash cho nhiều messages bằng 1 query"""
+        try:
+            rows = self._fetch_by_ids('id, content_hash', message_ids)
+            return {message_id: row['content_hash'] for message_id, row in rows.items()}
+        except Exception as e:
+            logger.error(f"❌ Error fetching content_hash for messages {message_ids}: {e}")
+            return {}
+
+    def identity_map(self) -> IdentityMap:
+        """Identity map mới cho 1 batch: mỗi message chỉ được load từ DB 1 lần"""
+        return IdentityMap(self.get_messages_by_ids)
+
+
+# Global instance
+message_repository = MessageRepository()
@@ -0,0 +1,335 @@
+"""
+Message Work Queue
+Hàng đợi bền vững (trên bảng zalo_received_messages) cho việc bóc tách tin nhắn:
+worker nhận việc bằng lease, retry với backoff và chuyển DEAD khi lỗi quá số lần
+"""
+
+import os
+import socket
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import text
+from utils.metrics import metrics, span
+from .database_pools import chat_pool
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+logger = logging.getLogger(__name__)
+
+# Cột message trả về cho processor khi claim
+MESSAGE_COLUMNS = """id, session_id, config_id, sender_id, sender_name,
+           content, thread_id, thread_type, received_at,
+           status_push_kafka, warehouse_ids, reply_quote,
+           content_hash, added_document_chunks, attempt_count"""
+
+# Độ dài tối đa của last_error lưu vào DB
+MAX_ERROR_LENGTH = 2000
+
+# Bucket (giây) cho độ trễ từ lúc nhận tin tới lúc được claim: từ 1 giây tới 1 ngày
+QUEUE_LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+QUEUE_LAG = metrics.histogram('zalo_queue_lag_seconds',
+                              'Delay between received_at and the moment a message is claimed',
+                              buckets=QUEUE_LAG_BUCKETS)
+QUEUE_OLDEST_LAG = metrics.gauge('zalo_queue_oldest_lag_seconds',
+                                 'Lag of the oldest message in the most recent claim')
+CLAIMED_MESSAGES = metrics.counter('zalo_queue_claimed_total', 'Messages leased by this worker')
+
+
+def _id_params(message_ids: List[int], prefix: str = 'id') -> Tuple[str, Dict]:
+    """Tạo placeholders + params cho mệnh đề IN"""
+    placeholders = ','.join([f':{prefix}_{i}' for i in range(len(message_ids))])
+    params = {f'{prefix}_{i}': message_id for i, message_id in enumerate(message_ids)}
+    return placeholders, params
+
+
+class MessageWorkQueue:
+    """
+    Work queue có lease cho zalo_received_messages (xem migrations/zalo_received_messages_processing_lease.sql)
+
+    - claim(): nhận tối đa N message bằng SELECT ... FOR UPDATE SKIP LOCKED, đánh dấu LEASED
+    - complete()/fail(): kết thúc lease, FAILED được retry sau backoff, quá max_attempts thì DEAD
+    - Lease hết hạn (worker chết giữa chừng) được thu hồi ở lần claim kế tiếp
+    - Mọi mốc thời gian dùng NOW() của MySQL nên chạy nhiều instance trên nhiều host vẫn đúng
+    """
+
+    def __init__(self, owner: Optional[str] = None):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = int(os.getenv('ZALO_QUEUE_LEASE_SECONDS', '300'))
+        self.max_attempts = int(os.getenv('ZALO_QUEUE_MAX_ATTEMPTS', '5'))
+        self.backoff_base = int(os.getenv('ZALO_QUEUE_BACKOFF_BASE', '30'))
+        self.backoff_max = int(os.getenv('ZALO_QUEUE_BACKOFF_MAX', '3600'))
+
+        logger.info(f"MessageWorkQueue initialized (owner: {self.owner}, lease: {self.lease_seconds}s, "
+                    f"max attempts: {self.max_attempts})")
+
+    def reclaim_expired(self, connection) -> int:
+        """Thu hồi các lease đã hết hạn: tính là 1 lần lỗi, retry ngay hoặc DEAD"""
+        result = connection.execute(text("""
+            UPDATE zalo_received_messages
+            SET processing_state = IF(attempt_count >= :max_attempts, 'DEAD', 'FAILED'),
+                next_attempt_at = IF(attempt_count >= :max_attempts, NULL, NOW()),
+                last_error = CONCAT('Lease expired (owner: ', COALESCE(lease_owner, ''), ')'),
+                lease_owner = NULL,
+                lease_expires_at = NULL
+            WHERE processing_state = 'LEASED' AND lease_expires_at < NOW()
+        """), {'max_attempts': self.max_attempts})
+        if result.rowcount:
+            logger.warning(f"⚠️ Reclaimed {result.rowcount} expired lease(s)")
+        return result.rowcount
+
+    def claim(self, limit: int = 20, message_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Nhận tối đa `limit` message chưa xử lý (PENDING hoặc FAILED tới hạn retry)
+
+        Args:
+            limit: Số message tối đa
+            message_ids: Chỉ nhận trong các message này (message mới nhận từ bot), None = bất kỳ
+
+        Returns:
+            List các message dictionaries đã được lease cho owner này
+        """
+        with span('fetch'):
+            messages = self._claim_messages(limit, message_ids)
+        self._observe_lag(messages)
+        return messages
+
+    def _observe_lag(self, messages: List[Dict]):
+        """Ghi độ trễ hàng đợi (received_at -> claim) của các message vừa nhận"""
+        if not messages:
+            return
+        now = datetime.now()
+        lags = [max(0.0, (now - m['received_at']).total_seconds())
+                for m in messages if isinstance(m.get('received_at'), datetime)]
+        for lag in lags:
+            QUEUE_LAG.observe(lag)
+        if lags:
+            QUEUE_OLDEST_LAG.set(max(lags))
+        CLAIMED_MESSAGES.inc(len(messages))
+
+    def _claim_messages(self, limit: int, message_ids: Optional[List[int]]) -> List[Dict]:
+        connection = chat_pool.connect()
+        try:
+            claim_params = {'limit': limit}
+            id_filter = ''
+            if message_ids:
+                placeholders, id_params = _id_params(message_ids, prefix='claim_id')
+                id_filter = f"AND id IN ({placeholders})"
+                claim_params.update(id_params)
+                claim_params['limit'] = len(message_ids)
+            else:
+                self.reclaim_expired(connection)
+                connection.commit()
+
+            # Khóa các row cần nhận, bỏ qua row đang bị worker khác khóa
+            rows = connection.execute(text(f"""
+                SELECT id FROM zalo_received_messages
+                WHERE processing_state IN ('PENDING', 'FAILED')
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+                  AND has_warehouse_ids = 0
+                  AND content_hash IS NOT NULL
+                  {id_filter}
+                ORDER BY id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            """), claim_params).fetchall()
+            message_ids = [row._mapping['id'] for row in rows]
+            if not message_ids:
+                connection.commit()
+                return []
+
+            placeholders, params = _id_params(message_ids)
+            connection.execute(text(f"""
+                UPDATE zalo_received_messages
+                SET processing_state = 'LEASED',
+                    lease_owner = :owner,
+                    lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND,
+                    attempt_count = attempt_count + 1
+                WHERE id IN ({placeholders})
+            """), dict(params, owner=self.owner, lease_seconds=self.lease_seconds))
+            connection.commit()
+
+            result = connection.execute(text(f"""
+                SELECT {MESSAGE_COLUMNS}
+                FROM zalo_received_messages
+                WHERE id IN ({placeholders})
+                ORDER BY id
+            """), params)
+            messages = [dict(row._mapping) for row in result]
+            logger.info(f"📥 Claimed {len(messages)} message(s) (owner: {self.owner})")
+            return messages
+        except Exception as e:
+            connection.rollback()
+            logger.error(f"❌ Error claiming messages: {e}")
+            return []
+        finally:
+            connection.close()
+
+    def extend_lease(self, messages: List[Dict]) -> Set[int]:
+        """
+        Gia hạn lease cho các message đang xử lý (batch chờ Groq lâu, retry/chia nhỏ batch).
+        Chỉ gia hạn lease còn hạn của đúng lần claim này (owner + attempt_count lúc claim):
+        lease đã hết hạn hoặc đã bị thu hồi rồi claim lại thì không còn thuộc batch đang giữ.
+
+        Args:
+            messages: List message đã claim (cần 'id' và 'attempt_count')
+
+        Returns:
+            Set id các message vẫn thuộc worker này và đã được gia hạn
+        """
+        if not messages:
+            return set()
+        placeholders = ','.join(f'(:id_{i}, :attempt_{i})' for i in range(len(messages)))
+        params = {'owner': self.owner, 'lease_seconds': self.lease_seconds}
+        for i, message in enumerate(messages):
+            params[f'id_{i}'] = message['id']
+            params[f'attempt_{i}'] = message.get('attempt_count')
+
+        connection = chat_pool.connect()
+        try:
+            rows = connection.execute(text(f"""
+                SELECT id FROM zalo_received_messages
+                WHERE (id, attempt_count) IN ({placeholders})
+                  AND processing_state = 'LEASED' AND lease_owner = :owner AND lease_expires_at >= NOW()
+                FOR UPDATE
+            """), params).fetchall()
+            renewed = {row._mapping['id'] for row in rows}
+            if renewed:
+                id_placeholders, id_params = _id_params(sorted(renewed), prefix='renew_id')
+                connection.execute(text(f"""
+                    UPDATE zalo_received_messages
+                    SET lease_expires_at = NOW() + INTERVAL :lease_seconds SECOND
+                    WHERE id IN ({id_placeholders})
+                """), dict(id_params, lease_seconds=self.lease_seconds))
+            connection.commit()
+            return renewed
+        except Exception as e:
+            connection.rollback()
+            logger.error(f"❌ Error extending leases: {e}")
+            return set()
+        finally:
+            connection.close()
+
+    def complete(self, message_ids: List[int]) -> int:
+        """Đánh dấu DONE cho các message đã xử lý xong"""
+        if not message_ids:
+            return 0
+        placeholders, params = _id_params(message_ids)
+        return self._execute(f"""
+            UPDATE zalo_received_messages
+            SET processing_state = 'DONE',
+                lease_owner = NULL,
+                lease_expires_at = NULL,
+                next_attempt_at = NULL,
+                last_error = NULL
+            WHERE id IN ({placeholders}) AND processing_state = 'LEASED' AND lease_owner = :owner
+        """, dict(params, owner=self.owner))
+
+    def fail(self, message_ids: List[int], error: str) -> int:
+        """
+        Đánh dấu lỗi: FAILED và retry sau backoff (base * 2^(attempt-1), tối đa backoff_max),
+        hoặc DEAD nếu đã hết số lần thử
+        """
+        if not message_ids:
+            return 0
+        placeholders, params = _id_params(message_ids)
+        return self._execute(f"""
+            UPDATE zalo_received_messages
+            SET processing_state = IF(attempt_count >= :max_attempts, 'DEAD', 'FAILED'),
+                next_attempt_at = IF(attempt_count >= :max_attempts, NULL,
+                    NOW() + INTERVAL LEAST(:backoff_base * POW(2, GREATEST(attempt_count - 1, 0)), :backoff_max) SECOND),
+                last_error = :error,
+                lease_owner = NULL,
+                lease_expires_at = NULL
+            WHERE id IN ({placeholders}) AND processing_state = 'LEASED' AND lease_owner = :owner
+        """, dict(
+            params,
+            owner=self.owner,
+            error=(error or 'Unknown error')[:MAX_ERROR_LENGTH],
+            max_attempts=self.max_attempts,
+            backoff_base=self.backoff_base,
+            backoff_max=self.backoff_max
+        ))
+
+    def skip(self, scores: Dict[int, float]) -> int:
+        """
+        Đánh dấu SKIPPED cho các message prefilter coi là không phải tin rao (không gửi Groq)
+
+        Args:
+            scores: Dict {message_id: listing_score}
+        """
+        if not scores:
+            return 0
+        placeholders, params = _id_params(list(scores))
+        cases = ' '.join(f"WHEN :id_{i} THEN :score_{i}" for i in range(len(scores)))
+        params.update({f'score_{i}': round(score, 4) for i, score in enumerate(scores.values())})
+        return self._execute(f"""
+            UPDATE zalo_received_messages
+            SET processing_state = 'SKIPPED',
+                listing_score = CASE id {cases} END,
+                lease_owner = NULL,
+                lease_expires_at = NULL,
+                next_attempt_at = NULL
+            WHERE id IN ({placeholders}) AND processing_state = 'LEASED' AND lease_owner = :owner
+        """, dict(params, owner=self.owner))
+
+    def requeue(self, message_ids: Optional[List[int]] = None, state: str = 'DEAD') -> int:
+        """
+        Đưa message DEAD (hoặc SKIPPED) về PENDING
+
+        Args:
+            message_ids: None để requeue toàn bộ message ở trạng thái state
+            state: 'DEAD' hoặc 'SKIPPED'
+        """
+        if state not in ('DEAD', 'SKIPPED'):
+            raise ValueError("state must be DEAD or SKIPPED")
+        where = "processing_state = :state"
+        params = {}
+        if message_ids:
+            placeholders, params = _id_params(message_ids)
+            where += f" AND id IN ({placeholders})"
+        params['state'] = state
+        return self._execute(f"""
+            UPDATE zalo_received_messages
+            SET processing_state = 'PENDING', attempt_count = 0, next_attempt_at = NULL, last_error = NULL
+            WHERE {where}
+        """, params)
+
+    def get_stats(self) -> Dict:
+        """Số message theo processing_state"""
+        connection = chat_pool.connect()
+        try:
+            rows = connection.execute(text("""
+                SELECT processing_state, COUNT(*) AS total
+                FROM zalo_received_messages
+                GROUP BY processing_state
+            """)).fetchall()
+            return {
+                'owner': self.owner,
+                'lease_seconds': self.lease_seconds,
+                'max_attempts': self.max_attempts,
+                'states': {row._mapping['processing_state']: row._mapping['total'] for row in rows}
+            }
+        finally:
+            connection.close()
+
+    def _execute(self, sql: str, params: Dict) -> int:
+        connection = chat_pool.connect()
+        try:
+            result = connection.execute(text(sql), params)
+            connection.commit()
+            return result.rowcount
+        except Exception as e:
+            connection.rollback()
+            logger.error(f"❌ Work queue update failed: {e}")
+            return 0
+        finally:
+            connection.close()
+
+
+# Global instance
+message_work_queue = MessageWorkQueue()
@@ -0,0 +1,224 @@
+"""
+Near Duplicate Index
+Gom các tin nhắn gần trùng (đăng lại đổi emoji, đổi 1 chữ số điện thoại...) thành cluster bằng MinHash/LSH.
+Chỉ message đại diện của cluster được gửi Groq, các message còn lại dùng chung warehouse_ids của đại diện.
+"""
+
+import os
+import logging
+import threading
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import text
+from utils.minhash import MinHasher
+from .database_pools import chat_pool
+from .message_work_queue import MESSAGE_COLUMNS, _id_params
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+logger = logging.getLogger(__name__)
+
+
+class NearDuplicateIndex:
+    """
+    Index MinHash/LSH lưu trong database (cột minhash_signature, near_dup_of và bảng zalo_message_lsh_buckets)
+
+    - Chỉ message đại diện (near_dup_of IS NULL) được ghi vào bucket nên bucket không phình to
+      khi 1 tin bị đăng lại hàng trăm lần
+    - Message mới được gán vào cluster của đại diện giống nhất có độ tương đồng >= threshold
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('ZALO_NEAR_DUP_ENABLED', '1') == '1'
+        self.threshold = float(os.getenv('ZALO_NEAR_DUP_THRESHOLD', '0.85'))
+        self.hasher = MinHasher()
+        self.stats = {
+            'indexed': 0,
+            'clustered': 0,
+            'shared': 0
+        }
+        self._lock = threading.Lock()
+        logger.info(f"NearDuplicateIndex initialized (enabled: {self.enabled}, threshold: {self.threshold})")
+
+    def assign_clusters(self, messages: List[Dict]) -> Dict[int, int]:
+        """
+        Tính chữ ký, tìm cluster và lưu index cho các messages
+
+        Args:
+            messages: List message dictionaries (cần 'id' và 'content')
+
+        Returns:
+            Dict {message_id: id đại diện} cho các message gần trùng với 1 message khác
+            (message đại diện và message không trùng không có trong kết quả)
+        """
+        signatures = {}
+        band_keys = {}
+        for message in sorted(messages, key=lambda m: m['id']):
+            signature = self.hasher.signature(message.get('content'))
+            if signature:
+                signatures[message['id']] = signature
+                band_keys[message['id']] = self.hasher.band_keys(signature)
+        if not signatures:
+            return {}
+
+        connection = chat_pool.connect()
+        try:
+            buckets, candidate_signatures = self._load_candidates(connection, band_keys)
+            candidate_signatures.update(signatures)
+
+            # Duyệt theo id tăng dần: message trước trong batch có thể là đại diện của message sau.
+            # Đại diện luôn là message cũ hơn nên cluster không bị vòng.
+            clusters = {}
+            for message_id, signature in signatures.items():
+                best_root, best_similarity = None, self.threshold
+                candidate_ids = set()
+                for key in band_keys[message_id]:
+                    candidate_ids.update(buckets.get(key, ()))
+                for candidate_id in candidate_ids:
+                    if candidate_id >= message_id:
+                        continue
+                    candidate_signature = candidate_signatures.get(candidate_id)
+                    similarity = self.hasher.similarity(signature, candidate_signature)
+                    if similarity >= best_similarity:
+                        best_root, best_similarity = candidate_id, similarity
+                if best_root is not None:
+                    clusters[message_id] = best_root
+                else:
+                    # Message là đại diện mới: thêm vào bucket trong bộ nhớ để các message sau trong batch tìm thấy
+                    for key in band_keys[message_id]:
+                        buckets.setdefault(key, set()).add(message_id)
+
+            self._save(connection, signatures, band_keys, clusters)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        with self._lock:
+            self.stats['indexed'] += len(signatures)
+            self.stats['clustered'] += len(clusters)
+        if clusters:
+            logger.info(f"🧬 {len(clusters)}/{len(signatures)} message(s) matched an existing near-duplicate cluster")
+        return clusters
+
+    def _load_candidates(self, connection, band_keys: Dict[int, List[str]]) -> Tuple[Dict[str, set], Dict[int, List[int]]]:
+        """
+        Lấy các message đại diện chung band key với messages
+
+        Returns:
+            Tuple ({band_key: set(message_id)}, {message_id: signature})
+        """
+        all_keys = sorted({key for keys in band_keys.values() for key in keys})
+        key_placeholders, params = _id_params(all_keys, prefix='band')
+        id_placeholders, id_params = _id_params(list(band_keys), prefix='self')
+        params.update(id_params)
+        rows = connection.execute(text(f"""
+            SELECT b.band_key, b.message_id, m.minhash_signature
+            FROM zalo_message_lsh_buckets b
+            JOIN zalo_received_messages m ON m.id = b.message_id
+            WHERE b.band_key IN ({key_placeholders})
+              AND b.message_id NOT IN ({id_placeholders})
+              AND m.near_dup_of IS NULL
+        """), params).fetchall()
+
+        buckets = {}
+        candidate_signatures = {}
+        for row in rows:
+            row = row._mapping
+            signature = self.hasher.unpack(row['minhash_signature'])
+            if signature:
+                buckets.setdefault(row['band_key'], set()).add(row['message_id'])
+                candidate_signatures[row['message_id']] = signature
+        return buckets, candidate_signatures
+
+    def _save(self, connection, signatures: Dict[int, List[int]], band_keys: Dict[int, List[str]], clusters: Dict[int, int]):
+        """Lưu chữ ký, near_dup_of và bucket (chỉ cho message đại diện)"""
+        connection.execute(text("""
+            UPDATE zalo_received_messages
+            SET minhash_signature = :signature, near_dup_of = :root_id
+            WHERE id = :id
+        """), [
+            {'id': message_id, 'signature': self.hasher.pack(signature), 'root_id': clusters.get(message_id)}
+            for message_id, signature in signatures.items()
+        ])
+
+        values = []
+        params = {}
+        for message_id, keys in band_keys.items():
+            if message_id in clusters:
+                continue
+            for key in keys:
+                i = len(values)
+                values.append(f"(:key_{i}, :mid_{i})")
+                params[f'key_{i}'] = key
+                params[f'mid_{i}'] = message_id
+        if values:
+            connection.execute(text(f"""
+                INSERT IGNORE INTO zalo_message_lsh_buckets (band_key, message_id)
+                VALUES {', '.join(values)}
+            """), params)
+
+    def get_roots(self, root_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Trạng thái xử lý và warehouse_ids của các message đại diện
+
+        Returns:
+            Dict {message_id: {'processing_state', 'warehouse_ids'}}
+        """
+        if not root_ids:
+            return {}
+        placeholders, params = _id_params(list(root_ids))
+        connection = chat_pool.connect()
+        try:
+            rows = connection.execute(text(f"""
+                SELECT id, processing_state, warehouse_ids
+                FROM zalo_received_messages
+                WHERE id IN ({placeholders})
+            """), params).fetchall()
+            return {row._mapping['id']: dict(row._mapping) for row in rows}
+        finally:
+            connection.close()
+
+    def record_shared(self, count: int):
+        """Ghi nhận số message dùng chung kết quả của đại diện (không gọi Groq)"""
+        with self._lock:
+            self.stats['shared'] += count
+
+    def backfill(self, limit: int = 1000, after_id: int = 0) -> Tuple[int, int]:
+        """
+        Index các message cũ chưa có chữ ký (chỉ gán cluster, không chia sẻ warehouse_ids)
+
+        Args:
+            limit: Số message mỗi lần
+            after_id: Chỉ lấy message có id > after_id (message rỗng sau chuẩn hóa không có chữ ký nên cần con trỏ)
+
+        Returns:
+            Tuple (số message đã đọc, id lớn nhất đã đọc)
+        """
+        connection = chat_pool.connect()
+        try:
+            messages = [dict(row._mapping) for row in connection.execute(text(f"""
+                SELECT {MESSAGE_COLUMNS}
+                FROM zalo_received_messages
+                WHERE minhash_signature IS NULL AND id > :after_id
+                ORDER BY id
+                LIMIT :limit
+            """), {'limit': limit, 'after_id': after_id})]
+        finally:
+            connection.close()
+        if not messages:
+            return 0, after_id
+        self.assign_clusters(messages)
+        return len(messages), messages[-1]['id']
+
+    def get_stats(self) -> Dict:
+        """Thống kê index"""
+        with self._lock:
+            return dict(self.stats, enabled=self.enabled, threshold=self.threshold)
+
+
+# Global instance
+near_duplicate_index = NearDuplicateIndex()
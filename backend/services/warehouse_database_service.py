@@ -7,11 +7,22 @@ import os
 import time
 import logging
 import json
-from typing import Dict, Optional, List
+import uuid
+from typing import Any, Dict, Optional, List
 from dotenv import load_dotenv
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from utils.property_service_sql import PropertyService
+from utils.property_tree_cache import PropertyTreeCache
+from utils.ttl_cache import TTLCache
+from utils.response_cache import ResponseCache
+from utils.metrics import metrics, span
+from utils.apartment_natural_key import natural_key
+from utils.keyset_pagination import decode_cursor, encode_cursor
+from utils import apartment_search_text
+from utils.text_normalize import normalize_message_text
+from .database_pools import warehouse_pool
+
+INSERTED_APARTMENTS = metrics.counter('zalo_warehouse_inserted_total', 'Apartments written to the warehouse by outcome (ok, merged, error)')
+DB_RETRIES = metrics.counter('zalo_db_retries_total', 'Database connection/query retries by database')
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -19,11 +30,149 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# Tạo Flask app cho warehouse database
-warehouse_app = Flask(__name__)
-warehouse_app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql://{os.getenv('DB_WAREHOUSE_USER', 'root')}:{os.getenv('DB_WAREHOUSE_PASSWORD', '')}@{os.getenv('DB_WAREHOUSE_HOST', '103.6.234.59')}:{os.getenv('DB_WAREHOUSE_PORT', '6033')}/{os.getenv('DB_WAREHOUSE_NAME', 'warehouse')}"
-warehouse_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-warehouse_db = SQLAlchemy(warehouse_app)
+# Warehouse database dùng pool chung trong database_pools.py
+
+
+# Thứ tự cột khi insert vào bảng apartments
+APARTMENT_INSERT_COLUMNS = [
+    'property_group', 'unit_type', 'unit_code', 'unit_axis', 'unit_floor_number',
+    'area_land', 'area_construction', 'area_net', 'area_gross',
+    'num_bedrooms', 'num_bathrooms', 'type_view',
+    'direction_door', 'direction_balcony',
+    'price', 'price_early', 'price_schedule', 'price_loan', 'price_rent',
+    'notes', 'status', 'data_status', 'unit_allocation', 'listing_type', 'phone_number',
+    'furnished_status', 'floor_level_category', 'move_in_ready', 'includes_transfer_fees'
+]
+
+# Gộp tin rao cùng 1 căn theo natural_key (cần chạy migrations/apartments_natural_key_upsert.sql trước)
+APARTMENT_UPSERT_ENABLED = os.getenv('WAREHOUSE_APARTMENT_UPSERT', '1') == '1'
+
+# Khi gộp: cột mô tả căn giữ giá trị đã có, chỉ bổ sung nếu đang NULL
+APARTMENT_FILL_COLUMNS = [
+    'unit_type', 'unit_code', 'unit_axis', 'unit_floor_number',
+    'area_land', 'area_construction', 'area_net', 'area_gross',
+    'num_bedrooms', 'num_bathrooms', 'type_view',
+    'direction_door', 'direction_balcony', 'floor_level_category'
+]
+
+# Khi gộp: cột theo tin rao mới nhất, tin mới có giá trị thì ghi đè
+# (property_group, listing_type nằm trong natural_key; data_status, unit_allocation giữ nguyên trạng thái duyệt)
+APARTMENT_REFRESH_COLUMNS = [
+    'price', 'price_early', 'price_schedule', 'price_loan', 'price_rent',
+    'notes', 'status', 'phone_number',
+    'furnished_status', 'move_in_ready', 'includes_transfer_fees'
+]
+
+
+def validate_apartment_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate và clean apartment item data
+    Thiếu trường để NULL, thừa trường bỏ qua
+    """
+    # Danh sách các trường hợp lệ trong bảng apartments (khớp với DB schema)
+    valid_fields = {
+        'property_group': 'int',
+        'unit_type': 'int',
+        'unit_code': 'str',
+        'unit_axis': 'str',
+        'unit_floor_number': 'str',       # char(255) trong DB
+        'area_land': 'float',
+        'area_construction': 'float',
+        'area_net': 'float',
+        'area_gross': 'float',
+        'num_bedrooms': 'int',
+        'num_bathrooms': 'int',
+        'type_view': 'int',               # int FK to types_view trong DB
+        'direction_door': 'str',
+        'direction_balcony': 'str',
+        'price': 'float',
+        'price_early': 'float',
+        'price_schedule': 'float',
+        'price_loan': 'float',
+        'price_rent': 'float',
+        'notes': 'str',
+        'status': 'str',
+        'data_status': 'str',
+        'unit_allocation': 'str',
+        'listing_type': 'str',
+        'phone_number': 'str',
+        'furnished_status': 'str',
+        'floor_level_category': 'str',
+        'move_in_ready': 'bool',
+        'includes_transfer_fees': 'bool',
+    }
+    
+    cleaned_item = {}
+    
+    for field, field_type in valid_fields.items():
+        if field in item:
+            value = item[field]
+            
+            # Convert và validate theo type
+            if value is None or value == '' or value == 'null':
+                cleaned_item[field] = None
+            elif field_type == 'int':
+                try:
+                    cleaned_item[field] = int(float(str(value).replace('m2', '').replace('tỷ', '').replace('triệu', '').strip()))
+                except (ValueError, TypeError):
+                    cleaned_item[field] = None
+            elif field_type == 'float':
+                try:
+                    cleaned_item[field] = float(str(value).replace('m2', '').replace('tỷ', '').replace('triệu', '').strip())
+                except (ValueError, TypeError):
+                    cleaned_item[field] = None
+            elif field_type == 'bool':
+                if isinstance(value, bool):
+                    cleaned_item[field] = int(value)
+                elif isinstance(value, int):
+                    cleaned_item[field] = 1 if value else 0
+                else:
+                    cleaned_item[field] = None
+            elif field_type == 'str':
+                cleaned_item[field] = str(value) if value else None
+            else:
+                cleaned_item[field] = value
+        else:
+            # Thiếu trường thì để NULL
+            cleaned_item[field] = None
+    
+    # Validate enum values
+    if cleaned_item.get('direction_door') not in ['D', 'T', 'N', 'B', 'DB', 'DN', 'TB', 'TN', None]:
+        cleaned_item['direction_door'] = None
+    
+    if cleaned_item.get('direction_balcony') not in ['D', 'T', 'N', 'B', 'DB', 'DN', 'TB', 'TN', None]:
+        cleaned_item['direction_balcony'] = None
+    
+    if cleaned_item.get('status') not in ['CHUA_BAN', 'DA_LOCK', 'DA_COC', 'DA_BAN', None]:
+        cleaned_item['status'] = None
+    
+    if cleaned_item.get('data_status') not in ['REVIEWING', 'PENDING', 'APPROVED', None]:
+        cleaned_item['data_status'] = 'PENDING'  # Default value
+    
+    # unit_allocation là SET type, validate từng giá trị
+    valid_allocations = {'QUY_DOC_QUYEN', 'QUY_AN', 'QUY_CHEO', 'QUY_THUONG'}
+    if cleaned_item.get('unit_allocation'):
+        parts = [p.strip() for p in cleaned_item['unit_allocation'].split(',')]
+        valid_parts = [p for p in parts if p in valid_allocations]
+        cleaned_item['unit_allocation'] = ','.join(valid_parts) if valid_parts else 'QUY_CHEO'
+
+    # Validate listing_type enum values
+    if cleaned_item.get('listing_type') not in ['CAN_THUE', 'CAN_CHO_THUE', 'CAN_BAN', 'CAN_MUA', 'KHAC', None]:
+        cleaned_item['listing_type'] = None
+
+    # Validate furnished_status enum
+    if cleaned_item.get('furnished_status') not in ['FULL', 'PARTIAL', 'UNFURNISHED', None]:
+        cleaned_item['furnished_status'] = None
+
+    # Validate floor_level_category enum
+    if cleaned_item.get('floor_level_category') not in ['LOW', 'MEDIUM', 'HIGH', None]:
+        cleaned_item['floor_level_category'] = None
+
+    # data_status là NOT NULL, default PENDING
+    if not cleaned_item.get('data_status'):
+        cleaned_item['data_status'] = 'PENDING'
+
+    return cleaned_item
 
 
 class WarehouseDatabaseService:
@@ -47,10 +196,26 @@ class WarehouseDatabaseService:
             'Đơn lập cạnh góc': 12
         }
         
+        # Cache property tree đã render cho prompt (TTL tính bằng giây)
+        self.property_tree_cache = PropertyTreeCache(
+            loader=self._load_property_tree_for_prompt,
+            ttl=int(os.getenv('PROPERTY_TREE_CACHE_TTL', '600'))
+        )
+        # Tên property groups (dự án/phân khu/tòa) cho prefilter, dùng chung TTL với property tree
+        self.property_group_names_cache = TTLCache(ttl=int(os.getenv('PROPERTY_TREE_CACHE_TTL', '600')))
+        # Map slug -> id (property group kèm toàn bộ nhóm con, unit type) cho filter danh sách apartments
+        self.filter_lookup_cache = TTLCache(ttl=int(os.getenv('PROPERTY_TREE_CACHE_TTL', '600')))
+        # COUNT(*) của danh sách apartments theo bộ filter (không COUNT lại ở mỗi trang)
+        self.apartment_count_cache = TTLCache(ttl=int(os.getenv('APARTMENTS_COUNT_CACHE_TTL', '60')))
+        # Response của các endpoint tham chiếu (unit types, property groups) kèm ETag
+        self.reference_cache = ResponseCache(ttl=int(os.getenv('WAREHOUSE_REFERENCE_CACHE_TTL', '300')))
+        # Cột tùy chọn của schema, kiểm tra 1 lần (probe_schema() lúc khởi động hoặc lần dùng đầu tiên)
+        self.schema = None
+        
         logger.info("WarehouseDatabaseService initialized")
     
     def get_warehouse_db_connection(self):
-        """Tạo kết nối database warehouse với retry mechanism"""
+        """Mượn kết nối database warehouse từ pool chung với retry mechanism"""
         max_retries = 3
         retry_delay = 1
         
@@ -58,17 +223,17 @@ class WarehouseDatabaseService:
             try:
                 logger.info(f"Attempting to connect to warehouse database... (attempt {attempt + 1}/{max_retries})")
                 
-                with warehouse_app.app_context():
-                    # Sử dụng SQLAlchemy engine
-                    connection = warehouse_db.engine.connect()
-                    logger.info("✅ Warehouse database connection successful")
-                    return connection
+                # Mượn connection từ pool chung (close() để trả lại pool)
+                connection = warehouse_pool.connect()
+                logger.info("✅ Warehouse database connection successful")
+                return connection
                     
             except Exception as e:
                 logger.error(f"❌ Warehouse database connection error (attempt {attempt + 1}): {e}")
                 logger.error(f"Error type: {type(e)}")
                 
                 if attempt < max_retries - 1:
+                    DB_RETRIES.inc(database='warehouse')
                     logger.info(f"Retrying in {retry_delay} seconds...")
                     time.sleep(retry_delay)
                     retry_delay *= 2  # Exponential backoff
@@ -79,7 +244,7 @@ class WarehouseDatabaseService:
     
     def get_property_tree_for_prompt(self, root_id: int = 1) -> str:
         """
-        Lấy property tree cho prompt
+        Lấy property tree cho prompt (từ cache, chỉ query database khi cache hết hạn)
         
         Args:
             root_id (int): ID của root group (mặc định là 1)
@@ -88,30 +253,149 @@ class WarehouseDatabaseService:
             str: Property tree đã format cho prompt
         """
         try:
-            # Lấy property tree từ database (đã bao gồm unit types)
-            # Sử dụng raw SQL để tránh vấn đề với app context
-            import pymysql
-            
-            # Tạo connection đến warehouse database
-            connection = pymysql.connect(
-                host=os.getenv('DB_WAREHOUSE_HOST', '103.6.234.59'),
-                port=int(os.getenv('DB_WAREHOUSE_PORT', '6033')),
-                user=os.getenv('DB_WAREHOUSE_USER', 'root'),
-                password=os.getenv('DB_WAREHOUSE_PASSWORD', ''),
-                database=os.getenv('DB_WAREHOUSE_NAME', 'warehouse'),
-                charset='utf8mb4'
-            )
-            
-            property_tree = PropertyService.get_property_tree_for_prompt_with_sql(root_id, connection)
-            connection.close()
-
-            return property_tree
-            
+            return self.property_tree_cache.get(root_id)
         except Exception as e:
             logger.error(f"Lỗi khi lấy property tree: {str(e)}")
             # Fallback về hardcoded data nếu có lỗi
             return """Không có thông tin dự án"""
     
+    def _load_property_tree_for_prompt(self, root_id: int) -> str:
+        """
+        Query property tree + unit types từ database và render cho prompt
+        Raise exception nếu lỗi để cache không lưu kết quả lỗi
+        """
+        # PropertyService dùng DBAPI cursor nên mượn raw connection từ pool
+        connection = warehouse_pool.raw_connection()
+        try:
+            property_tree = PropertyService.get_property_tree_for_prompt_with_sql(root_id, connection)
+        finally:
+            connection.close()
+        
+        if property_tree.startswith("Lỗi") or property_tree.startswith("Không tìm thấy"):
+            raise ValueError(property_tree)
+        
+        return property_tree
+    
+    def get_property_tree_version(self, root_id: int = 1) -> Optional[str]:
+        """Version (hash nội dung) của property tree đang dùng trong prompt"""
+        return self.property_tree_cache.get_version(root_id)
+    
+    def invalidate_property_tree_cache(self, root_id: Optional[int] = None):
+        """Xóa cache property tree (root_id=None để xóa toàn bộ)"""
+        self.property_tree_cache.invalidate(root_id)
+    
+    def refresh_property_tree(self, root_id: int = 1) -> Dict:
+        """Load lại property tree từ database và trả về thông tin cache"""
+        self.property_group_names_cache.invalidate()
+        self.filter_lookup_cache.invalidate()
+        self.reference_cache.invalidate()
+        return self.property_tree_cache.refresh(root_id)
+    
+    def probe_schema(self) -> Dict:
+        """Kiểm tra các cột tùy chọn của schema warehouse 1 lần (thay cho SHOW COLUMNS ở mỗi request)"""
+        from sqlalchemy import text
+        connection = warehouse_pool.connect()
+        try:
+            schema = {
+                'types_unit_slug': connection.execute(text("SHOW COLUMNS FROM types_unit LIKE 'slug'")).fetchone() is not None
+            }
+        finally:
+            connection.close()
+        self.schema = schema
+        logger.info(f"Warehouse schema probed: {schema}")
+        return schema
+    
+    def has_schema_feature(self, name: str) -> bool:
+        """Schema có cột tùy chọn `name` không (probe nếu chưa probe lúc khởi động)"""
+        if self.schema is None:
+            self.probe_schema()
+        return self.schema.get(name, False)
+    
+    def get_property_group_names(self) -> List[str]:
+        """Tên tất cả property groups (dự án, phân khu, tòa), cache theo PROPERTY_TREE_CACHE_TTL"""
+        return self.property_group_names_cache.get_or_load('names', self._load_property_group_names)
+    
+    def _load_property_group_names(self) -> List[str]:
+        from sqlalchemy import text
+        connection = warehouse_pool.connect()
+        try:
+            rows = connection.execute(text("SELECT DISTINCT name FROM property_groups WHERE name IS NOT NULL")).fetchall()
+            return [row._mapping['name'] for row in rows]
+        finally:
+            connection.close()
+    
+    def get_filter_lookups(self) -> Dict:
+        """
+        Map slug -> id cho filter danh sách apartments và tên nhóm/loại căn cho search_text,
+        cache theo PROPERTY_TREE_CACHE_TTL (thay cho query slug + recursive CTE ở mỗi request)
+        
+        Returns:
+            Dict {'property_group_ids': {slug: [id của nhóm và toàn bộ nhóm con]}, 'unit_type_ids': {slug: id},
+                  'property_group_paths': {id: [tên nhóm cha..., tên nhóm]}, 'unit_type_names': {id: name}}
+        """
+        return self.filter_lookup_cache.get_or_load('lookups', self._load_filter_lookups)
+    
+    def _load_filter_lookups(self) -> Dict:
+        from sqlalchemy import text
+        connection = warehouse_pool.connect()
+        try:
+            groups = connection.execute(text("SELECT id, parent_id, slug, name FROM property_groups")).fetchall()
+            unit_types = connection.execute(text("SELECT id, slug, name FROM types_unit")).fetchall()
+        finally:
+            connection.close()
+        
+        children = {}
+        for row in groups:
+            children.setdefault(row.parent_id, []).append(row.id)
+        property_group_ids = {}
+        for row in groups:
+            if not row.slug:
+                continue
+            # Duyệt cây từ nhóm này xuống (seen để không lặp vô hạn nếu parent_id bị vòng)
+            ids, stack, seen = [], [row.id], set()
+            while stack:
+                group_id = stack.pop()
+                if group_id in seen:
+                    continue
+                seen.add(group_id)
+                ids.append(group_id)
+                stack.extend(children.get(group_id, []))
+            property_group_ids[row.slug] = ids
+        
+        # Tên nhóm kèm các nhóm cha (bỏ nhóm gốc không có parent), để tìm theo tên dự án ra cả căn của tòa con
+        by_id = {row.id: row for row in groups}
+        property_group_paths = {}
+        for row in groups:
+            names, current, seen = [], row, set()
+            while current is not None and current.id not in seen:
+                seen.add(current.id)
+                if current.parent_id is None and current.id != row.id:
+                    break
+                names.append(current.name)
+                current = by_id.get(current.parent_id)
+            property_group_paths[row.id] = [name for name in reversed(names) if name]
+        return {
+            'property_group_ids': property_group_ids,
+            'unit_type_ids': {row.slug: row.id for row in unit_types if row.slug},
+            'property_group_paths': property_group_paths,
+            'unit_type_names': {row.id: row.name for row in unit_types}
+        }
+    
+    def build_search_text(self, record: Dict, lookups: Optional[Dict] = None) -> str:
+        """
+        search_text (bỏ dấu) của 1 căn: mã căn, trục, tên dự án/phân khu/tòa, loại căn, ghi chú
+        
+        Args:
+            record: Record apartments
+            lookups: Kết quả get_filter_lookups() (None = lấy từ cache)
+        """
+        lookups = lookups if lookups is not None else self.get_filter_lookups()
+        return apartment_search_text.build_search_text(
+            record,
+            property_group_names=lookups.get('property_group_paths', {}).get(record.get('property_group'), []),
+            unit_type_name=lookups.get('unit_type_names', {}).get(record.get('unit_type'))
+        )
+    
     def map_unit_type_to_id(self, unit_type_name) -> Optional[int]:
         """
         Map unit type name sang ID
@@ -157,297 +441,437 @@ class WarehouseDatabaseService:
         digits = ''.join(c for c in str(phone).strip() if c.isdigit())
         return digits if digits else None
 
-    def insert_apartment_via_api(self, apartment_data: Dict) -> bool:
+    def build_apartment_record(self, apartment_data: Dict) -> Dict:
         """
-        Insert apartment vào warehouse database thông qua API
+        Chuyển dữ liệu căn hộ từ Groq sang record của bảng apartments (chưa validate)
         
         Args:
             apartment_data: Dữ liệu căn hộ từ Groq
             
         Returns:
-            True nếu thành công, False nếu lỗi
+            Dict record với các cột của bảng apartments
+        """
+        # Map unit_type name sang ID
+        unit_type_id = None
+        if apartment_data.get('unit_type'):
+            unit_type_id = self.map_unit_type_to_id(apartment_data['unit_type'])
+        
+        return {
+            'property_group': apartment_data.get('property_group', 1),  # Default to 1
+            'unit_type': unit_type_id,
+            'unit_code': apartment_data.get('unit_code'),
+            'unit_axis': apartment_data.get('unit_axis'),
+            'unit_floor_number': apartment_data.get('unit_floor_number'),
+            'area_land': apartment_data.get('area_land'),
+            'area_construction': apartment_data.get('area_construction'),
+            'area_net': apartment_data.get('area_net'),
+            'area_gross': apartment_data.get('area_gross'),
+            'num_bedrooms': apartment_data.get('num_bedrooms'),
+            'num_bathrooms': apartment_data.get('num_bathrooms'),
+            'type_view': apartment_data.get('type_view'),
+            'direction_door': apartment_data.get('direction_door'),
+            'direction_balcony': apartment_data.get('direction_balcony'),
+            'price': apartment_data.get('price'),
+            'price_early': apartment_data.get('price_early'),
+            'price_schedule': apartment_data.get('price_schedule'),
+            'price_loan': apartment_data.get('price_loan'),
+            'notes': apartment_data.get('notes'),
+            'status': apartment_data.get('status'),
+            'data_status': apartment_data.get('data_status', 'PENDING'),  # Default to PENDING
+            'listing_type': apartment_data.get('listing_type'),
+            'phone_number': self.format_phone_number(apartment_data.get('phone_number')),
+            'price_rent': apartment_data.get('price_rent'),
+            'furnished_status': apartment_data.get('furnished_status'),
+            'floor_level_category': apartment_data.get('floor_level_category'),
+            'move_in_ready': apartment_data.get('move_in_ready'),
+            'includes_transfer_fees': apartment_data.get('includes_transfer_fees'),
+            'unit_allocation': 'QUY_CHEO'  # Luôn set mặc định
+        }
+    
+    @staticmethod
+    def _values_sql(records: List[Dict], columns: List[str], prefix: str = 'r', literals: tuple = ()) -> tuple:
+        """VALUES (:property_group_r0, ...), (:property_group_r1, ...) + params cho INSERT nhiều dòng (literals: biểu thức SQL thêm vào cuối mỗi dòng)"""
+        values_sql = []
+        params = {}
+        for i, item in enumerate(records):
+            values_sql.append("(" + ", ".join([f":{col}_{prefix}{i}" for col in columns] + list(literals)) + ")")
+            for col in columns:
+                params[f"{col}_{prefix}{i}"] = item.get(col)
+        return ", ".join(values_sql), params
+
+    def _insert_rows(self, connection, records: List[Dict]) -> List[int]:
         """
+        INSERT nhiều dòng không gộp, trả về đúng ID của từng record
+        
+        Không suy ID từ lastrowid + rowcount (sai khi innodb_autoinc_lock_mode=2 và nhiều worker insert đồng thời):
+        mỗi dòng mang correlation_key '<batch token>:<index>' và ID được đọc lại bằng 1 query theo prefix token
+        """
+        from sqlalchemy import text
+        batch_token = uuid.uuid4().hex
+        columns = APARTMENT_INSERT_COLUMNS + ['search_text', 'correlation_key']
+        rows = [dict(record, correlation_key=f"{batch_token}:{i}") for i, record in enumerate(records)]
+        values_sql, params = self._values_sql(rows, columns)
+        connection.execute(text(f"INSERT INTO apartments ({', '.join(columns)}) VALUES {values_sql}"), params)
+        
+        # Range scan trên uq_apartments_correlation_key, cùng transaction nên thấy dòng vừa insert
+        id_by_key = {
+            row.correlation_key: row.id
+            for row in connection.execute(text("""
+                SELECT id, correlation_key FROM apartments WHERE correlation_key LIKE :prefix
+            """), {'prefix': f"{batch_token}:%"})
+        }
+        return [id_by_key.get(row['correlation_key']) for row in rows]
+
+    def _upsert_rows(self, connection, records: List[Dict], keys: List[str]) -> tuple:
+        """
+        INSERT ... ON DUPLICATE KEY UPDATE theo natural_key: căn đã có thì gộp tin mới vào dòng cũ
+        (row alias `new` thay cho VALUES(col) đã deprecated, cần MySQL 8.0.19+)
+
+        Returns:
+            Tuple (apartment_ids theo thứ tự records, số dòng mới, số tin đã gộp vào dòng có sẵn)
+        """
+        from sqlalchemy import text
+        columns = APARTMENT_INSERT_COLUMNS + ['search_text', 'natural_key']
+        rows = [dict(record, natural_key=key) for record, key in zip(records, keys)]
+        values_sql, params = self._values_sql(rows, columns, prefix='k', literals=('NOW()',))
+        update_sql = ", ".join(
+            [f"{col} = COALESCE({col}, new.{col})" for col in APARTMENT_FILL_COLUMNS] +
+            [f"{col} = COALESCE(new.{col}, {col})" for col in APARTMENT_REFRESH_COLUMNS + ['search_text']] +
+            ["source_count = source_count + 1", "last_seen_at = NOW()"]
+        )
+        result = connection.execute(text(f"""
+            INSERT INTO apartments ({', '.join(columns)}, last_seen_at)
+            VALUES {values_sql} AS new
+            ON DUPLICATE KEY UPDATE {update_sql}
+        """), params)
+        # Affected rows: 1 cho mỗi dòng mới, 2 cho mỗi dòng được gộp (source_count luôn đổi)
+        merged_count = max(0, result.rowcount - len(rows))
+
+        # ID của dòng gộp không có trong lastrowid: đọc lại theo natural_key (cùng transaction)
+        unique_keys = list(dict.fromkeys(keys))
+        placeholders = ", ".join(f":key_{i}" for i in range(len(unique_keys)))
+        key_params = {f"key_{i}": key for i, key in enumerate(unique_keys)}
+        id_by_key = {
+            row.natural_key: row.id
+            for row in connection.execute(text(f"""
+                SELECT id, natural_key FROM apartments WHERE natural_key IN ({placeholders})
+            """), key_params)
+        }
+        return [id_by_key.get(key) for key in keys], len(rows) - merged_count, merged_count
+
+    def _link_sources(self, connection, records: List[Dict], apartment_ids: List[Optional[int]],
+                      source_message_ids: Optional[List[Optional[int]]]):
+        """Ghi nguồn (tin nhắn, số điện thoại) của từng căn vào apartment_sources"""
+        from sqlalchemy import text
+        links = {}
+        message_ids = source_message_ids or [None] * len(records)
+        for record, apartment_id, message_id in zip(records, apartment_ids, message_ids):
+            phone_number = record.get('phone_number') or ''
+            if not apartment_id or (not message_id and not phone_number):
+                continue
+            links[(apartment_id, int(message_id or 0), phone_number)] = None
+        if not links:
+            return
+        rows = [{'apartment_id': a, 'message_id': m, 'phone_number': p} for a, m, p in links]
+        values_sql, params = self._values_sql(rows, ['apartment_id', 'message_id', 'phone_number'], prefix='s')
+        connection.execute(text(f"""
+            INSERT INTO apartment_sources (apartment_id, message_id, phone_number)
+            VALUES {values_sql}
+            ON DUPLICATE KEY UPDATE seen_count = seen_count + 1, last_seen_at = NOW()
+        """), params)
+
+    def _with_search_text(self, records: List[Dict]) -> List[Dict]:
+        """Bản sao records kèm search_text (không lấy được tên nhóm/loại căn thì chỉ dùng trường của căn)"""
         try:
-            import requests
-            
-            # Map unit_type name sang ID
-            unit_type_id = None
-            if apartment_data.get('unit_type'):
-                unit_type_id = self.map_unit_type_to_id(apartment_data['unit_type'])
-            
-            # Chuẩn bị dữ liệu để gửi tới API
-            logger.info(f"🔍 Original apartment_data: {apartment_data}")
-            logger.info(f"🔍 unit_type_id mapped: {unit_type_id}")
-            
-            apartment_record = {
-                'property_group': apartment_data.get('property_group', 1),  # Default to 1
-                'unit_type': unit_type_id,
-                'unit_code': apartment_data.get('unit_code'),
-                'unit_axis': apartment_data.get('unit_axis'),
-                'unit_floor_number': apartment_data.get('unit_floor_number'),
-                'area_land': apartment_data.get('area_land'),
-                'area_construction': apartment_data.get('area_construction'),
-                'area_net': apartment_data.get('area_net'),
-                'area_gross': apartment_data.get('area_gross'),
-                'num_bedrooms': apartment_data.get('num_bedrooms'),
-                'num_bathrooms': apartment_data.get('num_bathrooms'),
-                'type_view': apartment_data.get('type_view'),
-                'direction_door': apartment_data.get('direction_door'),
-                'direction_balcony': apartment_data.get('direction_balcony'),
-                'price': apartment_data.get('price'),
-                'price_early': apartment_data.get('price_early'),
-                'price_schedule': apartment_data.get('price_schedule'),
-                'price_loan': apartment_data.get('price_loan'),
-                'notes': apartment_data.get('notes'),
-                'status': apartment_data.get('status'),
-                'data_status': apartment_data.get('data_status', 'PENDING'),  # Default to PENDING
-                'listing_type': apartment_data.get('listing_type'),
-                'phone_number': self.format_phone_number(apartment_data.get('phone_number')),
-                'price_rent': apartment_data.get('price_rent'),
-                'furnished_status': apartment_data.get('furnished_status'),
-                'floor_level_category': apartment_data.get('floor_level_category'),
-                'move_in_ready': apartment_data.get('move_in_ready'),
-                'includes_transfer_fees': apartment_data.get('includes_transfer_fees'),
-                'unit_allocation': 'QUY_CHEO'  # Luôn set mặc định
-            }
-            
-            logger.info(f"🔍 Prepared apartment_record: {apartment_record}")
+            lookups = self.get_filter_lookups()
+        except Exception as e:
+            logger.warning(f"⚠️ Cannot load property group names for search_text: {e}")
+            lookups = {}
+        return [dict(record, search_text=self.build_search_text(record, lookups)) for record in records]
+    
+    def bulk_insert_apartments(self, apartments: List[Dict], validated: bool = False,
+                               source_message_ids: Optional[List[Optional[int]]] = None) -> Dict:
+        """
+        Ghi nhiều apartments trong 1 transaction, gộp các tin rao cùng 1 căn theo natural_key
+        
+        - Căn có natural_key (xem utils/apartment_natural_key.py): INSERT ... ON DUPLICATE KEY UPDATE,
+          căn đã có thì cập nhật giá/ghi chú theo tin mới và tăng source_count thay vì thêm dòng
+        - Căn không đủ thông tin để nhận diện: INSERT dòng mới như trước
+        - Tin nhắn nguồn và số điện thoại được lưu vào apartment_sources
+        
+        Args:
+            apartments: Danh sách apartment records (cột của bảng apartments)
+            validated: True nếu các record đã qua validate_apartment_item
+            source_message_ids: ID tin nhắn nguồn theo thứ tự apartments (None nếu không có)
             
-            # Gọi API warehouse để insert (dùng batch-insert với mảng 1 phần tử)
-            api_url = f"http://localhost:5000/warehouse/api/warehouse/apartments/batch-insert"
-
-            response = requests.post(api_url, json={'apartments': [apartment_record]}, timeout=30)
-
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('success'):
-                    apartment_ids = result.get('data', {}).get('apartment_ids', [])
-                    apartment_id = apartment_ids[0] if apartment_ids else None
-                    logger.info(f"✅ Successfully inserted apartment via API: {apartment_record.get('unit_code', 'N/A')} (ID: {apartment_id})")
-                    return apartment_id
-                else:
-                    logger.error(f"❌ API returned error: {result.get('error')}")
-                    return False
-            else:
-                logger.error(f"❌ API request failed with status {response.status_code}: {response.text}")
-                return False
+        Returns:
+            Dict {'success', 'inserted_count', 'merged_count', 'apartment_ids', 'error'}
+            apartment_ids theo đúng thứ tự input (các tin gộp vào cùng 1 căn có cùng ID)
+        """
+        if not apartments:
+            return {'success': True, 'inserted_count': 0, 'merged_count': 0, 'apartment_ids': []}
+        
+        with span('validate'):
+            cleaned_apartments = apartments if validated else [validate_apartment_item(a) for a in apartments]
+            keys = [natural_key(a) if APARTMENT_UPSERT_ENABLED else None for a in cleaned_apartments]
+            cleaned_apartments = self._with_search_text(cleaned_apartments)
+        plain_indexes = [i for i, key in enumerate(keys) if not key]
+        keyed_indexes = [i for i, key in enumerate(keys) if key]
+        
+        connection = None
+        try:
+            connection = self.get_warehouse_db_connection()
+            if not connection:
+                return {'success': False, 'error': 'Failed to connect to warehouse database', 'inserted_count': 0, 'merged_count': 0, 'apartment_ids': []}
+                
+            apartment_ids = [None] * len(cleaned_apartments)
+            inserted_count = 0
+            merged_count = 0
+            with span('insert'):
+                if plain_indexes:
+                    plain_ids = self._insert_rows(connection, [cleaned_apartments[i] for i in plain_indexes])
+                    if None in plain_ids:
+                        raise RuntimeError(f'Could not read back IDs for {plain_ids.count(None)}/{len(plain_indexes)} inserted apartment(s)')
+                    for i, apartment_id in zip(plain_indexes, plain_ids):
+                        apartment_ids[i] = apartment_id
+                    inserted_count += len(plain_ids)
+                if keyed_indexes:
+                    keyed_ids, new_count, merged_count = self._upsert_rows(
+                        connection, [cleaned_apartments[i] for i in keyed_indexes], [keys[i] for i in keyed_indexes])
+                    for i, apartment_id in zip(keyed_indexes, keyed_ids):
+                        apartment_ids[i] = apartment_id
+                    inserted_count += new_count
+                if APARTMENT_UPSERT_ENABLED:
+                    self._link_sources(connection, cleaned_apartments, apartment_ids, source_message_ids)
+                connection.commit()
+            # Căn mới làm đổi tổng số, căn gộp có thể đổi giá/ghi chú mà filter/tìm kiếm dựa vào
+            self.apartment_count_cache.invalidate()
+                
+            INSERTED_APARTMENTS.inc(inserted_count, outcome='ok')
+            if merged_count:
+                INSERTED_APARTMENTS.inc(merged_count, outcome='merged')
+            logger.info(f"Batch insert completed: {inserted_count} inserted, {merged_count} merged, IDs: {apartment_ids}")
+                
+            return {'success': True, 'inserted_count': inserted_count, 'merged_count': merged_count, 'apartment_ids': apartment_ids}
                 
         except Exception as e:
-            logger.error(f"❌ Error calling warehouse API: {str(e)}")
-            logger.error(f"❌ Error type: {type(e)}")
-            logger.error(f"❌ Error details: {e}")
-            import traceback
-            logger.error(f"❌ Full traceback: {traceback.format_exc()}")
-            return False
+            if connection:
+                connection.rollback()
+            INSERTED_APARTMENTS.inc(len(cleaned_apartments), outcome='error')
+            logger.error(f"Database error during batch insert: {e}")
+            return {'success': False, 'error': f'Database error: {str(e)}', 'inserted_count': 0, 'merged_count': 0, 'apartment_ids': []}
+        finally:
+            if connection:
+                connection.close()
     
-    def get_apartments_list(self, limit: int = 100, offset: int = 0, property_group_id: Optional[int] = None, property_group_slug: Optional[str] = None, unit_type_id: Optional[int] = None, unit_type_slug: Optional[str] = None, listing_type: Optional[str] = None, price_from: Optional[float] = None, price_to: Optional[float] = None, area_from: Optional[float] = None, area_to: Optional[float] = None) -> Dict:
+    def insert_apartments(self, apartments_data: List[Dict],
+                          source_message_ids: Optional[List[Optional[int]]] = None) -> List[Optional[int]]:
+        """
+        Insert nhiều căn hộ bóc tách từ Groq trực tiếp vào warehouse (không qua HTTP API)
+        
+        Args:
+            apartments_data: Danh sách dữ liệu căn hộ từ Groq
+            source_message_ids: ID tin nhắn nguồn theo thứ tự apartments_data (lưu vào apartment_sources)
+            
+        Returns:
+            List apartment_id theo đúng thứ tự input (None nếu insert lỗi)
+        """
+        if not apartments_data:
+            return []
+        
+        with span('build_record'):
+            records = [self.build_apartment_record(a) for a in apartments_data]
+        result = self.bulk_insert_apartments(records, source_message_ids=source_message_ids)
+        
+        apartment_ids = result.get('apartment_ids', [])
+        if not result['success'] or len(apartment_ids) != len(records):
+            logger.error(f"❌ Bulk insert failed for {len(records)} apartment(s): {result.get('error')}")
+            return [None] * len(records)
+        
+        logger.info(f"✅ Wrote {len(apartment_ids)} apartment(s) in one transaction "
+                    f"({result.get('merged_count', 0)} merged into existing): {apartment_ids}")
+        return apartment_ids
+    
+    def insert_apartment_via_api(self, apartment_data: Dict) -> bool:
+        """
+        Insert 1 apartment vào warehouse database
+        (giữ tên cũ cho backward compatibility, không còn gọi HTTP API)
+        
+        Args:
+            apartment_data: Dữ liệu căn hộ từ Groq
+            
+        Returns:
+            apartment_id nếu thành công, False nếu lỗi
+        """
+        apartment_ids = self.insert_apartments([apartment_data])
+        return apartment_ids[0] if apartment_ids and apartment_ids[0] else False
+    
+    def get_apartments_list(self, limit: int = 100, offset: int = 0, property_group_id: Optional[int] = None, property_group_slug: Optional[str] = None, unit_type_id: Optional[int] = None, unit_type_slug: Optional[str] = None, listing_type: Optional[str] = None, price_from: Optional[float] = None, price_to: Optional[float] = None, area_from: Optional[float] = None, area_to: Optional[float] = None, cursor: Optional[str] = None) -> Dict:
         """
         Lấy danh sách apartments với thông tin property_group và unit_type
 
         Args:
             limit: Số lượng records tối đa (default: 100)
-            offset: Vị trí bắt đầu (default: 0)
+            offset: Vị trí bắt đầu (default: 0), bỏ qua khi có cursor
             property_group_id: Filter theo property_group_id (optional)
-            property_group_slug: Filter theo property_group slug (optional)
+            property_group_slug: Filter theo property_group slug, gồm cả các nhóm con (optional)
             unit_type_id: Filter theo unit_type_id (optional)
             unit_type_slug: Filter theo unit_type slug (optional)
             listing_type: Filter theo listing_type (optional): CAN_THUE, CAN_CHO_THUE, CAN_BAN, CAN_MUA, KHAC
             price_from: Filter giá từ (optional)
             price_to: Filter giá đến (optional)
-            area_from: Filter diện tích từ (optional)
-            area_to: Filter diện tích đến (optional)
+            area_from: Filter diện tích từ (optional), theo effective_area = COALESCE(area_net, area_gross)
+            area_to: Filter diện tích đến (optional), theo effective_area
+            cursor: next_cursor của trang trước (keyset pagination theo id, không chậm dần ở trang sâu)
 
         Returns:
-            Dict chứa danh sách apartments và metadata
+            Dict chứa danh sách apartments, total, has_more và next_cursor
         """
         connection = None
         try:
-            with warehouse_app.app_context():
-                connection = self.get_warehouse_db_connection()
-                if not connection:
-                    return {
-                        'success': False,
-                        'error': 'Cannot connect to warehouse database',
-                        'data': [],
-                        'total': 0
-                    }
+            # Slug -> id từ cache (không query slug + recursive CTE ở mỗi request)
+            where_conditions = []
+            params = {}
+            lookups = None
+            if property_group_slug is not None or unit_type_slug is not None:
+                lookups = self.get_filter_lookups()
                 
-                from sqlalchemy import text
-                
-                # Base query với JOIN để lấy tên property_group và unit_type
-                base_query = """
-                SELECT
-                    a.id,
-                    a.property_group,
-                    pg.name as property_group_name,
-                    a.unit_type,
-                    ut.name as unit_type_name,
-                    a.unit_code,
-                    a.unit_axis,
-                    a.unit_floor_number,
-                    a.area_land,
-                    a.area_construction,
-                    a.area_net,
-                    a.area_gross,
-                    a.num_bedrooms,
-                    a.num_bathrooms,
-                    a.type_view,
-                    a.direction_door,
-                    a.direction_balcony,
-                    a.price,
-                    a.price_early,
-                    a.price_schedule,
-                    a.price_loan,
-                    a.price_rent,
-                    a.notes,
-                    a.status,
-                    a.unit_allocation,
-                    a.furnished_status,
-                    a.floor_level_category,
-                    a.move_in_ready,
-                    a.includes_transfer_fees,
-                    a.listing_type
-                FROM apartments a
-                LEFT JOIN property_groups pg ON a.property_group = pg.id
-                LEFT JOIN types_unit ut ON a.unit_type = ut.id
-                """
-                
-                # Điều kiện WHERE
-                where_conditions = []
-                params = {}
+            if property_group_slug is not None:
+                group_ids = lookups['property_group_ids'].get(property_group_slug)
+                if not group_ids:
+                    return self._empty_apartments_page(limit, offset)
+                placeholders = ','.join(f':pg_{i}' for i in range(len(group_ids)))
+                where_conditions.append(f"a.property_group IN ({placeholders})")
+                params.update({f'pg_{i}': group_id for i, group_id in enumerate(group_ids)})
+            elif property_group_id is not None:
+                where_conditions.append("a.property_group = :property_group_id")
+                params['property_group_id'] = property_group_id
                 
-                if property_group_slug is not None:
-                    # Filter theo slug - cần lấy tất cả property groups con (recursive)
-                    # Sử dụng recursive CTE để lấy tất cả children và grandchildren
-                    # First, get the root property group ID by slug
-                    root_query = text("SELECT id FROM property_groups WHERE slug = :slug")
-                    root_result = connection.execute(root_query, {'slug': property_group_slug})
-                    root_row = root_result.fetchone()
-                    
-                    if root_row:
-                        root_id = root_row[0]
-                        # Use recursive CTE to get all descendant property group IDs
-                        # MySQL 8.0+ supports recursive CTE
-                        recursive_cte = text("""
-                        WITH RECURSIVE property_group_tree AS (
-                            -- Base case: start with the root property group
-                            SELECT id FROM property_groups WHERE id = :root_id
-                            UNION ALL
-                            -- Recursive case: get all children
-                            SELECT pg.id 
-                            FROM property_groups pg
-                            INNER JOIN property_group_tree pgt ON pg.parent_id = pgt.id
-                        )
-                        SELECT id FROM property_group_tree
-                        """)
-                        descendant_result = connection.execute(recursive_cte, {'root_id': root_id})
-                        descendant_ids = [row[0] for row in descendant_result.fetchall()]
-                        
-                        if descendant_ids:
-                            # Filter apartments by all descendant property group IDs
-                            # Use SQLAlchemy text() with IN clause
-                            placeholders = ','.join([f':id{i}' for i in range(len(descendant_ids))])
-                            where_conditions.append(f"a.property_group IN ({placeholders})")
-                            for i, pg_id in enumerate(descendant_ids):
-                                params[f'id{i}'] = pg_id
-                        else:
-                            # Only the root group itself, no children
-                            where_conditions.append("a.property_group = :root_property_group_id")
-                            params['root_property_group_id'] = root_id
-                    else:
-                        # If slug not found, return empty result
-                        where_conditions.append("1 = 0")  # Always false condition
-                elif property_group_id is not None:
-                    where_conditions.append("a.property_group = :property_group_id")
-                    params['property_group_id'] = property_group_id
-                
-                if unit_type_slug is not None:
-                    # Filter by unit_type slug - need to get unit_type ID first
-                    unit_type_query = text("SELECT id FROM types_unit WHERE slug = :slug")
-                    unit_type_result = connection.execute(unit_type_query, {'slug': unit_type_slug})
-                    unit_type_row = unit_type_result.fetchone()
-
-                    if unit_type_row:
-                        unit_type_id_from_slug = unit_type_row[0]
-                        where_conditions.append("a.unit_type = :unit_type_id_from_slug")
-                        params['unit_type_id_from_slug'] = unit_type_id_from_slug
-                    else:
-                        # If slug not found, return empty result
-                        where_conditions.append("1 = 0")  # Always false condition
-                elif unit_type_id is not None:
-                    where_conditions.append("a.unit_type = :unit_type_id")
-                    params['unit_type_id'] = unit_type_id
-                
-                if listing_type is not None:
-                    where_conditions.append("a.listing_type = :listing_type")
-                    params['listing_type'] = listing_type
-                
-                if price_from is not None:
-                    where_conditions.append("a.price >= :price_from")
-                    params['price_from'] = price_from
-                
-                if price_to is not None:
-                    where_conditions.append("a.price <= :price_to")
-                    params['price_to'] = price_to
-                
-                if area_from is not None:
-                    where_conditions.append("(a.area_net >= :area_from OR a.area_gross >= :area_from)")
-                    params['area_from'] = area_from
-                
-                if area_to is not None:
-                    where_conditions.append("(a.area_net <= :area_to OR a.area_gross <= :area_to)")
-                    params['area_to'] = area_to
-                
-                where_clause = ""
-                if where_conditions:
-                    where_clause = "WHERE " + " AND ".join(where_conditions)
-                
-                # Query để đếm tổng số records
-                count_query = f"""
-                SELECT COUNT(*) as total
-                FROM apartments a
-                LEFT JOIN property_groups pg ON a.property_group = pg.id
-                LEFT JOIN types_unit ut ON a.unit_type = ut.id
-                {where_clause}
-                """
-                
-                # Query để lấy data với pagination
-                data_query = f"""
-                {base_query}
-                {where_clause}
-                ORDER BY a.id DESC
-                LIMIT :limit OFFSET :offset
-                """
-                
-                # Thêm parameters cho pagination
-                params['limit'] = limit
-                params['offset'] = offset
-                
-                logger.info(f"Executing apartments list query with params: {params}")
-                
-                # Đếm tổng số records
-                count_result = connection.execute(text(count_query), params)
-                total_count = count_result.fetchone()[0]
-                
-                # Lấy data
-                data_result = connection.execute(text(data_query), params)
-                apartments = []
-                
-                for row in data_result:
-                    apartment_data = dict(row._mapping)
-                    apartments.append(apartment_data)
-                
-                logger.info(f"Retrieved {len(apartments)} apartments out of {total_count} total")
+            if unit_type_slug is not None:
+                unit_type_id_from_slug = lookups['unit_type_ids'].get(unit_type_slug)
+                if unit_type_id_from_slug is None:
+                    return self._empty_apartments_page(limit, offset)
+                where_conditions.append("a.unit_type = :unit_type_id_from_slug")
+                params['unit_type_id_from_slug'] = unit_type_id_from_slug
+            elif unit_type_id is not None:
+                where_conditions.append("a.unit_type = :unit_type_id")
+                params['unit_type_id'] = unit_type_id
+                
+            if listing_type is not None:
+                where_conditions.append("a.listing_type = :listing_type")
+                params['listing_type'] = listing_type
+                
+            if price_from is not None:
+                where_conditions.append("a.price >= :price_from")
+                params['price_from'] = price_from
+                
+            if price_to is not None:
+                where_conditions.append("a.price <= :price_to")
+                params['price_to'] = price_to
+                
+            # effective_area là cột generated có index (thay cho OR giữa area_net và area_gross)
+            if area_from is not None:
+                where_conditions.append("a.effective_area >= :area_from")
+                params['area_from'] = area_from
+                
+            if area_to is not None:
+                where_conditions.append("a.effective_area <= :area_to")
+                params['area_to'] = area_to
                 
+            count_where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+            
+            data_conditions = list(where_conditions)
+            data_params = dict(params, limit=limit + 1)
+            if cursor:
+                _, cursor_id = decode_cursor(cursor)
+                data_conditions.append("a.id < :cursor_id")
+                data_params['cursor_id'] = cursor_id
+            data_where_clause = "WHERE " + " AND ".join(data_conditions) if data_conditions else ""
+            
+            connection = self.get_warehouse_db_connection()
+            if not connection:
                 return {
-                    'success': True,
-                    'data': apartments,
-                    'total': total_count,
-                    'limit': limit,
-                    'offset': offset,
-                    'has_more': (offset + len(apartments)) < total_count
+                    'success': False,
+                    'error': 'Cannot connect to warehouse database',
+                    'data': [],
+                    'total': 0
                 }
                 
+            from sqlalchemy import text
+                
+            # Lấy thừa 1 bản ghi để biết còn trang sau hay không
+            data_query = f"""
+            SELECT
+                a.id,
+                a.property_group,
+                pg.name as property_group_name,
+                a.unit_type,
+                ut.name as unit_type_name,
+                a.unit_code,
+                a.unit_axis,
+                a.unit_floor_number,
+                a.area_land,
+                a.area_construction,
+                a.area_net,
+                a.area_gross,
+                a.num_bedrooms,
+                a.num_bathrooms,
+                a.type_view,
+                a.direction_door,
+                a.direction_balcony,
+                a.price,
+                a.price_early,
+                a.price_schedule,
+                a.price_loan,
+                a.price_rent,
+                a.notes,
+                a.status,
+                a.unit_allocation,
+                a.furnished_status,
+                a.floor_level_category,
+                a.move_in_ready,
+                a.includes_transfer_fees,
+                a.listing_type
+            FROM apartments a
+            LEFT JOIN property_groups pg ON a.property_group = pg.id
+            LEFT JOIN types_unit ut ON a.unit_type = ut.id
+            {data_where_clause}
+            ORDER BY a.id DESC
+            LIMIT :limit{'' if cursor else ' OFFSET :offset'}
+            """
+            if not cursor:
+                data_params['offset'] = offset
+                
+            logger.info(f"Executing apartments list query with params: {data_params}")
+                
+            data_result = connection.execute(text(data_query), data_params)
+            apartments = [dict(row._mapping) for row in data_result]
+            
+            next_cursor = None
+            has_more = len(apartments) > limit
+            if has_more:
+                apartments = apartments[:limit]
+                next_cursor = encode_cursor(apartments[-1]['id'], apartments[-1]['id'])
+                
+            # Đếm tổng số records: chỉ bảng apartments (LEFT JOIN không đổi số dòng), cache theo bộ filter
+            count_query = text(f"SELECT COUNT(*) AS total FROM apartments a {count_where_clause}")
+            total_count = self.apartment_count_cache.get_or_load(
+                tuple(sorted(params.items())),
+                lambda: connection.execute(count_query, params).fetchone()[0]
+            )
+                
+            logger.info(f"Retrieved {len(apartments)} apartments out of {total_count} total")
+                
+            return {
+                'success': True,
+                'data': apartments,
+                'total': total_count,
+                'limit': limit,
+                'offset': offset,
+                'has_more': has_more,
+                'next_cursor': next_cursor
+            }
+                
         except Exception as e:
             logger.error(f"Error getting apartments list: {e}")
             return {
@@ -460,6 +884,19 @@ class WarehouseDatabaseService:
             if connection:
                 connection.close()
     
+    @staticmethod
+    def _empty_apartments_page(limit: int, offset: int) -> Dict:
+        """Kết quả rỗng khi slug filter không tồn tại"""
+        return {
+            'success': True,
+            'data': [],
+            'total': 0,
+            'limit': limit,
+            'offset': offset,
+            'has_more': False,
+            'next_cursor': None
+        }
+    
     def get_apartments_by_ids(self, apartment_ids: List[int]) -> Dict:
         """
         Lấy thông tin apartments theo danh sách ID với thông tin property_group và unit_type
@@ -472,89 +909,88 @@ class WarehouseDatabaseService:
         """
         connection = None
         try:
-            with warehouse_app.app_context():
-                connection = self.get_warehouse_db_connection()
-                if not connection:
-                    return {
-                        'success': False,
-                        'error': 'Cannot connect to warehouse database',
-                        'data': []
-                    }
-                
-                if not apartment_ids:
-                    return {
-                        'success': True,
-                        'data': [],
-                        'message': 'No apartment IDs provided'
-                    }
-                
-                from sqlalchemy import text
-                
-                # Tạo placeholder cho IN clause
-                placeholders = ','.join([f':id_{i}' for i in range(len(apartment_ids))])
-                
-                query = f"""
-                SELECT 
-                    a.id,
-                    a.property_group,
-                    pg.name as property_group_name,
-                    a.unit_type,
-                    ut.name as unit_type_name,
-                    a.unit_code,
-                    a.unit_axis,
-                    a.unit_floor_number,
-                    a.area_land,
-                    a.area_construction,
-                    a.area_net,
-                    a.area_gross,
-                    a.num_bedrooms,
-                    a.num_bathrooms,
-                    a.type_view,
-                    a.direction_door,
-                    a.direction_balcony,
-                    a.price,
-                    a.price_early,
-                    a.price_schedule,
-                    a.price_loan,
-                    a.price_rent,
-                    a.notes,
-                    a.status,
-                    a.data_status,
-                    a.unit_allocation,
-                    a.listing_type,
-                    a.phone_number,
-                    a.furnished_status,
-                    a.floor_level_category,
-                    a.move_in_ready,
-                    a.includes_transfer_fees
-                FROM apartments a
-                LEFT JOIN property_groups pg ON a.property_group = pg.id
-                LEFT JOIN types_unit ut ON a.unit_type = ut.id
-                WHERE a.id IN ({placeholders})
-                ORDER BY a.id
-                """
-                
-                # Tạo parameters dict
-                params = {f'id_{i}': apartment_id for i, apartment_id in enumerate(apartment_ids)}
-                
-                logger.info(f"Getting apartments by IDs: {apartment_ids}")
-                
-                result = connection.execute(text(query), params)
-                apartments = []
-                
-                for row in result:
-                    apartment_data = dict(row._mapping)
-                    apartments.append(apartment_data)
-                
-                logger.info(f"Found {len(apartments)} apartments out of {len(apartment_ids)} requested IDs")
+            connection = self.get_warehouse_db_connection()
+            if not connection:
+                return {
+                    'success': False,
+                    'error': 'Cannot connect to warehouse database',
+                    'data': []
+                }
                 
+            if not apartment_ids:
                 return {
                     'success': True,
-                    'data': apartments,
-                    'requested_count': len(apartment_ids),
-                    'found_count': len(apartments),
-                    'missing_ids': [aid for aid in apartment_ids if aid not in [apt['id'] for apt in apartments]]
+                    'data': [],
+                    'message': 'No apartment IDs provided'
                 }
+                
+            from sqlalchemy import text
+                
+            # Tạo placeholder cho IN clause
+            placeholders = ','.join([f':id_{i}' for i in range(len(apartment_ids))])
+                
+            query = f"""
+            SELECT 
+                a.id,
+                a.property_group,
+                pg.name as property_group_name,
+                a.unit_type,
+                ut.name as unit_type_name,
+                a.unit_code,
+                a.unit_axis,
+                a.unit_floor_number,
+                a.area_land,
+                a.area_construction,
+                a.area_net,
+                a.area_gross,
+                a.num_bedrooms,
+                a.num_bathrooms,
+                a.type_view,
+                a.direction_door,
+                a.direction_balcony,
+                a.price,
+                a.price_early,
+                a.price_schedule,
+                a.price_loan,
+                a.price_rent,
+                a.notes,
+                a.status,
+                a.data_status,
+                a.unit_allocation,
+                a.listing_type,
+                a.phone_number,
+                a.furnished_status,
+                a.floor_level_category,
+                a.move_in_ready,
+                a.includes_transfer_fees
+            FROM apartments a
+            LEFT JOIN property_groups pg ON a.property_group = pg.id
+            LEFT JOIN types_unit ut ON a.unit_type = ut.id
+            WHERE a.id IN ({placeholders})
+            ORDER BY a.id
+            """
+                
+            # Tạo parameters dict
+            params = {f'id_{i}': apartment_id for i, apartment_id in enumerate(apartment_ids)}
+                
+            logger.info(f"Getting apartments by IDs: {apartment_ids}")
+                
+            result = connection.execute(text(query), params)
+            apartments = []
+                
+            for row in result:
+                apartment_data = dict(row._mapping)
+                apartments.append(apartment_data)
+                
+            logger.info(f"Found {len(apartments)} apartments out of {len(apartment_ids)} requested IDs")
+                
+            return {
+                'success': True,
+                'data': apartments,
+                'requested_count': len(apartment_ids),
+                'found_count': len(apartments),
+                'missing_ids': [aid for aid in apartment_ids if aid not in [apt['id'] for apt in apartments]]
+            }
                     
         except Exception as e:
             logger.error(f"Error getting apartments by IDs: {e}")
@@ -601,18 +1037,17 @@ class WarehouseDatabaseService:
             return {'success': False, 'error': 'data_status must be REVIEWING, PENDING or APPROVED'}
         connection = None
         try:
-            with warehouse_app.app_context():
-                connection = self.get_warehouse_db_connection()
-                if not connection:
-                    return {'success': False, 'error': 'Cannot connect to warehouse database'}
-                from sqlalchemy import text
-                q = text("UPDATE apartments SET data_status = :data_status WHERE id = :apartment_id")
-                result = connection.execute(q, {"data_status": data_status, "apartment_id": apartment_id})
-                connection.commit()
-                if result.rowcount == 0:
-                    return {'success': False, 'error': f'Apartment {apartment_id} not found'}
-                logger.info(f"Updated apartment {apartment_id} data_status to {data_status}")
-                return {'success': True, 'apartment_id': apartment_id, 'data_status': data_status}
+            connection = self.get_warehouse_db_connection()
+            if not connection:
+                return {'success': False, 'error': 'Cannot connect to warehouse database'}
+            from sqlalchemy import text
+            q = text("UPDATE apartments SET data_status = :data_status WHERE id = :apartment_id")
+            result = connection.execute(q, {"data_status": data_status, "apartment_id": apartment_id})
+            connection.commit()
+            if result.rowcount == 0:
+                return {'success': False, 'error': f'Apartment {apartment_id} not found'}
+            logger.info(f"Updated apartment {apartment_id} data_status to {data_status}")
+            return {'success': True, 'apartment_id': apartment_id, 'data_status': data_status}
         except Exception as e:
             if connection:
                 connection.rollback()
@@ -628,18 +1063,18 @@ class WarehouseDatabaseService:
         """
         connection = None
         try:
-            with warehouse_app.app_context():
-                connection = self.get_warehouse_db_connection()
-                if not connection:
-                    return {'success': False, 'error': 'Cannot connect to warehouse database'}
-                from sqlalchemy import text
-                q = text("DELETE FROM apartments WHERE id = :apartment_id")
-                result = connection.execute(q, {"apartment_id": apartment_id})
-                connection.commit()
-                if result.rowcount == 0:
-                    return {'success': False, 'error': f'Apartment {apartment_id} not found'}
-                logger.info(f"Deleted apartment {apartment_id}")
-                return {'success': True, 'apartment_id': apartment_id}
+            connection = self.get_warehouse_db_connection()
+            if not connection:
+                return {'success': False, 'error': 'Cannot connect to warehouse database'}
+            from sqlalchemy import text
+            q = text("DELETE FROM apartments WHERE id = :apartment_id")
+            result = connection.execute(q, {"apartment_id": apartment_id})
+            connection.commit()
+            if result.rowcount == 0:
+                return {'success': False, 'error': f'Apartment {apartment_id} not found'}
+            self.apartment_count_cache.invalidate()
+            logger.info(f"Deleted apartment {apartment_id}")
+            return {'success': True, 'apartment_id': apartment_id}
         except Exception as e:
             if connection:
                 connection.rollback()
@@ -651,128 +1086,131 @@ class WarehouseDatabaseService:
 
     def search_apartments(self, search_query: str, limit: int = 50, offset: int = 0) -> Dict:
         """
-        Tìm kiếm apartments với từ khóa
+        Tìm kiếm apartments với từ khóa (không phân biệt dấu, xếp theo độ liên quan)
+        
+        Dùng FULLTEXT ngram index trên apartments.search_text (mã căn, trục, tên dự án/phân khu/tòa,
+        loại căn, ghi chú đã bỏ dấu). Từ khóa không có từ nào đủ dài cho ngram thì LIKE trên search_text.
         
         Args:
-            search_query: Từ khóa tìm kiếm (unit_code, property_group_name, unit_type_name)
+            search_query: Từ khóa tìm kiếm (unit_code, property_group_name, unit_type_name, notes)
             limit: Số lượng records tối đa (default: 50)
             offset: Vị trí bắt đầu (default: 0)
             
         Returns:
-            Dict chứa danh sách apartments và metadata
+            Dict chứa danh sách apartments (kèm score) và metadata
         """
         connection = None
         try:
-            with warehouse_app.app_context():
-                connection = self.get_warehouse_db_connection()
-                if not connection:
+            boolean_query = apartment_search_text.build_search_query(search_query)
+            if boolean_query:
+                match_sql = "MATCH(a.search_text) AGAINST(:search_query IN BOOLEAN MODE)"
+                search_condition = f"WHERE {match_sql}"
+                score_sql = f"{match_sql} AS score"
+                order_sql = "ORDER BY score DESC, a.id DESC"
+                search_param = boolean_query
+                search_mode = 'fulltext'
+            else:
+                folded_query = normalize_message_text(search_query)
+                search_condition = "WHERE a.search_text LIKE :search_query"
+                score_sql = "0 AS score"
+                order_sql = "ORDER BY a.id DESC"
+                search_param = f"%{folded_query}%"
+                search_mode = 'like'
+                if not folded_query:
                     return {
-                        'success': False,
-                        'error': 'Cannot connect to warehouse database',
+                        'success': True,
                         'data': [],
-                        'total': 0
+                        'total': 0,
+                        'limit': limit,
+                        'offset': offset,
+                        'has_more': False,
+                        'search_query': search_query,
+                        'search_mode': search_mode
                     }
                 
-                from sqlalchemy import text
-                
-                # Query với search conditions
-                search_conditions = """
-                WHERE (
-                    a.unit_code LIKE :search_query OR
-                    pg.name LIKE :search_query OR
-                    ut.name LIKE :search_query OR
-                    a.unit_axis LIKE :search_query OR
-                    a.notes LIKE :search_query
-                )
-                """
-                
-                # Base query với JOIN để lấy tên property_group và unit_type
-                base_query = """
-                SELECT 
-                    a.id,
-                    a.property_group,
-                    pg.name as property_group_name,
-                    a.unit_type,
-                    ut.name as unit_type_name,
-                    a.unit_code,
-                    a.unit_axis,
-                    a.unit_floor_number,
-                    a.area_land,
-                    a.area_construction,
-                    a.area_net,
-                    a.area_gross,
-                    a.num_bedrooms,
-                    a.num_bathrooms,
-                    a.type_view,
-                    a.direction_door,
-                    a.direction_balcony,
-                    a.price,
-                    a.price_early,
-                    a.price_schedule,
-                    a.price_loan,
-                    a.price_rent,
-                    a.notes,
-                    a.status,
-                    a.unit_allocation,
-                    a.furnished_status,
-                    a.floor_level_category,
-                    a.move_in_ready,
-                    a.includes_transfer_fees
-                FROM apartments a
-                LEFT JOIN property_groups pg ON a.property_group = pg.id
-                LEFT JOIN types_unit ut ON a.unit_type = ut.id
-                """
-                
-                # Query để đếm tổng số records
-                count_query = f"""
-                SELECT COUNT(*) as total
-                FROM apartments a
-                LEFT JOIN property_groups pg ON a.property_group = pg.id
-                LEFT JOIN types_unit ut ON a.unit_type = ut.id
-                {search_conditions}
-                """
-                
-                # Query để lấy data với pagination
-                data_query = f"""
-                {base_query}
-                {search_conditions}
-                ORDER BY a.id DESC
-                LIMIT :limit OFFSET :offset
-                """
-                
-                # Parameters
-                search_pattern = f"%{search_query}%"
-                params = {
-                    'search_query': search_pattern,
-                    'limit': limit,
-                    'offset': offset
+            connection = self.get_warehouse_db_connection()
+            if not connection:
+                return {
+                    'success': False,
+                    'error': 'Cannot connect to warehouse database',
+                    'data': [],
+                    'total': 0
                 }
                 
-                logger.info(f"Executing apartments search query with params: {params}")
+            from sqlalchemy import text
                 
-                # Đếm tổng số records
-                count_result = connection.execute(text(count_query), params)
-                total_count = count_result.fetchone()[0]
+            # JOIN chỉ để lấy tên property_group và unit_type của các dòng trong trang
+            data_query = f"""
+            SELECT 
+                a.id,
+                a.property_group,
+                pg.name as property_group_name,
+                a.unit_type,
+                ut.name as unit_type_name,
+                a.unit_code,
+                a.unit_axis,
+                a.unit_floor_number,
+                a.area_land,
+                a.area_construction,
+                a.area_net,
+                a.area_gross,
+                a.num_bedrooms,
+                a.num_bathrooms,
+                a.type_view,
+                a.direction_door,
+                a.direction_balcony,
+                a.price,
+                a.price_early,
+                a.price_schedule,
+                a.price_loan,
+                a.price_rent,
+                a.notes,
+                a.status,
+                a.unit_allocation,
+                a.furnished_status,
+                a.floor_level_category,
+                a.move_in_ready,
+                a.includes_transfer_fees,
+                {score_sql}
+            FROM apartments a
+            LEFT JOIN property_groups pg ON a.property_group = pg.id
+            LEFT JOIN types_unit ut ON a.unit_type = ut.id
+            {search_condition}
+            {order_sql}
+            LIMIT :limit OFFSET :offset
+            """
                 
-                # Lấy data
-                data_result = connection.execute(text(data_query), params)
-                apartments = []
+            params = {
+                'search_query': search_param,
+                'limit': limit,
+                'offset': offset
+            }
                 
-                for row in data_result:
-                    apartment_data = dict(row._mapping)
-                    apartments.append(apartment_data)
+            logger.info(f"Executing apartments search query ({search_mode}) with params: {params}")
                 
-                logger.info(f"Found {len(apartments)} apartments matching '{search_query}' out of {total_count} total")
+            # Lấy data
+            data_result = connection.execute(text(data_query), params)
+            apartments = [dict(row._mapping) for row in data_result]
                 
-                return {
-                    'success': True,
-                    'data': apartments,
-                    'total': total_count,
-                    'limit': limit,
-                    'offset': offset,
-                    'has_more': (offset + len(apartments)) < total_count,
-                    'search_query': search_query
-                }
+            # Đếm tổng số records (chỉ bảng apartments), cache theo từ khóa đã chuẩn hóa
+            count_query = text(f"SELECT COUNT(*) AS total FROM apartments a {search_condition}")
+            total_count = self.apartment_count_cache.get_or_load(
+                ('search', search_mode, search_param),
+                lambda: connection.execute(count_query, {'search_query': search_param}).fetchone()[0]
+            )
+                
+            logger.info(f"Found {len(apartments)} apartments matching '{search_query}' out of {total_count} total")
+                
+            return {
+                'success': True,
+                'data': apartments,
+                'total': total_count,
+                'limit': limit,
+                'offset': offset,
+                'has_more': (offset + len(apartments)) < total_count,
+                'search_query': search_query,
+                'search_mode': search_mode
+            }
                 
         except Exception as e:
             logger.error(f"Error searching apartments: {e}")
@@ -786,6 +1224,68 @@ class WarehouseDatabaseService:
             if connection:
                 connection.close()
 
+    def rebuild_search_text(self, batch_size: int = 500) -> Dict:
+        """
+        Tính lại search_text cho toàn bộ apartments theo từng batch id
+        (sau migration, hoặc sau khi đổi tên dự án/loại căn; căn mới insert đã có search_text)
+        
+        Args:
+            batch_size: Số căn mỗi câu UPDATE
+            
+        Returns:
+            Dict {'success', 'updated_count', 'error'}
+        """
+        connection = None
+        updated_count = 0
+        try:
+            self.filter_lookup_cache.invalidate()
+            lookups = self.get_filter_lookups()
+            connection = self.get_warehouse_db_connection()
+            if not connection:
+                return {'success': False, 'error': 'Cannot connect to warehouse database', 'updated_count': 0}
+            from sqlalchemy import text
+            
+            last_id = 0
+            while True:
+                rows = connection.execute(text("""
+                    SELECT id, property_group, unit_type, unit_code, unit_axis, notes
+                    FROM apartments
+                    WHERE id > :last_id
+                    ORDER BY id
+                    LIMIT :limit
+                """), {'last_id': last_id, 'limit': batch_size}).fetchall()
+                if not rows:
+                    break
+                
+                cases = []
+                params = {}
+                for i, row in enumerate(rows):
+                    cases.append(f"WHEN :id_{i} THEN :search_text_{i}")
+                    params[f'id_{i}'] = row.id
+                    params[f'search_text_{i}'] = self.build_search_text(dict(row._mapping), lookups)
+                placeholders = ','.join(f':id_{i}' for i in range(len(rows)))
+                connection.execute(text(f"""
+                    UPDATE apartments
+                    SET search_text = CASE id {' '.join(cases)} END
+                    WHERE id IN ({placeholders})
+                """), params)
+                connection.commit()
+                
+                updated_count += len(rows)
+                last_id = rows[-1].id
+                logger.info(f"🔎 Rebuilt search_text for {updated_count} apartment(s) (last id: {last_id})")
+            
+            self.apartment_count_cache.invalidate()
+            return {'success': True, 'updated_count': updated_count}
+        except Exception as e:
+            if connection:
+                connection.rollback()
+            logger.error(f"Error rebuilding apartments search_text: {e}")
+            return {'success': False, 'error': str(e), 'updated_count': updated_count}
+        finally:
+            if connection:
+                connection.close()
+
 
 # Global instance
 warehouse_service = WarehouseDatabaseService()
@@ -12,9 +12,12 @@ import queue
 import sys
 import os
 from datetime import datetime
-from flask import Flask
+from flask import Flask, has_app_context
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 from models import db, ZaloConfig, ZaloSession, ZaloReceivedMessage, ZaloReceivedMessageExtraSender, ZaloMessage
+from utils.ttl_cache import TTLCache
+from .message_ingest_writer import MessageIngestWriter
 
 # Helper function để lấy Flask app instance (tránh circular import)
 def get_flask_app():
@@ -68,6 +71,24 @@ class ZaloBotManager:
         self.running = {}  # {config_id: running}
         self.message_queues = {}  # {config_id: queue}
         self.stats = {}  # {config_id: stats}
+        
+        # Config (đã parse cookies) + session_id theo config_id, dùng chung cho ingest và gửi tin.
+        # Bị xóa khi config/session thay đổi trong process này, khi cleanup/khởi tạo lại bot, hoặc sau TTL
+        # (phòng trường hợp config được sửa từ process khác)
+        self.config_cache = TTLCache(ttl=int(os.getenv('ZALO_CONFIG_CACHE_TTL', '300')))
+        
+        # Ghi tin nhắn nhận được ở thread riêng, gom nhiều tin vào 1 transaction, DB lỗi thì ghi ra journal
+        self.ingest_async = os.getenv('ZALO_INGEST_ASYNC', '1') == '1'
+        self.ingest_writer = MessageIngestWriter(
+            handler=self._write_messages_batch,
+            max_pending=int(os.getenv('ZALO_INGEST_QUEUE_SIZE', '5000')),
+            batch_size=int(os.getenv('ZALO_INGEST_BATCH_SIZE', '100')),
+            max_wait_ms=int(os.getenv('ZALO_INGEST_MAX_WAIT_MS', '200')),
+            journal_path=os.getenv('ZALO_INGEST_JOURNAL_PATH', os.path.join(backend_dir, 'journal', 'zalo_ingest.jsonl')),
+            retry_seconds=float(os.getenv('ZALO_INGEST_RETRY_SECONDS', '5')),
+            name='zalo-ingest',
+            dead_letter_path=os.getenv('ZALO_INGEST_DEAD_LETTER_PATH')
+        )
     
     def get_all_configs(self):
         """Lấy danh sách tất cả configs từ database"""
@@ -100,41 +121,82 @@ class ZaloBotManager:
             return []
     
     def get_config_by_id(self, config_id):
-        """Lấy config theo ID"""
+        """
+        Lấy config theo ID (từ cache, chỉ query DB khi chưa có)
+        
+        Returns:
+            Dict {'id', 'name', 'imei', 'cookies', 'is_default', 'session_id'} hoặc None nếu không tìm thấy
+        """
         try:
-            flask_app = get_flask_app()
-            if not flask_app:
-                logger.error(f"Không thể lấy Flask app instance")
-                return None
-            
-            with flask_app.app_context():
-                config = ZaloConfig.query.filter_by(id=config_id).first()
-                
-                if config:
-                    # Parse cookies từ JSON string
-                    try:
-                        cookies = json.loads(config.cookies) if config.cookies else {}
-                    except json.JSONDecodeError:
-                        cookies = {}
-                    
-                    config_data = {
-                        'id': config.id,
-                        'name': config.name,
-                        'imei': config.imei,
-                        'cookies': cookies,
-                        'is_default': config.is_default
-                    }
-                    
-                    return config_data
-                else:
+            if has_app_context():
+                config_data = self._get_cached_config(config_id)
+            else:
+                flask_app = get_flask_app()
+                if not flask_app:
+                    logger.error(f"Không thể lấy Flask app instance")
                     return None
+                with flask_app.app_context():
+                    config_data = self._get_cached_config(config_id)
+            return dict(config_data) if config_data else None
                     
         except Exception as e:
             logger.error(f"Lỗi lấy config {config_id}: {e}")
             return None
     
+    def get_session_id(self, config_id):
+        """ID của ZaloSession ứng với IMEI của config (tạo session nếu chưa có), None nếu không có config"""
+        config_data = self.get_config_by_id(config_id)
+        return config_data['session_id'] if config_data else None
+    
+    def invalidate_config_cache(self, config_id=None):
+        """Xóa cache config/session của config_id, hoặc toàn bộ nếu config_id=None"""
+        self.config_cache.invalidate(config_id)
+    
+    def _get_cached_config(self, config_id):
+        """Lấy config + session_id từ cache, load từ DB nếu chưa có (cần app context)"""
+        return self.config_cache.get_or_load(config_id, lambda: self._load_config(config_id))
+    
+    def _load_config(self, config_id):
+        """Query config, parse cookies và tìm/tạo session theo IMEI (cần app context)"""
+        config = ZaloConfig.query.filter_by(id=config_id).first()
+        if not config:
+            return None
+        
+        # Parse cookies từ JSON string
+        try:
+            cookies = json.loads(config.cookies) if config.cookies else {}
+        except json.JSONDecodeError:
+            cookies = {}
+        
+        db_session = ZaloSession.query.filter_by(imei=config.imei).first()
+        if not db_session:
+            # Tạo session mới nếu không có (commit riêng để session_id trong cache luôn tồn tại)
+            logger.info(f"Config {config_id}: Tạo session mới cho IMEI {config.imei}")
+            db_session = ZaloSession(
+                imei=config.imei,
+                cookies=json.dumps(cookies),
+                created_at=datetime.now(),
+                is_active=True
+            )
+            db.session.add(db_session)
+            db.session.commit()
+            logger.info(f"Config {config_id}: Đã tạo session {db_session.id}")
+        
+        return {
+            'id': config.id,
+            'name': config.name,
+            'imei': config.imei,
+            'cookies': cookies,
+            'is_default': config.is_default,
+            'session_id': db_session.id
+        }
+    
     def save_message_to_db(self, config_id, sender_id, sender_name, content, thread_id, thread_type):
-        """Lưu tin nhắn nhận được vào database"""
+        """
+        Lưu tin nhắn nhận được vào database
+        ZALO_INGEST_ASYNC=1 (mặc định): chỉ đưa vào hàng đợi của ingest writer rồi trả về ngay,
+        listener websocket không phải chờ DB
+        """
         try:
             # Validation - Đảm bảo sender_name không bao giờ NULL
             if not sender_name or sender_name.strip() == "":
@@ -151,128 +213,184 @@ class ZaloBotManager:
                 logger.error(f"Config {config_id}: Content rỗng, không thể lưu tin nhắn")
                 return
             
-            logger.info(f"Config {config_id}: Bắt đầu lưu tin nhắn với sender_name='{sender_name}', sender_id='{sender_id}'")
+            record = {
+                'config_id': config_id,
+                'sender_id': str(sender_id),
+                'sender_name': str(sender_name),
+                'content': str(content),
+                'thread_id': str(thread_id) if thread_id else None,
+                'thread_type': str(thread_type) if thread_type else None,
+                'received_at': datetime.now()
+            }
             
-            # Sử dụng app instance trực tiếp thay vì current_app vì được gọi từ thread
-            flask_app = get_flask_app()
-            if not flask_app:
-                logger.error(f"Config {config_id}: Không thể lấy Flask app instance")
-                return
+            if self.ingest_async:
+                self.ingest_writer.submit(record)
+            else:
+                self._write_messages_batch([record])
             
-            with flask_app.app_context():
-                # Lấy config trực tiếp trong context này để tránh tạo context lồng nhau
-                config = ZaloConfig.query.filter_by(id=config_id).first()
-                if not config:
-                    logger.error(f"Config {config_id}: Không tìm thấy config")
-                    return
-                
-                # Parse cookies từ JSON string
-                try:
-                    cookies_dict = json.loads(config.cookies) if config.cookies else {}
-                except json.JSONDecodeError:
-                    cookies_dict = {}
-                
-                config_info = {
-                    'id': config.id,
-                    'name': config.name,
-                    'imei': config.imei,
-                    'cookies': cookies_dict,
-                    'is_default': config.is_default
+            # Cập nhật stats cho config này
+            if config_id not in self.stats:
+                self.stats[config_id] = {
+                    'start_time': None,
+                    'messages_received': 0,
+                    'messages_sent': 0,
+                    'last_message_time': None
                 }
-                
-                db_session = ZaloSession.query.filter_by(imei=config_info['imei']).first()
-                
-                if not db_session:
-                    # Tạo session mới nếu không có
-                    logger.info(f"Config {config_id}: Tạo session mới cho IMEI {config_info['imei']}")
-                    db_session = ZaloSession(
-                        imei=config_info['imei'],
-                        cookies=json.dumps(config_info['cookies']),
-                        created_at=datetime.now(),
-                        is_active=True
-                    )
-                    db.session.add(db_session)
-                    db.session.commit()
-                    db.session.refresh(db_session)
-                    logger.info(f"Config {config_id}: Đã tạo session {db_session.id}")
-                else:
-                    logger.info(f"Config {config_id}: Sử dụng session hiện có {db_session.id}")
-                
-                # Hash content giống MySQL SHA(content) để kiểm tra trùng
-                content_hash = hashlib.sha1(str(content).encode('utf-8')).hexdigest()
-                existing = ZaloReceivedMessage.query.filter_by(content_hash=content_hash).first()
-                
-                if existing:
-                    # Tin nhắn trùng content: chỉ lưu sender vào bảng extra_senders
-                    try:
-                        extra = ZaloReceivedMessageExtraSender(
-                            message_id=existing.id,
-                            sender_id=str(sender_id),
-                            sender_name=str(sender_name),
-                            session_id=db_session.id,
-                            config_id=config_id,
-                            received_at=datetime.now()
-                        )
-                        db.session.add(extra)
-                        db.session.commit()
-                        logger.info(f"Config {config_id}: Tin nhắn trùng content_hash, đã lưu sender {sender_name} vào extra_senders (message_id={existing.id})")
-                    except IntegrityError:
-                        db.session.rollback()
-                        logger.info(f"Config {config_id}: Sender {sender_id} đã tồn tại cho message_id={existing.id}, bỏ qua")
-                else:
-                    # Tin nhắn mới: insert vào zalo_received_messages
-                    received_msg = ZaloReceivedMessage(
-                        session_id=db_session.id,
-                        config_id=config_id,
-                        sender_id=str(sender_id),
-                        sender_name=str(sender_name),
-                        content=str(content),
-                        thread_id=str(thread_id) if thread_id else None,
-                        thread_type=str(thread_type) if thread_type else None,
-                        received_at=datetime.now(),
-                        status_push_kafka=0
-                    )
-                    db.session.add(received_msg)
-                    db.session.commit()
-                    logger.info(f"Config {config_id}: Đã lưu tin nhắn từ {sender_name} vào database (session_id: {db_session.id})")
-                    received_msg.status_push_kafka = 1
-                    db.session.commit()
-                
-                # Cập nhật stats cho config này
-                if config_id not in self.stats:
-                    self.stats[config_id] = {
-                        'start_time': None,
-                        'messages_received': 0,
-                        'messages_sent': 0,
-                        'last_message_time': None
-                    }
-                
-                self.stats[config_id]['messages_received'] += 1
-                self.stats[config_id]['last_message_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Thêm vào message queue của config này
-                if config_id not in self.message_queues:
-                    self.message_queues[config_id] = queue.Queue()
-                
-                self.message_queues[config_id].put({
-                    'type': 'received',
-                    'sender': sender_name,
-                    'content': content,
-                    'time': datetime.now().strftime('%H:%M:%S')
-                })
+            
+            self.stats[config_id]['messages_received'] += 1
+            self.stats[config_id]['last_message_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            
+            # Thêm vào message queue của config này
+            if config_id not in self.message_queues:
+                self.message_queues[config_id] = queue.Queue()
+            
+            self.message_queues[config_id].put({
+                'type': 'received',
+                'sender': sender_name,
+                'content': content,
+                'time': datetime.now().strftime('%H:%M:%S')
+            })
             
         except Exception as e:
             logger.error(f"Lỗi lưu tin nhắn cho config {config_id}: {e}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
+    
+    def _write_messages_batch(self, records):
+        """
+        Ghi 1 batch tin nhắn (do ingest writer gom) vào database trong 1 transaction
+        
+        - Config và session lấy từ cache theo config_id, content_hash đã có được lấy bằng 1 query cho cả batch
+        - Tin có content mới: insert vào zalo_received_messages (status_push_kafka=1 ngay khi insert)
+        - Tin trùng content (với DB hoặc với tin trước trong batch): lưu sender vào extra_senders (INSERT IGNORE)
+        - content_hash vừa được process khác insert (IntegrityError): ghi lại từng tin riêng
+        
+        Args:
+            records: List dict (config_id, sender_id, sender_name, content, thread_id, thread_type, received_at)
+            
+        Raises:
+            Exception khi lỗi database: lỗi kết nối thì ingest writer đưa batch vào journal,
+            lỗi dữ liệu thì writer ghi lại từng tin và tách tin lỗi ra file dead-letter
+        """
+        flask_app = get_flask_app()
+        if not flask_app:
+            raise RuntimeError("Không thể lấy Flask app instance")
+        
+        with flask_app.app_context():
             try:
-                # Thử rollback nếu có app context
-                flask_app = get_flask_app()
-                if flask_app:
-                    with flask_app.app_context():
+                new_messages = self._insert_messages(records)
+            except IntegrityError:
+                db.session.rollback()
+                logger.warning(f"Content_hash trùng với tin vừa được ghi ở nơi khác, ghi lại {len(records)} tin nhắn từng tin một")
+                # Có thể do session_id trong cache đã bị xóa: load lại config/session
+                for config_id in {record['config_id'] for record in records}:
+                    self.invalidate_config_cache(config_id)
+                new_messages = []
+                for record in records:
+                    try:
+                        new_messages.extend(self._insert_messages([record]))
+                    except IntegrityError:
+                        # Lần ghi lại thấy bản ghi đã có nên chỉ còn lỗi nếu sender cũng vừa được ghi
                         db.session.rollback()
-            except:
-                pass
+                        new_messages.extend(self._insert_messages([record]))
+            except Exception:
+                db.session.rollback()
+                raise
+        
+        # Content mới: đưa vào micro-batcher để bóc tách ngay thay vì chờ scheduler
+        for config_id, message_id in new_messages:
+            self.enqueue_for_extraction(config_id, message_id)
+    
+    def _insert_messages(self, records):
+        """
+        Insert 1 batch tin nhắn và commit (cần app context)
+        
+        Returns:
+            List (config_id, message_id) của các tin có content mới
+        """
+        # Config và session lấy từ cache, chỉ query khi config chưa có trong cache
+        session_ids = {}
+        for config_id in {record['config_id'] for record in records}:
+            config_data = self._get_cached_config(config_id)
+            if config_data:
+                session_ids[config_id] = config_data['session_id']
+        
+        # Hash content giống MySQL SHA(content) để kiểm tra trùng
+        hashes = [hashlib.sha1(record['content'].encode('utf-8')).hexdigest() for record in records]
+        canonical = {
+            row.content_hash: (row.id, row.sender_id)
+            for row in db.session.query(
+                ZaloReceivedMessage.id, ZaloReceivedMessage.content_hash, ZaloReceivedMessage.sender_id
+            ).filter(ZaloReceivedMessage.content_hash.in_(set(hashes))).all()
+        }
+        
+        new_messages = {}  # {content_hash: (config_id, ZaloReceivedMessage)}
+        duplicates = []  # [(content_hash, record, session_id)]
+        for record, content_hash in zip(records, hashes):
+            config_id = record['config_id']
+            session_id = session_ids.get(config_id)
+            if not session_id:
+                logger.error(f"Config {config_id}: Không tìm thấy config, bỏ qua tin nhắn từ {record['sender_name']}")
+                continue
+            received_at = record['received_at']
+            if isinstance(received_at, str):
+                received_at = datetime.fromisoformat(received_at)
+            
+            if content_hash in canonical or content_hash in new_messages:
+                duplicates.append((content_hash, dict(record, received_at=received_at), session_id))
+                continue
+            
+            # Tin nhắn mới: insert vào zalo_received_messages
+            received_msg = ZaloReceivedMessage(
+                session_id=session_id,
+                config_id=config_id,
+                sender_id=record['sender_id'],
+                sender_name=record['sender_name'],
+                content=record['content'],
+                thread_id=record['thread_id'],
+                thread_type=record['thread_type'],
+                received_at=received_at,
+                status_push_kafka=1
+            )
+            db.session.add(received_msg)
+            new_messages[content_hash] = (config_id, received_msg)
+        db.session.flush()
+        
+        for content_hash, (_, received_msg) in new_messages.items():
+            canonical[content_hash] = (received_msg.id, received_msg.sender_id)
+        
+        # Tin nhắn trùng content: chỉ lưu sender vào bảng extra_senders (sender đã có thì bỏ qua)
+        extra_rows = []
+        for content_hash, record, session_id in duplicates:
+            message_id, canonical_sender_id = canonical[content_hash]
+            if record['sender_id'] == canonical_sender_id:
+                continue
+            extra_rows.append({
+                'message_id': message_id,
+                'sender_id': record['sender_id'],
+                'sender_name': record['sender_name'],
+                'session_id': session_id,
+                'config_id': record['config_id'],
+                'received_at': record['received_at']
+            })
+        if extra_rows:
+            db.session.execute(ZaloReceivedMessageExtraSender.__table__.insert().prefix_with('IGNORE'), extra_rows)
+        
+        db.session.commit()
+        logger.info(f"💾 Saved {len(new_messages)} new message(s) and {len(extra_rows)} extra sender(s) "
+                    f"from {len(records)} received message(s)")
+        return [(config_id, received_msg.id) for config_id, received_msg in new_messages.values()]
+    
+    def enqueue_for_extraction(self, config_id, message_id):
+        """Đưa message mới vào hàng đợi bóc tách realtime của Zalo Message Processor"""
+        try:
+            # Import ở đây để tránh circular import và chỉ khởi tạo processor khi cần
+            from services.zalo_message_processor import zalo_processor
+            if zalo_processor.enqueue_new_message(message_id):
+                logger.info(f"Config {config_id}: Đã đưa message {message_id} vào hàng đợi bóc tách realtime")
+        except Exception as e:
+            # Không ảnh hưởng việc lưu tin nhắn, scheduler sẽ xử lý sau
+            logger.warning(f"Config {config_id}: Không thể đưa message {message_id} vào hàng đợi bóc tách: {e}")
     
     def create_bot(self, config_id):
         """Tạo bot instance cho config_id cụ thể"""
@@ -280,6 +398,8 @@ class ZaloBotManager:
             logger.error("ZaloAPI không khả dụng. Hãy cài đặt zlapi.")
             return False
             
+        # Khởi tạo lại bot (ví dụ sau khi cập nhật cookies) thì luôn đọc config mới từ DB
+        self.invalidate_config_cache(config_id)
         config = self.get_config_by_id(config_id)
         if not config:
             logger.error(f"Không thể lấy config {config_id}")
@@ -557,6 +677,9 @@ class ZaloBotManager:
             if config_id in self.message_queues:
                 del self.message_queues[config_id]
             
+            # Xóa cache config/session
+            self.invalidate_config_cache(config_id)
+            
             # Reset status
             if config_id in bot_status:
                 bot_status[config_id] = 'stopped'
@@ -571,6 +694,11 @@ class ZaloBotManager:
             logger.error(f"❌ [CLEANUP_BOT] Config {config_id}: Lỗi cleanup: {e}")
             return False
     
+    def get_ingest_stats(self):
+        """Thống kê ghi tin nhắn vào DB (hàng đợi, journal, lỗi)"""
+        return dict(self.ingest_writer.get_stats(), async_enabled=self.ingest_async,
+                    config_cache=self.config_cache.get_info())
+    
     def get_bot_status(self, config_id):
         """Lấy trạng thái bot cho config_id cụ thể"""
         if config_id not in self.stats:
@@ -605,3 +733,16 @@ class ZaloBotManager:
 # Khởi tạo singleton instance
 zalo_bot_manager = ZaloBotManager()
 
+
+# Config/session bị sửa hoặc xóa qua ORM trong process này thì bỏ cache tương ứng
+@event.listens_for(ZaloConfig, 'after_update')
+@event.listens_for(ZaloConfig, 'after_delete')
+def _invalidate_config_on_change(mapper, connection, target):
+    zalo_bot_manager.invalidate_config_cache(target.id)
+
+
+@event.listens_for(ZaloSession, 'after_update')
+@event.listens_for(ZaloSession, 'after_delete')
+def _invalidate_sessions_on_change(mapper, connection, target):
+    zalo_bot_manager.invalidate_config_cache()
+
@@ -8,14 +8,30 @@ import time
 import threading
 import logging
 import json
+import re
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from typing import List, Dict, Optional
-from groq import Groq
+from typing import List, Dict, Optional, Set, Tuple
 from dotenv import load_dotenv
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from utils.property_service_sql import PropertyService
+from utils.keyset_pagination import decode_cursor, encode_cursor, keyset_condition
+from utils.ttl_cache import TTLCache
+from utils.token_budget import AdaptiveBatchSizer
+from utils.listing_prefilter import ListingPrefilter
+from utils.streaming_json import IncrementalJSONObjectParser, is_empty_json_array, parse_json_objects
+from utils.llm_gateway import llm_gateway
+from utils.metrics import metrics, span, STAGE_DURATION
+from utils.deterministic_extractor import (
+    EXTRACTOR_VERSION, FALLBACK_FIELDS, LOCAL_FIELDS, extract_structured_fields
+)
+from .database_pools import chat_pool
+from .message_work_queue import message_work_queue
+from .message_repository import message_repository
+from .message_micro_batcher import MessageMicroBatcher
+from .extraction_cache import extraction_cache, compute_fingerprint
+from .near_duplicate_index import near_duplicate_index
 from .warehouse_database_service import warehouse_service
 
 # Load environment variables
@@ -38,21 +54,41 @@ logger.info(f"DB_WAREHOUSE_USER: {os.getenv('DB_WAREHOUSE_USER', 'NOT_SET')}")
 logger.info(f"DB_WAREHOUSE_PASSWORD: {'SET' if os.getenv('DB_WAREHOUSE_PASSWORD') else 'NOT_SET'}")
 logger.info(f"DB_WAREHOUSE_NAME: {os.getenv('DB_WAREHOUSE_NAME', 'NOT_SET')}")
 
-# Tạo Flask app cho easychat database
-zalo_app = Flask(__name__)
-zalo_app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql://{os.getenv('DB_CHAT_USER', 'easychat')}:{os.getenv('DB_CHAT_PASSWORD', '')}@{os.getenv('DB_CHAT_HOST', '103.6.234.59')}:{os.getenv('DB_CHAT_PORT', '6033')}/{os.getenv('DB_NAME', 'easychat')}"
-zalo_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-zalo_db = SQLAlchemy(zalo_app)
+# Easychat database dùng pool chung trong database_pools.py
 
+# Số content_hash tối đa trong 1 câu SELECT/UPDATE khi cập nhật warehouse_ids theo batch
+WAREHOUSE_IDS_UPDATE_CHUNK_SIZE = 500
+
+# Metrics của processor (export qua /metrics và /api/zalo-processor/status)
+BATCH_SIZE = metrics.histogram('zalo_batch_size_messages', 'Messages per LLM extraction request',
+                               buckets=(1, 2, 5, 10, 15, 20, 30, 50, 100))
+PROMPT_TOKENS = metrics.histogram('zalo_prompt_tokens_estimated', 'Estimated prompt tokens per LLM extraction request',
+                                  buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000))
+LLM_LATENCY = metrics.histogram('zalo_llm_latency_seconds', 'LLM extraction request latency by serving model')
+LLM_REQUESTS = metrics.counter('zalo_llm_requests_total', 'LLM extraction requests by serving model and finish reason')
+LLM_TOKENS = metrics.counter('zalo_llm_tokens_total', 'LLM tokens used by model and kind (prompt, completion, reasoning)')
+PARSE_RESULTS = metrics.counter('zalo_parse_results_total', 'LLM responses by parse outcome (ok, malformed, truncated, failed)')
+MESSAGES_PROCESSED = metrics.counter('zalo_messages_processed_total', 'Claimed messages by final outcome (done, failed, skipped, shared)')
+BATCH_DURATION = metrics.histogram('zalo_batch_duration_seconds', 'End-to-end time of a claimed batch (prepare to ack)')
+DB_RETRIES = metrics.counter('zalo_db_retries_total', 'Database connection/query retries by database')
 # Warehouse database service được import từ warehouse_database_service.py
 
+
+def _omit_schema_fields(prompt: str, fields: List[str]) -> str:
+    """Bỏ định nghĩa các trường khỏi JSON schema trong prompt (mỗi property nằm ở indent 6 khoảng trắng)"""
+    for field in fields:
+        prompt = re.sub(r'\n      "' + re.escape(field) + r'": \{.*?\n      \},?', '', prompt, count=1, flags=re.S)
+    return prompt
+
+
 class ZaloMessageProcessor:
     """Service xử lý tin nhắn Zalo định kỳ"""
     
     def __init__(self):
         """Khởi tạo service"""
-        # Groq client
-        self.groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+        # Gọi LLM qua gateway chung (rate limit theo model, hedge, failover sang model dự phòng)
+        self.llm_gateway = llm_gateway
+        self.extraction_model = os.getenv('GROQ_EXTRACTION_MODEL', 'openai/gpt-oss-120b')
         
         # Service control
         self.is_running = False
@@ -67,13 +103,69 @@ class ZaloMessageProcessor:
         self.schedule_enabled = schedule_minutes > 0  # Flag mặc định: 0 = tắt, >0 = bật
         self.started_at = None  # Thời gian bắt đầu schedule
         
+        # Cấu hình pipeline: số batch gọi Groq song song và số batch tối đa đang chờ xử lý
+        self.pipeline_concurrency = max(1, int(os.getenv('ZALO_PROCESSOR_CONCURRENCY', '4')))
+        self.pipeline_queue_depth = max(self.pipeline_concurrency, int(os.getenv('ZALO_PROCESSOR_QUEUE_DEPTH', '8')))
+        self.pipeline_batch_size = max(1, int(os.getenv('ZALO_PROCESSOR_BATCH_SIZE', '20')))
+        
         # Warehouse service instance
         self.warehouse_service = warehouse_service
         
+        # Ngân sách token cho mỗi request Groq, số tin nhắn mỗi batch tự điều chỉnh theo kết quả thực tế
+        self.max_completion_tokens = int(os.getenv('ZALO_BATCH_OUTPUT_TOKEN_BUDGET', '36751'))
+        # Stream response từ Groq và parse từng object ngay khi đóng ngoặc (giữ lại object hoàn chỉnh khi bị cắt cụt)
+        self.stream_completions = os.getenv('ZALO_GROQ_STREAM', '1') == '1'
+        self.batch_sizer = AdaptiveBatchSizer(
+            input_budget=int(os.getenv('ZALO_BATCH_INPUT_TOKEN_BUDGET', '32000')),
+            output_budget=self.max_completion_tokens,
+            max_messages=int(os.getenv('ZALO_BATCH_MAX_MESSAGES', '50')),
+            reasoning_reserve=int(os.getenv('ZALO_BATCH_REASONING_RESERVE', '4096')),
+            output_tokens_per_message=int(os.getenv('ZALO_BATCH_OUTPUT_TOKENS_PER_MESSAGE', '400'))
+        )
+        
+        # Work queue có lease để nhiều processor instance không xử lý trùng message
+        self.work_queue = message_work_queue
+        
+        # Đọc message theo lô (1 query IN cho nhiều id)
+        self.message_repository = message_repository
+        
+        # Bóc tách ngay khi có message mới (flush khi đủ N message hoặc sau T ms), scheduler vẫn chạy để dọn phần còn sót.
+        # Chỉ hoạt động khi processor đang chạy (start/stop), ZALO_MESSAGE_PROCESSOR_SCHEDULE=0 hoặc đã stop thì không gọi Groq
+        self.realtime_enabled = os.getenv('ZALO_REALTIME_EXTRACTION', '1') == '1'
+        self.micro_batcher = MessageMicroBatcher(
+            handler=self.process_message_ids,
+            max_batch_size=int(os.getenv('ZALO_REALTIME_BATCH_SIZE', str(self.pipeline_batch_size))),
+            max_wait_ms=int(os.getenv('ZALO_REALTIME_MAX_WAIT_MS', '3000')),
+            max_pending=int(os.getenv('ZALO_REALTIME_MAX_PENDING', '1000')),
+            max_concurrent_flushes=self.pipeline_concurrency,
+            name='zalo-realtime'
+        )
+        
+        # Cache kết quả bóc tách theo content_hash + fingerprint (model, prompt, property tree)
+        self.extraction_cache = extraction_cache
+        
+        # hybrid: giá/diện tích/số phòng/hướng/SĐT bóc tách bằng regex, LLM chỉ trả các trường cần suy luận
+        # llm: LLM trả toàn bộ schema
+        self.extraction_mode = os.getenv('ZALO_EXTRACTION_MODE', 'hybrid')
+        if self.extraction_mode not in ('hybrid', 'llm'):
+            logger.warning(f"⚠️ Unknown ZALO_EXTRACTION_MODE={self.extraction_mode}, using hybrid")
+            self.extraction_mode = 'hybrid'
+        
+        # Prefilter: bỏ qua tin chào hỏi/quảng cáo (score < ngưỡng) trước khi gửi Groq
+        self.prefilter_enabled = os.getenv('ZALO_PREFILTER_ENABLED', '1') == '1'
+        self.listing_prefilter = ListingPrefilter(threshold=float(os.getenv('ZALO_PREFILTER_THRESHOLD', '0.35')))
+        self.prefilter_stats = {'checked': 0, 'skipped': 0}
+        
+        # Gom tin gần trùng (MinHash/LSH): chỉ gửi Groq message đại diện, các message khác dùng chung warehouse_ids
+        self.near_duplicate_index = near_duplicate_index
+        
+        # Cache tổng số messages theo filter (COUNT trên bảng lớn tốn kém, chỉ cần xấp xỉ)
+        self.message_count_cache = TTLCache(ttl=int(os.getenv('ZALO_MESSAGES_COUNT_CACHE_TTL', '60')))
+        
         logger.info(f"ZaloMessageProcessor initialized (schedule: {self.interval//60} minutes, enabled: {self.schedule_enabled})")
     
     def get_zalo_db_connection(self):
-        """Tạo kết nối database easychat với retry mechanism"""
+        """Mượn kết nối database easychat từ pool chung với retry mechanism"""
         max_retries = 3
         retry_delay = 1
         
@@ -81,17 +173,17 @@ class ZaloMessageProcessor:
             try:
                 logger.info(f"Attempting to connect to easychat database... (attempt {attempt + 1}/{max_retries})")
                 
-                with zalo_app.app_context():
-                    # Sử dụng SQLAlchemy engine với connection pooling
-                    connection = zalo_db.engine.connect()
-                    logger.info("✅ Easychat database connection successful")
-                    return connection
+                # Mượn connection từ pool chung (close() để trả lại pool)
+                connection = chat_pool.connect()
+                logger.info("✅ Easychat database connection successful")
+                return connection
                     
             except Exception as e:
                 logger.error(f"❌ Easychat database connection error (attempt {attempt + 1}): {e}")
                 logger.error(f"Error type: {type(e)}")
                 
                 if attempt < max_retries - 1:
+                    DB_RETRIES.inc(database='easychat')
                     logger.info(f"Retrying in {retry_delay} seconds...")
                     time.sleep(retry_delay)
                     retry_delay *= 2  # Exponential backoff
@@ -104,120 +196,127 @@ class ZaloMessageProcessor:
         """Tạo kết nối database warehouse với retry mechanism"""
         return self.warehouse_service.get_warehouse_db_connection()
     
-    def get_unprocessed_messages(self, limit: int = 20, offset: int = 0, warehouse_id: str = 'NULL', sort: str = 'newest') -> List[Dict]:
+    def get_unprocessed_messages(self, limit: int = 20, offset: int = 0, warehouse_id: str = 'NULL', sort: str = 'newest', cursor: Optional[str] = None) -> Dict:
         """
         Lấy danh sách tin nhắn từ bảng zalo_received_messages trong database easychat theo warehouse_id
+        Phân trang keyset theo (received_at, id): truyền next_cursor của trang trước vào cursor
         
         Args:
             limit: Số lượng tin nhắn tối đa cần lấy
-            offset: Số lượng tin nhắn bỏ qua (cho pagination)
+            offset: Số lượng tin nhắn bỏ qua (pagination kiểu cũ, bỏ qua khi có cursor)
             warehouse_id: Trạng thái warehouse_id ('NULL', 'NOT_NULL', 'ALL')
             sort: Sắp xếp theo thời gian - 'newest' (mới nhất trước) hoặc 'oldest' (cũ nhất trước)
+            cursor: Cursor trả về từ trang trước (next_cursor)
             
         Returns:
-            List các tin nhắn theo warehouse_id
+            Dict {'messages': [...], 'total': tổng số (cache theo TTL), 'next_cursor': cursor trang sau hoặc None}
         """
+        # Cursor không hợp lệ thì báo lỗi ngay (ValueError), không retry
+        if cursor:
+            decode_cursor(cursor)
+        
         try:
             logger.info("🔍 Starting to fetch unprocessed messages...")
             
             # Retry logic cho connection
             max_retries = 3
             for attempt in range(max_retries):
+                connection = None
                 try:
                     logger.info(f"🔄 Attempt {attempt + 1}/{max_retries}")
                     
-                    with zalo_app.app_context():
-                        logger.info("📡 Zalo app context created")
-                        connection = self.get_zalo_db_connection()
-                        if not connection:
-                            logger.error("❌ No database connection available")
-                            continue
+                    connection = self.get_zalo_db_connection()
+                    if not connection:
+                        logger.error("❌ No database connection available")
+                        continue
                         
-                        logger.info("📊 Executing query to fetch messages...")
-                        from sqlalchemy import text
+                    logger.info("📊 Executing query to fetch messages...")
+                    from sqlalchemy import text
                         
-                        # Xây dựng WHERE clause dựa trên warehouse_ids (JSON set)
-                        # Luôn thêm điều kiện content_hash IS NOT NULL để chỉ lấy messages unique
-                        if warehouse_id == 'ALL':
-                            where_clause = "WHERE content_hash IS NOT NULL"
-                            params = {"limit": limit, "offset": offset}
-                        elif warehouse_id == 'NULL':
-                            where_clause = "WHERE (warehouse_ids IS NULL OR JSON_LENGTH(warehouse_ids) = 0) AND content_hash IS NOT NULL"
-                            params = {"limit": limit, "offset": offset}
-                        elif warehouse_id == 'NOT_NULL':
-                            where_clause = "WHERE warehouse_ids IS NOT NULL AND JSON_LENGTH(warehouse_ids) > 0 AND content_hash IS NOT NULL"
-                            params = {"limit": limit, "offset": offset}
-                        else:
-                            # Nếu warehouse_id là một số cụ thể: message chứa id này trong set
-                            where_clause = "WHERE JSON_CONTAINS(warehouse_ids, CAST(:warehouse_id AS JSON), '$') AND content_hash IS NOT NULL"
-                            params = {"limit": limit, "offset": offset, "warehouse_id": int(warehouse_id)}
+                    # Xây dựng WHERE clause dựa trên cột generated has_warehouse_ids và multi-valued index warehouse_ids
+                    # content_hash là UNIQUE nên mỗi content_hash chỉ có 1 bản ghi, không cần GROUP BY
+                    conditions = ["content_hash IS NOT NULL"]
+                    params = {}
+                    if warehouse_id == 'NULL':
+                        conditions.append("has_warehouse_ids = 0")
+                    elif warehouse_id == 'NOT_NULL':
+                        conditions.append("has_warehouse_ids = 1")
+                    elif warehouse_id != 'ALL':
+                        # Nếu warehouse_id là một số cụ thể: message chứa id này trong set
+                        conditions.append("CAST(:warehouse_id AS UNSIGNED) MEMBER OF (warehouse_ids)")
+                        params["warehouse_id"] = int(warehouse_id)
+                    count_where_clause = "WHERE " + " AND ".join(conditions)
                         
-                        # Sắp xếp theo thời gian: newest = DESC, oldest = ASC
-                        order_dir = "DESC" if (sort or "newest").lower() == "newest" else "ASC"
+                    # Sắp xếp theo thời gian: newest = DESC, oldest = ASC
+                    descending = (sort or "newest").lower() == "newest"
+                    order_dir = "DESC" if descending else "ASC"
+                    cursor_condition = keyset_condition('received_at', 'id', cursor, descending, params)
+                    if cursor_condition:
+                        conditions.append(cursor_condition)
+                    where_clause = "WHERE " + " AND ".join(conditions)
                         
-                        # Query để đếm tổng số records (unique content_hash)
-                        # Chỉ đếm các content_hash unique, không trùng lặp
-                        count_query = text(f"""
-                        SELECT COUNT(DISTINCT content_hash) as total
-                        FROM zalo_received_messages 
-                        {where_clause}
-                        """)
+                    # Lấy thừa 1 bản ghi để biết còn trang sau hay không
+                    data_query = text(f"""
+                    SELECT id, session_id, config_id, sender_id, sender_name, 
+                           content, thread_id, thread_type, received_at, 
+                           status_push_kafka, warehouse_ids, reply_quote,
+                           content_hash, added_document_chunks
+                    FROM zalo_received_messages
+                    {where_clause}
+                    ORDER BY received_at {order_dir}, id {order_dir}
+                    LIMIT :limit{'' if cursor else ' OFFSET :offset'}
+                    """)
+                    data_params = dict(params, limit=limit + 1)
+                    if not cursor:
+                        data_params["offset"] = offset
                         
-                        # Query để lấy data với pagination - chỉ lấy messages unique theo content_hash
-                        # Sử dụng subquery để lấy MIN(id) cho mỗi content_hash unique
-                        data_query = text(f"""
-                        SELECT z.id, z.session_id, z.config_id, z.sender_id, z.sender_name, 
-                               z.content, z.thread_id, z.thread_type, z.received_at, 
-                               z.status_push_kafka, z.warehouse_ids, z.reply_quote,
-                               z.content_hash, z.added_document_chunks
-                        FROM zalo_received_messages z
-                        INNER JOIN (
-                            SELECT content_hash, MIN(id) as min_id
-                            FROM zalo_received_messages
-                            {where_clause}
-                            GROUP BY content_hash
-                            ORDER BY MIN(received_at) {order_dir}
-                            LIMIT :limit OFFSET :offset
-                        ) unique_hashes ON z.content_hash = unique_hashes.content_hash AND z.id = unique_hashes.min_id
-                        ORDER BY z.received_at {order_dir}
-                        """)
+                    logger.info(f"🔍 Data Query: {data_query}")
+                    logger.info(f"🔍 Limit: {limit}, Offset: {offset}, Cursor: {cursor}")
+                    logger.info(f"🔍 Warehouse ID filter: {warehouse_id}")
                         
-                        logger.info(f"🔍 Data Query: {data_query}")
-                        logger.info(f"🔍 Limit: {limit}, Offset: {offset}")
-                        logger.info(f"🔍 Warehouse ID filter: {warehouse_id}")
+                    # Lấy data
+                    result = connection.execute(data_query, data_params)
+                    logger.info("✅ Query executed successfully")
                         
-                        # Đếm tổng số records (unique content_hash)
-                        count_params = {k: v for k, v in params.items() if k != 'limit' and k != 'offset'}
-                        count_result = connection.execute(count_query, count_params)
-                        total_count = count_result.fetchone()[0]
+                    messages = []
+                    for row in result:
+                        messages.append(dict(row._mapping))
                         
-                        # Lấy data
-                        result = connection.execute(data_query, params)
-                        logger.info("✅ Query executed successfully")
+                    next_cursor = None
+                    if len(messages) > limit:
+                        messages = messages[:limit]
+                        last = messages[-1]
+                        next_cursor = encode_cursor(last['received_at'], last['id'])
                         
-                        messages = []
-                        for row in result:
-                            messages.append(dict(row._mapping))
+                    # Đếm tổng số records: cache theo filter để không COUNT lại ở mỗi trang
+                    count_params = {k: v for k, v in params.items() if not k.startswith('cursor_')}
+                    count_query = text(f"SELECT COUNT(*) AS total FROM zalo_received_messages {count_where_clause}")
+                    total_count = self.message_count_cache.get_or_load(
+                        ('messages', warehouse_id),
+                        lambda: connection.execute(count_query, count_params).fetchone()[0]
+                    )
                         
-                        logger.info(f"✅ Found {len(messages)} unprocessed messages out of {total_count} total")
-                        # Return messages with total count as metadata
-                        # We'll modify the return to include total in a dict
-                        return {'messages': messages, 'total': total_count}
+                    logger.info(f"✅ Found {len(messages)} unprocessed messages out of {total_count} total")
+                    return {'messages': messages, 'total': total_count, 'next_cursor': next_cursor}
                         
                 except Exception as e:
                     logger.error(f"❌ Attempt {attempt + 1} failed: {e}")
                     if attempt < max_retries - 1:
+                        DB_RETRIES.inc(database='easychat')
                         logger.info(f"🔄 Retrying in 2 seconds...")
                         time.sleep(2)
                     else:
                         raise e
+                finally:
+                    if connection:
+                        connection.close()
                         
         except Exception as e:
             logger.error(f"❌ Error fetching messages after {max_retries} attempts: {e}")
             logger.error(f"❌ Error type: {type(e)}")
             import traceback
             logger.error(f"❌ Traceback: {traceback.format_exc()}")
-            return {'messages': [], 'total': 0}
+            return {'messages': [], 'total': 0, 'next_cursor': None}
     
     def get_property_tree_for_prompt(self, root_id: int = 1) -> str:
         """
@@ -231,22 +330,22 @@ class ZaloMessageProcessor:
         """
         return self.warehouse_service.get_property_tree_for_prompt(root_id)
     
-    def process_message_with_groq(self, message_content: str) -> Optional[str]:
+    def build_extraction_prompt(self, message_content: str, omit_fields: Optional[List[str]] = None) -> str:
         """
-        Gửi tin nhắn tới Groq API để bóc tách thông tin căn hộ
+        Tạo prompt bóc tách thông tin căn hộ (schema output + property tree + tin nhắn)
         
         Args:
-            message_content: Nội dung tin nhắn cần xử lý
+            message_content: Nội dung tin nhắn (hoặc nhiều tin nhắn đã gộp bằng create_batch_prompt)
+            omit_fields: Các trường bỏ khỏi schema output (chế độ hybrid: đã bóc tách local)
             
         Returns:
-            Kết quả từ Groq API hoặc None nếu lỗi
+            String prompt cho Groq
         """
-        try:
-            # Lấy property tree từ database
-            property_tree = self.get_property_tree_for_prompt()
-            
-            # Prompt để Groq trả về JSON
-            prompt = f"""
+        # Lấy property tree từ database
+        property_tree = self.get_property_tree_for_prompt()
+        
+        # Prompt để Groq trả về JSON
+        prompt = f"""
             Hãy phân tích tin nhắn rao bán căn hộ trong cặp thẻ XML <message></message> và trả về  duy nhất JSON string chứa thông tin căn hộ như được mô tả trong cặp thẻ XML <output></output>
             
             <message>
@@ -413,13 +512,47 @@ class ZaloMessageProcessor:
 
             
             """
-
-            print("prompt")
-            print(prompt)
-            # exit()
+        if omit_fields:
+            prompt = _omit_schema_fields(prompt, omit_fields)
+        return prompt
+    
+    def process_message_with_groq(self, message_content: str, max_completion_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Gửi tin nhắn tới Groq API để bóc tách thông tin căn hộ
+        
+        Args:
+            message_content: Nội dung tin nhắn cần xử lý
+            max_completion_tokens: Giới hạn token output (default: ZALO_BATCH_OUTPUT_TOKEN_BUDGET)
+            
+        Returns:
+            Kết quả từ Groq API hoặc None nếu lỗi
+        """
+        try:
+            result = self.complete_extraction(self.build_extraction_prompt(message_content), max_completion_tokens)
+            return result['content'] if result else None
+        except Exception as e:
+            logger.error(f"Error processing message with Groq: {e}")
+            return None
+    
+    def complete_extraction(self, prompt: str, max_completion_tokens: Optional[int] = None) -> Optional[Dict]:
+        """
+        Gửi prompt đã build tới Groq (streaming nếu ZALO_GROQ_STREAM=1)
+        
+        Args:
+            prompt: Prompt từ build_extraction_prompt()
+            max_completion_tokens: Giới hạn token output (default: ZALO_BATCH_OUTPUT_TOKEN_BUDGET)
+            
+        Returns:
+            Dict {'model', 'content', 'finish_reason', 'usage', 'objects', 'parse_errors'} hoặc None nếu lỗi
+            - model: model đã trả lời (có thể là model dự phòng khi model chính bị rate limit/lỗi)
+            - objects: các JSON object hoàn chỉnh trong response (kể cả khi response bị cắt cụt)
+        """
+        started = time.perf_counter()
+        try:
+            logger.debug(f"Extraction prompt:\n{prompt}")
             
-            completion = self.groq_client.chat.completions.create(
-                model="openai/gpt-oss-120b",
+            model, completion = self.llm_gateway.create_completion(
+                model=self.extraction_model,
                 messages=[
                     {
                         "role": "user",
@@ -427,51 +560,97 @@ class ZaloMessageProcessor:
                     }
                 ],
                 temperature=0.1,  # Giảm temperature để kết quả ổn định hơn với GPT-OSS
-                max_completion_tokens=36751,  # Tăng token limit cho GPT-OSS
+                max_completion_tokens=max_completion_tokens or self.max_completion_tokens,
                 top_p=0.9,  # Giảm top_p để tập trung hơn
-                stream=False,
+                stream=self.stream_completions,
                 stop=None
             )
             
-            # Collect streaming response với error handling tốt hơn
-            response_content = completion.choices[0].message.content
-            # print('response_content2', completion.choices[0].message)
-            # try:
-            #     for chunk in completion:
-            #         if hasattr(chunk, 'choices') and chunk.choices and len(chunk.choices) > 0:
-            #             if hasattr(chunk.choices[0], 'delta') and chunk.choices[0].delta:
-            #                 if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-            #                     response_content += chunk.choices[0].delta.content
-            #     print('response_content', response_content)
-            # except Exception as stream_error:
-            #     logger.error(f"Error in streaming response: {stream_error}")
-            #     # Fallback: thử lấy response không streaming
-            #     try:
-            #         completion_no_stream = self.groq_client.chat.completions.create(
-            #             model="openai/gpt-oss-120b",
-            #             messages=[
-            #                 {
-            #                     "role": "user",
-            #                     "content": prompt
-            #                 }
-            #             ],
-            #             temperature=0.1,
-            #             max_completion_tokens=2048,
-            #             top_p=0.9,
-            #             stream=False
-            #         )
-            #         response_content = completion_no_stream.choices[0].message.content
-            #     except Exception as fallback_error:
-            #         logger.error(f"Fallback also failed: {fallback_error}")
-            #         return None
-            
-            logger.info(f"GPT-OSS processing completed for message, response length: {len(response_content)}")
-            return response_content
+            parser = IncrementalJSONObjectParser()
+            if self.stream_completions:
+                response_content, finish_reason, usage = self._collect_stream(completion, parser)
+            else:
+                response_content = completion.choices[0].message.content or ''
+                finish_reason = completion.choices[0].finish_reason
+                usage = self._usage_to_dict(getattr(completion, 'usage', None))
+                parser.feed(response_content)
+            objects = parser.close()
+            self._record_llm_metrics(model, time.perf_counter() - started, usage, finish_reason)
+            
+            logger.info(f"{model} processing completed for message, response length: {len(response_content)}, "
+                        f"finish_reason: {finish_reason}, objects: {len(objects)}, "
+                        f"malformed objects: {len(parser.errors)}, usage: {usage}")
+            return {
+                'model': model,
+                'content': response_content,
+                'finish_reason': finish_reason,
+                'usage': usage,
+                'objects': objects,
+                'parse_errors': len(parser.errors)
+            }
             
         except Exception as e:
+            STAGE_DURATION.observe(time.perf_counter() - started, stage='llm')
+            LLM_REQUESTS.inc(model=self.extraction_model, outcome='error')
             logger.error(f"Error processing message with Groq: {e}")
             return None
     
+    @staticmethod
+    def _record_llm_metrics(model: str, elapsed: float, usage: Dict, finish_reason: Optional[str]):
+        """Ghi latency, token và finish_reason của 1 lần gọi LLM"""
+        STAGE_DURATION.observe(elapsed, stage='llm')
+        LLM_LATENCY.observe(elapsed, model=model)
+        LLM_REQUESTS.inc(model=model, outcome=finish_reason or 'unknown')
+        for kind in ('prompt_tokens', 'completion_tokens', 'reasoning_tokens'):
+            if usage.get(kind):
+                LLM_TOKENS.inc(usage[kind], model=model, kind=kind[:-len('_tokens')])
+    
+    def _collect_stream(self, completion, parser: IncrementalJSONObjectParser) -> Tuple[str, Optional[str], Dict]:
+        """
+        Đọc streaming response, đưa từng chunk vào parser
+        
+        Returns:
+            Tuple (content, finish_reason, usage)
+        """
+        parts = []
+        finish_reason = None
+        usage = {}
+        started_at = time.time()
+        first_object_at = None
+        for chunk in completion:
+            choices = getattr(chunk, 'choices', None) or []
+            if choices:
+                delta = getattr(choices[0], 'delta', None)
+                content = getattr(delta, 'content', None) if delta else None
+                if content:
+                    parts.append(content)
+                    if parser.feed(content) and first_object_at is None:
+                        first_object_at = time.time()
+                finish_reason = getattr(choices[0], 'finish_reason', None) or finish_reason
+            # Groq trả usage ở chunk cuối (x_groq.usage), OpenAI-compatible thì ở chunk.usage
+            chunk_usage = getattr(chunk, 'usage', None) or getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+            if chunk_usage:
+                usage = self._usage_to_dict(chunk_usage)
+        if first_object_at is not None:
+            logger.info(f"⏱️ First object after {first_object_at - started_at:.2f}s, stream finished after {time.time() - started_at:.2f}s")
+        return ''.join(parts), finish_reason, usage
+    
+    @staticmethod
+    def _usage_to_dict(usage) -> Dict:
+        """Chuyển usage của Groq response thành dict (prompt_tokens, completion_tokens, reasoning_tokens)"""
+        if not usage:
+            return {}
+        result = {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', None) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', None) or 0,
+            'total_tokens': getattr(usage, 'total_tokens', None) or 0
+        }
+        details = getattr(usage, 'completion_tokens_details', None)
+        reasoning_tokens = getattr(details, 'reasoning_tokens', None) if details else None
+        if reasoning_tokens:
+            result['reasoning_tokens'] = reasoning_tokens
+        return result
+    
     def parse_groq_response(self, groq_response: str) -> Optional[Dict]:
         """
         Parse JSON response từ Groq/GPT-OSS
@@ -565,7 +744,7 @@ class ZaloMessageProcessor:
     
     def insert_apartment_via_api(self, apartment_data: Dict) -> bool:
         """
-        Insert apartment vào warehouse database thông qua API
+        Insert apartment vào warehouse database (in-process, giữ tên cũ cho backward compatibility)
         
         Args:
             apartment_data: Dữ liệu căn hộ từ Groq
@@ -575,10 +754,25 @@ class ZaloMessageProcessor:
         """
         return self.warehouse_service.insert_apartment_via_api(apartment_data)
     
+    def insert_apartments(self, apartments_data: List[Dict],
+                          source_message_ids: Optional[List[Optional[int]]] = None) -> List[Optional[int]]:
+        """
+        Insert nhiều apartments vào warehouse trong 1 transaction (in-process, không qua HTTP)
+        Tin rao trùng căn đã có được gộp vào căn cũ (xem WarehouseDatabaseService.bulk_insert_apartments)
+        
+        Args:
+            apartments_data: Danh sách dữ liệu căn hộ từ Groq
+            source_message_ids: ID tin nhắn nguồn theo thứ tự apartments_data
+            
+        Returns:
+            List apartment_id theo thứ tự input (None nếu lỗi)
+        """
+        return self.warehouse_service.insert_apartments(apartments_data, source_message_ids=source_message_ids)
+    
     def update_message_warehouse_id(self, message_id: int, warehouse_id: int) -> bool:
         """
-        Cập nhật warehouse_id của tin nhắn sau khi xử lý với retry mechanism
-        DEPRECATED: Sử dụng update_warehouse_id_by_content_hash() để update tất cả messages cùng content_hash
+        Cập nhật warehouse_id của tin nhắn sau khi xử lý
+        Thêm warehouse_id cho tất cả messages cùng content_hash (xem update_messages_warehouse_ids())
         
         Args:
             message_id: ID của tin nhắn
@@ -587,41 +781,151 @@ class ZaloMessageProcessor:
         Returns:
             True nếu cập nhật thành công, False nếu lỗi
         """
-        # Lấy content_hash từ message để update tất cả messages cùng content_hash
-        message = self.get_message_by_id(message_id)
-        if message and message.get('content_hash'):
-            return self.update_warehouse_id_by_content_hash(message['content_hash'], warehouse_id)
-        else:
-            # Fallback: update chỉ message này nếu không có content_hash
-            return self._update_single_message_warehouse_id(message_id, warehouse_id)
+        return message_id in self.update_messages_warehouse_ids([(message_id, warehouse_id)])
+    
+    def update_messages_warehouse_ids(self, updates: List[Tuple[int, int]], messages: Optional[List[Dict]] = None) -> Set[int]:
+        """
+        Cập nhật warehouse_ids cho cả batch (message_id, warehouse_id) theo content_hash.
+        
+        Args:
+            updates: List [(message_id, warehouse_id), ...]
+            messages: Messages đã load sẵn (có content_hash) để khỏi query lại, có thể None
+            
+        Returns:
+            Set các message_id đã cập nhật thành công
+        """
+        if not updates:
+            return set()
+        
+        hash_by_message = {m['id']: m.get('content_hash') for m in (messages or []) if m.get('id') is not None}
+        missing_ids = sorted({mid for mid, _ in updates if mid not in hash_by_message})
+        if missing_ids:
+            hash_by_message.update(self._get_content_hashes(missing_ids))
+        
+        # Gom warehouse_ids theo content_hash (giữ thứ tự, bỏ trùng)
+        warehouse_ids_by_hash: Dict[str, List[int]] = {}
+        no_hash_updates = []
+        for message_id, warehouse_id in updates:
+            content_hash = hash_by_message.get(message_id)
+            if content_hash:
+                ids = warehouse_ids_by_hash.setdefault(content_hash, [])
+                if warehouse_id not in ids:
+                    ids.append(warehouse_id)
+            else:
+                no_hash_updates.append((message_id, warehouse_id))
+        
+        updated_message_ids = set()
+        if warehouse_ids_by_hash:
+            result = self.update_warehouse_ids_by_content_hash(warehouse_ids_by_hash)
+            updated_hashes = set(result.get('updated_hashes', []))
+            for message_id, _ in updates:
+                if hash_by_message.get(message_id) in updated_hashes:
+                    updated_message_ids.add(message_id)
+        
+        # Fallback: message không có content_hash thì update riêng message đó
+        failed_ids = set()
+        for message_id, warehouse_id in no_hash_updates:
+            if self._update_single_message_warehouse_id(message_id, warehouse_id):
+                updated_message_ids.add(message_id)
+            else:
+                failed_ids.add(message_id)
+        
+        return updated_message_ids - failed_ids
+    
+    def _get_content_hashes(self, message_ids: List[int]) -> Dict[int, Optional[str]]:
+        """Lấy content_hash cho nhiều messages bằng 1 query"""
+        return self.message_repository.get_content_hashes(message_ids)
     
     def update_warehouse_id_by_content_hash(self, content_hash: str, warehouse_id: int) -> bool:
         """
         Thêm warehouse_id vào set warehouse_ids cho TẤT CẢ các messages có cùng content_hash.
         """
-        with zalo_app.app_context():
-            conn = self.get_zalo_db_connection()
-            if not conn:
-                return False
-            try:
-                from sqlalchemy import text
-                sel = text("SELECT id, warehouse_ids FROM zalo_received_messages WHERE content_hash = :content_hash")
-                rows = conn.execute(sel, {"content_hash": content_hash}).fetchall()
-                if not rows:
-                    return False
+        result = self.update_warehouse_ids_by_content_hash({content_hash: [warehouse_id]})
+        return content_hash in result.get('updated_hashes', [])
+    
+    def update_warehouse_ids_by_content_hash(self, warehouse_ids_by_hash: Dict[str, List[int]]) -> Dict:
+        """
+        Thêm warehouse_ids vào set warehouse_ids cho TẤT CẢ messages của nhiều content_hash trong 1 transaction.
+        Mỗi chunk chỉ tốn 1 SELECT ... FOR UPDATE và 1 UPDATE ... CASE, không phụ thuộc số messages.
+        
+        Args:
+            warehouse_ids_by_hash: Dict {content_hash: [warehouse_id, ...]}
+            
+        Returns:
+            Dict {'success', 'updated_hashes', 'missing_hashes', 'updated_rows', 'error'}
+        """
+        result = {'success': False, 'updated_hashes': [], 'missing_hashes': [], 'updated_rows': 0, 'error': None}
+        hashes = [h for h, ids in warehouse_ids_by_hash.items() if h and ids]
+        if not hashes:
+            result['success'] = True
+            return result
+        
+        conn = self.get_zalo_db_connection()
+        if not conn:
+            result['error'] = 'No database connection available'
+            return result
+        try:
+            from sqlalchemy import text
+            found_hashes = set()
+            for start in range(0, len(hashes), WAREHOUSE_IDS_UPDATE_CHUNK_SIZE):
+                chunk = hashes[start:start + WAREHOUSE_IDS_UPDATE_CHUNK_SIZE]
+                placeholders = ','.join([f':h_{i}' for i in range(len(chunk))])
+                params = {f'h_{i}': h for i, h in enumerate(chunk)}
+                rows = conn.execute(
+                    text(f"SELECT id, content_hash, warehouse_ids FROM zalo_received_messages "
+                         f"WHERE content_hash IN ({placeholders}) FOR UPDATE"),
+                    params
+                ).fetchall()
+                
+                # Merge warehouse_ids trong Python, chỉ update các row thực sự thay đổi
+                changed = []
                 for row in rows:
-                    msg_id = row._mapping["id"]
-                    self._add_warehouse_id_to_message(conn, msg_id, row._mapping.get("warehouse_ids"), warehouse_id)
-                conn.commit()
-                logger.info(f"✅ Added warehouse_id {warehouse_id} to {len(rows)} message(s) with content_hash={content_hash}")
-                return True
-            except Exception as e:
-                conn.rollback()
-                logger.error(f"❌ Error updating warehouse_ids by content_hash: {e}")
-                return False
-            finally:
-                conn.close()
-        return False
+                    content_hash = row._mapping['content_hash']
+                    found_hashes.add(content_hash)
+                    merged, is_changed = self._merge_warehouse_ids(row._mapping.get('warehouse_ids'), warehouse_ids_by_hash[content_hash])
+                    if is_changed:
+                        changed.append((row._mapping['id'], merged))
+                
+                if changed:
+                    cases = ' '.join([f'WHEN :id_{i} THEN CAST(:ids_{i} AS JSON)' for i in range(len(changed))])
+                    id_placeholders = ','.join([f':id_{i}' for i in range(len(changed))])
+                    upd_params = {}
+                    for i, (message_id, merged) in enumerate(changed):
+                        upd_params[f'id_{i}'] = message_id
+                        upd_params[f'ids_{i}'] = json.dumps(merged)
+                    conn.execute(
+                        text(f"UPDATE zalo_received_messages SET warehouse_ids = CASE id {cases} END "
+                             f"WHERE id IN ({id_placeholders})"),
+                        upd_params
+                    )
+                    result['updated_rows'] += len(changed)
+            conn.commit()
+            if result['updated_rows']:
+                self.message_count_cache.invalidate()
+            
+            result['success'] = True
+            result['updated_hashes'] = [h for h in hashes if h in found_hashes]
+            result['missing_hashes'] = [h for h in hashes if h not in found_hashes]
+            logger.info(f"✅ Added warehouse_ids for {len(result['updated_hashes'])} content_hash(es), "
+                        f"{result['updated_rows']} message(s) changed, {len(result['missing_hashes'])} hash(es) not found")
+            return result
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"❌ Error updating warehouse_ids by content_hash: {e}")
+            result['error'] = str(e)
+            return result
+        finally:
+            conn.close()
+    
+    def _merge_warehouse_ids(self, current_warehouse_ids, new_warehouse_ids: List[int]) -> Tuple[List[int], bool]:
+        """Thêm new_warehouse_ids vào set hiện tại, trả về (list mới, có thay đổi hay không)."""
+        ids = self._parse_warehouse_ids(current_warehouse_ids)
+        changed = False
+        for warehouse_id in new_warehouse_ids:
+            if warehouse_id not in ids:
+                ids.append(warehouse_id)
+                changed = True
+        return ids, changed
     
     def _parse_warehouse_ids(self, raw) -> List[int]:
         """Chuyển warehouse_ids từ DB (list/str/None) thành list int."""
@@ -658,22 +962,21 @@ class ZaloMessageProcessor:
             connection = None
             try:
                 logger.info(f"Adding warehouse_id {warehouse_id} to message {message_id} (attempt {attempt + 1}/{max_retries})")
-                with zalo_app.app_context():
-                    connection = self.get_zalo_db_connection()
-                    if not connection:
-                        continue
-                    from sqlalchemy import text
-                    row = connection.execute(
-                        text("SELECT warehouse_ids FROM zalo_received_messages WHERE id = :message_id"),
-                        {"message_id": message_id}
-                    ).fetchone()
-                    if not row:
-                        logger.warning(f"⚠️ Message {message_id} not found")
-                        return False
-                    self._add_warehouse_id_to_message(connection, message_id, row._mapping.get("warehouse_ids"), warehouse_id)
-                    connection.commit()
-                    logger.info(f"✅ Added warehouse_id {warehouse_id} to message {message_id}")
-                    return True
+                connection = self.get_zalo_db_connection()
+                if not connection:
+                    continue
+                from sqlalchemy import text
+                row = connection.execute(
+                    text("SELECT warehouse_ids FROM zalo_received_messages WHERE id = :message_id"),
+                    {"message_id": message_id}
+                ).fetchone()
+                if not row:
+                    logger.warning(f"⚠️ Message {message_id} not found")
+                    return False
+                self._add_warehouse_id_to_message(connection, message_id, row._mapping.get("warehouse_ids"), warehouse_id)
+                connection.commit()
+                logger.info(f"✅ Added warehouse_id {warehouse_id} to message {message_id}")
+                return True
             except Exception as e:
                 logger.error(f"❌ Error: {e}")
                 if attempt < max_retries - 1:
@@ -689,6 +992,514 @@ class ZaloMessageProcessor:
                         pass
         return False
     
+    def get_extraction_fingerprint(self) -> str:
+        """
+        Fingerprint của model + prompt template + property tree hiện tại.
+        Đổi một trong các thành phần này thì kết quả cache cũ không còn được dùng.
+        """
+        prompt_template = self.build_extraction_prompt(self.create_batch_prompt([]))
+        if self.extraction_mode == 'hybrid':
+            # Kết quả hybrid phụ thuộc cả phiên bản extractor
+            prompt_template += f"\n[hybrid extractor v{EXTRACTOR_VERSION}]"
+        return compute_fingerprint(self.extraction_model, prompt_template)
+    
+    def _extract_batch(self, messages: List[Dict]) -> Tuple[Optional[str], List[Dict], Dict[int, str]]:
+        """
+        Gộp nhiều messages vào prompt, gửi Groq và parse kết quả.
+        Messages đã có kết quả trong extraction cache (cùng content_hash) không gửi Groq lại.
+        Messages được chia theo ngân sách token (AdaptiveBatchSizer) nên có thể thành nhiều request.
+        Chế độ hybrid: tin nhắn mà extractor local bóc tách không mơ hồ được gửi với schema rút gọn,
+        tin nhắn có nhiều giá/diện tích khác nhau (nhiều căn) vẫn gửi schema đầy đủ.
+        Chỉ đọc/ghi bảng cache, không ghi warehouse nên có thể chạy song song trong worker pool.
+        
+        Args:
+            messages: List các message dictionaries
+            
+        Returns:
+            Tuple (groq_result, apartments_data, failed) - failed: {message_id: lỗi} cho message gọi Groq lỗi
+            hoặc không parse được; message không có trong failed và không có apartment là tin không có căn nào
+        """
+        fingerprint = self.get_extraction_fingerprint()
+        cached = self.extraction_cache.get_many([m.get('content_hash') for m in messages], fingerprint)
+        
+        groq_results = []
+        apartments_data = []
+        failed = {}
+        uncached_messages = []
+        for message in messages:
+            cached_apartments = cached.get(message.get('content_hash'))
+            if cached_apartments is None:
+                uncached_messages.append(message)
+            else:
+                apartments_data.extend(dict(apartment, message_id=message['id']) for apartment in cached_apartments)
+        if cached:
+            logger.info(f"♻️ Extraction cache: {len(messages) - len(uncached_messages)}/{len(messages)} messages reused, "
+                        f"{len(uncached_messages)} sent to Groq")
+        
+        local_fields, full_messages = self._extract_local_fields(uncached_messages)
+        hybrid_messages = [m for m in uncached_messages if m['id'] in local_fields]
+        
+        sent_batches = 0
+        for group, group_local_fields in ((hybrid_messages, local_fields), (full_messages, None)):
+            for sub_batch in self._pack_messages(group):
+                # Các request chạy tuần tự: gia hạn lease của cả batch trước mỗi request tiếp theo
+                if sent_batches:
+                    self.work_queue.extend_lease(messages)
+                sent_batches += 1
+                groq_result, sub_apartments, sub_failed = self._extract_sub_batch(sub_batch, fingerprint, group_local_fields)
+                if groq_result:
+                    groq_results.append(groq_result)
+                apartments_data.extend(sub_apartments)
+                failed.update(sub_failed)
+        return ('\n'.join(groq_results) or None), apartments_data, failed
+    
+    def _extract_local_fields(self, messages: List[Dict]) -> Tuple[Dict[int, Dict], List[Dict]]:
+        """
+        Bóc tách local các trường có cấu trúc (chế độ hybrid)
+        
+        Returns:
+            Tuple (local_fields theo message_id, messages cần gửi schema đầy đủ)
+        """
+        if self.extraction_mode != 'hybrid':
+            return {}, messages
+        local_fields = {}
+        full_messages = []
+        for message in messages:
+            fields, ambiguous = extract_structured_fields(message.get('content'))
+            if any(field in LOCAL_FIELDS for field in ambiguous):
+                full_messages.append(message)
+            else:
+                local_fields[message['id']] = fields
+        if full_messages:
+            logger.info(f"🧮 Hybrid extraction: {len(local_fields)} message(s) with reduced schema, "
+                        f"{len(full_messages)} ambiguous message(s) with full schema")
+        return local_fields, full_messages
+    
+    @staticmethod
+    def _apply_local_fields(apartments_data: List[Dict], local_fields: Dict[int, Dict]) -> List[Dict]:
+        """
+        Ghép các trường bóc tách local vào apartments LLM trả về (schema rút gọn):
+        LOCAL_FIELDS luôn lấy giá trị local, FALLBACK_FIELDS chỉ điền khi LLM trả null
+        """
+        for apartment_data in apartments_data:
+            try:
+                fields = local_fields.get(int(apartment_data.get('message_id')))
+            except (TypeError, ValueError):
+                fields = None
+            if fields is None:
+                continue
+            for field in LOCAL_FIELDS:
+                apartment_data[field] = fields.get(field)
+            for field in FALLBACK_FIELDS:
+                if apartment_data.get(field) is None:
+                    apartment_data[field] = fields.get(field)
+        return apartments_data
+    
+    def _pack_messages(self, messages: List[Dict]) -> List[List[Dict]]:
+        """Chia messages thành các batch vừa ngân sách token input/output của 1 request"""
+        if len(messages) <= 1:
+            return [messages] if messages else []
+        preamble_tokens = self.batch_sizer.estimate(self.build_extraction_prompt(''))
+        batches = self.batch_sizer.pack(messages, preamble_tokens)
+        if len(batches) > 1:
+            logger.info(f"📦 Packed {len(messages)} messages into {len(batches)} batches by token budget: {[len(b) for b in batches]}")
+        return batches
+    
+    def _extract_sub_batch(self, messages: List[Dict], fingerprint: Optional[str] = None,
+                           local_fields: Optional[Dict[int, Dict]] = None) -> Tuple[Optional[str], List[Dict], Dict[int, str]]:
+        """
+        Gửi 1 batch tới Groq. Nếu output bị cắt cụt (finish_reason=length) thì giữ kết quả của các tin nhắn
+        đã xong và chỉ gửi lại phần còn lại; không parse được thì giảm kích thước batch và chia đôi gửi lại.
+        Object JSON lỗi được bỏ qua, tin nhắn chưa có apartment nào được gửi lại.
+        Kết quả parse thành công được lưu vào extraction cache khi có fingerprint.
+        Có local_fields (hybrid) thì gửi schema rút gọn và ghép các trường local vào kết quả.
+        
+        Returns:
+            Tuple (groq_result, apartments_data, failed) - failed: {message_id: lỗi} cho message gọi Groq lỗi,
+            không parse được hoặc bị cắt cụt mà không còn object nào; [] hợp lệ không tính là lỗi
+        """
+        with span('prompt_build'):
+            batch_content = self.create_batch_prompt(messages)
+            prompt = self.build_extraction_prompt(batch_content, LOCAL_FIELDS if local_fields is not None else None)
+            estimated_tokens = self.batch_sizer.estimate(prompt)
+        BATCH_SIZE.observe(len(messages))
+        PROMPT_TOKENS.observe(estimated_tokens)
+        logger.info(f"📝 Batch prompt created with {len(messages)} messages (~{estimated_tokens} tokens)")
+        
+        logger.info("🤖 Processing batch with Groq...")
+        result = self.complete_extraction(prompt, self.batch_sizer.output_tokens_for(len(messages)))
+        if not result or not result['content']:
+            logger.error("❌ Failed to process batch with Groq")
+            return None, [], {m['id']: 'Groq request failed' for m in messages}
+        
+        logger.info(f"✅ Groq batch result received")
+        groq_result = result['content']
+        # Kết quả của model dự phòng (failover) không lưu cache dưới fingerprint của model chính
+        cache_fingerprint = fingerprint if result.get('model', self.extraction_model) == self.extraction_model else None
+        truncated = result.get('finish_reason') == 'length'
+        # Bị cắt cụt: chỉ dùng các object đã đóng ngoặc trong stream
+        with span('parse'):
+            apartments_data = (result.get('objects') or []) if truncated else self.parse_groq_batch_response(groq_result)
+            if local_fields is not None:
+                apartments_data = self._apply_local_fields(apartments_data, local_fields)
+        # Chỉ response đúng bằng mảng rỗng [] là kết quả hợp lệ (không có tin rao), còn lại coi là parse lỗi
+        parse_failed = not truncated and not apartments_data and not is_empty_json_array(groq_result)
+        PARSE_RESULTS.inc(outcome='truncated' if truncated else 'failed' if parse_failed
+                          else 'malformed' if result.get('parse_errors') else 'ok')
+        
+        if truncated or parse_failed:
+            if truncated:
+                self.batch_sizer.record_truncation(len(messages))
+            else:
+                self.batch_sizer.record_parse_failure(len(messages))
+            
+            if len(messages) > 1:
+                # Retry/chia nhỏ làm batch giữ lâu hơn dự kiến: gia hạn lease trước khi gửi lại
+                self.work_queue.extend_lease(messages)
+                done_count, kept_apartments = self._split_salvaged(messages, apartments_data) if truncated else (0, [])
+                if done_count:
+                    logger.warning(f"⚠️ Batch of {len(messages)} messages truncated, kept {len(kept_apartments)} apartment(s) "
+                                   f"of {done_count} finished message(s), re-extracting {len(messages) - done_count}")
+                    if cache_fingerprint:
+                        self._cache_extraction_results(messages[:done_count], kept_apartments, cache_fingerprint)
+                    rest_result, rest_apartments, rest_failed = self._extract_sub_batch(messages[done_count:], fingerprint, local_fields)
+                    results = [r for r in (groq_result, rest_result) if r]
+                    return '\n'.join(results), kept_apartments + rest_apartments, rest_failed
+                
+                mid = len(messages) // 2
+                logger.warning(f"⚠️ Batch of {len(messages)} messages {'truncated' if truncated else 'not parseable'}, "
+                               f"retrying as {mid} + {len(messages) - mid}")
+                left_result, left_apartments, left_failed = self._extract_sub_batch(messages[:mid], fingerprint, local_fields)
+                right_result, right_apartments, right_failed = self._extract_sub_batch(messages[mid:], fingerprint, local_fields)
+                results = [r for r in (left_result, right_result) if r]
+                return ('\n'.join(results) or None), left_apartments + right_apartments, {**left_failed, **right_failed}
+            
+            # 1 tin nhắn vẫn bị cắt cụt: giữ các object hoàn chỉnh đã nhận được, không có object nào thì tính là lỗi
+            if not apartments_data:
+                error = 'Groq response truncated' if truncated else 'Failed to parse Groq response'
+                logger.error(f"❌ {error} for message {messages[0]['id']}")
+                return groq_result, [], {messages[0]['id']: error}
+        else:
+            self.batch_sizer.record_success(len(messages), estimated_tokens, result.get('usage'))
+            
+            missing = self._messages_without_apartments(messages, apartments_data) if result.get('parse_errors') else []
+            if missing and len(missing) < len(messages):
+                logger.warning(f"⚠️ {result['parse_errors']} malformed object(s) in response, "
+                               f"re-extracting {len(missing)} message(s) without apartments")
+                missing_ids = {m['id'] for m in missing}
+                self.work_queue.extend_lease(messages)
+                if cache_fingerprint:
+                    self._cache_extraction_results([m for m in messages if m['id'] not in missing_ids], apartments_data, cache_fingerprint)
+                retry_result, retry_apartments, retry_failed = self._extract_sub_batch(missing, fingerprint, local_fields)
+                results = [r for r in (groq_result, retry_result) if r]
+                return '\n'.join(results), apartments_data + retry_apartments, retry_failed
+            
+            if cache_fingerprint and not result.get('parse_errors'):
+                self._cache_extraction_results(messages, apartments_data, cache_fingerprint)
+        
+        if not apartments_data:
+            logger.info(f"ℹ️ No apartments in {len(messages)} message(s)")
+        return groq_result, apartments_data, {}
+    
+    @staticmethod
+    def _apartment_message_index(messages: List[Dict], apartments_data: List[Dict]) -> Optional[List[int]]:
+        """Vị trí trong batch của message tương ứng từng apartment (None nếu có apartment không rõ message_id)"""
+        positions = {m['id']: i for i, m in enumerate(messages)}
+        indexes = []
+        for apartment_data in apartments_data:
+            try:
+                indexes.append(positions[int(apartment_data.get('message_id'))])
+            except (KeyError, TypeError, ValueError):
+                return None
+        return indexes
+    
+    def _split_salvaged(self, messages: List[Dict], apartments_data: List[Dict]) -> Tuple[int, List[Dict]]:
+        """
+        Tách kết quả dùng được của response bị cắt cụt. Model trả apartment theo thứ tự tin nhắn nên các tin nhắn
+        trước tin nhắn cuối cùng xuất hiện trong response đã xong; tin nhắn cuối có thể còn apartment bị cắt.
+        
+        Returns:
+            Tuple (số tin nhắn đầu batch đã xong, apartments của các tin nhắn đó)
+        """
+        indexes = self._apartment_message_index(messages, apartments_data)
+        if not indexes:
+            return 0, []
+        done_count = max(indexes)
+        return done_count, [a for a, i in zip(apartments_data, indexes) if i < done_count]
+    
+    def _messages_without_apartments(self, messages: List[Dict], apartments_data: List[Dict]) -> List[Dict]:
+        """Các tin nhắn không có apartment nào trong kết quả ([] nếu không xác định được message_id)"""
+        indexes = self._apartment_message_index(messages, apartments_data)
+        if indexes is None:
+            return []
+        found = set(indexes)
+        return [m for i, m in enumerate(messages) if i not in found]
+    
+    def _cache_extraction_results(self, messages: List[Dict], apartments_data: List[Dict], fingerprint: str):
+        """
+        Lưu apartments theo content_hash của từng message (message không có apartment lưu []).
+        Chỉ lưu khi mọi apartment đều có message_id thuộc batch, nếu không thì không biết chắc apartment của message nào.
+        """
+        apartments_by_message = {m['id']: [] for m in messages}
+        for apartment_data in apartments_data:
+            try:
+                message_id = int(apartment_data.get('message_id'))
+            except (TypeError, ValueError):
+                message_id = None
+            if message_id not in apartments_by_message:
+                logger.info("ℹ️ Skipping extraction cache: apartments not mapped to message_id")
+                return
+            apartments_by_message[message_id].append(
+                {key: value for key, value in apartment_data.items() if key != 'message_id'}
+            )
+        
+        entries = {m.get('content_hash'): apartments_by_message[m['id']] for m in messages if m.get('content_hash')}
+        self.extraction_cache.put_many(entries, fingerprint, self.extraction_model)
+    
+    def _pair_apartments_with_messages(self, messages: List[Dict], apartments_data: List[Dict]) -> List[Tuple[int, Dict]]:
+        """
+        Ghép apartment với message: 1 message có thể có nhiều apartments
+        (theo message_id trong response hoặc theo index)
+        
+        Returns:
+            List [(message_id, apartment_data), ...]
+        """
+        message_ids_set = {m['id'] for m in messages}
+        pairs = []
+        for i, apartment_data in enumerate(apartments_data):
+            mid = apartment_data.get('message_id')
+            try:
+                mid = int(mid) if mid is not None else None
+            except (TypeError, ValueError):
+                mid = None
+            if mid is not None and mid in message_ids_set:
+                pairs.append((mid, apartment_data))
+            else:
+                # Fallback: ghép theo index (message i % len(messages))
+                idx = i % len(messages) if messages else 0
+                pairs.append((messages[idx]['id'], apartment_data))
+        return pairs
+    
+    def _keep_leased(self, messages: List[Dict], apartments_data: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Kiểm tra lease trước khi ghi warehouse: message mà worker này không còn giữ lease (hết hạn, đã bị
+        thu hồi/claim lại) bị bỏ ra khỏi batch cùng apartments của nó để không ghi trùng với lần xử lý khác
+        
+        Returns:
+            Tuple (messages còn lease, apartments_data của các message đó)
+        """
+        renewed = self.work_queue.extend_lease(messages)
+        if len(renewed) == len(messages):
+            return messages, apartments_data
+        
+        lost_ids = {m['id'] for m in messages if m['id'] not in renewed}
+        logger.warning(f"⚠️ Dropping {len(lost_ids)} message(s) without lease before warehouse write: {sorted(lost_ids)}")
+        kept_apartments = []
+        for apartment_data in apartments_data:
+            try:
+                message_id = int(apartment_data.get('message_id'))
+            except (TypeError, ValueError):
+                message_id = None
+            if message_id not in lost_ids:
+                kept_apartments.append(apartment_data)
+        return [m for m in messages if m['id'] in renewed], kept_apartments
+    
+    def _store_batch(self, messages: List[Dict], apartments_data: List[Dict],
+                     extraction_failed: Optional[Dict[int, str]] = None) -> Tuple[int, int, Dict[int, str]]:
+        """
+        Insert các apartments đã bóc tách vào warehouse và cập nhật warehouse_id cho messages
+        
+        Args:
+            messages: List các message trong batch
+            apartments_data: List apartments đã parse từ Groq
+            extraction_failed: {message_id: lỗi} của các message bóc tách lỗi (từ _extract_batch)
+            
+        Returns:
+            Tuple (processed_count, error_count, failed) - failed: {message_id: lỗi} để work queue retry,
+            message bóc tách hợp lệ nhưng không có căn nào không nằm trong failed (được đánh dấu DONE)
+        """
+        message_ids = {m['id'] for m in messages}
+        failed = {message_id: error for message_id, error in (extraction_failed or {}).items() if message_id in message_ids}
+        processed_count = 0
+        error_count = len(failed)
+        if not apartments_data:
+            return processed_count, error_count, failed
+        
+        pairs = self._pair_apartments_with_messages(messages, apartments_data)
+        logger.info(f"📊 Parsed {len(apartments_data)} apartment(s), built {len(pairs)} message–apartment pair(s) for {len(messages)} message(s)")
+        
+        # Set data_status='REVIEWING' cho apartment data (giống như API test)
+        for _, apartment_data in pairs:
+            apartment_data['data_status'] = 'REVIEWING'
+        
+        # Ghi toàn bộ apartments của batch trong 1 transaction (tin trùng căn đã có được gộp)
+        apartment_ids = self.insert_apartments([apartment_data for _, apartment_data in pairs],
+                                               source_message_ids=[message_id for message_id, _ in pairs])
+        
+        # Gom các cặp (message_id, apartment_id) insert thành công để cập nhật warehouse_ids 1 lần cho cả batch
+        updates = []
+        for idx, ((message_id, apartment_data), warehouse_result) in enumerate(zip(pairs, apartment_ids)):
+            if warehouse_result and isinstance(warehouse_result, int) and message_id:
+                updates.append((message_id, warehouse_result))
+            elif warehouse_result:
+                logger.warning(f"⚠️ Skipping warehouse_id update: warehouse_result={warehouse_result}, message_id={message_id}")
+                error_count += 1
+            else:
+                logger.error(f"❌ Warehouse insert failed for apartment {idx+1}")
+                error_count += 1
+                failed[message_id] = 'Warehouse insert failed'
+        
+        if updates:
+            logger.info(f"🔄 Attempting to update warehouse_ids for {len(updates)} message–apartment pair(s)")
+            try:
+                with span('back_link'):
+                    updated_message_ids = self.update_messages_warehouse_ids(updates, messages)
+            except Exception as e:
+                logger.error(f"Error updating warehouse_ids for batch: {e}")
+                updated_message_ids = set()
+            
+            for message_id, warehouse_result in updates:
+                if message_id in updated_message_ids:
+                    processed_count += 1
+                else:
+                    logger.error(f"❌ Failed to update warehouse_id {warehouse_result} for message {message_id}")
+                    error_count += 1
+                    failed[message_id] = 'Failed to update warehouse_ids'
+            logger.info(f"✅ Successfully updated warehouse_ids for {len(updated_message_ids)} message(s)")
+        
+        return processed_count, error_count, failed
+    
+    def _finish_claimed_batch(self, messages: List[Dict], failed: Dict[int, str],
+                              duplicates: Optional[Dict[int, List[Dict]]] = None) -> int:
+        """
+        Kết thúc lease của batch đã claim: DONE cho message thành công, FAILED/DEAD cho message lỗi.
+        Sau đó chia sẻ warehouse_ids của message đại diện cho các message gần trùng (duplicates).
+        
+        Returns:
+            int: Số message gần trùng đã dùng chung kết quả của đại diện
+        """
+        with span('ack'):
+            self.work_queue.complete([m['id'] for m in messages if m['id'] not in failed])
+            
+            # Gom message lỗi theo nội dung lỗi để update 1 lần cho mỗi loại lỗi
+            ids_by_error: Dict[str, List[int]] = {}
+            for message_id, error in failed.items():
+                ids_by_error.setdefault(error, []).append(message_id)
+            for error, message_ids in ids_by_error.items():
+                self.work_queue.fail(message_ids, error)
+        MESSAGES_PROCESSED.inc(len(messages) - len(failed), outcome='done')
+        MESSAGES_PROCESSED.inc(len(failed), outcome='failed')
+        
+        if not duplicates:
+            return 0
+        return self._share_with_duplicates(duplicates, failed)
+    
+    def _prepare_claimed(self, messages: List[Dict]) -> Tuple[List[Dict], Dict[int, List[Dict]]]:
+        """
+        Chuẩn bị batch vừa claim: bỏ qua tin không phải tin rao, tách tin gần trùng
+        
+        Returns:
+            Tuple (messages cần bóc tách, {id đại diện: [message gần trùng]})
+        """
+        with span('prepare'):
+            return self._split_near_duplicates(self._skip_non_listings(messages))
+    
+    def _skip_non_listings(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Chấm điểm bằng prefilter (regex + keyword + tên dự án), đánh dấu SKIPPED các tin có score < ngưỡng
+        
+        Returns:
+            List messages được coi là tin rao
+        """
+        if not self.prefilter_enabled or not messages:
+            return messages
+        try:
+            self.listing_prefilter.set_project_names(self.warehouse_service.get_property_group_names())
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load property group names for prefilter: {e}")
+        
+        listings = []
+        skipped = {}
+        for message in messages:
+            is_listing, score = self.listing_prefilter.is_listing(message.get('content'))
+            if is_listing:
+                listings.append(message)
+            else:
+                skipped[message['id']] = score
+        
+        self.prefilter_stats['checked'] += len(messages)
+        if skipped:
+            self.work_queue.skip(skipped)
+            self.prefilter_stats['skipped'] += len(skipped)
+            MESSAGES_PROCESSED.inc(len(skipped), outcome='skipped')
+            logger.info(f"🚫 Prefilter skipped {len(skipped)}/{len(messages)} non-listing message(s)")
+        return listings
+    
+    def _split_near_duplicates(self, messages: List[Dict]) -> Tuple[List[Dict], Dict[int, List[Dict]]]:
+        """
+        Tách các message gần trùng với 1 message đại diện (cùng batch hoặc đã xử lý xong)
+        
+        Returns:
+            Tuple (messages cần bóc tách, {id đại diện: [message gần trùng]})
+        """
+        if not self.near_duplicate_index.enabled or not messages:
+            return messages, {}
+        try:
+            clusters = self.near_duplicate_index.assign_clusters(messages)
+            batch_ids = {m['id'] for m in messages}
+            roots = self.near_duplicate_index.get_roots([rid for rid in set(clusters.values()) if rid not in batch_ids])
+        except Exception as e:
+            logger.error(f"❌ Near-duplicate lookup failed, extracting all messages: {e}")
+            return messages, {}
+        
+        representatives = []
+        duplicates: Dict[int, List[Dict]] = {}
+        for message in messages:
+            root_id = clusters.get(message['id'])
+            # Đại diện ngoài batch chưa xử lý xong thì message tự bóc tách
+            if root_id is not None and (root_id in batch_ids or roots.get(root_id, {}).get('processing_state') == 'DONE'):
+                duplicates.setdefault(root_id, []).append(message)
+            else:
+                representatives.append(message)
+        if duplicates:
+            logger.info(f"🧬 {len(messages) - len(representatives)} near-duplicate message(s) will reuse "
+                        f"results of {len(duplicates)} representative(s)")
+        return representatives, duplicates
+    
+    def _share_with_duplicates(self, duplicates: Dict[int, List[Dict]], failed: Optional[Dict[int, str]] = None) -> int:
+        """
+        Gán warehouse_ids của message đại diện cho các message gần trùng và kết thúc lease của chúng.
+        Đại diện lỗi thì các message gần trùng cũng FAILED để retry sau.
+        
+        Returns:
+            int: Số message gần trùng đã xử lý xong
+        """
+        failed = failed or {}
+        roots = self.near_duplicate_index.get_roots(list(duplicates))
+        duplicate_messages = [m for messages in duplicates.values() for m in messages]
+        duplicate_failed = {}
+        updates = []
+        for root_id, messages in duplicates.items():
+            root = roots.get(root_id)
+            if root_id in failed or not root or root['processing_state'] != 'DONE':
+                error = f"Near-duplicate representative {root_id} not processed: {failed.get(root_id, 'pending')}"
+                duplicate_failed.update({m['id']: error for m in messages})
+                continue
+            for warehouse_id in self._parse_warehouse_ids(root['warehouse_ids']):
+                updates.extend((m['id'], warehouse_id) for m in messages)
+        
+        if updates:
+            updated_message_ids = self.update_messages_warehouse_ids(updates, duplicate_messages)
+            for message_id, _ in updates:
+                if message_id not in updated_message_ids:
+                    duplicate_failed[message_id] = 'Failed to share warehouse_ids from near-duplicate representative'
+        
+        self._finish_claimed_batch(duplicate_messages, duplicate_failed)
+        shared = len(duplicate_messages) - len(duplicate_failed)
+        self.near_duplicate_index.record_shared(shared)
+        logger.info(f"🧬 Shared warehouse_ids with {shared}/{len(duplicate_messages)} near-duplicate message(s)")
+        return shared
+    
     def process_messages_batch(self, limit: int = 20):
         """
         Xử lý một batch tin nhắn (sử dụng batch processing giống như /api/zalo-test/process-message)
@@ -698,97 +1509,184 @@ class ZaloMessageProcessor:
         """
         logger.info(f"Starting message batch processing (limit: {limit})...")
         
-        # Lấy tin nhắn chưa xử lý
-        result = self.get_unprocessed_messages(limit=limit)
-        messages = result.get('messages', []) if isinstance(result, dict) else result
+        # Nhận (lease) tin nhắn chưa xử lý từ work queue
+        messages = self.work_queue.claim(limit=limit)
         
         if not messages:
             logger.info("No unprocessed messages found")
             return 0, 0
         
-        processed_count = 0
-        error_count = 0
+        # Bỏ qua tin không phải tin rao; message gần trùng với message khác chỉ dùng chung kết quả, không gửi Groq
+        started = time.perf_counter()
+        messages, duplicates = self._prepare_claimed(messages)
         
+        processed_count, error_count, failed = 0, 0, {}
         try:
-            logger.info(f"📋 Processing {len(messages)} messages in batch mode")
-            
-            # Tạo prompt cho nhiều messages
-            batch_content = self.create_batch_prompt(messages)
-            logger.info(f"📝 Batch prompt created with {len(messages)} messages")
-            
-            # Gửi tới Groq để bóc tách thông tin cho tất cả messages
-            logger.info("🤖 Processing batch with Groq...")
-            groq_result = self.process_message_with_groq(batch_content)
-            
-            if groq_result:
-                logger.info(f"✅ Groq batch result received")
-                
-                # Parse JSON từ Groq response (expecting array)
-                apartments_data = self.parse_groq_batch_response(groq_result)
-                
-                if apartments_data and len(apartments_data) > 0:
-                    logger.info(f"📊 Parsed {len(apartments_data)} apartment(s) from batch")
-                    logger.info(f"📋 Processing {len(messages)} message(s)")
-                    
-                    # Đảm bảo số lượng apartments khớp với số lượng messages
-                    if len(apartments_data) != len(messages):
-                        logger.warning(f"⚠️ Mismatch: {len(apartments_data)} apartments but {len(messages)} messages")
-                        logger.warning(f"⚠️ Will process {min(len(apartments_data), len(messages))} pairs")
-                    
-                    # Xử lý từng cặp apartment-message
-                    num_to_process = min(len(apartments_data), len(messages))
-                    for i in range(num_to_process):
-                        try:
-                            apartment_data = apartments_data[i]
-                            message_id = messages[i]['id']
-                            
-                            logger.info(f"🏠 Processing apartment {i+1}/{num_to_process} for message {message_id}")
-                            
-                            # Set data_status='REVIEWING' cho apartment data (giống như API test)
-                            apartment_data['data_status'] = 'REVIEWING'
-                            
-                            # Insert vào warehouse database
-                            warehouse_result = self.insert_apartment_via_api(apartment_data)
-                            
-                            if warehouse_result:
-                                logger.info(f"✅ Warehouse insert/update successful for apartment {i+1}")
-                                
-                                # Cập nhật warehouse_id cho tất cả messages cùng content_hash
-                                if isinstance(warehouse_result, int) and message_id:
-                                    logger.info(f"🔄 Attempting to update warehouse_id for message {message_id} to {warehouse_result}")
-                                    
-                                    update_success = self.update_message_warehouse_id(message_id, warehouse_result)
-                                    
-                                    if update_success:
-                                        logger.info(f"✅ Successfully updated warehouse_id for message {message_id}")
-                                        processed_count += 1
-                                    else:
-                                        logger.error(f"❌ Failed to update warehouse_id for message {message_id}")
-                                        error_count += 1
-                                else:
-                                    logger.warning(f"⚠️ Skipping warehouse_id update: warehouse_result={warehouse_result}, message_id={message_id}")
-                                    error_count += 1
-                            else:
-                                logger.error(f"❌ Warehouse insert/update failed for apartment {i+1}")
-                                error_count += 1
-                                
-                        except Exception as e:
-                            logger.error(f"Error processing apartment {i+1} for message {messages[i].get('id', 'unknown')}: {e}")
-                            error_count += 1
-                else:
-                    logger.error("❌ Failed to parse Groq batch response")
-                    error_count = len(messages)  # Tất cả messages đều lỗi
-            else:
-                logger.error("❌ Failed to process batch with Groq")
-                error_count = len(messages)  # Tất cả messages đều lỗi
-                
+            if messages:
+                logger.info(f"📋 Processing {len(messages)} messages in batch mode")
+                _, apartments_data, extraction_failed = self._extract_batch(messages)
+                messages, apartments_data = self._keep_leased(messages, apartments_data)
+                processed_count, error_count, failed = self._store_batch(messages, apartments_data, extraction_failed)
         except Exception as e:
             logger.error(f"❌ Error in batch processing: {e}")
-            error_count = len(messages)  # Tất cả messages đều lỗi
+            processed_count, error_count = 0, len(messages)  # Tất cả messages đều lỗi
+            failed = {m['id']: str(e) for m in messages}
+        
+        processed_count += self._finish_claimed_batch(messages, failed, duplicates)
+        BATCH_DURATION.observe(time.perf_counter() - started)
         
         logger.info(f"Batch processing completed. Processed: {processed_count}, Errors: {error_count}")
         return processed_count, error_count
     
+    def enqueue_new_message(self, message_id: int) -> bool:
+        """
+        Đưa message mới (content_hash chưa từng có) vào micro-batcher để bóc tách ngay
+        
+        Returns:
+            True nếu đã vào hàng đợi, False nếu realtime tắt, processor không chạy hoặc hàng đợi đầy
+            (scheduler sẽ xử lý sau)
+        """
+        if not self.realtime_enabled or not self.is_running or not message_id:
+            return False
+        return self.micro_batcher.submit(message_id)
+    
+    def process_message_ids(self, message_ids: List[int]) -> Tuple[int, int]:
+        """
+        Xử lý 1 batch message theo id (được micro-batcher gọi)
+        Chỉ xử lý các message nhận được lease, message đang được worker khác xử lý sẽ bị bỏ qua
+        
+        Returns:
+            Tuple (processed_count, error_count)
+        """
+        # Processor đã dừng sau khi message vào micro-batcher: để nguyên PENDING, không gọi Groq
+        if not self.is_running:
+            logger.info(f"⏸️ Processor stopped, leaving realtime batch {list(message_ids)} for the scheduler")
+            return 0, 0
+        
+        messages = self.work_queue.claim(message_ids=list(message_ids))
+        if not messages:
+            logger.info(f"No claimable messages in realtime batch {list(message_ids)}")
+            return 0, 0
+        
+        started = time.perf_counter()
+        messages, duplicates = self._prepare_claimed(messages)
+        
+        processed_count, error_count, failed = 0, 0, {}
+        try:
+            if messages:
+                logger.info(f"⚡ Realtime extraction for {len(messages)} message(s)")
+                _, apartments_data, extraction_failed = self._extract_batch(messages)
+                messages, apartments_data = self._keep_leased(messages, apartments_data)
+                processed_count, error_count, failed = self._store_batch(messages, apartments_data, extraction_failed)
+        except Exception as e:
+            logger.error(f"❌ Error in realtime batch: {e}")
+            processed_count, error_count = 0, len(messages)
+            failed = {m['id']: str(e) for m in messages}
+        
+        processed_count += self._finish_claimed_batch(messages, failed, duplicates)
+        BATCH_DURATION.observe(time.perf_counter() - started)
+        logger.info(f"Realtime batch completed. Processed: {processed_count}, Errors: {error_count}")
+        return processed_count, error_count
+    
+    def process_messages_pipeline(self, batch_size: Optional[int] = None, concurrency: Optional[int] = None,
+                                  queue_depth: Optional[int] = None, max_batches: Optional[int] = None) -> Tuple[int, int, int]:
+        """
+        Xử lý tin nhắn chưa xử lý theo kiểu pipeline:
+        - Worker pool gọi Groq song song cho nhiều batch (tối đa `concurrency` request cùng lúc)
+        - Thread hiện tại lấy batch tiếp theo và ghi kết quả các batch đã xong vào warehouse
+        - Tối đa `queue_depth` batch được lấy ra và đang chờ xử lý tại một thời điểm
+        
+        Args:
+            batch_size: Số tin nhắn mỗi prompt (default: ZALO_PROCESSOR_BATCH_SIZE)
+            concurrency: Số request Groq song song (default: ZALO_PROCESSOR_CONCURRENCY)
+            queue_depth: Số batch tối đa đang chờ (default: ZALO_PROCESSOR_QUEUE_DEPTH)
+            max_batches: Giới hạn tổng số batch (None = xử lý tới khi hết tin nhắn)
+            
+        Returns:
+            Tuple (processed_count, error_count, batch_count)
+        """
+        batch_size = batch_size or self.pipeline_batch_size
+        concurrency = max(1, concurrency or self.pipeline_concurrency)
+        queue_depth = max(concurrency, queue_depth or self.pipeline_queue_depth)
+        
+        logger.info(f"🚀 Starting pipeline (batch_size={batch_size}, concurrency={concurrency}, queue_depth={queue_depth})")
+        
+        total_processed = 0
+        total_errors = 0
+        batch_count = 0
+        exhausted = False
+        packed = deque()  # Sub-batch đã claim và chia theo ngân sách token, chờ chỗ trống trong hàng đợi
+        in_flight = {}  # {future: (messages, duplicates, thời điểm đưa vào hàng đợi)}
+        # Gia hạn lease của batch đang chờ/đang gọi Groq trước khi hết hạn (3 lần mỗi chu kỳ lease)
+        renew_interval = max(1.0, self.work_queue.lease_seconds / 3)
+        renewed_at = time.perf_counter()
+        
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='zalo-extract') as executor:
+            while True:
+                # Nạp thêm batch cho tới khi đầy hàng đợi (tính theo sub-batch thực sự gửi Groq)
+                while len(in_flight) < queue_depth:
+                    if packed:
+                        sub_batch, sub_duplicates = packed.popleft()
+                        batch_count += 1
+                        logger.info(f"📥 Queued batch {batch_count} ({len(sub_batch)} messages, last id: {sub_batch[-1]['id']})")
+                        in_flight[executor.submit(self._extract_batch, sub_batch)] = (sub_batch, sub_duplicates, time.perf_counter())
+                        continue
+                    
+                    if exhausted:
+                        break
+                    if max_batches is not None and batch_count >= max_batches:
+                        exhausted = True
+                        break
+                    
+                    # Nhận (lease) batch từ work queue: message đang được worker khác xử lý sẽ bị bỏ qua
+                    messages = self.work_queue.claim(limit=batch_size)
+                    if not messages:
+                        exhausted = True
+                        break
+                    
+                    # Bỏ qua tin không phải tin rao; message gần trùng chờ đại diện của nó (cùng sub-batch) xong rồi dùng chung kết quả
+                    messages, duplicates = self._prepare_claimed(messages)
+                    batch_ids = {m['id'] for m in messages}
+                    external_duplicates = {rid: dups for rid, dups in duplicates.items() if rid not in batch_ids}
+                    if external_duplicates:
+                        total_processed += self._share_with_duplicates(external_duplicates)
+                    
+                    # Chia theo ngân sách token trước để các request chạy song song
+                    for sub_batch in self._pack_messages(messages):
+                        packed.append((sub_batch, {m['id']: duplicates[m['id']] for m in sub_batch if m['id'] in duplicates}))
+                
+                if not in_flight:
+                    break
+                
+                if time.perf_counter() - renewed_at >= renew_interval:
+                    held = []
+                    for sub_batch, sub_duplicates in [entry[:2] for entry in in_flight.values()] + list(packed):
+                        held.extend(sub_batch)
+                        held.extend(m for dups in sub_duplicates.values() for m in dups)
+                    self.work_queue.extend_lease(held)
+                    renewed_at = time.perf_counter()
+                
+                # Ghi kết quả các batch đã có response trong khi các batch khác vẫn đang chạy
+                done, _ = wait(in_flight, timeout=renew_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    messages, duplicates, queued_at = in_flight.pop(future)
+                    try:
+                        _, apartments_data, extraction_failed = future.result()
+                        messages, apartments_data = self._keep_leased(messages, apartments_data)
+                        processed_count, error_count, failed = self._store_batch(messages, apartments_data, extraction_failed)
+                    except Exception as e:
+                        logger.error(f"❌ Error in pipeline batch: {e}")
+                        processed_count, error_count = 0, len(messages)
+                        failed = {m['id']: str(e) for m in messages}
+                    processed_count += self._finish_claimed_batch(messages, failed, duplicates)
+                    BATCH_DURATION.observe(time.perf_counter() - queued_at)
+                    
+                    total_processed += processed_count
+                    total_errors += error_count
+                    logger.info(f"Pipeline batch completed: {processed_count} processed, {error_count} errors ({len(in_flight)} in flight)")
+        
+        return total_processed, total_errors, batch_count
+    
     def run_test_mode(self, limit: int = 50):
         """Chế độ test - chạy một số tin nhắn đầu để thử"""
         logger.info(f"🧪 Running in TEST mode - processing {limit} messages")
@@ -804,7 +1702,7 @@ class ZaloMessageProcessor:
     
     def get_message_by_id(self, message_id: int) -> Optional[Dict]:
         """
-        Lấy tin nhắn theo ID
+        Lấy tin nhắn theo ID (nhiều ID thì dùng message_repository.get_messages_by_ids)
         
         Args:
             message_id: ID của tin nhắn cần lấy
@@ -812,43 +1710,13 @@ class ZaloMessageProcessor:
         Returns:
             Dict chứa thông tin tin nhắn hoặc None nếu không tìm thấy
         """
-        try:
-            logger.info(f"🔍 Fetching message with ID: {message_id}")
-            
-            with zalo_app.app_context():
-                connection = self.get_zalo_db_connection()
-                if not connection:
-                    logger.error("❌ No database connection available")
-                    return None
-                
-                from sqlalchemy import text
-                
-                query = text("""
-                SELECT id, session_id, config_id, sender_id, sender_name, 
-                       content, thread_id, thread_type, received_at, 
-                       status_push_kafka, warehouse_ids, reply_quote,
-                       content_hash, added_document_chunks
-                FROM zalo_received_messages 
-                WHERE id = :message_id
-                """)
-                
-                result = connection.execute(query, {"message_id": message_id})
-                row = result.fetchone()
-                
-                if row:
-                    message_data = dict(row._mapping)
-                    logger.info(f"✅ Found message {message_id}: {message_data.get('content', '')[:100]}...")
-                    return message_data
-                else:
-                    logger.warning(f"❌ Message with ID {message_id} not found")
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"❌ Error fetching message {message_id}: {e}")
-            return None
-        finally:
-            if connection:
-                connection.close()
+        logger.info(f"🔍 Fetching message with ID: {message_id}")
+        message_data = self.message_repository.get_messages_by_ids([message_id]).get(message_id)
+        if message_data:
+            logger.info(f"✅ Found message {message_id}: {(message_data.get('content') or '')[:100]}...")
+        else:
+            logger.warning(f"❌ Message with ID {message_id} not found")
+        return message_data
     
     def run_test_one_mode(self, message_id: int, real_insert: bool = False):
         """
@@ -881,10 +1749,15 @@ class ZaloMessageProcessor:
             else:
                 logger.info(f"🆕 Message has no warehouse_ids - will create new")
             
-            # Gửi tới Groq để bóc tách thông tin
-            logger.info("🤖 Processing with Groq...")
-            groq_result = self.process_message_with_groq(content)
-            
+            # Dùng kết quả đã cache theo content_hash nếu có, không thì gửi tới Groq để bóc tách thông tin
+            content_hash = message.get('content_hash')
+            cached_apartments = self.extraction_cache.get_many([content_hash], self.get_extraction_fingerprint()).get(content_hash)
+            if cached_apartments:
+                logger.info(f"♻️ Using cached extraction result ({len(cached_apartments)} apartment(s))")
+                groq_result = json.dumps(cached_apartments[0], ensure_ascii=False)
+            else:
+                logger.info("🤖 Processing with Groq...")
+                groq_result = self.process_message_with_groq(content)
             
             if groq_result:
                 logger.info(f"✅ Groq result: {groq_result}")
@@ -983,31 +1856,17 @@ class ZaloMessageProcessor:
             logger.error(f"❌ Error in test-one mode: {e}")
             return None, str(e)
     
-    def run_batch_mode(self):
-        """Chế độ batch - chạy tất cả tin nhắn từ trước đến nay"""
+    def run_batch_mode(self, batch_size: Optional[int] = None, concurrency: Optional[int] = None, queue_depth: Optional[int] = None):
+        """Chế độ batch - chạy tất cả tin nhắn từ trước đến nay (pipeline nhiều batch song song)"""
         logger.info("📦 Running in BATCH mode - processing ALL unprocessed messages")
         
-        total_processed = 0
-        total_errors = 0
-        batch_size = 100  # Xử lý từng batch 100 tin nhắn
-        batch_count = 0
-        
         start_time = time.time()
         
-        while True:
-            batch_count += 1
-            logger.info(f"Processing batch {batch_count} (size: {batch_size})")
-            
-            processed_count, error_count = self.process_messages_batch(limit=batch_size)
-            
-            total_processed += processed_count
-            total_errors += error_count
-            
-            # Nếu không có tin nhắn nào được xử lý, dừng lại
-            if processed_count == 0:
-                break
-                
-            logger.info(f"Batch {batch_count} completed: {processed_count} processed, {error_count} errors")
+        total_processed, total_errors, batch_count = self.process_messages_pipeline(
+            batch_size=batch_size,
+            concurrency=concurrency,
+            queue_depth=queue_depth
+        )
         
         elapsed_time = time.time() - start_time
         
@@ -1121,65 +1980,50 @@ class ZaloMessageProcessor:
         start_time = time.time()
         
         try:
-            # Lấy tất cả messages theo IDs
-            messages = []
-            for message_id in message_ids:
-                message = self.get_message_by_id(message_id)
-                if message:
-                    messages.append(message)
-                else:
-                    logger.warning(f"❌ Message with ID {message_id} not found")
+            # Lấy tất cả messages theo IDs bằng 1 query, các bước sau dùng lại cùng các object này
+            message_ids = [int(message_id) for message_id in message_ids]
+            loaded_messages = self.message_repository.identity_map()
+            messages = loaded_messages.get_many(message_ids)
+            missing_ids = [message_id for message_id in message_ids if message_id not in loaded_messages]
+            if missing_ids:
+                logger.warning(f"❌ Messages not found: {missing_ids}")
             
             if not messages:
                 return None, "No valid messages found"
             
             logger.info(f"✅ Found {len(messages)} valid messages out of {len(message_ids)} requested")
             
-            # Tạo prompt cho nhiều messages
-            batch_content = self.create_batch_prompt(messages)
-            logger.info(f"📝 Batch prompt created with {len(messages)} messages")
-            
-            # Gửi tới Groq để bóc tách thông tin cho tất cả messages
+            # Gửi tới Groq để bóc tách thông tin (messages đã có trong extraction cache không gửi lại)
             logger.info("🤖 Processing batch with Groq...")
-            groq_result = self.process_message_with_groq(batch_content)
-            print('groq_result', groq_result)
+            groq_result, apartments_data, _ = self._extract_batch(messages)
             
-            if groq_result:
-                logger.info(f"✅ Groq batch result received")
-                
-                # Parse JSON từ Groq response (expecting array)
-                apartments_data = self.parse_groq_batch_response(groq_result)
-                
+            if groq_result or apartments_data:
+                logger.info(f"✅ Batch extraction result received")
                 
                 if apartments_data and len(apartments_data) > 0:
                     logger.info(f"📊 Parsed {len(apartments_data)} apartment(s) from batch")
                     logger.info(f"📋 Processing {len(messages)} message(s)")
                     
                     # Ghép apartment với message: 1 message có thể có nhiều apartments (theo message_id trong response hoặc theo index)
-                    message_ids_set = {m['id'] for m in messages}
-                    pairs = []  # [(message_id, apartment_data), ...]
-                    for i, apartment_data in enumerate(apartments_data):
-                        mid = apartment_data.get('message_id')
-                        if mid is not None and mid in message_ids_set:
-                            pairs.append((int(mid), apartment_data))
-                        else:
-                            # Fallback: ghép theo index (message i % len(messages))
-                            idx = i % len(messages) if messages else 0
-                            pairs.append((messages[idx]['id'], apartment_data))
+                    pairs = self._pair_apartments_with_messages(messages, apartments_data)
                     logger.info(f"📋 Built {len(pairs)} message–apartment pair(s) (1 message → nhiều apartment được hỗ trợ)")
                     
                     # Insert/update vào warehouse database cho từng apartment
                     results = []
                     warehouse_ids = []
                     
-                    for idx, (message_id, apartment_data) in enumerate(pairs):
-                        logger.info(f"🏠 Processing apartment {idx+1}/{len(pairs)} for message {message_id}")
-                        
-                        # Set data_status='REVIEWING' cho apartment data
+                    # Set data_status='REVIEWING' cho apartment data
+                    for _, apartment_data in pairs:
                         apartment_data['data_status'] = 'REVIEWING'
-                        
-                        # Insert vào warehouse database
-                        warehouse_result = self.insert_apartment_via_api(apartment_data)
+                    
+                    # Ghi toàn bộ apartments của batch trong 1 transaction (tin trùng căn đã có được gộp)
+                    apartment_ids = self.insert_apartments([apartment_data for _, apartment_data in pairs],
+                                                           source_message_ids=[message_id for message_id, _ in pairs])
+                    
+                    current_ids_by_message = {}
+                    updates = []
+                    for idx, ((message_id, apartment_data), warehouse_result) in enumerate(zip(pairs, apartment_ids)):
+                        logger.info(f"🏠 Processing apartment {idx+1}/{len(pairs)} for message {message_id}")
                         
                         apartment_result = {
                             'message_id': message_id,
@@ -1197,13 +2041,13 @@ class ZaloMessageProcessor:
                             apartment_result['warehouse_success'] = True
                             apartment_result['apartment_id'] = warehouse_result if isinstance(warehouse_result, int) else None
                             
-                            # Luôn cập nhật warehouse_id sau khi insert thành công
+                            # Luôn cập nhật warehouse_id sau khi insert thành công (gom lại, update 1 lần cho cả batch)
                             if isinstance(warehouse_result, int) and message_id:
-                                logger.info(f"🔄 Attempting to update warehouse_id for message {message_id} to {warehouse_result}")
-                                
-                                # Kiểm tra message đã có warehouse_ids chưa
-                                current_message = self.get_message_by_id(message_id)
-                                current_warehouse_ids = self._parse_warehouse_ids(current_message.get('warehouse_ids') if current_message else None)
+                                # Kiểm tra message đã có warehouse_ids chưa (dùng dữ liệu đã load, cộng dồn trong batch)
+                                message = loaded_messages.get(message_id) or {}
+                                current_warehouse_ids = current_ids_by_message.setdefault(
+                                    message_id, self._parse_warehouse_ids(message.get('warehouse_ids'))
+                                )
                                 current_warehouse_id = current_warehouse_ids[0] if current_warehouse_ids else None
                                 if current_warehouse_ids:
                                     logger.info(f"🔄 Adding to existing warehouse_ids {current_warehouse_ids} for message {message_id}")
@@ -1211,14 +2055,8 @@ class ZaloMessageProcessor:
                                     apartment_result['previous_warehouse_id'] = current_warehouse_id
                                 else:
                                     logger.info(f"🆕 Setting warehouse_ids to [{warehouse_result}] for message {message_id}")
-                                
-                                update_success = self.update_message_warehouse_id(message_id, warehouse_result)
-                                
-                                if update_success:
-                                    logger.info(f"✅ Successfully updated warehouse_id for message {message_id}")
-                                    warehouse_ids.append(warehouse_result)
-                                else:
-                                    logger.error(f"❌ Failed to update warehouse_id for message {message_id}")
+                                current_warehouse_ids.append(warehouse_result)
+                                updates.append((message_id, warehouse_result))
                             else:
                                 logger.warning(f"⚠️ Skipping warehouse_id update: warehouse_result={warehouse_result}, message_id={message_id}")
                         else:
@@ -1226,6 +2064,18 @@ class ZaloMessageProcessor:
                         
                         results.append(apartment_result)
                     
+                    if updates:
+                        logger.info(f"🔄 Attempting to update warehouse_ids for {len(updates)} message–apartment pair(s)")
+                        updated_message_ids = self.update_messages_warehouse_ids(updates, messages)
+                        for message_id, warehouse_result in updates:
+                            if message_id in updated_message_ids:
+                                warehouse_ids.append(warehouse_result)
+                            else:
+                                logger.error(f"❌ Failed to update warehouse_id {warehouse_result} for message {message_id}")
+                        # Đồng bộ warehouse_ids của message đã load với DB thay vì đọc lại
+                        for message_id in updated_message_ids:
+                            loaded_messages.update(message_id, warehouse_ids=json.dumps(current_ids_by_message[message_id]))
+                    
                     # Load full apartment data: lấy đủ bản ghi tương ứng số apartment đã insert (giữ thứ tự, bỏ trùng)
                     apartment_ids_to_load = []
                     seen = set()
@@ -1302,7 +2152,8 @@ class ZaloMessageProcessor:
     
     def parse_groq_batch_response(self, groq_response: str) -> List[Dict]:
         """
-        Parse Groq response cho batch processing (expecting JSON array or single object)
+        Parse Groq response cho batch processing (expecting JSON array or single object).
+        Nếu array lỗi thì vẫn lấy các object hoàn chỉnh trong response.
         
         Args:
             groq_response: Response từ Groq
@@ -1338,30 +2189,13 @@ class ZaloMessageProcessor:
                     except json.JSONDecodeError as e:
                         logger.debug(f"Failed to parse as array: {e}")
             
-            # Nếu không tìm thấy array, thử tìm single JSON object { ... }
-            object_start = response_clean.find('{')
-            if object_start != -1:
-                # Tìm closing brace bằng cách đếm balanced braces
-                brace_count = 0
-                object_end = -1
-                for i in range(object_start, len(response_clean)):
-                    if response_clean[i] == '{':
-                        brace_count += 1
-                    elif response_clean[i] == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            object_end = i
-                            break
-                
-                if object_end != -1:
-                    json_str = response_clean[object_start:object_end + 1]
-                    try:
-                        apartment = json.loads(json_str)
-                        if isinstance(apartment, dict):
-                            logger.info(f"✅ Parsed 1 apartment from batch response (single object format, wrapped in array)")
-                            return [apartment]  # Wrap single object in array
-                    except json.JSONDecodeError as e:
-                        logger.debug(f"Failed to parse as object: {e}")
+            # Không parse được cả array (không có array, bị cắt cụt hoặc 1 phần tử lỗi):
+            # lấy từng object hoàn chỉnh, bỏ qua object lỗi
+            apartments, errors = parse_json_objects(response_clean)
+            if apartments:
+                logger.info(f"✅ Salvaged {len(apartments)} apartments from batch response "
+                            f"({len(errors)} malformed object(s) skipped)")
+                return apartments
             
             # Nếu cả hai đều không thành công, log lỗi chi tiết
             logger.error("❌ No valid JSON array or object found in Groq response")
@@ -1385,7 +2219,18 @@ class ZaloMessageProcessor:
             'interval': self.interval,
             'interval_minutes': self.interval // 60,
             'schedule_enabled': self.schedule_enabled,  # Chỉ là giá trị mặc định từ env
-            'started_at': getattr(self, 'started_at', None)
+            'started_at': getattr(self, 'started_at', None),
+            'realtime_enabled': self.realtime_enabled,
+            'realtime_active': self.realtime_enabled and self.is_running,
+            'realtime': self.micro_batcher.get_stats(),
+            'batch_sizing': self.batch_sizer.get_info(),
+            'extraction_cache': self.extraction_cache.get_stats(),
+            'extraction_mode': self.extraction_mode,
+            'llm_gateway': self.llm_gateway.get_stats(),
+            'near_duplicates': self.near_duplicate_index.get_stats(),
+            'prefilter': dict(self.prefilter_stats, enabled=self.prefilter_enabled,
+                              threshold=self.listing_prefilter.threshold),
+            'metrics': metrics.snapshot()
         }
 
 
@@ -1395,12 +2240,19 @@ zalo_processor = ZaloMessageProcessor()
 def main():
     """Main function với command line arguments"""
     parser = argparse.ArgumentParser(description='Zalo Message Processor Service')
-    parser.add_argument('--mode', choices=['test', 'test-one', 'batch', 'scheduler'], default='scheduler',
-                       help='Chế độ chạy: test (50 tin nhắn), test-one (1 tin nhắn theo ID), batch (tất cả), scheduler (định kỳ)')
+    parser.add_argument('--mode', choices=['test', 'test-one', 'batch', 'scheduler', 'backfill-near-dup'], default='scheduler',
+                       help='Chế độ chạy: test (50 tin nhắn), test-one (1 tin nhắn theo ID), batch (tất cả), scheduler (định kỳ), '
+                            'backfill-near-dup (index MinHash cho tin nhắn cũ, --limit tin nhắn mỗi lần)')
     parser.add_argument('--limit', type=int, default=50,
                        help='Số lượng tin nhắn cho chế độ test (default: 50)')
     parser.add_argument('--message-id', type=int,
                        help='ID của tin nhắn cần test (chỉ dùng với mode test-one)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                       help='Số tin nhắn mỗi prompt cho chế độ batch (default: ZALO_PROCESSOR_BATCH_SIZE)')
+    parser.add_argument('--concurrency', type=int, default=None,
+                       help='Số request Groq chạy song song cho chế độ batch (default: ZALO_PROCESSOR_CONCURRENCY)')
+    parser.add_argument('--queue-depth', type=int, default=None,
+                       help='Số batch tối đa đang chờ xử lý cho chế độ batch (default: ZALO_PROCESSOR_QUEUE_DEPTH)')
     
     args = parser.parse_args()
     
@@ -1424,7 +2276,22 @@ def main():
             
         elif args.mode == 'batch':
             logger.info("📦 Starting ZaloMessageProcessor in BATCH mode")
-            zalo_processor.run_batch_mode()
+            zalo_processor.run_batch_mode(
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                queue_depth=args.queue_depth
+            )
+            
+        elif args.mode == 'backfill-near-dup':
+            logger.info(f"🧬 Backfilling near-duplicate index ({args.limit} messages per round)")
+            total, last_id = 0, 0
+            while True:
+                count, last_id = zalo_processor.near_duplicate_index.backfill(limit=args.limit, after_id=last_id)
+                if not count:
+                    break
+                total += count
+                logger.info(f"🧬 Indexed {total} message(s) (last id: {last_id})")
+            logger.info(f"✅ Backfill completed: {total} message(s), {zalo_processor.near_duplicate_index.get_stats()}")
             
         elif args.mode == 'scheduler':
             logger.info("⏰ Starting ZaloMessageProcessor in SCHEDULER mode")
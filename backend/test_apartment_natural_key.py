@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Test natural key - các tin rao cùng 1 căn cho ra cùng 1 khóa
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.apartment_natural_key import natural_key, normalize_floor
+
+
+def test_same_unit_same_key():
+    """Mã căn khác cách viết, trục có số 0 đứng đầu, tầng dạng chữ vẫn ra cùng khóa"""
+    a = {'property_group': 12, 'listing_type': 'CAN_BAN', 'unit_code': 'a1-12.05'}
+    b = {'property_group': '12', 'listing_type': 'CAN_BAN', 'unit_code': 'A1 1205', 'price': 3.2}
+    assert natural_key(a) == natural_key(b) == '12|sale|code:A11205'
+
+    c = {'property_group': 12, 'listing_type': 'CAN_CHO_THUE', 'unit_axis': '05', 'unit_floor_number': 'tầng 12'}
+    d = {'property_group': 12, 'price_rent': 15, 'unit_axis': '5', 'unit_floor_number': 12}
+    assert natural_key(c) == natural_key(d) == '12|rent|axis:5|floor:12'
+    print("✓ Same unit, same key")
+
+
+def test_no_key_when_ambiguous():
+    """Không đủ thông tin để chắc chắn cùng 1 căn thì không có khóa (insert dòng mới)"""
+    assert natural_key({'property_group': 1, 'listing_type': 'CAN_BAN', 'unit_code': 'A1'}) is None
+    assert natural_key({'property_group': None, 'listing_type': 'CAN_BAN', 'unit_code': 'A1'}) is None
+    assert natural_key({'property_group': 12, 'listing_type': 'CAN_MUA', 'unit_code': 'A1'}) is None
+    assert natural_key({'property_group': 12, 'unit_code': 'A1'}) is None
+    assert natural_key({'property_group': 12, 'listing_type': 'CAN_BAN', 'unit_axis': '05'}) is None
+    assert natural_key({'property_group': 12, 'listing_type': 'CAN_BAN', 'unit_code': ' - '}) is None
+    assert normalize_floor('12-15') is None and normalize_floor(True) is None
+    print("✓ No key when ambiguous")
+
+
+def test_sale_and_rent_are_different():
+    """Tin bán và tin cho thuê cùng 1 căn là 2 dòng khác nhau"""
+    sale = {'property_group': 12, 'listing_type': 'CAN_BAN', 'unit_code': 'A1205'}
+    rent = dict(sale, listing_type='CAN_CHO_THUE')
+    assert natural_key(sale) != natural_key(rent)
+    print("✓ Sale and rent are different")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test natural key...\n")
+    test_same_unit_same_key()
+    test_no_key_when_ambiguous()
+    test_sale_and_rent_are_different()
+    print("\n✅ All tests passed")
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Test search_text - tìm kiếm không phân biệt dấu, mã căn gõ tách hay liền đều khớp
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.apartment_search_text import build_search_query, build_search_text
+
+
+def test_build_search_text():
+    """Bỏ dấu, chữ thường, mã căn có cả dạng tách và viết liền"""
+    text = build_search_text(
+        {'unit_code': 'A1-12.05', 'unit_axis': '05', 'notes': 'Căn góc, view hồ, đã có sổ đỏ'},
+        property_group_names=['Vinhomes Smart City', 'Tòa S1.02'],
+        unit_type_name='2PN1WC'
+    )
+    assert text == 'a1 12 05 a11205 05 vinhomes smart city toa s1 02 2pn1wc can goc view ho da co so do'
+    assert build_search_text({}) == ''
+    print("✓ Build search text")
+
+
+def test_build_search_query():
+    """Mọi từ đều bắt buộc, bỏ từ ngắn hơn ngram và ký tự đặc biệt của BOOLEAN MODE"""
+    assert build_search_query('Vịnhomes  SMART') == '+vinhomes +smart'
+    assert build_search_query('a1-12.05') == '+a1 +12 +05'
+    assert build_search_query('"căn" -góc*') == '+can +goc'
+    assert build_search_query('a') is None
+    assert build_search_query('  ') is None
+    print("✓ Build search query")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test search text...\n")
+    test_build_search_text()
+    test_build_search_query()
+    print("\n✅ All tests passed")
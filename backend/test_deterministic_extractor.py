@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Test deterministic extractor - bóc tách giá, diện tích, số phòng, tầng, hướng, SĐT bằng regex
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.deterministic_extractor import extract_structured_fields, normalize_phone
+
+
+def test_sale_listing():
+    """Giá tỷ là giá bán, diện tích không ghi loại là tim tường, hướng không ghi loại là cửa chính"""
+    fields, ambiguous = extract_structured_fields(
+        "Bán căn 2PN2WC 68m2 giá 4 tỷ 1, tầng 12 hướng Đông Nam, ban công Tây Bắc. LH 0912.345.678")
+    assert ambiguous == []
+    assert fields['price'] == 4_100_000_000 and fields['price_rent'] is None
+    assert fields['area_gross'] == 68.0
+    assert fields['num_bedrooms'] == 2 and fields['num_bathrooms'] == 2
+    assert fields['unit_floor_number'] == 12
+    assert fields['direction_door'] == 'DN' and fields['direction_balcony'] == 'TB'
+    assert fields['phone_number'] == '0912345678'
+    print("✓ Sale listing")
+
+
+def test_rent_listing():
+    """Giá triệu là giá thuê, viết tắt 8tr5 / tc 7tr5"""
+    fields, _ = extract_structured_fields("Cho thuê 1PN 45m2 full đồ 8tr5/tháng LH +84 988 123 456")
+    assert fields['price_rent'] == 8_500_000 and fields['price'] is None
+    assert fields['phone_number'] == '0988123456'
+    fields, _ = extract_structured_fields("Cần thuê studio tc 7tr5, diện tích thông thủy 30,5m2")
+    assert fields['price_rent'] == 7_500_000
+    assert fields['area_net'] == 30.5 and fields['area_gross'] is None
+    assert extract_structured_fields("giá 6ty8")[0]['price'] == 6_800_000_000
+    assert extract_structured_fields("giá 2 tỷ 950")[0]['price'] == 2_950_000_000
+    print("✓ Rent listing")
+
+
+def test_ambiguous_and_empty():
+    """Tin nhiều căn có nhiều giá khác nhau bị đánh dấu mơ hồ, tầng 1x không phải số tầng"""
+    fields, ambiguous = extract_structured_fields("Quỹ căn: 1PN 6tr, 2PN 9tr. Ib 0911888999 hoặc 0866111222")
+    assert 'price_rent' in ambiguous and 'num_bedrooms' in ambiguous
+    assert 'phone_number' not in ambiguous and fields['phone_number'] == '0911888999'
+    assert extract_structured_fields("căn tầng 1x view hồ")[0]['unit_floor_number'] is None
+    assert extract_structured_fields("nhà đẹp năm 2020")[0]['direction_door'] is None
+    fields, ambiguous = extract_structured_fields(None)
+    assert all(value is None for value in fields.values()) and ambiguous == []
+    assert normalize_phone('+84 912-345-678') == '0912345678'
+    print("✓ Ambiguous and empty")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test deterministic extractor...\n")
+    test_sale_listing()
+    test_rent_listing()
+    test_ambiguous_and_empty()
+    print("\n✅ All tests passed")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test identity map - mỗi id chỉ load 1 lần trong phạm vi 1 batch
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.identity_map import IdentityMap
+
+
+def make_loader(rows):
+    calls = []
+
+    def loader(ids):
+        calls.append(list(ids))
+        return {i: dict(rows[i]) for i in ids if i in rows}
+
+    return loader, calls
+
+
+def test_loads_only_missing_ids():
+    """get_many() giữ thứ tự, bỏ id trùng, chỉ load id chưa có (kể cả id không tồn tại cũng không load lại)"""
+    loader, calls = make_loader({1: {'id': 1}, 2: {'id': 2}, 3: {'id': 3}})
+    identity_map = IdentityMap(loader)
+    assert [m['id'] for m in identity_map.get_many([3, 1, 3, 99])] == [3, 1]
+    assert [m['id'] for m in identity_map.get_many([1, 2, 99])] == [1, 2]
+    assert identity_map.get(3)['id'] == 3 and identity_map.get(99) is None
+    assert calls == [[3, 1, 99], [2]]
+    assert identity_map.loads == 2 and len(identity_map) == 3
+    assert 99 not in identity_map and 2 in identity_map
+    print("✓ Loads only missing ids")
+
+
+def test_same_object_and_update():
+    """Các lần lấy trả về cùng 1 object, update() sửa record đã load"""
+    loader, calls = make_loader({7: {'id': 7, 'warehouse_ids': None}})
+    identity_map = IdentityMap(loader)
+    message = identity_map.get(7)
+    identity_map.update(7, warehouse_ids='[10]')
+    identity_map.update(8, warehouse_ids='[11]')
+    assert identity_map.get(7) is message and message['warehouse_ids'] == '[10]'
+    assert calls == [[7]]
+    print("✓ Same object and update")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test identity map...\n")
+    test_loads_only_missing_ids()
+    test_same_object_and_update()
+    print("\n✅ All tests passed")
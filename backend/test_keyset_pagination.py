@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test keyset pagination (cursor) và TTLCache
+"""
+
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.keyset_pagination import encode_cursor, decode_cursor, keyset_condition
+from utils.ttl_cache import TTLCache
+
+
+def test_cursor_roundtrip():
+    """Test encode/decode cursor"""
+    received_at = datetime(2024, 5, 1, 10, 30, 15)
+    cursor = encode_cursor(received_at, 123)
+    assert decode_cursor(cursor) == (received_at, 123)
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+    print("✓ Cursor encode/decode")
+
+    try:
+        decode_cursor('not-a-cursor')
+        assert False, "Cursor không hợp lệ phải raise ValueError"
+    except ValueError:
+        print("✓ Cursor không hợp lệ bị từ chối")
+
+
+def test_keyset_condition():
+    """Test điều kiện WHERE sinh ra từ cursor"""
+    params = {}
+    assert keyset_condition('received_at', 'id', None, True, params) is None
+    assert params == {}
+
+    cursor = encode_cursor(datetime(2024, 5, 1), 10)
+    condition = keyset_condition('received_at', 'id', cursor, True, params)
+    assert 'received_at < :cursor_value' in condition
+    assert 'id < :cursor_id' in condition
+    assert 'received_at IS NULL' in condition
+    assert params == {'cursor_value': datetime(2024, 5, 1), 'cursor_id': 10}
+    print(f"✓ DESC: {condition}")
+
+    params = {}
+    condition = keyset_condition('received_at', 'id', cursor, False, params)
+    assert 'received_at > :cursor_value' in condition
+    assert 'IS NULL' not in condition
+    print(f"✓ ASC: {condition}")
+
+    params = {}
+    condition = keyset_condition('received_at', 'id', encode_cursor(None, 5), True, params)
+    assert condition == "(received_at IS NULL AND id < :cursor_id)"
+    print(f"✓ DESC với cursor NULL: {condition}")
+
+
+def test_ttl_cache():
+    """Test TTLCache"""
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return 42
+
+    cache = TTLCache(ttl=60)
+    assert cache.get_or_load('total', loader) == 42
+    assert cache.get_or_load('total', loader) == 42
+    assert len(calls) == 1
+
+    cache.invalidate()
+    assert cache.get_or_load('total', loader) == 42
+    assert len(calls) == 2
+    print(f"✓ TTLCache: {cache.get_info()}")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test keyset pagination...\n")
+    test_cursor_roundtrip()
+    test_keyset_condition()
+    test_ttl_cache()
+    print("\n✅ All tests passed")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test ListingPrefilter - phân loại nhanh tin rao căn hộ trước khi gửi Groq
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.listing_prefilter import KeywordTrie, ListingPrefilter
+from utils.text_normalize import normalize_message_text
+
+
+def test_keyword_trie():
+    """Trie tìm cụm nhiều từ trên nội dung không dấu"""
+    trie = KeywordTrie(['cho thuê', 'căn hộ', 'Vinhomes Ocean Park'])
+    tokens = normalize_message_text("CHO THUÊ căn hộ tại Vinhomes Ocean Park").split()
+    assert trie.find_all(tokens) == ['can ho', 'cho thue', 'vinhomes ocean park']
+    assert trie.find_all(['ocean', 'park']) == []
+    print("✓ Keyword trie")
+
+
+def test_classify():
+    """Tin rao có điểm cao, tin chào hỏi/tuyển dụng có điểm thấp"""
+    prefilter = ListingPrefilter(project_names=['Vinhomes Ocean Park', 'A'], threshold=0.35)
+    listing, listing_score = prefilter.is_listing(
+        "🔥 Cho thuê căn hộ 2PN Vinhomes Ocean Park, S1.05 tầng 12, full đồ, giá 8tr/tháng. LH 0912345678")
+    assert listing and listing_score > 0.9
+    assert prefilter.features("Studio 30m2, 6.5tr")['area'] == 1.0
+    for content in ["Chào cả nhà ạ", "ok anh", "Hỗ trợ vay vốn ngân hàng lãi suất thấp, ib em", ""]:
+        is_listing, score = prefilter.is_listing(content)
+        assert not is_listing, (content, score)
+    # Tên dự án quá ngắn ('A') không được dùng để khớp
+    assert prefilter.features("a b c")['project'] == 0.0
+    print(f"✓ Classify (listing score: {listing_score:.3f})")
+
+
+def test_evaluate_and_fit():
+    """Precision/recall và học lại trọng số"""
+    samples = [
+        ("Cho thuê 2PN tầng 12 giá 8tr LH 0912345678", True),
+        ("Bán căn 3PN 95m2 giá 4 tỷ", True),
+        ("Chào cả nhà", False),
+        ("Cảm ơn mọi người", False),
+    ]
+    prefilter = ListingPrefilter(threshold=0.35)
+    report = prefilter.evaluate(samples)
+    assert report['tp'] + report['fn'] == 2 and report['tn'] + report['fp'] == 2
+    assert report['recall'] == 1.0
+    weights = prefilter.fit(samples, epochs=50)
+    assert set(weights) == set(prefilter.weights)
+    assert prefilter.evaluate(samples)['f1'] == 1.0
+    print(f"✓ Evaluate: {report}")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test listing prefilter...\n")
+    test_keyword_trie()
+    test_classify()
+    test_evaluate_and_fit()
+    print("\n✅ All tests passed")
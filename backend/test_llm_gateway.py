@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test LLM gateway - ngân sách rpm/tpm, failover khi 429 và hedge request chậm (chạy offline với StubProvider)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.llm_gateway import LLMGateway, LLMUnavailableError, ModelBudget, StubProvider, StubStatusError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_gateway(**attrs):
+    gateway = LLMGateway()
+    gateway.providers['stub'] = StubProvider(responder=lambda model, messages: f'{{"model": "{model}"}}')
+    gateway.default_provider = 'stub'
+    gateway.fallbacks = {'primary': ['backup']}
+    gateway.limits = {}
+    gateway.default_rpm = gateway.default_tpm = 0
+    gateway.hedge_after = 0
+    for name, value in attrs.items():
+        setattr(gateway, name, value)
+    return gateway
+
+
+def test_budget_window():
+    """Vượt rpm/tpm thì phải chờ tới khi request cũ ra khỏi cửa sổ 60s, 429 thì cooldown"""
+    clock = FakeClock()
+    budget = ModelBudget(rpm=2, tpm=1000, clock=clock)
+    assert budget.acquire(400) is not None
+    clock.now += 10
+    reservation = budget.acquire(400)
+    assert reservation is not None
+    assert budget.acquire(100) is None
+    assert budget.wait_time(100) == 50.0
+    clock.now += 51
+    budget.settle(reservation, 900)
+    assert budget.wait_time(200) == 9.0
+    clock.now += 10
+    assert budget.wait_time(200) == 0
+    budget.cooldown(5)
+    assert budget.wait_time(0) == 5.0
+    print(f"✓ Budget window: {budget.get_info()}")
+
+
+def test_failover_on_rate_limit():
+    """Model chính 429 thì chuyển model dự phòng, cooldown model chính theo retry-after"""
+    gateway = make_gateway()
+    stub = gateway.providers['stub']
+    stub.fail_next('primary', StubStatusError(429, retry_after=30))
+    served, completion = gateway.create_completion('primary', [{'role': 'user', 'content': 'hi'}])
+    assert served == 'backup' and 'backup' in completion.choices[0].message.content
+    assert gateway.budget('primary').wait_time(0) > 29
+    # Model chính đang cooldown nên request tiếp theo đi thẳng sang model dự phòng
+    served, _ = gateway.create_completion('primary', [{'role': 'user', 'content': 'hi'}])
+    assert served == 'backup' and stub.calls == ['primary', 'backup', 'backup']
+    stats = gateway.get_stats()['models']
+    assert stats['primary']['rate_limited'] == 1 and stats['backup']['failovers'] == 2
+
+    stub.fail_next('other', StubStatusError(401))
+    try:
+        gateway.create_completion('other', [{'role': 'user', 'content': 'hi'}], fallbacks=['backup'])
+        assert False, "401 must not fail over"
+    except LLMUnavailableError:
+        pass
+    print("✓ Failover on rate limit")
+
+
+def test_stream_and_hedge():
+    """Stream trả chunk giống groq SDK; request chậm được hedge sang model dự phòng"""
+    gateway = make_gateway()
+    text = ''.join(gateway.stream_text('primary', [{'role': 'user', 'content': 'hi'}]))
+    assert text == '{"model": "primary"}'
+
+    gateway = make_gateway(hedge_after=0.05)
+    gateway.providers['stub'].latency = {'primary': 0.5}
+    served, _ = gateway.create_completion('primary', [{'role': 'user', 'content': 'hi'}])
+    assert served == 'backup'
+    stats = gateway.get_stats()['models']
+    assert stats['primary']['hedges'] == 1 and stats['backup']['hedge_wins'] == 1
+    assert gateway.complete_text('stub:solo', [{'role': 'user', 'content': 'x'}]) == '{"model": "solo"}'
+    print("✓ Stream and hedge")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test LLM gateway...\n")
+    test_budget_window()
+    test_failover_on_rate_limit()
+    test_stream_and_hedge()
+    print("\n✅ All tests passed")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Test message ingest writer - gom batch, spill ra journal khi DB lỗi và ghi lại khi DB ổn
+"""
+
+import sys
+import os
+import json
+import time
+import tempfile
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.exc import DataError
+from services.message_ingest_writer import MessageIngestWriter
+
+
+class FakeDatabase:
+    def __init__(self, poison=None):
+        self.batches = []
+        self.down = False
+        self.poison = poison
+
+    def write(self, records):
+        if self.down:
+            raise ConnectionError('database is down')
+        if any(r['content'] == self.poison for r in records):
+            raise DataError('INSERT ...', {}, Exception('Data too long for column content'))
+        self.batches.append(list(records))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_batches_writes():
+    """Nhiều tin gửi liên tiếp được ghi trong ít transaction"""
+    database = FakeDatabase()
+    writer = MessageIngestWriter(database.write, batch_size=10, max_wait_ms=100)
+    for i in range(25):
+        assert writer.submit({'content': f'tin {i}'})
+    assert wait_for(lambda: writer.stats['written'] == 25)
+    writer.stop()
+    assert len(database.batches) <= 5
+    assert [r['content'] for batch in database.batches for r in batch] == [f'tin {i}' for i in range(25)]
+    print(f"✓ Batched writes: {[len(b) for b in database.batches]}")
+
+
+def test_spill_and_replay():
+    """DB lỗi thì tin vào journal (datetime thành ISO), DB ổn lại thì journal được ghi lại"""
+    database = FakeDatabase()
+    database.down = True
+    journal_path = os.path.join(tempfile.mkdtemp(), 'ingest.jsonl')
+    writer = MessageIngestWriter(database.write, batch_size=5, max_wait_ms=20,
+                                 journal_path=journal_path, retry_seconds=0.2)
+    received_at = datetime(2025, 1, 2, 3, 4, 5)
+    for i in range(7):
+        writer.submit({'content': f'tin {i}', 'received_at': received_at})
+    assert wait_for(lambda: writer.get_stats()['journal_records'] == 7)
+    assert writer.stats['write_errors'] >= 1 and writer.stats['spilled'] == 7
+
+    database.down = False
+    assert wait_for(lambda: writer.stats['replayed'] == 7)
+    writer.stop()
+    replayed = [r for batch in database.batches for r in batch]
+    assert sorted(r['content'] for r in replayed) == [f'tin {i}' for i in range(7)]
+    assert replayed[0]['received_at'] == '2025-01-02T03:04:05'
+    assert writer.get_stats()['journal_records'] == 0 and not os.path.exists(journal_path)
+    print("✓ Spill and replay")
+
+
+def test_poison_message_dead_lettered():
+    """1 tin luôn lỗi dữ liệu chỉ vào dead-letter, các tin khác vẫn được ghi DB và không vào journal"""
+    database = FakeDatabase(poison='tin 3')
+    journal_path = os.path.join(tempfile.mkdtemp(), 'ingest.jsonl')
+    writer = MessageIngestWriter(database.write, batch_size=5, max_wait_ms=20,
+                                 journal_path=journal_path, retry_seconds=60)
+    for i in range(12):
+        writer.submit({'content': f'tin {i}'})
+    assert wait_for(lambda: writer.stats['written'] == 11)
+    writer.stop()
+    written = sorted(r['content'] for batch in database.batches for r in batch)
+    assert written == sorted(f'tin {i}' for i in range(12) if i != 3)
+    assert writer.stats['dead_lettered'] == 1 and writer.stats['spilled'] == 0
+    assert writer.get_stats()['journal_records'] == 0 and not os.path.exists(journal_path)
+    with open(writer.dead_letter_path, encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f]
+    assert [e['record']['content'] for e in entries] == ['tin 3'] and entries[0]['error'].startswith('DataError')
+    print("✓ Poison message dead-lettered")
+
+
+def test_queue_full_and_recovery():
+    """Hàng đợi đầy thì submit() ghi thẳng ra journal; journal còn sót được đọc lại khi khởi động"""
+    journal_path = os.path.join(tempfile.mkdtemp(), 'ingest.jsonl')
+    blocker = FakeDatabase()
+    writer = MessageIngestWriter(blocker.write, max_pending=1, journal_path=journal_path)
+    writer._thread = type('Alive', (), {'is_alive': lambda self: True})()  # Không chạy writer thread
+    assert writer.submit({'content': 'a'}) is True
+    assert writer.submit({'content': 'b'}) is False
+    assert writer.stats['spilled_queue_full'] == 1
+
+    restarted = MessageIngestWriter(blocker.write, journal_path=journal_path)
+    assert restarted.get_stats()['journal_records'] == 1
+    print("✓ Queue full and recovery")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test message ingest writer...\n")
+    test_batches_writes()
+    test_spill_and_replay()
+    test_poison_message_dead_lettered()
+    test_queue_full_and_recovery()
+    print("\n✅ All tests passed")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Test metrics registry - counter/gauge/histogram, text format Prometheus và snapshot cho status API
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.metrics import MetricsRegistry, STAGE_DURATION, span
+
+
+def test_counter_and_gauge():
+    """Counter cộng dồn theo label, gauge ghi đè, collector chạy trước khi export"""
+    registry = MetricsRegistry()
+    requests = registry.counter('llm_requests_total', 'LLM requests')
+    requests.inc(model='a', outcome='stop')
+    requests.inc(2, model='a', outcome='stop')
+    requests.inc(model='b', outcome='length')
+    assert registry.counter('llm_requests_total', 'ignored') is requests
+    assert requests.value(outcome='stop', model='a') == 3
+
+    pool = registry.gauge('pool_connections', 'Pool connections')
+    registry.register_collector(lambda: pool.set(4, pool='warehouse'))
+    pool.set(1, pool='warehouse')
+    text = registry.render_prometheus()
+    assert '# TYPE llm_requests_total counter' in text
+    assert 'llm_requests_total{model="a",outcome="stop"} 3' in text
+    assert 'pool_connections{pool="warehouse"} 4' in text
+    assert registry.snapshot()['llm_requests_total'] == {'model=a,outcome=stop': 3, 'model=b,outcome=length': 1}
+    print("✓ Counter and gauge")
+
+
+def test_histogram():
+    """Bucket cộng dồn, có +Inf, _sum/_count; snapshot có avg và p50/p95"""
+    registry = MetricsRegistry()
+    sizes = registry.histogram('batch_size', 'Batch size', buckets=(5, 10, 20))
+    for value in (1, 3, 7, 12, 40):
+        sizes.observe(value)
+    text = registry.render_prometheus()
+    assert 'batch_size_bucket{le="5"} 2' in text
+    assert 'batch_size_bucket{le="10"} 3' in text
+    assert 'batch_size_bucket{le="20"} 4' in text
+    assert 'batch_size_bucket{le="+Inf"} 5' in text
+    assert 'batch_size_sum 63' in text and 'batch_size_count 5' in text
+    info = registry.snapshot()['batch_size']['total']
+    assert info['count'] == 5 and info['avg'] == 12.6 and info['p50'] == 7 and info['max'] == 40
+    print(f"✓ Histogram: {info}")
+
+
+def test_span():
+    """span() ghi thời gian stage kể cả khi khối lệnh ném exception"""
+    before = STAGE_DURATION.snapshot().get('stage=test_stage', {}).get('count', 0)
+    with span('test_stage'):
+        pass
+    try:
+        with span('test_stage'):
+            raise ValueError('boom')
+    except ValueError:
+        pass
+    assert STAGE_DURATION.snapshot()['stage=test_stage']['count'] == before + 2
+    print("✓ Span")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test metrics...\n")
+    test_counter_and_gauge()
+    test_histogram()
+    test_span()
+    print("\n✅ All tests passed")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Test MinHash/LSH - phát hiện tin nhắn gần trùng
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.minhash import MinHasher
+from utils.text_normalize import fold_accents, normalize_message_text
+
+LISTING = "🔥🔥 Cho thuê căn hộ 2PN Vinhomes Ocean Park, S1.05 tầng 12, full đồ, giá 8tr/tháng. LH 0912345678 ✅"
+REPOST = "Cho thuê căn hộ 2PN Vinhomes Ocean Park, S1.05 tầng 12, full đồ, giá 8tr/tháng. LH 0912345679 🌟🌟"
+OTHER = "Bán căn 3PN Times City tòa T5 tầng 20 giá 5 tỷ LH 0988777666"
+
+
+def test_normalize():
+    """Test bỏ dấu và chuẩn hóa nội dung"""
+    assert fold_accents("Đường Nguyễn Trãi") == "Duong Nguyen Trai"
+    assert normalize_message_text("🔥 Cho THUÊ, căn hộ!!  2PN") == "cho thue can ho 2pn"
+    assert normalize_message_text(None) == ""
+    print("✓ Normalize")
+
+
+def test_near_duplicate_similarity():
+    """Tin đăng lại đổi emoji/1 chữ số giống nhau cao, tin khác thì thấp"""
+    hasher = MinHasher()
+    listing, repost, other = hasher.signature(LISTING), hasher.signature(REPOST), hasher.signature(OTHER)
+    assert hasher.similarity(listing, repost) >= 0.85
+    assert hasher.similarity(listing, other) < 0.3
+    assert set(hasher.band_keys(listing)) & set(hasher.band_keys(repost)), "Tin gần trùng phải chung ít nhất 1 bucket"
+    assert not set(hasher.band_keys(listing)) & set(hasher.band_keys(other))
+    print(f"✓ Similarity: repost={hasher.similarity(listing, repost):.2f}, other={hasher.similarity(listing, other):.2f}")
+
+
+def test_signature_stable_and_packable():
+    """Chữ ký ổn định giữa các instance và lưu/đọc được dạng bytes"""
+    signature = MinHasher().signature(LISTING)
+    assert signature == MinHasher().signature(LISTING)
+    hasher = MinHasher()
+    assert hasher.unpack(hasher.pack(signature)) == signature
+    assert hasher.unpack(b'short') is None
+    assert hasher.signature("🔥🔥 !!!") is None
+    print("✓ Signature stable")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test MinHash...\n")
+    test_normalize()
+    test_near_duplicate_similarity()
+    test_signature_stable_and_packable()
+    print("\n✅ All tests passed")
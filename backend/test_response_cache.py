@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test response cache - build 1 lần, ETag/If-None-Match trả 304, invalidate theo namespace
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from utils.response_cache import ResponseCache
+
+
+def make_app(cache):
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/items')
+    def items():
+        def build():
+            calls.append(1)
+            return {'success': True, 'data': ['Studio', '1PN'], 'version': len(calls)}
+        return cache.respond('items', 'all', build)
+
+    return app, calls
+
+
+def test_cached_with_etag():
+    """Lần gọi sau dùng body đã cache, If-None-Match trùng ETag thì trả 304 không body"""
+    cache = ResponseCache(ttl=60)
+    app, calls = make_app(cache)
+    client = app.test_client()
+
+    first = client.get('/items')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and first.get_json()['version'] == 1
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    second = client.get('/items')
+    assert second.get_data() == first.get_data() and second.headers['ETag'] == etag
+
+    not_modified = client.get('/items', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304 and not_modified.get_data() == b''
+    assert len(calls) == 1
+    print("✓ Cached with ETag")
+
+
+def test_invalidate_and_errors():
+    """invalidate() build lại response; builder lỗi thì không cache"""
+    cache = ResponseCache(ttl=60)
+    app, calls = make_app(cache)
+    client = app.test_client()
+
+    etag = client.get('/items').headers['ETag']
+    cache.invalidate('other')
+    assert client.get('/items', headers={'If-None-Match': etag}).status_code == 304
+    cache.invalidate('items')
+    changed = client.get('/items', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.get_json()['version'] == 2
+
+    with app.test_request_context('/broken'):
+        try:
+            cache.respond('broken', 'all', lambda: 1 / 0)
+            assert False
+        except ZeroDivisionError:
+            pass
+    assert cache.get_info()['broken']['entries'] == 0
+    print("✓ Invalidate and errors")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test response cache...\n")
+    test_cached_with_etag()
+    test_invalidate_and_errors()
+    print("\n✅ All tests passed")
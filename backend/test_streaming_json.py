@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test IncrementalJSONObjectParser - parse từng object của response Groq khi streaming
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.streaming_json import IncrementalJSONObjectParser, is_empty_json_array, parse_json_objects
+
+
+def test_objects_emitted_as_they_close():
+    """Object được trả về ngay khi đóng ngoặc, kể cả khi chunk cắt giữa chừng"""
+    text = '```json\n[{"message_id": 1, "note": "giá {8tr} \\"full\\""}, {"message_id": 2, "tags": {"a": [1, 2]}}]\n```'
+    parser = IncrementalJSONObjectParser()
+    emitted = []
+    for i in range(0, len(text), 5):
+        emitted.append(len(parser.feed(text[i:i + 5])))
+    objects = parser.close()
+    assert [o['message_id'] for o in objects] == [1, 2]
+    assert objects[0]['note'] == 'giá {8tr} "full"'
+    assert sum(emitted) == 2 and emitted.index(1) < len(emitted) - 1, "Object đầu phải được trả về trước khi hết stream"
+    assert not parser.truncated and not parser.errors
+    print("✓ Objects emitted incrementally")
+
+
+def test_salvage_truncated_and_malformed():
+    """Giữ object hoàn chỉnh khi response bị cắt cụt hoặc có object lỗi"""
+    objects, errors = parse_json_objects('[{"message_id": 1}, {"message_id": 2,, "x": 1}, {"message_id": 3}, {"message_id": 4, "pri')
+    assert [o['message_id'] for o in objects] == [1, 3]
+    assert len(errors) == 1
+
+    parser = IncrementalJSONObjectParser()
+    parser.feed('[{"message_id": 1}, {"message_id": 2')
+    parser.close()
+    assert parser.truncated
+    print("✓ Salvage truncated/malformed")
+
+
+def test_no_objects():
+    """Mảng rỗng hoặc text không có JSON"""
+    assert parse_json_objects('[]') == ([], [])
+    assert parse_json_objects('Không có tin rao') == ([], [])
+    print("✓ No objects")
+
+
+def test_empty_array_response():
+    """Chỉ response là đúng mảng [] mới là kết quả rỗng hợp lệ, [] lồng trong object lỗi hay đoạn văn thì không"""
+    assert is_empty_json_array('[]')
+    assert is_empty_json_array(' [ ] ')
+    assert is_empty_json_array('```json\n[]\n```')
+    assert not is_empty_json_array('[{"message_id": 1, "images": [], "price":}]')
+    assert not is_empty_json_array('Không có tin rao nào: []')
+    assert not is_empty_json_array('[{"message_id": 1}]')
+    assert not is_empty_json_array('')
+    print("✓ Empty array response")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test streaming JSON...\n")
+    test_objects_emitted_as_they_close()
+    test_salvage_truncated_and_malformed()
+    test_no_objects()
+    test_empty_array_response()
+    print("\n✅ All tests passed")
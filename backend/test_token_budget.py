@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test AdaptiveBatchSizer - chia batch tin nhắn theo ngân sách token
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.token_budget import AdaptiveBatchSizer, estimate_tokens
+
+
+def make_messages(lengths):
+    return [{'id': i + 1, 'content': 'x' * length} for i, length in enumerate(lengths)]
+
+
+def test_estimate_tokens():
+    """Test ước lượng token"""
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('x' * 300, chars_per_token=3.0) == 100
+    print("✓ estimate_tokens")
+
+
+def test_pack_by_input_budget():
+    """Tin nhắn dài bị tách sang batch mới khi vượt ngân sách input"""
+    sizer = AdaptiveBatchSizer(input_budget=1000, output_budget=100000, max_messages=50)
+    batches = sizer.pack(make_messages([600, 600, 600, 2400, 300]), preamble_tokens=300)
+    sizes = [len(b) for b in batches]
+    assert sum(sizes) == 5
+    assert [m['id'] for b in batches for m in b] == [1, 2, 3, 4, 5], "Phải giữ nguyên thứ tự"
+    # Tin nhắn 2400 ký tự (~800 token) + preamble vượt ngân sách nhưng vẫn được xếp 1 mình 1 batch
+    assert [len(b) for b in batches if b[0]['id'] == 4] == [1]
+    print(f"✓ Pack theo input budget: {sizes}")
+
+
+def test_pack_by_output_budget():
+    """Số tin nhắn mỗi batch bị giới hạn bởi ngân sách output"""
+    sizer = AdaptiveBatchSizer(input_budget=100000, output_budget=5000, max_messages=50,
+                               reasoning_reserve=1000, output_tokens_per_message=400)
+    batches = sizer.pack(make_messages([100] * 20), preamble_tokens=100)
+    # (5000 - 1000) / (400 * 1.2) = 8 tin nhắn mỗi batch
+    assert [len(b) for b in batches] == [8, 8, 4]
+    assert sizer.output_tokens_for(8) <= 5000
+    print(f"✓ Pack theo output budget: {[len(b) for b in batches]}")
+
+
+def test_adaptive_resize():
+    """Bị cắt cụt thì giảm một nửa, thành công thì tăng dần"""
+    sizer = AdaptiveBatchSizer(max_messages=20)
+    sizer.record_truncation(20)
+    assert sizer.max_messages == 10
+    sizer.record_parse_failure(10)
+    assert sizer.max_messages == 5
+    sizer.record_success(5, usage={'prompt_tokens': 1000, 'completion_tokens': 3000})
+    assert sizer.max_messages == 6
+    assert sizer.output_tokens_per_message > 400
+    print(f"✓ Adaptive resize: {sizer.get_info()}")
+
+
+if __name__ == "__main__":
+    print("Bắt đầu test token budget...\n")
+    test_estimate_tokens()
+    test_pack_by_input_budget()
+    test_pack_by_output_budget()
+    test_adaptive_resize()
+    print("\n✅ All tests passed")
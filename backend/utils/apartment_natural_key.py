@@ -0,0 +1,99 @@
+"""
+Apartment Natural Key
+Khóa tự nhiên của 1 căn trong warehouse để gộp các tin rao cùng 1 căn (nhiều môi giới cùng đăng)
+thay vì mỗi tin 1 dòng apartments
+"""
+
+import re
+import unicodedata
+from typing import Dict, Optional
+
+# property_group gốc của cây dự án: tin không xác định được dự án, không dùng để gộp
+ROOT_PROPERTY_GROUP_ID = 1
+
+# listing_type -> loại tin (bán/cho thuê là 2 tin khác nhau của cùng 1 căn); tin cần mua/cần thuê không phải nguồn hàng
+LISTING_SIDES = {
+    'CAN_BAN': 'sale',
+    'CAN_CHO_THUE': 'rent'
+}
+
+_NON_ALNUM_RE = re.compile(r'[^0-9A-Z]')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def _fold(value) -> str:
+    """Bỏ dấu, viết hoa, chỉ giữ chữ và số: 'a1-12.05' -> 'A11205', 'Tòa S1' -> 'TOAS1'"""
+    text = unicodedata.normalize('NFD', str(value)).replace('đ', 'd').replace('Đ', 'D')
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    return _NON_ALNUM_RE.sub('', text.upper())
+
+
+def normalize_unit_code(unit_code) -> Optional[str]:
+    """Mã căn chuẩn hóa (None nếu rỗng)"""
+    if unit_code is None:
+        return None
+    folded = _fold(unit_code)
+    return folded or None
+
+
+def normalize_axis(unit_axis) -> Optional[str]:
+    """Trục căn chuẩn hóa, trục chỉ gồm số thì bỏ số 0 đứng đầu: '05' -> '5'"""
+    folded = normalize_unit_code(unit_axis)
+    if folded and folded.isdigit():
+        return str(int(folded))
+    return folded
+
+
+def normalize_floor(unit_floor_number) -> Optional[int]:
+    """Số tầng từ chuỗi ('12', 'tầng 12', 12.0), None nếu không có đúng 1 số"""
+    if unit_floor_number is None or isinstance(unit_floor_number, bool):
+        return None
+    if isinstance(unit_floor_number, (int, float)):
+        return int(unit_floor_number)
+    numbers = _DIGITS_RE.findall(str(unit_floor_number))
+    return int(numbers[0]) if len(numbers) == 1 else None
+
+
+def listing_side(record: Dict) -> Optional[str]:
+    """Tin bán hay cho thuê; listing_type trống thì suy ra từ giá"""
+    listing_type = record.get('listing_type')
+    if listing_type:
+        return LISTING_SIDES.get(listing_type)
+    if record.get('price'):
+        return 'sale'
+    if record.get('price_rent'):
+        return 'rent'
+    return None
+
+
+def natural_key(record: Dict) -> Optional[str]:
+    """
+    Khóa tự nhiên của căn: dự án + loại tin + (mã căn, hoặc trục + tầng)
+
+    Args:
+        record: Record apartments (property_group, unit_code, unit_axis, unit_floor_number, listing_type, price...)
+
+    Returns:
+        Chuỗi khóa, ví dụ '12|sale|code:A11205' hoặc '12|rent|axis:5|floor:12';
+        None nếu không đủ thông tin để chắc chắn là cùng 1 căn (khi đó insert dòng mới như cũ)
+    """
+    try:
+        property_group = int(record.get('property_group') or 0)
+    except (TypeError, ValueError):
+        return None
+    if property_group <= 0 or property_group == ROOT_PROPERTY_GROUP_ID:
+        return None
+
+    side = listing_side(record)
+    if not side:
+        return None
+
+    unit_code = normalize_unit_code(record.get('unit_code'))
+    if unit_code:
+        return f"{property_group}|{side}|code:{unit_code}"
+
+    axis = normalize_axis(record.get('unit_axis'))
+    floor = normalize_floor(record.get('unit_floor_number'))
+    if axis and floor is not None:
+        return f"{property_group}|{side}|axis:{axis}|floor:{floor}"
+    return None
@@ -0,0 +1,63 @@
+"""
+Apartment Search Text
+Chuỗi tìm kiếm đã bỏ dấu của 1 căn (cột apartments.search_text, FULLTEXT ngram) và câu truy vấn
+BOOLEAN MODE tương ứng, để tìm "vinhomes", "Vinhomes", "vịnhomes" hay "a1-12.05", "A11205" đều ra cùng kết quả
+"""
+
+from typing import Dict, Iterable, Optional
+from utils.text_normalize import normalize_message_text
+
+# ngram_token_size mặc định của MySQL: từ ngắn hơn không có trong FULLTEXT index
+NGRAM_TOKEN_SIZE = 2
+
+# Giới hạn độ dài notes đưa vào search_text (notes dài không tăng độ chính xác, chỉ làm phình index)
+MAX_NOTES_LENGTH = 1000
+
+
+def _code_terms(value) -> str:
+    """Mã căn/trục: dạng tách từ ('a1 12 05') + dạng viết liền ('a11205') để tìm theo cả 2 cách gõ"""
+    normalized = normalize_message_text(str(value)) if value is not None else ''
+    compact = normalized.replace(' ', '')
+    if compact and compact != normalized:
+        return f"{normalized} {compact}"
+    return normalized
+
+
+def build_search_text(record: Dict, property_group_names: Iterable[str] = (),
+                      unit_type_name: Optional[str] = None) -> str:
+    """
+    Tạo search_text cho 1 căn
+
+    Args:
+        record: Record apartments (unit_code, unit_axis, notes...)
+        property_group_names: Tên nhóm của căn và các nhóm cha (dự án, phân khu, tòa)
+        unit_type_name: Tên loại căn (types_unit.name)
+
+    Returns:
+        Chuỗi chữ thường không dấu, các phần cách nhau 1 khoảng trắng
+    """
+    notes = record.get('notes')
+    parts = [
+        _code_terms(record.get('unit_code')),
+        _code_terms(record.get('unit_axis')),
+        ' '.join(normalize_message_text(name) for name in property_group_names if name),
+        normalize_message_text(unit_type_name),
+        normalize_message_text(str(notes)[:MAX_NOTES_LENGTH]) if notes else ''
+    ]
+    return ' '.join(part for part in parts if part)
+
+
+def build_search_query(search_query: str) -> Optional[str]:
+    """
+    Câu truy vấn MATCH ... AGAINST (... IN BOOLEAN MODE): mọi từ (đã bỏ dấu) đều phải có
+
+    Với ngram parser, mỗi từ được tách thành các ngram và tìm như 1 cụm, nên '+1205' khớp cả 'a11205'
+    (tìm theo tiền tố/chuỗi con của mã căn).
+
+    Returns:
+        Chuỗi BOOLEAN MODE, None nếu không có từ nào đủ NGRAM_TOKEN_SIZE ký tự (dùng LIKE thay thế)
+    """
+    terms = [term for term in normalize_message_text(search_query).split() if len(term) >= NGRAM_TOKEN_SIZE]
+    if not terms:
+        return None
+    return ' '.join(f'+{term}' for term in dict.fromkeys(terms))
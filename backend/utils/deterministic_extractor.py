@@ -0,0 +1,123 @@
+"""
+Deterministic Extractor
+Bóc tách các trường có cấu trúc rõ ràng (số điện thoại, giá tỷ/triệu, diện tích m2, số phòng ngủ/WC,
+tầng, hướng) bằng regex đã compile, để LLM chỉ cần xử lý các trường cần suy luận (tòa, mã căn, loại căn...)
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from utils.text_normalize import fold_accents
+
+# Tăng khi đổi quy tắc bóc tách để extraction cache (chế độ hybrid) không dùng lại kết quả cũ
+EXTRACTOR_VERSION = 1
+
+# Các trường được bỏ khỏi schema gửi LLM ở chế độ hybrid (luôn lấy từ extractor)
+LOCAL_FIELDS = [
+    'phone_number', 'price', 'price_rent',
+    'area_land', 'area_construction', 'area_net', 'area_gross',
+    'num_bedrooms', 'num_bathrooms',
+    'direction_door', 'direction_balcony'
+]
+
+# Các trường vẫn để LLM trả về (cần suy luận từ mã căn...), extractor chỉ điền khi LLM trả null
+FALLBACK_FIELDS = ['unit_floor_number']
+
+_NUMBER = r'(\d+(?:[.,]\d+)?)'
+
+PHONE_RE = re.compile(r'(?<!\d)((?:\+?84|0)(?:[\s.\-]?\d){9})(?!\d)')
+PRICE_BILLION_RE = re.compile(_NUMBER + r'\s*(?:ty|ti)(?![a-z])\s*(\d{1,3}(?![\d.,]*\s*(?:tr|trieu|m2|m²)))?')
+PRICE_MILLION_RE = re.compile(_NUMBER + r'\s*(?:trieu|tr)(?![a-z])\s*(\d{1,3}(?![\d.,]*\s*(?:m2|m²)))?')
+AREA_RE = re.compile(_NUMBER + r'\s*(?:m2|m²|met vuong)(?![a-z0-9])')
+BEDROOM_RE = re.compile(r'(?<![a-z0-9.])(\d)\s*(?:pn|phong ngu|br|bedroom)(?![a-z])')
+BATHROOM_RE = re.compile(r'(?<![0-9.])(\d)\s*(?:wc|vs|phong tam|toilet)(?![a-z])')
+FLOOR_RE = re.compile(r'(?<![a-z])tang\s*(\d{1,2})(?![\dx])')
+DIRECTION_RE = re.compile(r'(ban cong|bc|cua chinh|cua)?\s*(?:huong|h\.)\s*(ban cong|bc|cua chinh|cua)?\s*(dong nam|dong bac|tay nam|tay bac|dong|tay|nam|bac)(?![a-z])')
+BALCONY_DIRECTION_RE = re.compile(r'(?:ban cong|bc)\s+(dong nam|dong bac|tay nam|tay bac|dong|tay|nam|bac)(?![a-z])')
+
+DIRECTION_CODES = {
+    'dong': 'D', 'tay': 'T', 'nam': 'N', 'bac': 'B',
+    'dong bac': 'DB', 'dong nam': 'DN', 'tay bac': 'TB', 'tay nam': 'TN'
+}
+
+# Từ khóa loại diện tích trong khoảng ~20 ký tự trước số
+AREA_QUALIFIERS = [
+    ('thong thuy', 'area_net'),
+    ('tim tuong', 'area_gross'),
+    ('xay dung', 'area_construction'),
+    ('dat', 'area_land'),
+]
+
+
+def _to_float(value: str) -> float:
+    return float(value.replace(',', '.'))
+
+
+def _with_fraction(whole: str, fraction: Optional[str]) -> float:
+    """'4' + '1' -> 4.1 ; '8' + '5' -> 8.5 ; '5' + '200' -> 5.2"""
+    value = _to_float(whole)
+    if fraction and '.' not in whole and ',' not in whole:
+        value += int(fraction) / (10 ** len(fraction))
+    return value
+
+
+def normalize_phone(raw: str) -> str:
+    """Chỉ giữ chữ số, +84/84 -> 0"""
+    digits = re.sub(r'\D', '', raw)
+    if digits.startswith('84') and len(digits) == 11:
+        digits = '0' + digits[2:]
+    return digits
+
+
+def extract_structured_fields(text: Optional[str]) -> Tuple[Dict, List[str]]:
+    """
+    Bóc tách các trường có cấu trúc rõ ràng từ nội dung tin nhắn
+
+    Args:
+        text: Nội dung tin nhắn
+
+    Returns:
+        Tuple (fields, ambiguous)
+        - fields: {tên trường: giá trị} cho mọi trường trong LOCAL_FIELDS + FALLBACK_FIELDS (None nếu không có)
+        - ambiguous: các trường có nhiều giá trị khác nhau (tin có nhiều căn) - khi đó không nên tin kết quả local
+    """
+    folded = fold_accents(text or '').lower()
+    candidates: Dict[str, List] = {field: [] for field in LOCAL_FIELDS + FALLBACK_FIELDS}
+
+    for match in PHONE_RE.finditer(folded):
+        candidates['phone_number'].append(normalize_phone(match.group(1)))
+
+    # Giá tiền tỷ là giá bán, tiền triệu là giá thuê (giống quy ước trong prompt)
+    for match in PRICE_BILLION_RE.finditer(folded):
+        candidates['price'].append(int(round(_with_fraction(match.group(1), match.group(2)) * 1_000_000_000)))
+    for match in PRICE_MILLION_RE.finditer(folded):
+        candidates['price_rent'].append(int(round(_with_fraction(match.group(1), match.group(2)) * 1_000_000)))
+
+    for match in AREA_RE.finditer(folded):
+        before = folded[max(0, match.start() - 20):match.start()]
+        field = 'area_gross'
+        for keyword, qualified_field in AREA_QUALIFIERS:
+            if keyword in before:
+                field = qualified_field
+                break
+        candidates[field].append(_to_float(match.group(1)))
+
+    candidates['num_bedrooms'] = [int(m.group(1)) for m in BEDROOM_RE.finditer(folded)]
+    candidates['num_bathrooms'] = [int(m.group(1)) for m in BATHROOM_RE.finditer(folded)]
+    candidates['unit_floor_number'] = [int(m.group(1)) for m in FLOOR_RE.finditer(folded)]
+
+    for match in DIRECTION_RE.finditer(folded):
+        balcony = match.group(1) in ('ban cong', 'bc') or match.group(2) in ('ban cong', 'bc')
+        candidates['direction_balcony' if balcony else 'direction_door'].append(DIRECTION_CODES[match.group(3)])
+    for match in BALCONY_DIRECTION_RE.finditer(folded):
+        candidates['direction_balcony'].append(DIRECTION_CODES[match.group(1)])
+
+    fields = {}
+    ambiguous = []
+    for field, values in candidates.items():
+        distinct = list(dict.fromkeys(values))
+        # Nhiều số điện thoại là bình thường (LH 09.. hoặc 08..): lấy số đầu tiên
+        if len(distinct) > 1 and field != 'phone_number':
+            ambiguous.append(field)
+        fields[field] = distinct[0] if distinct else None
+    return fields, ambiguous
@@ -1,8 +1,8 @@
 import os
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 import re
 import time
+from utils.llm_gateway import llm_gateway
 
 class GroqChat:
     def __init__(self, model="llama-3.3-70b-versatile", max_tokens=1000, temperature=0.7, n=1, top_p=0.9, stream=False, max_history_length=10, response_format=None):
@@ -13,15 +13,11 @@ class GroqChat:
         if not self.api_key:
             raise ValueError("❌ GROQ_API_KEY không được tìm thấy. Hãy kiểm tra lại tệp .env!")
         
-        # Khởi tạo mô hình Llama từ Groq
-        self.llm = ChatGroq(
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            n=n,
-            stream=stream,
-            response_format=response_format
-        )
+        # Gọi model qua LLM gateway (rate limit theo model, failover sang model dự phòng khi Groq 429/chậm)
+        self.model = model
+        self.llm_params = {'max_tokens': max_tokens, 'temperature': temperature}
+        if response_format:
+            self.llm_params['response_format'] = response_format
         
         # Lưu trữ lịch sử hội thoại
         self.conversation_history = []
@@ -50,13 +46,13 @@ class GroqChat:
         messages = [("system", system_input)] + self.conversation_history
         
         try:
-            response = self.llm.invoke(messages)
-            self.conversation_history.append(("assistant", response.content))
+            content = llm_gateway.complete_text(self.model, self._to_chat_messages(messages), **self.llm_params)
+            self.conversation_history.append(("assistant", content))
 
             end = time.time()
             print(end - start)
 
-            return GroqResponse(response.content)
+            return GroqResponse(content)
         except Exception as e:
             return GroqResponse(f"❌ Lỗi từ Groq API: {e}")
 
@@ -74,14 +70,17 @@ class GroqChat:
 
         try:
             # 👇 Dùng stream thay vì invoke
-            stream = self.llm.stream(messages)
-            for chunk in stream:
-                # chunk là BaseMessage => chunk.content là phần text
-                yield chunk.content
+            for content in llm_gateway.stream_text(self.model, self._to_chat_messages(messages), **self.llm_params):
+                yield content
         except Exception as e:
             yield f"\n❌ Lỗi khi stream từ Groq: {str(e)}"
 
 
+    @staticmethod
+    def _to_chat_messages(messages):
+        """[(role, content)] -> [{'role', 'content'}] cho chat completion API"""
+        return [{"role": role, "content": content} for role, content in messages]
+
     def clear_history(self):
         """
         Xóa lịch sử hội thoại.
@@ -0,0 +1,58 @@
+"""
+Identity Map
+Cache trong phạm vi 1 batch/request: mỗi id chỉ load 1 lần, các lần lấy sau dùng lại cùng 1 object
+"""
+
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class IdentityMap:
+    """
+    Map id -> record đã load trong phạm vi 1 batch (không dùng chung giữa các batch, không có TTL).
+
+    - get_many(): chỉ gọi loader cho các id chưa có trong map, 1 lần cho cả danh sách
+    - Id không tồn tại cũng được nhớ để không query lại
+    - update(): sửa record trong map sau khi ghi DB để các bước sau thấy dữ liệu mới
+    """
+
+    def __init__(self, loader: Callable[[List[Hashable]], Dict[Hashable, Any]]):
+        """
+        Args:
+            loader: Hàm load nhiều record theo list id, trả về Dict {id: record} (id không tồn tại thì bỏ qua)
+        """
+        self.loader = loader
+        self.loads = 0
+        self._records: Dict[Hashable, Optional[Any]] = {}
+
+    def get_many(self, ids: Iterable[Hashable]) -> List[Any]:
+        """
+        Lấy nhiều record theo thứ tự id (bỏ id trùng và id không tồn tại)
+
+        Returns:
+            List record
+        """
+        ordered_ids = list(dict.fromkeys(i for i in ids if i is not None))
+        missing = [i for i in ordered_ids if i not in self._records]
+        if missing:
+            self.loads += 1
+            loaded = self.loader(missing) or {}
+            for record_id in missing:
+                self._records[record_id] = loaded.get(record_id)
+        return [self._records[i] for i in ordered_ids if self._records[i] is not None]
+
+    def get(self, record_id: Hashable) -> Optional[Any]:
+        """Lấy 1 record (load nếu chưa có)"""
+        records = self.get_many([record_id])
+        return records[0] if records else None
+
+    def update(self, record_id: Hashable, **fields):
+        """Cập nhật field của record đã load (không làm gì nếu record chưa được load)"""
+        record = self._records.get(record_id)
+        if record is not None:
+            record.update(fields)
+
+    def __contains__(self, record_id: Hashable) -> bool:
+        return self._records.get(record_id) is not None
+
+    def __len__(self) -> int:
+        return sum(1 for record in self._records.values() if record is not None)
@@ -0,0 +1,86 @@
+"""
+Keyset Pagination
+Cursor opaque cho phân trang theo (sort_value, id) thay cho LIMIT/OFFSET
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    """
+    Mã hóa vị trí (sort_value, id) của bản ghi cuối trang thành cursor
+
+    Args:
+        sort_value: Giá trị cột sắp xếp (datetime, số, chuỗi hoặc None)
+        row_id: ID của bản ghi
+
+    Returns:
+        str: Cursor dạng base64 url-safe
+    """
+    if isinstance(sort_value, datetime):
+        payload = {'t': 'dt', 'v': sort_value.isoformat()}
+    else:
+        payload = {'t': 'raw', 'v': sort_value}
+    payload['i'] = int(row_id)
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """
+    Giải mã cursor thành (sort_value, id)
+
+    Raises:
+        ValueError: Nếu cursor không hợp lệ
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        value = payload.get('v')
+        if payload.get('t') == 'dt' and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(payload['i'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def keyset_condition(column: str, id_column: str, cursor: Optional[str], descending: bool,
+                     params: Dict, prefix: str = 'cursor') -> Optional[str]:
+    """
+    Tạo điều kiện WHERE để lấy các bản ghi sau cursor theo thứ tự (column, id_column).
+    Cột sắp xếp có thể NULL: MySQL xếp NULL đầu tiên khi ASC và cuối cùng khi DESC.
+
+    Args:
+        column: Cột sắp xếp (vd: 'received_at')
+        id_column: Cột id dùng để phá hòa (vd: 'id')
+        cursor: Cursor của trang trước (None = trang đầu)
+        descending: True nếu sắp xếp giảm dần
+        params: Dict params của query, sẽ được thêm giá trị cursor
+        prefix: Tiền tố tên param
+
+    Returns:
+        str điều kiện SQL hoặc None nếu không có cursor
+    """
+    if not cursor:
+        return None
+
+    value, row_id = decode_cursor(cursor)
+    op = '<' if descending else '>'
+    params[f'{prefix}_id'] = row_id
+
+    if value is None:
+        if descending:
+            # NULL ở cuối: chỉ còn các bản ghi NULL có id nhỏ hơn
+            return f"({column} IS NULL AND {id_column} {op} :{prefix}_id)"
+        # NULL ở đầu: các bản ghi NULL còn lại, sau đó toàn bộ bản ghi có giá trị
+        return f"(({column} IS NULL AND {id_column} {op} :{prefix}_id) OR {column} IS NOT NULL)"
+
+    params[f'{prefix}_value'] = value
+    condition = (f"{column} {op} :{prefix}_value OR "
+                 f"({column} = :{prefix}_value AND {id_column} {op} :{prefix}_id)")
+    if descending:
+        condition += f" OR {column} IS NULL"
+    return f"({condition})"
@@ -0,0 +1,209 @@
+"""
+Listing Prefilter
+Phân loại nhanh (regex + keyword trie + logistic score) tin nhắn có phải tin rao căn hộ hay không,
+để bỏ qua tin chào hỏi/quảng cáo trước khi gửi Groq
+"""
+
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.text_normalize import fold_accents, normalize_message_text
+
+# Regex chạy trên nội dung đã bỏ dấu + chữ thường (giữ dấu câu để nhận giá, số điện thoại)
+PRICE_RE = re.compile(r'\d+(?:[.,]\d+)?\s*(?:ty|trieu|tr|k|cu|usd|\$)(?![a-z])')
+AREA_RE = re.compile(r'\d+(?:[.,]\d+)?\s*(?:m2|m²|met vuong|m(?![a-z0-9]))')
+BEDROOM_RE = re.compile(r'(?<![a-z0-9])(?:\d\s*(?:pn|phong ngu|br|bedroom)(?![a-z])|studio|duplex|penthouse)')
+PHONE_RE = re.compile(r'(?<!\d)(?:\+?84|0)(?:[\s.\-]?\d){9}(?!\d)')
+UNIT_CODE_RE = re.compile(r'(?<![a-z0-9])[a-z]{1,3}\d{0,2}[.\-]\d{2,4}(?![0-9])')
+
+LISTING_KEYWORDS = [
+    'cho thue', 'can cho thue', 'ban can', 'can ban', 'chuyen nhuong', 'sang nhuong', 'can ho',
+    'chinh chu', 'gia tot', 'gia re', 'full do', 'full noi that', 'noi that', 'do co ban', 'nha trong',
+    'ban cong', 'view', 'tang', 'toa', 'phan khu', 'dien tich', 'so do', 'hdmb', 'coc', 'bao phi',
+    'lien he', 'lh', 'ib', 'inbox', 'xem nha', 'don o ngay', 'vao o ngay', 'thang', 'phi dich vu'
+]
+
+NEGATIVE_KEYWORDS = [
+    'chao ca nha', 'chao moi nguoi', 'cam on', 'good morning', 'chuc mung', 'tuyen dung', 'tuyen sale',
+    'vay von', 'ho tro vay', 'khoa hoc', 'dang ky hoc', 'ban hang online', 'tim nguoi', 'hoi thong tin',
+    'ai biet', 'cho hoi', 'share', 'like'
+]
+
+# Trọng số mặc định của logistic model (có thể học lại bằng ListingPrefilter.fit trên dữ liệu đã gán nhãn)
+DEFAULT_WEIGHTS = {
+    'bias': -3.0,
+    'price': 2.0,
+    'area': 1.2,
+    'bedroom': 1.8,
+    'phone': 1.2,
+    'unit_code': 0.8,
+    'project': 1.5,
+    'keywords': 0.6,
+    'negative': -1.5,
+    'short': -1.5
+}
+
+FEATURE_NAMES = [name for name in DEFAULT_WEIGHTS if name != 'bias']
+
+
+class KeywordTrie:
+    """Trie theo token để tìm nhanh các cụm từ (nhiều từ) trong nội dung đã chuẩn hóa"""
+
+    def __init__(self, phrases: Optional[Iterable[str]] = None):
+        self.root: Dict = {}
+        for phrase in phrases or ():
+            self.add(phrase)
+
+    def add(self, phrase: str):
+        """Thêm cụm từ (được chuẩn hóa giống nội dung tin nhắn)"""
+        tokens = normalize_message_text(phrase).split()
+        if not tokens:
+            return
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[None] = ' '.join(tokens)
+
+    def find_all(self, tokens: List[str]) -> List[str]:
+        """Các cụm từ xuất hiện trong list token (mỗi cụm đếm 1 lần)"""
+        found = set()
+        for start in range(len(tokens)):
+            node = self.root
+            for token in tokens[start:]:
+                node = node.get(token)
+                if node is None:
+                    break
+                if None in node:
+                    found.add(node[None])
+        return sorted(found)
+
+
+def _sigmoid(x: float) -> float:
+    if x < -60:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class ListingPrefilter:
+    """
+    Chấm điểm xác suất tin nhắn là tin rao căn hộ.
+
+    - Đặc trưng: giá, diện tích, số phòng ngủ, số điện thoại, mã căn, tên dự án trong property tree,
+      số từ khóa tin rao, từ khóa tin không phải rao, tin quá ngắn
+    - score = sigmoid(bias + sum(weight * feature)), tin có score < threshold bị bỏ qua
+    """
+
+    def __init__(self, project_names: Optional[Iterable[str]] = None, threshold: float = 0.5,
+                 weights: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            project_names: Tên dự án/phân khu/tòa từ property tree
+            threshold: Ngưỡng score để coi là tin rao
+            weights: Trọng số model (mặc định DEFAULT_WEIGHTS)
+        """
+        self.threshold = threshold
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.keyword_trie = KeywordTrie(LISTING_KEYWORDS)
+        self.negative_trie = KeywordTrie(NEGATIVE_KEYWORDS)
+        self.project_trie = KeywordTrie()
+        self.set_project_names(project_names or ())
+
+    def set_project_names(self, project_names: Iterable[str]):
+        """Cập nhật tên dự án (bỏ qua tên quá ngắn như 'A', 'T1' vì dễ khớp nhầm)"""
+        self.project_trie = KeywordTrie(name for name in project_names if name and len(normalize_message_text(name)) >= 4)
+
+    def features(self, text: Optional[str]) -> Dict[str, float]:
+        """
+        Tính đặc trưng của nội dung
+
+        Returns:
+            Dict {tên đặc trưng: giá trị} theo FEATURE_NAMES
+        """
+        folded = fold_accents(text or '').lower()
+        tokens = normalize_message_text(text).split()
+        return {
+            'price': 1.0 if PRICE_RE.search(folded) else 0.0,
+            'area': 1.0 if AREA_RE.search(folded) else 0.0,
+            'bedroom': 1.0 if BEDROOM_RE.search(folded) else 0.0,
+            'phone': 1.0 if PHONE_RE.search(folded) else 0.0,
+            'unit_code': 1.0 if UNIT_CODE_RE.search(folded) else 0.0,
+            'project': 1.0 if self.project_trie.find_all(tokens) else 0.0,
+            'keywords': float(min(len(self.keyword_trie.find_all(tokens)), 5)),
+            'negative': float(min(len(self.negative_trie.find_all(tokens)), 2)),
+            'short': 1.0 if len(tokens) < 6 else 0.0
+        }
+
+    def score(self, text: Optional[str]) -> float:
+        """Xác suất (0-1) nội dung là tin rao căn hộ"""
+        features = self.features(text)
+        return _sigmoid(self.weights['bias'] + sum(self.weights[name] * value for name, value in features.items()))
+
+    def is_listing(self, text: Optional[str], threshold: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Phân loại nội dung
+
+        Returns:
+            Tuple (is_listing, score)
+        """
+        score = self.score(text)
+        return score >= (self.threshold if threshold is None else threshold), score
+
+    def evaluate(self, samples: List[Tuple[str, bool]], threshold: Optional[float] = None) -> Dict:
+        """
+        Precision/recall trên dữ liệu đã gán nhãn (positive = tin rao)
+
+        Args:
+            samples: List (content, is_listing)
+            threshold: Ngưỡng cần đánh giá (mặc định self.threshold)
+
+        Returns:
+            Dict {'threshold', 'tp', 'fp', 'tn', 'fn', 'precision', 'recall', 'f1', 'skipped_ratio'}
+        """
+        threshold = self.threshold if threshold is None else threshold
+        tp = fp = tn = fn = 0
+        for content, label in samples:
+            predicted, _ = self.is_listing(content, threshold)
+            if predicted and label:
+                tp += 1
+            elif predicted:
+                fp += 1
+            elif label:
+                fn += 1
+            else:
+                tn += 1
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        return {
+            'threshold': threshold,
+            'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+            'precision': round(precision, 4),
+            'recall': round(recall, 4),
+            'f1': round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+            'skipped_ratio': round((tn + fn) / len(samples), 4) if samples else 0.0
+        }
+
+    def fit(self, samples: List[Tuple[str, bool]], epochs: int = 300, learning_rate: float = 0.1,
+            l2: float = 0.01) -> Dict[str, float]:
+        """
+        Học lại trọng số bằng logistic regression (gradient descent, đủ cho vài nghìn mẫu)
+
+        Returns:
+            Dict trọng số mới (đã gán vào self.weights)
+        """
+        rows = [(self.features(content), 1.0 if label else 0.0) for content, label in samples]
+        if not rows:
+            return dict(self.weights)
+        weights = dict(self.weights)
+        for _ in range(epochs):
+            gradients = {name: 0.0 for name in weights}
+            for features, label in rows:
+                error = _sigmoid(weights['bias'] + sum(weights[n] * v for n, v in features.items())) - label
+                gradients['bias'] += error
+                for name, value in features.items():
+                    gradients[name] += error * value
+            for name in weights:
+                penalty = l2 * weights[name] if name != 'bias' else 0.0
+                weights[name] -= learning_rate * (gradients[name] / len(rows) + penalty)
+        self.weights = {name: round(value, 4) for name, value in weights.items()}
+        return dict(self.weights)
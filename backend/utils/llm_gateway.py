@@ -0,0 +1,511 @@
+"""
+LLM Gateway
+Điểm gọi LLM chung cho ZaloMessageProcessor, GroqChat (CrawlService, routes/content.py):
+- Ngân sách request/token theo model (cửa sổ trượt 60s), request xếp hàng chờ khi gần chạm rate limit
+- Model bị 429 thì tạm nghỉ theo retry-after và chuyển sang model dự phòng
+- Hedge: request chậm quá ngưỡng thì gửi song song sang model dự phòng, lấy kết quả về trước
+- Provider 'stub' trả response giả lập (cùng dạng Groq SDK) để chạy offline
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from utils.token_budget import estimate_tokens
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+logger = logging.getLogger(__name__)
+
+# Model dự phòng mặc định: "model=fallback1,fallback2;model2=..."
+DEFAULT_FALLBACKS = 'openai/gpt-oss-120b=openai/gpt-oss-20b;llama-3.3-70b-versatile=llama-3.1-8b-instant'
+
+# Giới hạn output của một số model (max_completion_tokens lớn hơn bị API từ chối khi failover)
+MODEL_MAX_OUTPUT_TOKENS = {
+    'openai/gpt-oss-120b': 65536,
+    'openai/gpt-oss-20b': 65536,
+    'llama-3.3-70b-versatile': 32768,
+    'llama-3.1-8b-instant': 131072
+}
+
+# Số token output dự kiến giữ chỗ trong ngân sách khi chưa biết usage thực tế
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 1024
+
+# Lỗi không nên thử model khác (sai API key, không có quyền)
+NON_RETRYABLE_STATUSES = (401, 403)
+
+
+class LLMUnavailableError(Exception):
+    """Mọi model trong chuỗi failover đều lỗi hoặc hết ngân sách"""
+
+
+def _parse_fallbacks(spec: str) -> Dict[str, List[str]]:
+    """'a=b,c;d=e' -> {'a': ['b', 'c'], 'd': ['e']}"""
+    fallbacks = {}
+    for item in (spec or '').split(';'):
+        if '=' not in item:
+            continue
+        model, models = item.split('=', 1)
+        fallbacks[model.strip()] = [m.strip() for m in models.split(',') if m.strip()]
+    return fallbacks
+
+
+def _parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """'model=rpm:tpm;model2=rpm:tpm' -> {'model': (rpm, tpm)} (0 = không giới hạn)"""
+    limits = {}
+    for item in (spec or '').split(';'):
+        if '=' not in item:
+            continue
+        model, values = item.rsplit('=', 1)
+        rpm, _, tpm = values.partition(':')
+        limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+def _error_status(error: Exception) -> Optional[int]:
+    """HTTP status của lỗi từ SDK (groq.APIStatusError có status_code)"""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Giá trị header retry-after (giây) của response 429 nếu có"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _usage_tokens(usage) -> Optional[int]:
+    if not usage:
+        return None
+    total = getattr(usage, 'total_tokens', None)
+    if total is None and isinstance(usage, dict):
+        total = usage.get('total_tokens')
+    return total
+
+
+class ModelBudget:
+    """
+    Ngân sách request/token của 1 model trong cửa sổ trượt.
+
+    - acquire(): giữ chỗ tokens dự kiến, chờ (tối đa max_wait) nếu vượt rpm/tpm hoặc đang cooldown
+    - settle(): cập nhật lại số token thực tế khi có usage
+    - cooldown(): tạm ngừng gửi tới model (sau khi nhận 429)
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, window: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.clock = clock
+        self._events = deque()  # [timestamp, tokens]
+        self._cooldown_until = 0.0
+        self._condition = threading.Condition()
+
+    def _prune(self, now: float):
+        while self._events and self._events[0][0] <= now - self.window:
+            self._events.popleft()
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """Số giây cần chờ trước khi gửi được request `tokens` token (0 = gửi ngay)"""
+        with self._condition:
+            return self._wait_time(tokens, self.clock())
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        self._prune(now)
+        wait_seconds = max(0.0, self._cooldown_until - now)
+        if self.rpm and len(self._events) >= self.rpm:
+            wait_seconds = max(wait_seconds, self._events[len(self._events) - self.rpm][0] + self.window - now)
+        if self.tpm and self._events:
+            excess = sum(event[1] for event in self._events) + tokens - self.tpm
+            # Request lớn hơn cả tpm chỉ cần chờ cửa sổ trống
+            for timestamp, event_tokens in self._events:
+                if excess <= 0:
+                    break
+                excess -= event_tokens
+                wait_seconds = max(wait_seconds, timestamp + self.window - now)
+        return wait_seconds
+
+    def acquire(self, tokens: int, max_wait: float = 0.0) -> Optional[List]:
+        """
+        Giữ chỗ trong ngân sách
+
+        Returns:
+            Reservation (truyền cho settle) hoặc None nếu phải chờ lâu hơn max_wait
+        """
+        deadline = self.clock() + max_wait
+        with self._condition:
+            while True:
+                now = self.clock()
+                wait_seconds = self._wait_time(tokens, now)
+                if wait_seconds <= 0:
+                    reservation = [now, tokens]
+                    self._events.append(reservation)
+                    return reservation
+                if now + wait_seconds > deadline:
+                    return None
+                self._condition.wait(wait_seconds)
+
+    def settle(self, reservation: Optional[List], actual_tokens: Optional[int]):
+        """Thay số token giữ chỗ bằng số token thực tế"""
+        if reservation is None or actual_tokens is None:
+            return
+        with self._condition:
+            reservation[1] = actual_tokens
+            self._condition.notify_all()
+
+    def cooldown(self, seconds: float):
+        with self._condition:
+            self._cooldown_until = max(self._cooldown_until, self.clock() + seconds)
+
+    def get_info(self) -> Dict:
+        with self._condition:
+            now = self.clock()
+            self._prune(now)
+            return {
+                'rpm': self.rpm,
+                'tpm': self.tpm,
+                'requests_in_window': len(self._events),
+                'tokens_in_window': sum(event[1] for event in self._events),
+                'cooldown_seconds': round(max(0.0, self._cooldown_until - now), 2)
+            }
+
+
+class GroqProvider:
+    """Provider Groq (groq SDK, tạo client khi cần)"""
+
+    name = 'groq'
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from groq import Groq
+                self._client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+            return self._client
+
+    def create(self, model: str, messages: List[Dict], stream: bool = False, **params):
+        return self.client.chat.completions.create(model=model, messages=messages, stream=stream, **params)
+
+
+class StubStatusError(Exception):
+    """Lỗi HTTP giả lập của StubProvider (cùng thuộc tính status_code/response như lỗi của groq SDK)"""
+
+    def __init__(self, status_code: int, message: str = '', retry_after: Optional[float] = None):
+        super().__init__(message or f"Stub error {status_code}")
+        self.status_code = status_code
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+class StubProvider:
+    """
+    Provider giả lập chạy offline: trả response dạng Groq SDK (choices/usage, stream theo chunk).
+
+    - responder(model, messages) -> nội dung trả về (mặc định '[]')
+    - latency: số giây chờ mỗi request, hoặc dict {model: giây}
+    - fail_next(): lỗi giả lập cho N request tiếp theo của model
+    """
+
+    name = 'stub'
+
+    def __init__(self, responder: Optional[Callable[[str, List[Dict]], str]] = None, latency=0.0, chunk_size: int = 16):
+        self.responder = responder or (lambda model, messages: '[]')
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls: List[str] = []
+        self._failures: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def fail_next(self, model: str, error: Exception, times: int = 1):
+        with self._lock:
+            self._failures.setdefault(model, deque()).extend([error] * times)
+
+    def create(self, model: str, messages: List[Dict], stream: bool = False, **params):
+        with self._lock:
+            self.calls.append(model)
+            failures = self._failures.get(model)
+            error = failures.popleft() if failures else None
+        latency = self.latency.get(model, 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            time.sleep(latency)
+        if error is not None:
+            raise error
+
+        content = self.responder(model, messages)
+        prompt_tokens = sum(estimate_tokens(m.get('content')) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        if not stream:
+            message = SimpleNamespace(content=content)
+            return SimpleNamespace(model=model, usage=usage,
+                                   choices=[SimpleNamespace(message=message, finish_reason='stop')])
+
+        chunks = [
+            SimpleNamespace(model=model, usage=None,
+                            choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + self.chunk_size]),
+                                                     finish_reason=None)])
+            for i in range(0, len(content), self.chunk_size)
+        ]
+        chunks.append(SimpleNamespace(model=model, usage=None, x_groq=SimpleNamespace(usage=usage),
+                                      choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason='stop')]))
+        return iter(chunks)
+
+
+class LLMGateway:
+    """
+    Gửi chat completion qua chuỗi model [model chính, model dự phòng...]:
+
+    - Chọn model đầu tiên trong chuỗi có thể gửi trong LLM_FAILOVER_WAIT giây, không có thì model chờ ít nhất
+      (chờ tối đa LLM_MAX_QUEUE_WAIT giây, quá thì bỏ qua model đó)
+    - Lỗi 429 (cooldown theo retry-after), 5xx, timeout... thì thử model tiếp theo trong chuỗi
+    - Request không stream chưa xong sau LLM_HEDGE_AFTER_SECONDS giây thì gửi thêm sang model dự phòng đang rảnh
+    - Model có dạng 'stub:<tên>' (hoặc LLM_PROVIDER=stub) dùng StubProvider
+    """
+
+    def __init__(self):
+        self.providers = {'groq': GroqProvider(), 'stub': StubProvider()}
+        self.default_provider = os.getenv('LLM_PROVIDER', 'groq')
+        self.fallbacks = _parse_fallbacks(os.getenv('LLM_FALLBACK_MODELS', DEFAULT_FALLBACKS))
+        self.limits = _parse_limits(os.getenv('LLM_MODEL_LIMITS', ''))
+        self.default_rpm = int(os.getenv('LLM_DEFAULT_RPM', '0'))
+        self.default_tpm = int(os.getenv('LLM_DEFAULT_TPM', '0'))
+        self.failover_wait = float(os.getenv('LLM_FAILOVER_WAIT', '2'))
+        self.max_queue_wait = float(os.getenv('LLM_MAX_QUEUE_WAIT', '30'))
+        self.rate_limit_cooldown = float(os.getenv('LLM_RATE_LIMIT_COOLDOWN', '10'))
+        # 0 = tắt hedge
+        self.hedge_after = float(os.getenv('LLM_HEDGE_AFTER_SECONDS', '0'))
+        self.hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_HEDGE_WORKERS', '8')),
+                                                 thread_name_prefix='llm-hedge')
+
+        self._budgets: Dict[str, ModelBudget] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+        logger.info(f"LLMGateway initialized (provider: {self.default_provider}, fallbacks: {self.fallbacks}, "
+                    f"limits: {self.limits}, hedge after: {self.hedge_after or 'off'})")
+
+    def _resolve(self, model: str) -> Tuple[Any, str]:
+        """'stub:model' -> (StubProvider, 'model'), còn lại dùng provider mặc định"""
+        prefix, sep, name = model.partition(':')
+        if sep and prefix in self.providers:
+            return self.providers[prefix], name
+        return self.providers[self.default_provider], model
+
+    def model_chain(self, model: str, fallbacks: Optional[List[str]] = None) -> List[str]:
+        """Model chính + các model dự phòng (không trùng)"""
+        chain = [model] + list(self.fallbacks.get(model, []) if fallbacks is None else fallbacks)
+        return list(dict.fromkeys(chain))
+
+    def budget(self, model: str) -> ModelBudget:
+        with self._lock:
+            if model not in self._budgets:
+                rpm, tpm = self.limits.get(model, (self.default_rpm, self.default_tpm))
+                self._budgets[model] = ModelBudget(rpm=rpm, tpm=tpm)
+            return self._budgets[model]
+
+    def _record(self, model: str, **increments):
+        with self._lock:
+            stats = self._stats.setdefault(model, {
+                'requests': 0, 'successes': 0, 'failures': 0, 'rate_limited': 0, 'queue_timeouts': 0,
+                'failovers': 0, 'hedges': 0, 'hedge_wins': 0, 'latency_ewma': None
+            })
+            latency = increments.pop('latency', None)
+            if latency is not None:
+                previous = stats['latency_ewma']
+                stats['latency_ewma'] = round(latency if previous is None else 0.8 * previous + 0.2 * latency, 3)
+            for key, value in increments.items():
+                stats[key] += value
+
+    def _pick(self, candidates: List[str], tokens: int) -> str:
+        """Model đầu tiên gửi được gần như ngay, không có thì model phải chờ ít nhất"""
+        waits = []
+        for candidate in candidates:
+            wait_seconds = self.budget(candidate).wait_time(tokens)
+            if wait_seconds <= self.failover_wait:
+                return candidate
+            waits.append((wait_seconds, candidate))
+        return min(waits)[1]
+
+    def create_completion(self, model: str, messages: List[Dict], stream: bool = False,
+                          fallbacks: Optional[List[str]] = None, estimated_tokens: Optional[int] = None,
+                          **params) -> Tuple[str, Any]:
+        """
+        Gửi chat completion (tham số giống groq SDK: temperature, max_completion_tokens, top_p...)
+
+        Args:
+            model: Model chính
+            messages: [{'role', 'content'}]
+            stream: True thì trả iterator chunk (failover chỉ áp dụng trước khi bắt đầu stream)
+            fallbacks: Model dự phòng (mặc định theo LLM_FALLBACK_MODELS)
+            estimated_tokens: Số token giữ chỗ trong ngân sách (mặc định ước lượng prompt + output dự kiến)
+
+        Returns:
+            Tuple (model đã trả lời, completion hoặc iterator chunk dạng groq SDK)
+
+        Raises:
+            LLMUnavailableError: mọi model đều lỗi hoặc phải chờ quá LLM_MAX_QUEUE_WAIT
+        """
+        if estimated_tokens is None:
+            max_output = params.get('max_completion_tokens') or params.get('max_tokens') or DEFAULT_EXPECTED_OUTPUT_TOKENS
+            estimated_tokens = (sum(estimate_tokens(m.get('content')) for m in messages)
+                                + min(max_output, DEFAULT_EXPECTED_OUTPUT_TOKENS))
+
+        chain = self.model_chain(model, fallbacks)
+        remaining = list(chain)
+        errors = []
+        while remaining:
+            candidate = self._pick(remaining, estimated_tokens)
+            remaining.remove(candidate)
+            reservation = self.budget(candidate).acquire(estimated_tokens, self.max_queue_wait)
+            if reservation is None:
+                self._record(candidate, queue_timeouts=1)
+                errors.append(f"{candidate}: rate budget exhausted")
+                logger.warning(f"⚠️ LLM {candidate} over budget for {self.max_queue_wait}s, trying next model")
+                continue
+            try:
+                if not stream and self.hedge_after > 0 and remaining:
+                    served, completion = self._invoke_hedged(candidate, remaining, messages, params,
+                                                             reservation, estimated_tokens)
+                else:
+                    served, completion = candidate, self._invoke(candidate, messages, stream, params, reservation)
+            except Exception as e:
+                errors.append(f"{candidate}: {e}")
+                if _error_status(e) in NON_RETRYABLE_STATUSES:
+                    break
+                if remaining:
+                    logger.warning(f"⚠️ LLM {candidate} failed ({e}), failing over to {remaining}")
+                continue
+            if served != model:
+                self._record(served, failovers=1)
+            return served, completion
+        raise LLMUnavailableError('; '.join(errors) or 'No model available')
+
+    def _invoke(self, model: str, messages: List[Dict], stream: bool, params: Dict, reservation: List):
+        """Gọi provider 1 lần, cập nhật ngân sách/thống kê"""
+        provider, name = self._resolve(model)
+        call_params = dict(params)
+        max_output = MODEL_MAX_OUTPUT_TOKENS.get(name)
+        for key in ('max_completion_tokens', 'max_tokens'):
+            if max_output and call_params.get(key) and call_params[key] > max_output:
+                call_params[key] = max_output
+
+        budget = self.budget(model)
+        self._record(model, requests=1)
+        started = time.monotonic()
+        try:
+            completion = provider.create(name, messages, stream=stream, **call_params)
+        except Exception as e:
+            if _error_status(e) == 429:
+                cooldown = _retry_after(e) or self.rate_limit_cooldown
+                budget.cooldown(cooldown)
+                self._record(model, failures=1, rate_limited=1)
+                logger.warning(f"⚠️ LLM {model} rate limited, cooling down {cooldown}s")
+            else:
+                self._record(model, failures=1)
+            raise
+
+        if stream:
+            return self._track_stream(model, completion, reservation, started)
+        budget.settle(reservation, _usage_tokens(getattr(completion, 'usage', None)))
+        self._record(model, successes=1, latency=time.monotonic() - started)
+        return completion
+
+    def _track_stream(self, model: str, completion, reservation: List, started: float) -> Iterator:
+        """Chuyển tiếp các chunk, cập nhật ngân sách bằng usage ở chunk cuối"""
+        budget = self.budget(model)
+        try:
+            for chunk in completion:
+                usage = getattr(chunk, 'usage', None) or getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+                if usage:
+                    budget.settle(reservation, _usage_tokens(usage))
+                yield chunk
+        except Exception:
+            self._record(model, failures=1)
+            raise
+        self._record(model, successes=1, latency=time.monotonic() - started)
+
+    def _invoke_hedged(self, model: str, candidates: List[str], messages: List[Dict], params: Dict,
+                       reservation: List, estimated_tokens: int) -> Tuple[str, Any]:
+        """
+        Gửi tới model chính, quá hedge_after giây chưa xong thì gửi thêm sang model dự phòng đang rảnh.
+        Trả kết quả thành công về trước; request còn lại chạy nốt ở background (kết quả bỏ qua).
+        """
+        futures = {self.hedge_executor.submit(self._invoke, model, messages, False, params, reservation): model}
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            for candidate in candidates:
+                hedge_reservation = self.budget(candidate).acquire(estimated_tokens, 0)
+                if hedge_reservation is None:
+                    continue
+                logger.info(f"🏁 LLM {model} slower than {self.hedge_after}s, hedging with {candidate}")
+                self._record(model, hedges=1)
+                futures[self.hedge_executor.submit(self._invoke, candidate, messages, False, params,
+                                                   hedge_reservation)] = candidate
+                break
+
+        pending = set(futures)
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    completion = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                served = futures[future]
+                if served != model:
+                    self._record(served, hedge_wins=1)
+                return served, completion
+        raise last_error
+
+    def complete_text(self, model: str, messages: List[Dict], **params) -> str:
+        """Chat completion không stream, trả nội dung text"""
+        _, completion = self.create_completion(model, messages, stream=False, **params)
+        return completion.choices[0].message.content or ''
+
+    def stream_text(self, model: str, messages: List[Dict], **params) -> Iterator[str]:
+        """Chat completion stream, yield từng đoạn text"""
+        _, completion = self.create_completion(model, messages, stream=True, **params)
+        for chunk in completion:
+            choices = getattr(chunk, 'choices', None) or []
+            delta = getattr(choices[0], 'delta', None) if choices else None
+            content = getattr(delta, 'content', None) if delta else None
+            if content:
+                yield content
+
+    def get_stats(self) -> Dict:
+        """Thống kê theo model: số request, lỗi, 429, failover, hedge, độ trễ và ngân sách hiện tại"""
+        with self._lock:
+            models = {model: dict(stats) for model, stats in self._stats.items()}
+            budgets = dict(self._budgets)
+        for model, budget in budgets.items():
+            models.setdefault(model, {})['budget'] = budget.get_info()
+        return {
+            'provider': self.default_provider,
+            'fallbacks': self.fallbacks,
+            'hedge_after_seconds': self.hedge_after,
+            'max_queue_wait_seconds': self.max_queue_wait,
+            'models': models
+        }
+
+
+# Global instance
+llm_gateway = LLMGateway()
@@ -0,0 +1,225 @@
+"""
+Metrics
+Registry metrics trong process (counter, gauge, histogram có label) cho processor và warehouse service:
+- render_prometheus(): text format của Prometheus cho endpoint /metrics
+- snapshot(): dict (count, avg, p50/p95 của các mẫu gần nhất) cho /api/zalo-processor/status
+- span(): context manager đo thời gian 1 stage
+"""
+
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bucket mặc định (giây) cho histogram thời gian: từ 1ms tới 5 phút
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Số mẫu gần nhất giữ lại để tính p50/p95 cho status API
+RECENT_SAMPLES = 1024
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(key) + list(extra or ())
+    if not items:
+        return ''
+    escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _snapshot_key(key: Tuple) -> str:
+    """Key dễ đọc cho status API: 'stage=llm,model=x' ('total' nếu không có label)"""
+    return ','.join(f'{k}={v}' for k, v in key) or 'total'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple, object] = {}
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """Giá trị chỉ tăng (tổng số request, token, lỗi...)"""
+
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._series.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = dict(self._series)
+        return self.header() + [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in sorted(series.items())]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {_snapshot_key(k): v for k, v in sorted(self._series.items())}
+
+
+class Gauge(Counter):
+    """Giá trị tại thời điểm (queue lag, số connection đang dùng...)"""
+
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._series[_label_key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Phân bố giá trị (thời gian, kích thước batch): bucket cho Prometheus + mẫu gần nhất cho p50/p95"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0,
+                          'recent': deque(maxlen=RECENT_SAMPLES)}
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+            series['recent'].append(value)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = [(k, list(s['counts']), s['sum'], s['count']) for k, s in sorted(self._series.items())]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            items = [(k, s['sum'], s['count'], list(s['recent'])) for k, s in sorted(self._series.items())]
+        return {
+            _snapshot_key(key): {
+                'count': count,
+                'avg': round(total / count, 4) if count else 0.0,
+                'p50': round(_quantile(recent, 0.5), 4),
+                'p95': round(_quantile(recent, 0.95), 4),
+                'max': round(max(recent), 4) if recent else 0.0
+            }
+            for key, total, count, recent in items
+        }
+
+
+class MetricsRegistry:
+    """Registry metrics dùng chung cho cả process (lấy metric đã có nếu trùng tên)"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], None]):
+        """Hàm cập nhật gauge ngay trước khi export (ví dụ thống kê connection pool)"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                pass
+
+    def render_prometheus(self) -> str:
+        self._collect()
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        self._collect()
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+# Global registry
+metrics = MetricsRegistry()
+
+# Metrics của pipeline bóc tách tin nhắn
+STAGE_DURATION = metrics.histogram('zalo_stage_duration_seconds',
+                                   'Duration of extraction pipeline stages (fetch, prompt_build, llm, parse, insert, ...)')
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Đo thời gian khối lệnh vào zalo_stage_duration_seconds{stage=...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=stage, **labels)
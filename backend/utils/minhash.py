@@ -0,0 +1,93 @@
+"""
+MinHash / LSH
+Chữ ký MinHash trên shingle ký tự của nội dung đã chuẩn hóa và chia band (LSH) để tìm nhanh
+các tin nhắn gần giống nhau (đăng lại đổi emoji, đổi 1-2 chữ số...)
+"""
+
+import random
+import struct
+import hashlib
+from typing import List, Optional, Set
+
+from utils.text_normalize import normalize_message_text
+
+# Số nguyên tố Mersenne 2^61 - 1 dùng cho hàm hash (a * x + b) mod P
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+class MinHasher:
+    """
+    Tính chữ ký MinHash và band key LSH.
+
+    - num_perm = bands * rows hàm hash; 2 tin có Jaccard s rơi vào cùng ít nhất 1 bucket
+      với xác suất 1 - (1 - s^rows)^bands (mặc định 16 x 8: ngưỡng ~0.7)
+    - Seed cố định nên chữ ký ổn định giữa các process, có thể lưu vào database
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, shingle_size: int = 5, seed: int = 1):
+        """
+        Args:
+            num_perm: Số hàm hash (độ dài chữ ký)
+            bands: Số band LSH (num_perm phải chia hết cho bands)
+            shingle_size: Độ dài shingle ký tự
+            seed: Seed sinh tham số hàm hash
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = random.Random(seed)
+        self._perms = [(rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+                       for _ in range(num_perm)]
+
+    def shingles(self, text: Optional[str]) -> Set[str]:
+        """Tập shingle ký tự của nội dung đã chuẩn hóa (rỗng nếu không còn nội dung)"""
+        normalized = normalize_message_text(text)
+        if not normalized:
+            return set()
+        if len(normalized) <= self.shingle_size:
+            return {normalized}
+        return {normalized[i:i + self.shingle_size] for i in range(len(normalized) - self.shingle_size + 1)}
+
+    def signature(self, text: Optional[str]) -> Optional[List[int]]:
+        """
+        Chữ ký MinHash của nội dung
+
+        Returns:
+            List num_perm số nguyên 32-bit, None nếu nội dung rỗng sau chuẩn hóa
+        """
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles]
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH for a, b in self._perms]
+
+    def band_keys(self, signature: List[int]) -> List[str]:
+        """Band key (hex 16 ký tự) cho từng band của chữ ký, 2 tin chung 1 key là ứng viên trùng"""
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(struct.pack(f'<I{self.rows}I', band, *chunk), digest_size=8).hexdigest()
+            keys.append(digest)
+        return keys
+
+    @staticmethod
+    def similarity(signature_a: List[int], signature_b: List[int]) -> float:
+        """Ước lượng độ tương đồng Jaccard từ 2 chữ ký"""
+        if not signature_a or not signature_b or len(signature_a) != len(signature_b):
+            return 0.0
+        return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+    def pack(self, signature: List[int]) -> bytes:
+        """Đóng gói chữ ký thành bytes để lưu cột VARBINARY"""
+        return struct.pack(f'<{self.num_perm}I', *signature)
+
+    def unpack(self, data: Optional[bytes]) -> Optional[List[int]]:
+        """Giải nén chữ ký từ bytes (None nếu dữ liệu không hợp lệ)"""
+        if not data or len(data) != self.num_perm * 4:
+            return None
+        return list(struct.unpack(f'<{self.num_perm}I', data))
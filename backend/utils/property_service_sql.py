@@ -6,76 +6,71 @@ class PropertyService:
     """Service để xử lý các thao tác liên quan đến property groups"""
     
     @staticmethod
-    def get_property_tree_with_sql(root_id: int, db_connection) -> str:
+    def get_property_tree_with_sql(root_id: int, db_connection, max_depth: int = 2) -> str:
         """
         Lấy danh sách tree property groups sử dụng raw SQL
+        Toàn bộ tree (root, children, grandchildren) được lấy bằng 1 recursive CTE duy nhất
         
         Args:
             root_id (int): ID của group root
             db_connection: Database connection
+            max_depth (int): Độ sâu tối đa tính từ root (mặc định 2 = tới grandchildren)
             
         Returns:
             str: Chuỗi tree theo định dạng
         """
         try:
-            # Lấy root group với join types_group để lấy tiền tố và description
+            # Lấy root và tất cả con cháu với join types_group để lấy tiền tố và description
             cursor = db_connection.cursor()
             cursor.execute("""
-                SELECT pg.id, pg.name, pg.description, tg.name as type_name 
-                FROM property_groups pg 
-                LEFT JOIN types_group tg ON pg.group_type = tg.id 
-                WHERE pg.id = %s
-            """, (root_id,))
-            root_group = cursor.fetchone()
-            
-            if not root_group:
+                WITH RECURSIVE property_group_tree AS (
+                    SELECT id, parent_id, name, description, group_type, 0 AS depth
+                    FROM property_groups
+                    WHERE id = %s
+                    UNION ALL
+                    SELECT pg.id, pg.parent_id, pg.name, pg.description, pg.group_type, pgt.depth + 1
+                    FROM property_groups pg
+                    INNER JOIN property_group_tree pgt ON pg.parent_id = pgt.id
+                    WHERE pgt.depth < %s
+                )
+                SELECT t.id, t.name, t.description, tg.name as type_name, t.parent_id, t.depth
+                FROM property_group_tree t
+                LEFT JOIN types_group tg ON t.group_type = tg.id
+                ORDER BY t.depth, t.name
+            """, (root_id, max_depth))
+            rows = cursor.fetchall()
+            cursor.close()
+            
+            if not rows:
                 return f"Không tìm thấy group với ID: {root_id}"
             
-            # Tạo tên với tiền tố từ types_group và description
-            root_name = f"{root_group[3]} {root_group[1]}" if root_group[3] else root_group[1]
-            root_description = f" - {root_group[2]}" if root_group[2] else ""
+            # Gom children theo parent_id (giữ thứ tự ORDER BY name của database)
+            root_group = None
+            children_by_parent = {}
+            for row in rows:
+                if row[5] == 0:
+                    root_group = row
+                else:
+                    children_by_parent.setdefault(row[4], []).append(row)
             
-            # Lấy tất cả children của root group với join types_group và description
-            cursor.execute("""
-                SELECT pg.id, pg.name, pg.description, tg.name as type_name 
-                FROM property_groups pg 
-                LEFT JOIN types_group tg ON pg.group_type = tg.id 
-                WHERE pg.parent_id = %s 
-                ORDER BY pg.name
-            """, (root_id,))
-            children = cursor.fetchall()
-            
-            if not children:
-                return f"- {root_name} (ID:{root_id}){root_description}"
-            
-            # Xây dựng tree string
-            tree_lines = []
+            if root_group is None:
+                return f"Không tìm thấy group với ID: {root_id}"
             
-            # Thêm root group với tiền tố và description
-            tree_lines.append(f"- {root_name} (ID:{root_id}){root_description}")
+            def format_line(group, level):
+                # Tạo tên với tiền tố từ types_group và description
+                name = f"{group[3]} {group[1]}" if group[3] else group[1]
+                description = f" - {group[2]}" if group[2] else ""
+                return f"{'- ' * (level + 1)}{name} (ID:{group[0]}){description}"
             
-            # Thêm children với tiền tố và description
-            for child in children:
-                child_name = f"{child[3]} {child[1]}" if child[3] else child[1]
-                child_description = f" - {child[2]}" if child[2] else ""
-                tree_lines.append(f"- - {child_name} (ID:{child[0]}){child_description}")
-                
-                # Lấy grandchildren (level 2) với join types_group và description
-                cursor.execute("""
-                    SELECT pg.id, pg.name, pg.description, tg.name as type_name 
-                    FROM property_groups pg 
-                    LEFT JOIN types_group tg ON pg.group_type = tg.id 
-                    WHERE pg.parent_id = %s 
-                    ORDER BY pg.name
-                """, (child[0],))
-                grandchildren = cursor.fetchall()
-                
-                for grandchild in grandchildren:
-                    grandchild_name = f"{grandchild[3]} {grandchild[1]}" if grandchild[3] else grandchild[1]
-                    grandchild_description = f" - {grandchild[2]}" if grandchild[2] else ""
-                    tree_lines.append(f"- - - {grandchild_name} (ID:{grandchild[0]}){grandchild_description}")
+            # Xây dựng tree string theo thứ tự duyệt sâu
+            tree_lines = []
             
-            cursor.close()
+            def append_subtree(group, level):
+                tree_lines.append(format_line(group, level))
+                for child in children_by_parent.get(group[0], []):
+                    append_subtree(child, level + 1)
+            
+            append_subtree(root_group, 0)
             return "\n".join(tree_lines)
             
         except Exception as e:
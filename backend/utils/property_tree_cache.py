@@ -0,0 +1,127 @@
+"""
+Property Tree Cache
+Cache in-process cho đoạn prompt <thong-tin-du-an> (property tree + unit types)
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PropertyTreeCache:
+    """
+    Cache có version cho property tree đã render sẵn cho prompt.
+
+    - Mỗi root_id có một entry: text, version (hash nội dung), generation, loaded_at
+    - Entry hết hạn sau `ttl` giây, hoặc khi gọi invalidate()
+    - Chỉ một thread load lại mỗi root_id tại một thời điểm, các thread khác chờ kết quả
+    - Nếu load lỗi mà vẫn còn entry cũ thì tiếp tục dùng entry cũ
+    """
+
+    def __init__(self, loader: Callable[[int], str], ttl: int = 600):
+        """
+        Args:
+            loader: Hàm nhận root_id và trả về text đã render (raise exception nếu lỗi)
+            ttl: Thời gian sống của entry (giây), <= 0 nghĩa là không hết hạn theo thời gian
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[int, threading.Lock] = {}
+
+    def _is_fresh(self, entry: Optional[Dict]) -> bool:
+        if not entry or entry['generation'] != self.generation:
+            return False
+        if self.ttl <= 0:
+            return True
+        return (time.time() - entry['loaded_at']) < self.ttl
+
+    def get(self, root_id: int = 1) -> str:
+        """Lấy text đã render cho root_id, load lại nếu entry không còn hợp lệ"""
+        entry = self._entries.get(root_id)
+        if self._is_fresh(entry):
+            self.hits += 1
+            return entry['text']
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(root_id, threading.Lock())
+
+        with load_lock:
+            # Thread khác có thể đã load xong trong lúc chờ
+            entry = self._entries.get(root_id)
+            if self._is_fresh(entry):
+                self.hits += 1
+                return entry['text']
+
+            self.misses += 1
+            return self._load(root_id, stale=entry)['text']
+
+    def _load(self, root_id: int, stale: Optional[Dict] = None) -> Dict:
+        generation = self.generation
+        try:
+            text = self.loader(root_id)
+        except Exception as e:
+            if stale:
+                logger.warning(f"⚠️ Reload property tree {root_id} failed, serving stale version {stale['version']}: {e}")
+                return stale
+            raise
+
+        entry = {
+            'text': text,
+            'version': hashlib.sha1(text.encode('utf-8')).hexdigest()[:12],
+            'generation': generation,
+            'loaded_at': time.time()
+        }
+        self._entries[root_id] = entry
+        logger.info(f"✅ Property tree {root_id} cached (version: {entry['version']}, generation: {generation})")
+        return entry
+
+    def refresh(self, root_id: int = 1) -> Dict:
+        """Invalidate và load lại ngay entry của root_id"""
+        self.invalidate(root_id)
+        self.get(root_id)
+        return self.get_info(root_id)
+
+    def invalidate(self, root_id: Optional[int] = None):
+        """Xóa entry của root_id, hoặc toàn bộ cache nếu root_id=None"""
+        with self._lock:
+            if root_id is None:
+                self.generation += 1
+                self._entries.clear()
+            else:
+                self._entries.pop(root_id, None)
+        logger.info(f"🧹 Property tree cache invalidated (root_id: {root_id if root_id is not None else 'ALL'})")
+
+    def get_version(self, root_id: int = 1) -> Optional[str]:
+        """Version (hash nội dung) của entry hiện tại, None nếu chưa load"""
+        entry = self._entries.get(root_id)
+        return entry['version'] if entry else None
+
+    def get_info(self, root_id: Optional[int] = None) -> Dict:
+        """Thông tin cache để debug/monitor"""
+        entries = self._entries if root_id is None else {
+            k: v for k, v in self._entries.items() if k == root_id
+        }
+        return {
+            'ttl': self.ttl,
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': {
+                str(k): {
+                    'version': v['version'],
+                    'loaded_at': v['loaded_at'],
+                    'age_seconds': round(time.time() - v['loaded_at'], 1),
+                    'fresh': self._is_fresh(v)
+                }
+                for k, v in entries.items()
+            }
+        }
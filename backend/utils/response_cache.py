@@ -0,0 +1,80 @@
+"""
+Response Cache
+Cache in-process cho response JSON của các endpoint đọc nhiều, ít thay đổi (unit types, property groups):
+body đã serialize sẵn + ETag, client gửi If-None-Match trùng thì trả 304 không body
+"""
+
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+from flask import Response, current_app, request
+from utils.ttl_cache import TTLCache
+
+
+class ResponseCache:
+    """
+    Cache response theo namespace (mỗi endpoint 1 namespace) + key (tham số request).
+
+    - respond(): trả response từ cache, hoặc gọi builder() lấy payload, serialize 1 lần rồi lưu lại
+    - ETag = hash của body; request có If-None-Match trùng ETag thì trả 304
+    - invalidate(): xóa 1 namespace hoặc toàn bộ (khi dữ liệu gốc thay đổi)
+    """
+
+    def __init__(self, ttl: int = 300, max_entries: int = 256):
+        """
+        Args:
+            ttl: Thời gian sống của response (giây), <= 0 nghĩa là tắt cache
+            max_entries: Số response tối đa mỗi namespace
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._namespaces: Dict[str, TTLCache] = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, namespace: str) -> TTLCache:
+        with self._lock:
+            cache = self._namespaces.get(namespace)
+            if cache is None:
+                cache = self._namespaces[namespace] = TTLCache(ttl=self.ttl, max_entries=self.max_entries)
+            return cache
+
+    def get_entry(self, namespace: str, key: Hashable, builder: Callable[[], Any]) -> Dict:
+        """
+        Lấy response đã serialize từ cache, hoặc build và lưu lại
+
+        Args:
+            namespace: Tên endpoint
+            key: Tham số request (hashable)
+            builder: Hàm trả về payload JSON (raise exception nếu lỗi để không cache kết quả lỗi)
+
+        Returns:
+            Dict {'body': bytes, 'etag': str}
+        """
+        cache = self._cache(namespace)
+        entry = cache.get(key)
+        if entry is None:
+            body = current_app.json.dumps(builder()).encode('utf-8')
+            entry = {'body': body, 'etag': hashlib.sha1(body).hexdigest()}
+            cache.set(key, entry)
+        return entry
+
+    def respond(self, namespace: str, key: Hashable, builder: Callable[[], Any]) -> Response:
+        """Response JSON có ETag (304 nếu If-None-Match trùng), client luôn revalidate trước khi dùng bản của mình"""
+        entry = self.get_entry(namespace, key, builder)
+        response = Response(entry['body'], mimetype='application/json')
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    def invalidate(self, namespace: Optional[str] = None):
+        """Xóa response của 1 namespace, hoặc toàn bộ nếu namespace=None"""
+        with self._lock:
+            caches = list(self._namespaces.values()) if namespace is None else [self._namespaces.get(namespace)]
+        for cache in caches:
+            if cache is not None:
+                cache.invalidate()
+
+    def get_info(self) -> Dict:
+        """Thông tin cache theo namespace để debug/monitor"""
+        with self._lock:
+            return {namespace: cache.get_info() for namespace, cache in self._namespaces.items()}
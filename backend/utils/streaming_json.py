@@ -0,0 +1,123 @@
+"""
+Streaming JSON
+Parser tăng dần cho response dạng mảng JSON object của LLM: trả về từng object ngay khi đóng ngoặc,
+bỏ qua object lỗi và vẫn giữ được các object hoàn chỉnh khi response bị cắt cụt
+"""
+
+import json
+import logging
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJSONObjectParser:
+    """
+    Nhận text theo từng chunk (streaming) và tách các JSON object cấp ngoài cùng.
+
+    - Text ngoài object (giải thích, ```json, dấu [ ] và dấu phẩy của mảng) được bỏ qua
+    - Theo dõi chuỗi/escape nên dấu { } trong giá trị chuỗi không làm lệch ngoặc
+    - Object không parse được được đếm vào errors, các object khác vẫn được trả về
+    - Object chưa đóng khi close() (response bị cắt cụt) đánh dấu truncated
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.objects: List[Dict] = []
+        self.errors: List[str] = []
+        self.truncated = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """
+        Đưa thêm text vào parser
+
+        Args:
+            chunk: Phần text mới nhận
+
+        Returns:
+            List các object vừa hoàn chỉnh trong chunk này
+        """
+        completed = []
+        for ch in chunk or '':
+            if self._depth == 0:
+                # Ngoài object: chỉ chờ dấu { mở object tiếp theo
+                if ch == '{':
+                    self._depth = 1
+                    self._buffer = [ch]
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._decode(''.join(self._buffer))
+                    self._buffer = []
+                    if obj is not None:
+                        completed.append(obj)
+        self.objects.extend(completed)
+        return completed
+
+    def _decode(self, text: str):
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.errors.append(f"{e.msg} at {e.pos}: {text[:120]}")
+            logger.warning(f"⚠️ Skipping malformed JSON object: {e.msg}")
+            return None
+        if not isinstance(obj, dict):
+            return None
+        return obj
+
+    def close(self) -> List[Dict]:
+        """Kết thúc stream, trả về toàn bộ object đã parse được"""
+        if self._depth > 0:
+            self.truncated = True
+            logger.warning(f"⚠️ Response ended inside an unfinished JSON object ({len(self._buffer)} chars dropped)")
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        return self.objects
+
+
+def parse_json_objects(text: str) -> Tuple[List[Dict], List[str]]:
+    """
+    Tách các JSON object cấp ngoài cùng trong text (không streaming)
+
+    Returns:
+        Tuple (objects, errors)
+    """
+    parser = IncrementalJSONObjectParser()
+    parser.feed(text)
+    return parser.close(), parser.errors
+
+
+def is_empty_json_array(text: str) -> bool:
+    """
+    Response chỉ gồm đúng 1 mảng rỗng [] (có thể nằm trong code fence ```json)
+    Mảng rỗng lồng trong object lỗi hoặc trong đoạn văn không tính
+    """
+    body = (text or '').strip()
+    if body.startswith('```') and body.endswith('```') and len(body) >= 6:
+        body = body[3:-3]
+        if body.startswith('json'):
+            body = body[4:]
+        body = body.strip()
+    try:
+        return json.loads(body) == []
+    except ValueError:
+        return False
@@ -0,0 +1,42 @@
+"""
+Text Normalize
+Chuẩn hóa nội dung tin nhắn tiếng Việt: bỏ dấu, đưa về chữ thường, bỏ emoji/ký tự trang trí
+để so sánh các tin đăng lại gần giống nhau
+"""
+
+import re
+import unicodedata
+from typing import Optional
+
+_NON_WORD_RE = re.compile(r'[^0-9a-z]+')
+
+
+def fold_accents(text: Optional[str]) -> str:
+    """
+    Bỏ dấu tiếng Việt (kể cả đ/Đ → d/D)
+
+    Args:
+        text: Chuỗi cần bỏ dấu
+
+    Returns:
+        str: Chuỗi không dấu
+    """
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+
+
+def normalize_message_text(text: Optional[str]) -> str:
+    """
+    Chuẩn hóa nội dung tin nhắn để so sánh: bỏ dấu, chữ thường, thay emoji/dấu câu/khoảng trắng
+    liên tiếp bằng 1 khoảng trắng. Chữ số được giữ nguyên (giá, mã căn, số điện thoại).
+
+    Args:
+        text: Nội dung tin nhắn
+
+    Returns:
+        str: Nội dung đã chuẩn hóa
+    """
+    return _NON_WORD_RE.sub(' ', fold_accents(text).lower()).strip()
@@ -0,0 +1,167 @@
+"""
+Token Budget
+Ước lượng token và chia batch tin nhắn theo ngân sách token input/output cho prompt Groq,
+tự điều chỉnh số tin nhắn mỗi batch theo kết quả thực tế (bị cắt cụt, parse lỗi, usage)
+"""
+
+import math
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: Optional[str], chars_per_token: float = 3.0) -> int:
+    """
+    Ước lượng số token của text (không cần tokenizer)
+    Tiếng Việt có dấu tốn nhiều token hơn tiếng Anh nên mặc định ~3 ký tự/token
+
+    Args:
+        text: Nội dung cần ước lượng
+        chars_per_token: Số ký tự trung bình mỗi token
+
+    Returns:
+        int: Số token ước lượng
+    """
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / max(chars_per_token, 0.5)))
+
+
+class AdaptiveBatchSizer:
+    """
+    Chia messages thành các batch vừa ngân sách token của 1 request.
+
+    - Input: preamble (schema + property tree) + nội dung từng tin nhắn <= input_budget
+    - Output: reasoning_reserve + số tin nhắn * output_tokens_per_message <= output_budget
+    - max_messages tăng dần 1 sau mỗi lần thành công, giảm một nửa khi output bị cắt cụt
+      hoặc parse lỗi (AIMD)
+    - output_tokens_per_message và hệ số hiệu chỉnh ước lượng input được học từ usage thực tế (EWMA)
+    """
+
+    def __init__(self, input_budget: int = 32000, output_budget: int = 36751, max_messages: int = 50,
+                 min_messages: int = 1, reasoning_reserve: int = 4096, output_tokens_per_message: int = 400,
+                 chars_per_token: float = 3.0, smoothing: float = 0.2):
+        """
+        Args:
+            input_budget: Số token input tối đa mỗi request
+            output_budget: Số token output tối đa mỗi request (max_completion_tokens)
+            max_messages: Giới hạn cứng số tin nhắn mỗi batch
+            min_messages: Số tin nhắn tối thiểu khi thu nhỏ batch
+            reasoning_reserve: Số token output dành cho phần reasoning của model
+            output_tokens_per_message: Ước lượng ban đầu số token output cho mỗi tin nhắn
+            chars_per_token: Số ký tự mỗi token dùng để ước lượng input
+            smoothing: Hệ số EWMA khi học từ usage thực tế
+        """
+        self.input_budget = input_budget
+        self.output_budget = output_budget
+        self.hard_max_messages = max(1, max_messages)
+        self.min_messages = max(1, min(min_messages, self.hard_max_messages))
+        self.reasoning_reserve = reasoning_reserve
+        self.output_tokens_per_message = float(output_tokens_per_message)
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+
+        # Hệ số nhân cho ước lượng input (usage.prompt_tokens / ước lượng)
+        self.input_correction = 1.0
+        self.max_messages = self.hard_max_messages
+        self.successes = 0
+        self.truncations = 0
+        self.parse_failures = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, text: Optional[str]) -> int:
+        """Ước lượng token input đã hiệu chỉnh theo usage thực tế"""
+        return int(math.ceil(estimate_tokens(text, self.chars_per_token) * self.input_correction))
+
+    def output_tokens_for(self, message_count: int) -> int:
+        """Số token output cần cho batch message_count tin nhắn (không vượt output_budget)"""
+        needed = self.reasoning_reserve + int(math.ceil(self.output_tokens_per_message * message_count * 1.2))
+        return min(self.output_budget, needed)
+
+    def pack(self, messages: List[Dict], preamble_tokens: int, content_key: str = 'content') -> List[List[Dict]]:
+        """
+        Chia messages thành các batch theo ngân sách token, giữ nguyên thứ tự.
+        Tin nhắn quá dài so với ngân sách vẫn được xếp 1 mình 1 batch.
+
+        Args:
+            messages: List message dictionaries
+            preamble_tokens: Số token của phần prompt cố định (schema, property tree)
+            content_key: Key chứa nội dung tin nhắn
+
+        Returns:
+            List các batch
+        """
+        with self._lock:
+            max_messages = self.max_messages
+            output_per_message = self.output_tokens_per_message
+        output_capacity = max(1, int((self.output_budget - self.reasoning_reserve) / (output_per_message * 1.2)))
+        limit = max(1, min(max_messages, output_capacity))
+
+        batches = []
+        current = []
+        current_tokens = preamble_tokens
+        for message in messages:
+            # ~20 token cho dòng tiêu đề "--- Tin nhắn i (ID: ...) ---"
+            message_tokens = self.estimate(message.get(content_key)) + 20
+            if current and (len(current) >= limit or current_tokens + message_tokens > self.input_budget):
+                batches.append(current)
+                current = []
+                current_tokens = preamble_tokens
+            current.append(message)
+            current_tokens += message_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def record_success(self, message_count: int, estimated_input_tokens: Optional[int] = None,
+                       usage: Optional[Dict] = None):
+        """Ghi nhận request thành công: tăng max_messages, học output/input từ usage"""
+        with self._lock:
+            self.successes += 1
+            if self.max_messages < self.hard_max_messages:
+                self.max_messages += 1
+            if not usage or message_count <= 0:
+                return
+            completion_tokens = usage.get('completion_tokens')
+            if completion_tokens:
+                observed = max(1.0, (completion_tokens - usage.get('reasoning_tokens', 0)) / message_count)
+                self.output_tokens_per_message += self.smoothing * (observed - self.output_tokens_per_message)
+            prompt_tokens = usage.get('prompt_tokens')
+            if prompt_tokens and estimated_input_tokens:
+                # estimated_input_tokens đã nhân input_correction hiện tại, quy về ước lượng gốc trước khi so
+                raw_estimate = estimated_input_tokens / self.input_correction
+                ratio = min(4.0, max(0.25, prompt_tokens / max(1.0, raw_estimate)))
+                self.input_correction += self.smoothing * (ratio - self.input_correction)
+
+    def record_truncation(self, message_count: int):
+        """Output bị cắt cụt (finish_reason=length): giảm một nửa số tin nhắn mỗi batch"""
+        with self._lock:
+            self.truncations += 1
+            self._shrink(message_count)
+
+    def record_parse_failure(self, message_count: int):
+        """Response không parse được: giảm một nửa số tin nhắn mỗi batch"""
+        with self._lock:
+            self.parse_failures += 1
+            self._shrink(message_count)
+
+    def _shrink(self, message_count: int):
+        self.max_messages = max(self.min_messages, min(self.max_messages, max(1, message_count)) // 2)
+        logger.warning(f"⚠️ Batch size reduced to {self.max_messages} message(s)")
+
+    def get_info(self) -> Dict:
+        """Thông tin để debug/monitor"""
+        with self._lock:
+            return {
+                'input_budget': self.input_budget,
+                'output_budget': self.output_budget,
+                'max_messages': self.max_messages,
+                'hard_max_messages': self.hard_max_messages,
+                'output_tokens_per_message': round(self.output_tokens_per_message, 1),
+                'input_correction': round(self.input_correction, 3),
+                'successes': self.successes,
+                'truncations': self.truncations,
+                'parse_failures': self.parse_failures
+            }
@@ -0,0 +1,81 @@
+"""
+TTL Cache
+Cache in-process đơn giản có thời gian sống (dùng cho count, kết quả query ít thay đổi)
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Cache key -> value, mỗi entry hết hạn sau `ttl` giây.
+
+    - get_or_load(): trả về giá trị trong cache hoặc gọi loader và lưu lại
+    - invalidate(): xóa 1 key hoặc toàn bộ cache (khi dữ liệu gốc thay đổi)
+    - Khi vượt max_entries thì bỏ entry cũ nhất
+    """
+
+    def __init__(self, ttl: int = 60, max_entries: int = 1024):
+        """
+        Args:
+            ttl: Thời gian sống của entry (giây), <= 0 nghĩa là tắt cache
+            max_entries: Số entry tối đa
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Hashable, Dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Lấy giá trị còn hạn, None nếu không có"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires_at'] > time.time():
+                self.hits += 1
+                return entry['value']
+            if entry:
+                self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any):
+        """Lưu giá trị vào cache"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                oldest_key = min(self._entries, key=lambda k: self._entries[k]['expires_at'])
+                self._entries.pop(oldest_key, None)
+            self._entries[key] = {'value': value, 'expires_at': time.time() + self.ttl}
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Lấy từ cache, nếu không có thì gọi loader() và lưu kết quả (không lưu None)"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Xóa entry của key, hoặc toàn bộ cache nếu key=None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_info(self) -> Dict:
+        """Thông tin cache để debug/monitor"""
+        with self._lock:
+            return {
+                'ttl': self.ttl,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }